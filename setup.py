@@ -19,6 +19,11 @@ requires = [
 if sys.version_info < (2,7):
     requires.append('unittest2')
 
+# os.scandir is only in python 3.5+, the backport lists the directories
+# without stat'ing each entry
+if sys.version_info < (3,5):
+    requires.append('scandir>=1.5')
+
 
 # chmod some file
 os.chmod("initscripts/storlever", 0755)
@@ -51,6 +51,111 @@ def main(global_config, **settings):
         set_lock_factory_from_name(settings.get("lock.module"),
                                    settings.get("lock.factory"))
 
+    # get the max age of block device inventory cache
+    if settings.get("block.inventory_ttl") is not None:
+        from storlever.mngr.block.blockmgr import block_mgr
+        block_mgr().set_inventory_ttl(float(settings.get("block.inventory_ttl")))
+
+    # get the scanner to build block device inventory
+    if settings.get("block.scanner") is not None:
+        from storlever.mngr.block.blockmgr import block_mgr
+        block_mgr().set_scanner(settings.get("block.scanner"))
+
+    # directory to cache the large conf files in a binary sidecar format
+    if settings.get("conf.sidecar_dir"):
+        from storlever.lib.config import Config
+        Config.sidecar_dir = settings.get("conf.sidecar_dir")
+
+    # seconds the conf file writes are delayed to be coalesced, 0 means no delay
+    if settings.get("conf.write_delay") is not None:
+        from storlever.lib.config import config_writer
+        config_writer().delay = float(settings.get("conf.write_delay"))
+
+    # max number of the external commands running at the same time
+    if settings.get("command.max_workers") is not None:
+        from storlever.lib.command import command_executor
+        command_executor().max_workers = int(settings.get("command.max_workers"))
+
+    # default seconds an external command is allowed to run
+    if settings.get("command.timeout"):
+        from storlever.lib.command import command_executor
+        command_executor().timeout = float(settings.get("command.timeout"))
+
+    # seconds a command run by a request waits for a free slot
+    if settings.get("command.queue_timeout") is not None:
+        from storlever.lib.command import command_executor
+        command_executor().queue_timeout = float(settings.get("command.queue_timeout"))
+
+    # max number of the background jobs running at the same time
+    if settings.get("job.max_workers") is not None:
+        from storlever.mngr.system.jobmgr import job_mgr
+        job_mgr().max_workers = int(settings.get("job.max_workers"))
+
+    # file to keep the state of the background jobs across restarts
+    if settings.get("job.state_file"):
+        from storlever.mngr.system.jobmgr import job_mgr
+        job_mgr().state_file = settings.get("job.state_file")
+
+    # max number of the disks queried by smartctl at the same time
+    if settings.get("smart.max_workers") is not None:
+        from storlever.mngr.block.smartmgr import smart_mgr
+        smart_mgr().max_workers = int(settings.get("smart.max_workers"))
+
+    # seconds the SMART info of a disk is cached
+    if settings.get("smart.cache_ttl") is not None:
+        from storlever.mngr.block.smartmgr import smart_mgr
+        smart_mgr().cache_ttl = float(settings.get("smart.cache_ttl"))
+
+    # directory of the SMART history files of the drives
+    if settings.get("smart.history_dir"):
+        from storlever.mngr.block.smartmgr import smart_mgr
+        smart_mgr().history.history_dir = settings.get("smart.history_dir")
+
+    # collect the SMART info of all disks in background, 0 means disabled
+    smart_interval = float(settings.get("smart.collect_interval", 0))
+    if smart_interval > 0:
+        from storlever.mngr.block.smartmgr import smart_mgr
+        from storlever.mngr.block.scsimgr import scsi_mgr
+        smart_mgr().start(scsi_mgr().get_smart_dev_files, smart_interval)
+
+    # max number of the mount points probed by statvfs at the same time
+    if settings.get("fs.usage_max_workers") is not None:
+        from storlever.mngr.fs.fsusage import fs_usage_mgr
+        fs_usage_mgr().max_workers = int(settings.get("fs.usage_max_workers"))
+
+    # seconds to wait for the usage of a filesystem
+    if settings.get("fs.usage_timeout") is not None:
+        from storlever.mngr.fs.fsusage import fs_usage_mgr
+        fs_usage_mgr().timeout = float(settings.get("fs.usage_timeout"))
+
+    # directory of the directory size index files of the filesystems
+    if settings.get("fs.dir_index_dir"):
+        from storlever.mngr.fs.dirindex import dir_index_mgr
+        dir_index_mgr().index_dir = settings.get("fs.dir_index_dir")
+
+    # max number of the directories scanned at the same time by the index
+    if settings.get("fs.dir_index_max_workers") is not None:
+        from storlever.mngr.fs.dirindex import dir_index_mgr
+        dir_index_mgr().max_workers = int(settings.get("fs.dir_index_max_workers"))
+
+    # refresh the directory index of all local filesystems in background,
+    # 0 means disabled
+    dir_index_interval = float(settings.get("fs.dir_index_interval", 0))
+    if dir_index_interval > 0:
+        from storlever.mngr.fs.dirindex import dir_index_mgr
+        from storlever.mngr.fs.fsmgr import fs_mgr
+        dir_index_mgr().start(fs_mgr().get_local_mount_points, dir_index_interval)
+
+    # start the metrics collector with the sample interval, 0 means disabled
+    metrics_interval = float(settings.get("metrics.interval", 0))
+    if metrics_interval > 0:
+        from storlever.mngr.system.metrics import metrics_mgr
+        metrics_mgr().start(metrics_interval)
+
+    # keep the /proc/stat snapshots from startup for the cpu percent API
+    from storlever.mngr.system.cpustat import cpu_stat_mgr
+    cpu_stat_mgr().start()
+
     # make JSON as the default renderer
     config.add_renderer(None, JSON(indent=json_indent, check_circular=True, cls=CustomJSONEncoder))
 
@@ -65,6 +170,11 @@ def main(global_config, **settings):
     # loads all the extensions with entry point group "storlever.extenstions"
     launch_extensions(config)
 
+    # load the jobs of the former run after all the modules registered the
+    # functions to resume their jobs
+    from storlever.mngr.system.jobmgr import job_mgr
+    job_mgr().load()
+
     return config.make_wsgi_app()
 
 
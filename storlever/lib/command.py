@@ -4,14 +4,85 @@ storlever.lib.command
 
 This module implements command call for storlever.
 
+The commands are run by the command executor, which runs at most
+COMMAND_MAX_WORKERS commands at the same time and kills a command (with
+all its children) when it runs out of its timeout, so a hanging command
+like iscsiadm on an unreachable target can not hold the request threads
+forever. The programs which may hang have a cap of the commands running at
+the same time, so they can not take all the slots, and a command run by a
+request thread fails with 503 if it can not get a slot in time. The output of a command is captured while it runs, and can be
+streamed to a callback line by line.
+
+The commands run by a thread within a CommandScope, like the commands of a
+background job, report their output to the scope and are cancelled with it.
+
 :copyright: (c) 2014 by OpenSight (www.opensight.cn).
 :license: AGPLv3, see LICENSE for more details.
 
 """
 import subprocess
 import os
+import re
+import time
+import heapq
+import signal
+import itertools
+import threading
+import collections
+import logging
 import exception
 
+from storlever.lib.lock import lock
+from storlever.lib import logger
+
+
+# max number of the commands running at the same time, the others wait
+# in the queue
+COMMAND_MAX_WORKERS = 8
+
+# default seconds a command is allowed to run, 0 means no limit. Only the
+# programs in COMMAND_TIMEOUTS are limited by default, since the others,
+# like quotacheck on a large filesystem, may run long legitimately
+COMMAND_TIMEOUT = 0
+
+# seconds a command run out of a CommandScope, like by a request thread,
+# waits in the queue for a free slot before it fails with
+# COMMAND_BUSY_STATUS, 0 means no limit
+COMMAND_QUEUE_TIMEOUT = 10
+
+# default timeout of the commands which may hang on an unreachable target
+# or a dead disk, by the program name
+COMMAND_TIMEOUTS = {
+    "iscsiadm": 120,
+    "smartctl": 60,
+    "blkid": 60,
+    "showmount": 30,
+    "rpcinfo": 10,
+}
+
+# max number of the commands of a program running at the same time, by the
+# program name, the others wait in the queue. A killed command is counted
+# until it exits
+COMMAND_PROGRAM_LIMITS = {
+    "iscsiadm": 2,
+    "smartctl": 4,
+    "blkid": 2,
+    "showmount": 2,
+}
+
+# max number of the killed commands which are not exited yet, like stuck in
+# the kernel on a dead disk, without holding their slots. The ones beyond
+# this number hold their slots until they exit
+COMMAND_MAX_STUCK = 4
+
+# http status of the error raised for a timed out command
+COMMAND_TIMEOUT_STATUS = 504
+
+# http status of the error raised for a command not started in time
+COMMAND_BUSY_STATUS = 503
+
+_LINE_END = re.compile(r"[\r\n]")
+
 # backport check_output to python 2.6
 if "check_output" not in dir( subprocess ):
     def backport_check_output(*popenargs, **kwargs):
@@ -36,7 +107,381 @@ if "check_output" not in dir( subprocess ):
     subprocess.check_output = backport_check_output;
 
 
-def check_output(cmd, shell=False, input_ret=[]):
+def _program_name(cmd, shell):
+    if isinstance(cmd, basestring):
+        cmd = cmd.split() if shell else [cmd]
+    return os.path.basename(cmd[0]) if cmd else ""
+
+
+def _cmd_str(cmd):
+    if isinstance(cmd, basestring):
+        return cmd
+    return " ".join(cmd)
+
+
+class CommandFuture(object):
+    """the pending result of a command submitted to the command executor"""
+
+    def __init__(self, cmd, shell, input_ret, timeout, on_output):
+        self.cmd = cmd
+        self.shell = shell
+        self.program = _program_name(cmd, shell)
+        self.input_ret = input_ret
+        self.timeout = timeout
+        self.on_output = on_output
+        self.process = None
+        self.start_time = None
+        self.output = None
+        self.error = None
+        self.cancelled = False
+        self.timed_out = False
+        # whether the slot of the executor is released
+        self.released = False
+        self._started = threading.Event()
+        self._event = threading.Event()
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """wait for the command to finish, return whether it's done"""
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        wait for the command and return its output, StorLeverCmdError is
+        raised if it fails, times out or is cancelled
+        """
+        if not self.wait(timeout):
+            raise exception.StorLeverError(
+                "command (%s) is still running" % _cmd_str(self.cmd), 500)
+        if self.error is not None:
+            raise self.error
+        return self.output
+
+    def kill(self):
+        """kill the command with all its children"""
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+class CommandScope(object):
+    """
+    the commands submitted by a thread within the scope, like in a
+    background job. Use it as a context manager in that thread:
+
+        with scope:
+            do_something()  # which calls check_output()
+
+    on_output of the scope is used by the commands without their own, and
+    timeout of the scope replaces the executor's default timeout (0 means
+    no limit). cancel() can be called from any thread, it cancels the
+    commands of the scope and the following ones fail at once
+    """
+
+    def __init__(self, on_output=None, timeout=None):
+        self.on_output = on_output
+        self.timeout = timeout
+        self.cancelled = False
+        self.lock = lock()
+        self._futures = []
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = current_command_scope()
+        _scopes.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _scopes.current = self._outer
+        self._outer = None
+
+    def _add(self, future):
+        with self.lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+            if self.cancelled:
+                future.cancelled = True
+
+    def cancel(self):
+        """cancel the queued and running commands of the scope"""
+        with self.lock:
+            self.cancelled = True
+            futures = self._futures
+            self._futures = []
+        for future in futures:
+            command_executor().cancel(future)
+
+
+_scopes = threading.local()
+
+
+def current_command_scope():
+    """return the CommandScope of the current thread, or None"""
+    return getattr(_scopes, "current", None)
+
+
+class CommandExecutor(object):
+    """run the commands with bounded concurrency and timeouts"""
+
+    def __init__(self, max_workers=COMMAND_MAX_WORKERS):
+        self.lock = lock()
+        self.max_workers = max_workers
+        self.timeout = COMMAND_TIMEOUT
+        self.queue_timeout = COMMAND_QUEUE_TIMEOUT
+        self.max_stuck = COMMAND_MAX_STUCK
+        self._running = 0
+        # program name -> number of its commands not exited yet
+        self._programs = collections.defaultdict(int)
+        # number of the killed commands not exited yet
+        self._stuck = 0
+        self._queue = collections.deque()
+        # heap of (deadline, sequence, future) of the running commands
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._watcher_cond = threading.Condition(self.lock)
+        self._watcher = None
+
+    def _default_timeout(self, cmd, shell, scope):
+        timeout = self.timeout
+        if scope is not None and scope.timeout is not None:
+            timeout = scope.timeout
+        return COMMAND_TIMEOUTS.get(_program_name(cmd, shell), timeout)
+
+    def submit(self, cmd, shell=False, input_ret=[], timeout=None,
+               on_output=None):
+        """
+        submit the cmd to run in background, return a CommandFuture.
+
+        :param input_ret: the return codes for which the StorLeverCmdError's
+                          http_status_code is 400 instead of 500
+        :param timeout: seconds the cmd is allowed to run before it's killed,
+                        default to COMMAND_TIMEOUTS of the program or the
+                        executor's timeout. 0 means no limit
+        :param on_output: called with each line of the stdout/stderr,
+                          without the line end, in the executor thread,
+                          default to the one of the current CommandScope
+        """
+        scope = current_command_scope()
+        if timeout is None:
+            timeout = self._default_timeout(cmd, shell, scope)
+        if on_output is None and scope is not None:
+            on_output = scope.on_output
+        future = CommandFuture(cmd, shell, input_ret, timeout, on_output)
+        if scope is not None:
+            scope._add(future)
+        with self.lock:
+            self._queue.append(future)
+        self._dispatch()
+        return future
+
+    def run(self, cmd, shell=False, input_ret=[], timeout=None, on_output=None):
+        """
+        run the cmd and return its output, see submit(). Out of a
+        CommandScope, StorLeverError with http_status_code 503 is raised if
+        the cmd is not started in queue_timeout seconds
+        """
+        future = self.submit(cmd, shell, input_ret, timeout, on_output)
+        if self.queue_timeout and current_command_scope() is None and \
+                not future._started.wait(self.queue_timeout):
+            self._dequeue(future, exception.StorLeverError(
+                "too many commands are running, command (%s) is not started "
+                "in %s seconds, try again later" %
+                (_cmd_str(cmd), self.queue_timeout), COMMAND_BUSY_STATUS))
+        return future.result()
+
+    def _dequeue(self, future, error):
+        """fail the command with the error if it's still queued"""
+        with self.lock:
+            if future not in self._queue:
+                return False
+            self._queue.remove(future)
+        future.error = error
+        future._event.set()
+        return True
+
+    def cancel(self, future):
+        """cancel the command, it's killed if running"""
+        with self.lock:
+            future.cancelled = True
+        if not self._dequeue(future, exception.StorLeverCmdError(
+                None, "command (%s) is cancelled" % _cmd_str(future.cmd), 500)):
+            future.kill()
+
+    def _dispatch(self):
+        """
+        start the queued commands while there are free slots, skip the ones
+        whose program runs out of its limit
+        """
+        started = []
+        with self.lock:
+            # the killed commands beyond max_stuck still hold their slots
+            workers = self.max_workers - max(0, self._stuck - self.max_stuck)
+            skipped = []
+            while self._queue and self._running < workers:
+                future = self._queue.popleft()
+                limit = COMMAND_PROGRAM_LIMITS.get(future.program)
+                if limit is not None and self._programs[future.program] >= limit:
+                    skipped.append(future)
+                    continue
+                self._running += 1
+                self._programs[future.program] += 1
+                started.append(future)
+            self._queue.extendleft(reversed(skipped))
+        for future in started:
+            future._started.set()
+            thread = threading.Thread(target=self._run_command, args=(future,),
+                                      name="storlever-command")
+            thread.daemon = True
+            thread.start()
+
+    def _finish(self, future):
+        """the command exits, release its slot if not yet"""
+        with self.lock:
+            self._programs[future.program] -= 1
+            if not future.released:
+                future.released = True
+                self._running -= 1
+            elif future.timed_out:
+                self._stuck -= 1
+        self._dispatch()
+
+    def _watch(self, future):
+        with self.lock:
+            heapq.heappush(self._deadlines, (future.start_time + future.timeout,
+                                             next(self._sequence), future))
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch_deadlines,
+                                                 name="storlever-command-watcher")
+                self._watcher.daemon = True
+                self._watcher.start()
+            self._watcher_cond.notify()
+
+    def _watch_deadlines(self):
+        while True:
+            expired = []
+            with self.lock:
+                while self._deadlines and self._deadlines[0][2].done():
+                    heapq.heappop(self._deadlines)
+                if not self._deadlines:
+                    self._watcher_cond.wait()
+                    continue
+                now = time.time()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    expired.append(heapq.heappop(self._deadlines)[2])
+                if not expired:
+                    self._watcher_cond.wait(self._deadlines[0][0] - now)
+            for future in expired:
+                self._expire(future)
+
+    def _expire(self, future):
+        """
+        the command runs out of its time, kill it and fail the caller at once.
+        The slot is released even if the command can not be killed, like
+        stuck in the kernel, so it can't block the other commands. It's
+        counted as stuck until it exits, see max_stuck
+        """
+        with self.lock:
+            if future.done() or future.released:
+                return
+            future.timed_out = True
+            future.released = True
+            self._running -= 1
+            self._stuck += 1
+        future.kill()
+        future.error = exception.StorLeverCmdError(
+            -signal.SIGKILL,
+            "command (%s) timed out after %s seconds\n%s" %
+            (_cmd_str(future.cmd), future.timeout, "".join(future.output or [])),
+            COMMAND_TIMEOUT_STATUS)
+        future._event.set()
+        logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                   "command (%s) timed out after %s seconds and is killed, "
+                   "%d killed commands are not exited yet" %
+                   (_cmd_str(future.cmd), future.timeout, self._stuck))
+        self._dispatch()
+
+    def _read_output(self, future, process):
+        chunks = []
+        future.output = chunks
+        pending = ""
+        fd = process.stdout.fileno()
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            chunks.append(data)
+            if future.on_output is not None:
+                lines = _LINE_END.split(pending + data)
+                pending = lines.pop()
+                for line in lines:
+                    if line:
+                        future.on_output(line)
+        if pending and future.on_output is not None:
+            future.on_output(pending)
+        return "".join(chunks)
+
+    def _run_command(self, future):
+        try:
+            if future.cancelled:
+                raise exception.StorLeverCmdError(
+                    None, "command (%s) is cancelled" % _cmd_str(future.cmd), 500)
+            future.start_time = time.time()
+            # run in its own process group to kill its children together
+            process = subprocess.Popen(future.cmd, shell=future.shell,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       close_fds=True, preexec_fn=os.setsid)
+            future.process = process
+            if future.cancelled:
+                future.kill()
+            if future.timeout:
+                self._watch(future)
+            try:
+                output = self._read_output(future, process)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+
+            if future.timed_out:
+                return
+            if future.cancelled:
+                raise exception.StorLeverCmdError(
+                    returncode, "command (%s) is cancelled\n%s" %
+                    (_cmd_str(future.cmd), output), 500)
+            if returncode:
+                if returncode in future.input_ret:
+                    http_status = 400
+                else:
+                    http_status = 500
+                raise exception.StorLeverCmdError(returncode, output, http_status)
+            future.output = output
+        except Exception as e:
+            # raised to the caller as is, like OSError if the program
+            # does not exist
+            future.error = e
+        finally:
+            # the timed out command is failed by _expire()
+            if not future.timed_out and not future.done():
+                future._event.set()
+            self._finish(future)
+
+
+CommandExecutor = CommandExecutor()
+
+
+def command_executor():
+    """return the global command executor"""
+    return CommandExecutor
+
+
+def check_output(cmd, shell=False, input_ret=[], timeout=None, on_output=None):
     """call the cmd and return output
 
      it's similar with subprocess.check_output except it would raise a
@@ -47,20 +492,12 @@ def check_output(cmd, shell=False, input_ret=[]):
 
      StorLeverError's str is the stdout/stderr of the cmd
 
+     The cmd is run by the command executor, it's killed after timeout
+     seconds (default to COMMAND_TIMEOUTS of the program), and
+     StorLeverCmdError with http_status_code 504 is raised in this case.
+     on_output is called with each line of the output while the cmd runs
     """
-    try:
-        return subprocess.check_output(cmd,
-                                       stderr=subprocess.STDOUT,
-                                       shell=shell)
-    except subprocess.CalledProcessError as e:
-        if e.returncode in input_ret:
-            http_status = 400
-        else:
-            http_status = 500
-        info = e.output
-
-        # re-raise the storlever's error
-        raise exception.StorLeverCmdError(e.returncode, info, http_status)
+    return command_executor().run(cmd, shell, input_ret, timeout, on_output)
 
 
 def read_file_entry(path, default_value = None):
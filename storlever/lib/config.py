@@ -1,23 +1,185 @@
 import yaml
 import os
+import re
+import sys
+import stat
+import time
+import atexit
+import marshal
+import hashlib
+import logging
+import tempfile
+import threading
+
+from storlever.lib.lock import lock
+from storlever.lib import logger
+
+# use the LibYAML based C implementation if available
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper as _SafeDumper
+
+
+# conf files larger than this are cached in a sidecar file if enabled
+CONF_SIDECAR_MIN_SIZE = 256 * 1024
+
+# version of the sidecar format, change it if the format is changed
+CONF_SIDECAR_VERSION = 1
+
+# seconds the write of a conf file is delayed, the writes of the same file
+# in this window are coalesced into one
+CONF_WRITE_DELAY = 0.5
+
+
+class ConfLoader(_SafeLoader):
+    """
+    safe loader of the conf files, which also accepts the python string tags
+    written by the former yaml.dump
+    """
+    pass
+
+
+def _construct_python_unicode(loader, node):
+    return unicode(loader.construct_scalar(node))
+
+
+def _construct_python_str(loader, node):
+    value = loader.construct_scalar(node)
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return value
+
+
+ConfLoader.add_constructor(u"tag:yaml.org,2002:python/unicode",
+                           _construct_python_unicode)
+ConfLoader.add_constructor(u"tag:yaml.org,2002:python/str",
+                           _construct_python_str)
+
+
+class ConfDumper(_SafeDumper):
+    """safe dumper of the conf files"""
+    pass
+
+
+ConfDumper.add_multi_representer(dict, ConfDumper.represent_dict)
+ConfDumper.add_multi_representer(list, ConfDumper.represent_list)
+ConfDumper.add_representer(tuple, ConfDumper.represent_list)
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=ConfLoader)
+
+
+def dump_yaml(data, stream=None):
+    return yaml.dump(data, stream, Dumper=ConfDumper, default_flow_style=False)
+
 
 class ConfigError(Exception):
     pass
 
 
+def write_file_atomic(file_name, content, mode=None):
+    """
+    replace the file with the content atomically, the content is written to
+    a temp file in the same directory, fsync'ed and renamed over the file,
+    so the file is never left truncated by a crash
+
+    :param mode: permission of the file, default to keep the current one,
+                 or 0644 for a new file
+    """
+    # replace the target of a symlink instead of the link itself
+    file_name = os.path.realpath(file_name)
+    dir_name = os.path.dirname(file_name)
+    if mode is None:
+        try:
+            mode = stat.S_IMODE(os.stat(file_name).st_mode)
+        except OSError:
+            mode = 0644
+    fd, tmp_file = tempfile.mkstemp(prefix="." + os.path.basename(file_name) + ".",
+                                    suffix=".tmp", dir=dir_name)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_file, mode)
+        os.rename(tmp_file, file_name)
+    except:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    # make the rename durable
+    dir_fd = os.open(dir_name, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
 class Config(object):
+    # directory of the sidecar cache files of the large conf files, which
+    # keep the validated conf in marshal format. None means disabled
+    sidecar_dir = None
+
     def __init__(self, conf_file, conf=None, schema=None):
         self.conf_file = conf_file
         self.conf = conf
         self.schema = schema
 
+    def _sidecar(self, content):
+        """return the sidecar file path and the key of the conf content"""
+        if self.sidecar_dir is None or len(content) < CONF_SIDECAR_MIN_SIZE:
+            return None, None
+        # the address of objects in schema repr differs in each process
+        schema_repr = re.sub(r" at 0x[0-9a-fA-F]+", "", repr(self.schema))
+        key = hashlib.sha1("\0".join([str(CONF_SIDECAR_VERSION), sys.version,
+                                      schema_repr, content])).hexdigest()
+        name = hashlib.sha1(os.path.abspath(self.conf_file)).hexdigest()
+        return os.path.join(self.sidecar_dir, name + ".cache"), key
+
+    def _load_sidecar(self, sidecar, key):
+        try:
+            with open(sidecar, "rb") as f:
+                sidecar_key, conf = marshal.load(f)
+        except Exception:
+            return None
+        if sidecar_key != key:
+            return None
+        return conf
+
+    def _save_sidecar(self, sidecar, key, conf):
+        tmp_file = "%s.%d.tmp" % (sidecar, os.getpid())
+        try:
+            if not os.path.isdir(self.sidecar_dir):
+                os.makedirs(self.sidecar_dir, 0700)
+            with open(tmp_file, "wb") as f:
+                marshal.dump((key, conf), f)
+            os.rename(tmp_file, sidecar)
+        except Exception as e:
+            # like the conf contains types not supported by marshal
+            logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                       "Failed to write sidecar cache of conf file %s (%s)" %
+                       (self.conf_file, str(e)))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
     def parse(self):
         if self.conf_file is not None and self.conf_file != "":
             try:
                 with open(self.conf_file, "r") as f:
-                    self.conf = yaml.load(f)
+                    content = f.read()
+                sidecar, key = self._sidecar(content)
+                if sidecar is not None:
+                    conf = self._load_sidecar(sidecar, key)
+                    if conf is not None:
+                        self.conf = conf
+                        return self.conf
+                self.conf = load_yaml(content)
                 if self.schema:
                     self.conf = self.schema.validate(self.conf)
+                if sidecar is not None:
+                    self._save_sidecar(sidecar, key, self.conf)
                 return self.conf
             except Exception as e:
                 raise ConfigError(str(e))
@@ -28,11 +190,10 @@ class Config(object):
         if self.conf_file is not None and self.conf_file != "" and \
                 self.conf is not None:
             try:
-                with open(self.conf_file, "w") as f:
-                    os.chmod(self.conf_file, 0600) # make config file is r/w only for root
-                    yaml.dump(self.conf, f, default_flow_style=False)
-            except Exception:
-                raise ConfigError(str(Exception))
+                # make config file is r/w only for root
+                write_file_atomic(self.conf_file, dump_yaml(self.conf), 0600)
+            except Exception as e:
+                raise ConfigError(str(e))
         else:
             raise ConfigError("conf file absent")
 
@@ -47,3 +208,233 @@ class Config(object):
         conf = cls(conf_file, conf=conf)
         conf.write()
         return conf
+
+
+class ConfigWriter(object):
+    """
+    write-behind writer of the conf files.
+
+    The content of a scheduled write is rendered when it's written, and a
+    later write of the same file replaces the pending one, so a burst of
+    changes within the delay is written only once. Each file is written
+    atomically by write_file_atomic. Call flush() before the file must be
+    on the disk, like before a service reads it.
+    """
+
+    def __init__(self, delay=CONF_WRITE_DELAY):
+        self.lock = lock()
+        # serialize the writes, so flush() returns after the pending writes
+        # popped by the other threads are finished
+        self._write_lock = lock()
+        self.delay = delay
+        # file name -> (render function, mode, callback after written)
+        self._pending = {}
+        # files popped from the pending writes but not written yet
+        self._writing = set()
+        self._pending_cond = threading.Condition(self.lock)
+        self._thread = None
+
+    def write(self, file_name, render, mode=None, on_written=None):
+        """
+        schedule to write the file with the content returned by render(),
+        which is called at the write time. It's written at once if the
+        delay is 0
+        """
+        self._schedule(file_name, (render, mode, on_written))
+
+    def remove(self, file_name):
+        """schedule to remove the file, instead of the pending write"""
+        self._schedule(file_name, (None, None, None))
+
+    def _schedule(self, file_name, write):
+        file_name = os.path.abspath(file_name)
+        with self.lock:
+            self._pending[file_name] = write
+            if self.delay > 0:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run,
+                                                    name="storlever-conf-writer")
+                    self._thread.daemon = True
+                    self._thread.start()
+                self._pending_cond.notify()
+        if self.delay <= 0:
+            self.flush(file_name)
+
+    def is_pending(self, file_name):
+        """whether the file is scheduled or being written"""
+        file_name = os.path.abspath(file_name)
+        with self.lock:
+            return file_name in self._pending or file_name in self._writing
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self._pending:
+                    self._pending_cond.wait()
+            # wait for the following writes to coalesce with
+            time.sleep(self.delay)
+            try:
+                self.flush()
+            except ConfigError:
+                pass    # already logged
+
+    def flush(self, file_name=None):
+        """
+        write the pending write of the file, or all files, at once.
+        ConfigError is raised if any file fails to be written
+        """
+        with self._write_lock:
+            with self.lock:
+                if file_name is None:
+                    writes = sorted(self._pending.items())
+                    self._pending.clear()
+                else:
+                    file_name = os.path.abspath(file_name)
+                    write = self._pending.pop(file_name, None)
+                    writes = [(file_name, write)] if write is not None else []
+                self._writing.update(name for name, _ in writes)
+
+            errors = []
+            for name, (render, mode, on_written) in writes:
+                try:
+                    if render is None:
+                        if os.path.lexists(name):
+                            os.remove(name)
+                    else:
+                        write_file_atomic(name, render(), mode)
+                    if on_written is not None:
+                        on_written()
+                except Exception as e:
+                    logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                               "Failed to write conf file %s (%s)" % (name, str(e)))
+                    errors.append("%s: %s" % (name, str(e)))
+                finally:
+                    with self.lock:
+                        self._writing.discard(name)
+            if errors:
+                raise ConfigError("; ".join(errors))
+
+
+ConfigWriter = ConfigWriter()
+
+
+def config_writer():
+    """return the global write-behind conf writer"""
+    return ConfigWriter
+
+
+def _flush_at_exit():
+    try:
+        ConfigWriter.flush()
+    except ConfigError:
+        pass    # already logged
+
+atexit.register(_flush_at_exit)
+
+
+def _copy_conf(conf):
+    """copy a conf made of dict/list/scalar, much faster than copy.deepcopy"""
+    if isinstance(conf, dict):
+        return conf.__class__((key, _copy_conf(value))
+                              for key, value in conf.iteritems())
+    elif isinstance(conf, list):
+        return [_copy_conf(value) for value in conf]
+    else:
+        return conf
+
+
+class ConfigStore(object):
+    """
+    keep the parsed and validated conf of each file in memory, the file is
+    parsed and validated again only when its (mtime, size, inode) changes.
+
+    Every load returns a private copy of the cached conf, so the caller can
+    change it freely without affecting the other callers.
+
+    The saved conf is written by the write-behind conf writer, and it's
+    returned by load until it's written.
+    """
+
+    def __init__(self, writer=None):
+        self.lock = lock()
+        self.writer = writer if writer is not None else config_writer()
+        # (conf file, schema) -> ((mtime, size, inode), conf), the file key
+        # is None if the conf is not written yet
+        self._cache = {}
+
+    @staticmethod
+    def _file_key(st):
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def load(self, conf_file, schema=None):
+        conf_file = os.path.abspath(conf_file)
+        cache_key = (conf_file, schema)
+        with self.lock:
+            entry = self._cache.get(cache_key)
+        if entry is not None and entry[0] is None:
+            return _copy_conf(entry[1])
+        if self.writer.is_pending(conf_file):
+            # saved with no cache entry of this schema, the file must be
+            # written before it's parsed
+            self.writer.flush(conf_file)
+        try:
+            st = os.stat(conf_file)
+        except OSError as e:
+            raise ConfigError(str(e))
+        file_key = self._file_key(st)
+        if entry is None or entry[0] != file_key:
+            entry = (file_key, Config.from_file(conf_file, schema).conf)
+            with self.lock:
+                self._cache[cache_key] = entry
+        return _copy_conf(entry[1])
+
+    def exists(self, conf_file):
+        """whether the conf file exists or is saved but not written yet"""
+        return self.writer.is_pending(conf_file) or os.path.exists(conf_file)
+
+    def save(self, conf_file, conf):
+        """save the conf to the file, it's written by the conf writer later"""
+        conf_file = os.path.abspath(conf_file)
+        conf = _copy_conf(conf)
+        with self.lock:
+            for cache_key in self._cache.keys():
+                if cache_key[0] == conf_file:
+                    self._cache[cache_key] = (None, conf)
+
+        def _on_written():
+            try:
+                file_key = self._file_key(os.stat(conf_file))
+            except OSError:
+                return
+            with self.lock:
+                for cache_key, entry in self._cache.items():
+                    # not saved again during the write
+                    if cache_key[0] == conf_file and entry[1] is conf:
+                        self._cache[cache_key] = (file_key, conf)
+
+        # make config file is r/w only for root
+        self.writer.write(conf_file, lambda: dump_yaml(conf), 0600, _on_written)
+
+    def flush(self, conf_file=None):
+        """write the saved conf of the file, or all files, at once"""
+        self.writer.flush(conf_file)
+
+    def invalidate(self, conf_file=None):
+        """drop the cached conf of the file, or all files"""
+        with self.lock:
+            if conf_file is None:
+                self._cache.clear()
+                return
+            conf_file = os.path.abspath(conf_file)
+            for cache_key in self._cache.keys():
+                if cache_key[0] == conf_file:
+                    del self._cache[cache_key]
+
+
+ConfigStore = ConfigStore()
+
+
+def config_store():
+    """return the global conf store"""
+    return ConfigStore
+
@@ -1,6 +1,23 @@
+"""
+storlever.lib.confparse
+~~~~~~~~~~~~~~~~
 
-import re,os
-from tempfile import mkstemp
+This module implements the parser of the properties (like ifcfg-* and
+vsftpd.conf) and ini (like smb.conf) conf files.
+
+A file is tokenized in one pass when it is read. The tokens are kept as the
+template of the file, so writing the conf back only patches the lines of
+the modified options, and keeps the other lines, comments and layout as is.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import re
+import os
+
+from storlever.lib.config import write_file_atomic
 
 
 class Error(Exception):
@@ -84,6 +101,172 @@ class MissingSectionHeaderError(ParsingError):
         self.line = line
 
 
+# kinds of the tokens of a conf file line
+_OPTION, _COMMENT, _CONT, _SECTION, _OTHER = range(5)
+
+_WHITESPACES = " \t\n\r\f\v"
+
+_OPTION_RE = re.compile(
+    r"\s*(?P<option>[^#;]+?)\s*[=:]\s*(?P<value>.+?)?(?:\s+(?:[#;].*)?)?$")
+# the common option line without comment, it's the same as _OPTION_RE
+# for the lines without "#" and ";"
+_PLAIN_OPTION_RE = re.compile(
+    r"[ \t]*(?P<option>[^#;=:\s](?:[^#;=:]*[^#;=:\s])?)\s*[=:]\s*(?P<value>[^#;]*?)\s*$")
+_CONT_RE = re.compile(r"\s+(?P<cont>[^#;]*?)(?:\s+[#;].*)?$")
+_SECTION_RE = re.compile(r"\[(?P<section>.+)\](?:\s+(?:[#;].*)?)?$")
+
+
+def _match_option(text):
+    """return (option, value start, value end, value) of an option line"""
+    eq, colon = text.find("="), text.find(":")
+    if eq < 0 and colon < 0:
+        return None
+    sep = colon if eq < 0 or 0 <= colon < eq else eq
+    option = text[:sep].strip(_WHITESPACES)
+    if option and "#" not in text and ";" not in text:
+        # the common case, same as _OPTION_RE without comment
+        rest = text[sep + 1:].lstrip(_WHITESPACES)
+        start = len(text) - len(rest)
+        value = rest.rstrip(_WHITESPACES)
+    else:
+        mo = _OPTION_RE.match(text)
+        if mo is None:
+            return None
+        option, value = mo.group("option", "value")
+        start = mo.start("value")
+    if not value:
+        # the value is inserted before the line ending
+        return option, len(text.rstrip("\r\n")), len(text.rstrip("\r\n")), ""
+    return option, start, start + len(value), value
+
+
+def _tokenize(lines, sections=False):
+    """
+    tokenize the lines of a conf file in one pass, return a list of
+    (kind, key, line, text, value start, value end, value) for each line
+    and the set of the active options, (section, option) if sections is True.
+
+    text is the line itself, or the commented text for the _COMMENT lines,
+    which is patched with the value of its key if it has one.
+    """
+    tokens = []
+    active = set()
+    append = tokens.append
+    plain_match = _PLAIN_OPTION_RE.match
+    section = ""
+    for line in lines:
+        mo = plain_match(line)
+        # the section header is checked first
+        if mo is not None and not (sections and line[:1] == "["):
+            option, value = mo.group("option", "value")
+            if value:
+                start = mo.start("value")
+                append((_OPTION, option, line, line, start, start + len(value), value))
+            else:
+                end = len(line.rstrip("\r\n"))
+                append((_OPTION, option, line, line, end, end, ""))
+            active.add((section, option) if sections else option)
+            continue
+
+        stripped = line.lstrip(_WHITESPACES)
+        first = stripped[:1]
+        if not first:
+            append((_OTHER, None, line, line, 0, 0, None))
+            continue
+
+        if first == "#" or first == ";":
+            cmted = stripped.lstrip("#;").lstrip(_WHITESPACES)
+            option = None
+            if not (sections and cmted[:1] == "[" and _SECTION_RE.match(cmted)):
+                option = _match_option(cmted)
+            if option is None:
+                append((_COMMENT, None, line, cmted, 0, 0, None))
+            else:
+                append((_COMMENT, option[0], line, cmted) + option[1:])
+            continue
+
+        if sections and line[:1] == "[":
+            header = line.rstrip(_WHITESPACES)
+            if len(header) > 2 and header[-1] == "]":
+                name = header[1:-1]
+            else:
+                mo = _SECTION_RE.match(line)
+                name = mo.group("section") if mo is not None else None
+            if name is not None:
+                section = name
+                append((_SECTION, section, line, line, 0, 0, None))
+                continue
+
+        option = _match_option(line)
+        if option is not None:
+            append((_OPTION, option[0], line, line) + option[1:])
+            active.add((section, option[0]) if sections else option[0])
+        elif first == line[:1]:
+            append((_OTHER, None, line, line, 0, 0, None))
+        elif "#" not in stripped and ";" not in stripped:
+            cont = stripped[:-1] if stripped[-1:] == "\n" else stripped
+            append((_CONT, None, line, line, 0, 0, cont))
+        else:
+            mo = _CONT_RE.match(line)
+            if mo is None:
+                append((_OTHER, None, line, line, 0, 0, None))
+            else:
+                append((_CONT, None, line, line, 0, 0, mo.group("cont")))
+    return tokens, active
+
+
+def _patch(text, start, end, old_value, value):
+    """replace the value in the line, the unchanged line is kept as is"""
+    if value == old_value:
+        return text
+    return text[:start] + value.replace('\n', '\n\t') + text[end:]
+
+
+class _Template(object):
+    """the tokens of a template file, re-tokenized only if the file changes"""
+
+    def __init__(self):
+        self.file_name = None
+        self.signature = None
+        self.tokens = ()
+        self.active = frozenset()
+
+    def read(self, fp, file_name, sections):
+        """tokenize the open file fp, return the tokens"""
+        try:
+            st = os.fstat(fp.fileno())
+            signature = (st.st_ino, st.st_size, st.st_mtime)
+        except (AttributeError, OSError):
+            signature = None
+        self.tokens, self.active = _tokenize(fp, sections)
+        self.file_name, self.signature = file_name, signature
+        return self.tokens
+
+    def load(self, file_name, sections):
+        """return the tokens and active options of the template file"""
+        if not isinstance(file_name, basestring) or not file_name:
+            return (), frozenset()
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            return (), frozenset()
+        signature = (st.st_ino, st.st_size, st.st_mtime)
+        if file_name != self.file_name or signature != self.signature:
+            try:
+                with open(file_name) as fp:
+                    self.read(fp, file_name, sections)
+            except IOError:
+                return (), frozenset()
+        return self.tokens, self.active
+
+
+def _template_of(conf):
+    """return the _Template of the properties or ini instance"""
+    if conf._template is None:
+        conf._template = _Template()
+    return conf._template
+
+
 class proxy(object):
     """When you aggregate a 'proxy' to a dikshanary then the
     proxy s attribute are the dict s item. Can be convenient"""
@@ -116,10 +299,11 @@ class properties(dict):
         """
 
    
-        self.dustbin, self.template = [], ""
+        self.dustbin, self.template = set(), ""
         self.order = _order
         self.proxy=proxy(self)
         self.sep = False
+        self._template = None
 
         if isinstance( _fileordict, basestring ) or isinstance( _fileordict, list):
             self.template=_fileordict
@@ -128,7 +312,7 @@ class properties(dict):
         elif hasattr( _fileordict, '__setitem__' ):
             self.update( _fileordict )
             if  hasattr( _fileordict, 'dustbin' ):
-                self.dustbin = _fileordict.dustbin[:]
+                self.dustbin = set(_fileordict.dustbin)
             if  hasattr( _fileordict, 'order' ):
                 self.order = _fileordict.order[:]
             if hasattr(_fileordict, 'sep'):
@@ -144,22 +328,6 @@ class properties(dict):
     def set_sep(self, sep):
         self.sep = sep
 
-    line=re.compile("""
-(^
-			\s*
-        (?P<option>	[^\#;]+?)
-        	 	(\s* (=|:) \s*)
-        (?P<value>	.+?)?
-        		(\s+((\#|;).*)?)?
-$)|(^
-    			(\s*(\#|;)+\s*
-        (?P<cmted>	(.|\s)*))
-$)|(^
-			\s+
-        (?P<cont>	[^\#;]*?)
-    			(\s+(\#|;).*)?
-$)""", re.VERBOSE)
-
     variable=re.compile(r'(?<!\\)\$(?P<name>\w+)')
 
     def interpolate(self, value):
@@ -209,8 +377,7 @@ $)""", re.VERBOSE)
     def __setitem__(self, item, value):
         """Sets a value for the item. If the item was in the dustbin,
         it is removed from the dustbin"""
-        if item in self.dustbin:
-            self.dustbin.remove(item)
+        self.dustbin.discard(item)
         dict.__setitem__( self, item, str(value))
     
 
@@ -218,7 +385,7 @@ $)""", re.VERBOSE)
         """Suppress the item and value from the instance. The deleted
         option is flagged to be skipped when writing or updated a file
         so that the option is effectively deleted"""
-        self.dustbin.append(item)
+        self.dustbin.add(item)
         if item in self:
             dict.__delitem__( self, item)
 
@@ -244,6 +411,17 @@ $)""", re.VERBOSE)
         if k in self: return k + sep + self[k].replace('\n','\n\t') + '\n'
         else : return ""
 
+    def _repr_left(self, written):
+        """The options not in the written set, sorted by the order
+        attribute and then alphabetically. written is updated"""
+        result = []
+        for k in self.order:
+            if k in self and k not in written:
+                result.append(self.linerepr(k))
+                written.add(k)
+        result.extend([self.linerepr(k) for k in sorted(self.keys()) if k not in written])
+        return ''.join(result)
+
     def __repr__(self):
         """The read and write methods will update the filename
         attribute. This file, if exist, is taken as a template for the
@@ -251,63 +429,45 @@ $)""", re.VERBOSE)
         represented. Then, keys in the instance but not found in the
         file (or if the filename attribute is empty) are added, sorted
         by the order attribute. Finally, left options are added
-        alphabetically."""
-
-        def replace_value_in_line (mo, value):
-            """Handy function that replace a named group by a string
-            in the string that the matched object was generated from"""
-            return mo.string[ :mo.start('value') ] + value.replace( '\n', '\n\t' ) + mo.string[ mo.end('value'): ]
-            
-        # Because we pop the written lines, we need to pop on a _copy_
-        a_copy = properties(self)
-
-        result=""
-        try: fp = file( self.template )
-        except: fp = []
-
-
-        for line in fp:
+        alphabetically.
 
-            mo = a_copy.line.match(line)
+        Only the lines of the modified options are patched, the other
+        lines of the template are kept as is. A commented option is
+        uncommented only if the option is not set in any line."""
 
-            if not mo:
-                result += line
-                continue
+        tokens, active = _template_of(self).load(self.template, False)
+        result, written, dustbin = [], set(), self.dustbin
 
-            option, cont, cmted = mo.group('option', 'cont', 'cmted')
+        for kind, key, line, text, start, end, value in tokens:
 
-            if option and option in a_copy:
-                result += replace_value_in_line (mo, a_copy[option] )
-                del a_copy[option]
-                            
-            elif cmted:
-                mo = a_copy.line.match(cmted)
-                if not mo:
-                    result += line
+            if kind == _OPTION:
+                # skip the duplicated lines and the line whose option is
+                # in the dustbin
+                if key in written or key in dustbin:
                     continue
-                
-                option = mo.group( 'option' )
-                if option and option in a_copy:
-                    result += replace_value_in_line ( mo, a_copy[option] )
-                    del a_copy[option]
+                if key in self:
+                    result.append(_patch(text, start, end, value, self[key]))
+                    written.add(key)
                 else:
-                    result += line
-                                                          
-            # skip the line whose option is in the dustbin
-            elif option and option in a_copy.dustbin: pass
+                    result.append(line)
 
-            # skip the continuation lines, already handled by the 'option' block
-            elif cont: pass
-            
-            else: result += line
+            elif kind == _COMMENT:
+                if key is not None and key in self and \
+                        key not in written and key not in active:
+                    result.append(_patch(text, start, end, value, self[key]))
+                    written.add(key)
+                else:
+                    result.append(line)
 
-        for k in a_copy.order[:] :
-            result += a_copy.linerepr( k )
-            del a_copy[k]
+            # skip the continuation lines, already handled by the option line
+            elif kind == _CONT and value:
+                continue
 
-        result += ''.join( [ a_copy.linerepr( k ) for k in sorted(a_copy.keys()) ] )
+            else:
+                result.append(line)
 
-        return result
+        result.append(self._repr_left(written))
+        return ''.join(result)
 
     def read(self,filenames=[]):
         """read and parse the list of named configuration files, given
@@ -318,7 +478,8 @@ $)""", re.VERBOSE)
         argument"""
 
         if isinstance(filenames, basestring):
-            self._read( file(filenames), filenames)
+            with open(filenames) as fp:
+                self._read(fp, filenames)
             self.template=filenames
 
         elif isinstance(filenames, list):
@@ -337,16 +498,15 @@ $)""", re.VERBOSE)
 
     def _read( self, fp, fn):
         """Parses each line of an open file, and detects options,
-        values, and continuation lines."""
-
-        for l in fp:
-            m = self.line.match( l )
-            if m:
-                option, value, cont = m.group('option', 'value', 'cont')
-                if value is None:
-                    value = ""
-                if option: 	cur_opt, self[option] = option, value
-                elif cont: 	self[cur_opt] += '\n' + cont.lstrip()
+        values, and continuation lines. The tokens are kept to
+        represent the instance with the file as template."""
+
+        cur_opt = None
+        for kind, key, line, text, start, end, value in _template_of(self).read(fp, fn, False):
+            if kind == _OPTION:
+                cur_opt, self[key] = key, value
+            elif kind == _CONT and value and cur_opt is not None:
+                self[cur_opt] += '\n' + value.lstrip()
                 
 
     def write(self, destination=None, order=None):
@@ -354,38 +514,21 @@ $)""", re.VERBOSE)
         without argument. The filename is the destination file, if
         missing, the filename attribute is the destination file. If
         both are empty, the representation of the instance is written
-        on stdout"""
+        on stdout. The file is replaced atomically and keeps its mode"""
+
+        if isinstance(destination, file):
+            destination.write(repr(self))
+            return
 
         if isinstance( destination, basestring):
             self.template = destination
-            fd, tmp = mkstemp("_storlever")
-            os.close(fd)
-            f = file(tmp,'w')
-
-        elif isinstance(destination,file):
-            f = destination
-
         elif self.template:
             destination = self.template
-            fd, tmp = mkstemp("_storlever")
-            os.close(fd)
-            f = file(tmp,'w')
-        
+
         if not self.template:
             print repr(self)
         else:
-            f.write(repr(self))
-
-        if isinstance(destination, basestring):
-            f.close()
-            try:
-                os.rename(tmp,destination)
-            except:
-                with open(tmp, "r") as f:
-                    tmp_content = f.read()
-                with open(destination, "w") as f:
-                    f.write(tmp_content)
-                os.unlink(tmp)
+            write_file_atomic(destination, repr(self))
 
     apply_to = write
 
@@ -399,9 +542,10 @@ class ini(dict):
 
     def __init__(self, _fileordict=None, **kwargs):
 
-        self.dustbin, self.defaults, self.template = [], {}, ""
+        self.dustbin, self.defaults, self.template = set(), {}, ""
         self.proxy=proxy(self)
         self.sep = False
+        self._template = None
 
         if isinstance(_fileordict, basestring):
             self.template=_fileordict
@@ -414,7 +558,7 @@ class ini(dict):
             else:
                 self.defaults.update(_fileordict)
             if hasattr(_fileordict, 'dustbin'):
-                self.dustbin = _fileordict.dustbin[:]
+                self.dustbin = set(_fileordict.dustbin)
             if hasattr(_fileordict, "sep"):
                 self.sep = _fileordict.sep
 
@@ -422,36 +566,17 @@ class ini(dict):
         if kwargs:
             self.defaults.update(kwargs)
 
-    line=re.compile('''
-(^
-			\[
-        (?P<section>	.+) \]
-        		(\s+((\#|;).*)?)?
-$)|(^
-    			\s*
-        (?P<option>	[^\#;]+?)
-        		(\s* (=|:) \s*)
-        (?P<value>	.+?)?
-        		(\s+((\#|;).*)?)?
-$)|(^
-		       	(\s*(\#|;)+\s*
-        (?P<cmted>	(.|\s)*))
-$)|(^
-        		\s+
-        (?P<cont>	[^\#;]*?)
-        		(\s+(\#|;).*)?
-$)''', re.VERBOSE)
+    def copy(self):
+        return ini(self)
 
-    
     def __setitem__(self, item, value):
         item = str( item )
-        if item in self.dustbin:
-            self.dustbin.remove(item)
+        self.dustbin.discard(item)
         dict.__setitem__(self,item, value)
 
     def __delitem__(self, item):
         item = str( item )
-        self.dustbin.append(item)
+        self.dustbin.add(item)
 
         if item in self:
             dict.__delitem__(self, item)
@@ -468,90 +593,74 @@ $)''', re.VERBOSE)
             return self.defaults[option]
 
     def simple_line ( self, section, key ) :
-        if self.sep:
-            sep = " = "
-        else:
-            sep = "="
-
-        if key in self.section:
-            return key + sep + self[section][key].replace('\n','\n\t') + '\n'
-        else : return ""
+        return self[section].linerepr(key)
 
     def __repr__(self):
-    
-        def replace_value_in_line (mo, value):
-            return mo.string[ :mo.start('value') ] + value.replace( '\n', '\n\t' ) + mo.string[ mo.end('value'): ]
-        
-        # Because we pop the written lines, we need to pop on a _copy_
-        a_copy, result, cur_sect = ini(self), '', ''
-        a_copy.set_sep(self.sep)
+        """Each section is represented like properties with the file as
+        template. The sections not in the file are added alphabetically,
+        a duplicated section in the file is merged into the first one"""
 
-        try: fp = file( self.template )
-        except: fp = []
-        
-        for line in fp :
+        tokens, active = _template_of(self).load(self.template, True)
+        result, dustbin = [], self.dustbin
+        # the sections whose options are all written
+        done = set()
+        cur_sect, sect, written = '', None, None
 
-            mo = a_copy.line.match(line)
-            
-            if not mo:
-                result += line
-                continue
-            
-            # if section then dump the remaining options and supppres the a_copy[cur_sect]
-            # then only then can you write the option
-            
-            section, option, cont, cmted = mo.group('section', 'option', 'cont', 'cmted')
-            
-            if section:
+        for kind, key, line, text, start, end, value in tokens:
 
-                if cur_sect and cur_sect in a_copy:
-                    result += repr ( a_copy[cur_sect] )
-                    del a_copy[cur_sect]
-                
-                if section not in a_copy.dustbin:
-                    result += line
-
-                cur_sect = section
-
-            # skip the line whose option is in the dustbin
-            elif option and cur_sect in a_copy and \
-                    option in a_copy[cur_sect].dustbin:
-                pass
-
-            # skip the line whose option is in a deleted section
-            elif option and cur_sect in a_copy.dustbin:
-                pass
-
-            elif option and cur_sect in a_copy and option in a_copy[cur_sect]:
-                result += replace_value_in_line (mo, a_copy[cur_sect][option])
-                del a_copy[cur_sect][option]
-                                
-            elif cmted:
-                mo = a_copy.line.match( cmted )
-                if not mo:
-                    result += line
+            # if section then dump the remaining options of the previous one
+            if kind == _SECTION:
+
+                if sect is not None:
+                    result.append(sect._repr_left(written))
+                    done.add(cur_sect)
+
+                if key not in dustbin and key not in done:
+                    result.append(line)
+
+                cur_sect = key
+                if key in self and key not in done:
+                    sect, written = self[key], set()
+                else:
+                    sect, written = None, None
+
+            elif kind == _OPTION:
+                # skip the line whose option is in the dustbin, or in a
+                # deleted section
+                if sect is not None and (key in sect.dustbin or key in written):
                     continue
-                option = mo.group( 'option' )
-                
-                if option and cur_sect in a_copy and option in a_copy[cur_sect]:
-                    result += replace_value_in_line (mo, a_copy[cur_sect][option])
-                    del a_copy[cur_sect][option]
-                            
-                else: result += line
-
-            # skip the continuation lines, already handled by the 'option' block
-            elif cont: pass
-            
-            else: result += line
+                if cur_sect in dustbin or cur_sect in done:
+                    continue
+                if sect is not None and key in sect:
+                    result.append(_patch(text, start, end, value, sect[key]))
+                    written.add(key)
+                else:
+                    result.append(line)
+
+            elif kind == _COMMENT:
+                if key is not None and sect is not None and key in sect and \
+                        key not in written and (cur_sect, key) not in active:
+                    result.append(_patch(text, start, end, value, sect[key]))
+                    written.add(key)
+                else:
+                    result.append(line)
+
+            # skip the continuation lines, already handled by the option line
+            elif kind == _CONT and value:
+                continue
+
+            else:
+                result.append(line)
 
-        if cur_sect and cur_sect in a_copy:
-            result += repr ( a_copy[cur_sect] )
-            del a_copy[cur_sect]
+        if sect is not None:
+            result.append(sect._repr_left(written))
+            done.add(cur_sect)
 
-        for section in sorted(a_copy.keys()):
-            result += '[' + section + ']\n' + repr ( a_copy[section] ) + '\n'
+        for section in sorted(self.keys()):
+            if section not in done:
+                result.append('[' + section + ']\n' + self[section]._repr_left(set()) + '\n')
 
-        return result
+        return ''.join(result)
         
     def read(self,filenames):
 
@@ -573,55 +682,41 @@ $)''', re.VERBOSE)
 
     def _read( self, fp, fn ):
         '''Can read ifcfg files, java properties files as well as ini
-        files with section, and updates self accordingly'''
+        files with section, and updates self accordingly. The options
+        before the first section are ignored'''
 
-        for line in fp:
-            m = self.line.match( line )
-            if m:
-                section, option, value, cont = m.group('section', 'option', 'value', 'cont')
+        cur_sect, cur_opt = None, None
+        for kind, key, line, text, start, end, value in _template_of(self).read(fp, fn, True):
+            if kind == _SECTION:
+                cur_sect = self[key] = properties()
+                cur_opt = None
 
-                if value is None:
-                    value = ""
-                
-                if section:
-                    cur_sect = self[section] = properties()
-                    
-                elif option:
-                    cur_sect[option], cur_opt,  = value, option
-                    
-                elif cont:
-                    cur_sect[cur_opt] += '\n' + cont.lstrip()
+            elif kind == _OPTION and cur_sect is not None:
+                # the new section has nothing in its dustbin
+                dict.__setitem__(cur_sect, key, value)
+                cur_opt = key
+
+            elif kind == _CONT and value and cur_opt is not None:
+                cur_sect[cur_opt] += '\n' + value.lstrip()
 
 
     def write(self, destination=None, order=None):
+        """like properties.write, but nothing is written if there is no
+        destination"""
+
+        if isinstance(destination, file):
+            destination.write(repr(self))
+            return
 
         if isinstance( destination, basestring):
             self.template = destination
-            fd, tmp = mkstemp("_storlever")
-            os.close(fd)
-            f = file(tmp,'w')
-
-        elif isinstance(destination,file):
-            f = destination
-
         elif self.template:
             destination = self.template
-            fd, tmp = mkstemp("_storlever")
-            os.close(fd)
-            f = file(tmp,'w')
-        
-        if not self.template:
-            repr(self)
-        else:
-            f.write(repr(self))
 
-        if isinstance(destination, basestring):
-            f.close()
-            try:
-                os.rename(tmp,destination)
-            except:
-                open(destination,'w').write(open(tmp,'r').read())
-                os.unlink(tmp)
+        if self.template:
+            write_file_atomic(destination, repr(self))
+
+    apply_to = write
 
 
 if __name__=='__main__':
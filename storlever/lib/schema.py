@@ -21,6 +21,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import re
+import copy
 from inspect import getargspec
 from functools import wraps
 
@@ -347,7 +348,9 @@ class Schema(object):
             # default for optional keys
             for k in set(s) - required - coverage:
                 try:
-                    new[k.default] = s[k].default
+                    # copy it, or the validated results share the mutable
+                    # default value
+                    new[k.default] = copy.deepcopy(s[k].default)
                 except AttributeError:
                     pass
             return new
@@ -0,0 +1,140 @@
+"""
+storlever.lib.uevent
+~~~~~~~~~~~~~~~~
+
+This module implements a kernel uevent monitor for storlever.
+
+Managers which cache the state of system devices can register a callback
+for a kernel subsystem (like "block"), which would be called in the monitor
+thread each time the kernel emits an uevent for that subsystem.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import socket
+import threading
+import errno
+import logging
+
+from storlever.lib import logger
+
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 16384
+
+
+def parse_uevent(data):
+    """parse a raw kernel uevent message into a dict
+
+    The message has the format "ACTION@DEVPATH\\0KEY=VALUE\\0KEY=VALUE...".
+    Messages from udevd (starting with "libudev") would be ignored and
+    an empty dict is returned.
+    """
+    fields = data.split("\0")
+    if not fields or "@" not in fields[0]:
+        return {}
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition("=")
+        if sep:
+            event[key] = value
+    return event
+
+
+class UeventMonitor(object):
+    """listen to kernel uevents and dispatch them to the registered callbacks"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callbacks = {}
+        self._sock = None
+        self._thread = None
+
+    def is_running(self):
+        return self._thread is not None
+
+    def register_cb(self, subsystem, fun):
+        """register a callback for the given kernel subsystem
+
+        The callback would be called with the uevent dict as its only
+        argument. The monitor thread is started on the first registration,
+        and if the netlink socket is not available in the system,
+        the callback would never be called.
+
+        return True if the monitor is running
+        """
+        with self.lock:
+            self.callbacks.setdefault(subsystem, []).append(fun)
+        return self.start()
+
+    def unregister_cb(self, subsystem, fun):
+        with self.lock:
+            cb_list = self.callbacks.get(subsystem, [])
+            if fun in cb_list:
+                cb_list.remove(fun)
+
+    def start(self):
+        with self.lock:
+            if self._thread is not None:
+                return True
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                     NETLINK_KOBJECT_UEVENT)
+                sock.bind((0, UEVENT_KERNEL_GROUP))
+            except (AttributeError, socket.error) as e:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "uevent monitor is not available (%s)" % str(e))
+                return False
+            self._sock = sock
+            self._thread = threading.Thread(target=self._run,
+                                            name="storlever-uevent")
+            self._thread.daemon = True
+            self._thread.start()
+        return True
+
+    def dispatch(self, event):
+        with self.lock:
+            cb_list = list(self.callbacks.get(event.get("SUBSYSTEM"), []))
+        for fun in cb_list:
+            try:
+                fun(event)
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "uevent callback failed", exc_info=True)
+
+    def _run(self):
+        while True:
+            try:
+                data = self._sock.recv(UEVENT_BUFFER_SIZE)
+            except socket.error as e:
+                if e.errno in (errno.EINTR, errno.ENOBUFS):
+                    # ENOBUFS means some events are lost, notify all
+                    # listeners as if every subsystem changed
+                    if e.errno == errno.ENOBUFS:
+                        with self.lock:
+                            subsystems = self.callbacks.keys()
+                        for subsystem in subsystems:
+                            self.dispatch({"SUBSYSTEM": subsystem,
+                                           "ACTION": "change"})
+                    continue
+                logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                           "uevent monitor stopped (%s)" % str(e))
+                with self.lock:
+                    self._sock.close()
+                    self._sock = None
+                    self._thread = None
+                return
+            event = parse_uevent(data)
+            if event:
+                self.dispatch(event)
+
+
+UeventMonitor = UeventMonitor()
+
+
+def uevent_monitor():
+    """return the global uevent monitor instance"""
+    return UeventMonitor
@@ -48,5 +48,19 @@ def encode_json(o):
     return json.dumps(o, check_circular=True, cls=CustomJSONEncoder)
 
 
-
+def iter_encode_json_list(iterable, chunk_size=64):
+    """encode an iterable as a JSON list piece by piece, for streaming response"""
+    encoder = CustomJSONEncoder(check_circular=True)
+    chunk = ["["]
+    first = True
+    for o in iterable:
+        if not first:
+            chunk.append(",")
+        first = False
+        chunk.append(encoder.encode(o))
+        if len(chunk) >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("]")
+    yield "".join(chunk)
 
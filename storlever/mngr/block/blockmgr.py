@@ -11,9 +11,13 @@ This module implements block device manager
 
 import os
 import os.path
+import re
+import time
 
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError
+from storlever.lib.lock import lock
+from storlever.lib.uevent import uevent_monitor
 from storlever.mngr.system.modulemgr import ModuleManager
 
 MODULE_INFO = {
@@ -28,6 +32,18 @@ BLOCKDEV_CMD = "/sbin/blockdev"
 LSBLK_CMD = "/bin/lsblk"
 DD_CMD = "/bin/dd"
 
+# bytes cleaned at the start and the end of a block dev by clean_meta
+CLEAN_META_SIZE = 4 * 1024 * 1024
+
+# default seconds before the block inventory snapshot is rebuilt
+BLOCK_INVENTORY_TTL = 5
+
+LSBLK_COLUMNS = "NAME,MAJ:MIN,TYPE,SIZE,RO,FSTYPE,MOUNTPOINT"
+
+# the scanner used to build the block inventory, can be "lsblk" or "sysfs"
+BLOCK_SCANNER = "lsblk"
+
+
 def _block_name_to_dev_file(name):
 
     if os.path.exists(os.path.join("/dev/", name)):
@@ -40,9 +56,280 @@ def _block_name_to_dev_file(name):
     return dev_file
 
 
+def _dev_dir_names():
+    """return the names in /dev and /dev/mapper, listed once per scan"""
+    try:
+        dev_names = set(os.listdir("/dev/"))
+    except OSError:
+        dev_names = set()
+    try:
+        mapper_names = set(os.listdir("/dev/mapper/"))
+    except OSError:
+        mapper_names = set()
+    return dev_names, mapper_names
+
+
+def _parse_lsblk_line(line):
+    """parse one line of "lsblk -ribn -o LSBLK_COLUMNS" into a property tuple
+
+    return (name, major, minor, size, type, readonly, fs_type, mount_point)
+    """
+    line_list = line.split(" ")
+    maj_num, sep, min_num = line_list[1].partition(":")
+    if int(line_list[4]) == 0:
+        ro = False
+    else:
+        ro = True
+    return (line_list[0], int(maj_num), int(min_num), int(line_list[3]),
+            line_list[2], ro, line_list[5], line_list[6])
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", name)]
+
+
+def _unescape_mount_path(path):
+    """decode the octal escapes (like \040 for space) in /proc mount files"""
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
+
+class SysfsBlockScanner(object):
+    """build the block inventory entries from sysfs, udev db and mountinfo
+
+    It gives the same entries as "lsblk -ribn -o LSBLK_COLUMNS" without
+    any subprocess. All paths are relative to root, so that it can work
+    on a fake system tree.
+    """
+
+    # udev database file pattern of different udev versions
+    UDEV_DB_PATTERNS = (
+        "run/udev/data/b%(major)d:%(minor)d",
+        "dev/.udev/data/b%(major)d:%(minor)d",
+        "dev/.udev/db/block:%(kname)s",
+    )
+
+    # dm uuid prefix to lsblk type
+    DM_TYPES = (
+        ("LVM-", "lvm"),
+        ("mpath-", "mpath"),
+        ("CRYPT-", "crypt"),
+        ("part", "part"),
+    )
+
+    def __init__(self, root="/"):
+        self.root = root
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def _read(self, *args):
+        try:
+            with open(self._path(*args), "r") as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def _listdir(self, *args):
+        try:
+            return os.listdir(self._path(*args))
+        except OSError:
+            return []
+
+    def _read_udev_props(self, kname, major, minor):
+        args = {"kname": kname, "major": major, "minor": minor}
+        for pattern in self.UDEV_DB_PATTERNS:
+            content = self._read(pattern % args)
+            if content is None:
+                continue
+            props = {}
+            for line in content.splitlines():
+                if line.startswith("E:"):
+                    key, sep, value = line[2:].partition("=")
+                    props[key] = value
+            return props
+        return {}
+
+    def _read_mount_points(self):
+        """return a dict of (major, minor) -> first mount point"""
+        mount_points = {}
+        content = self._read("proc/self/mountinfo")
+        if content is None:
+            return mount_points
+        for line in content.splitlines():
+            fields = line.split()
+            if len(fields) < 5:
+                continue
+            maj_num, sep, min_num = fields[2].partition(":")
+            try:
+                devno = (int(maj_num), int(min_num))
+            except ValueError:
+                continue
+            if devno not in mount_points:
+                mount_points[devno] = _unescape_mount_path(fields[4])
+        return mount_points
+
+    def _block_type(self, kname, is_part):
+        if is_part:
+            return "part"
+        dm_uuid = self._read("sys/class/block", kname, "dm/uuid")
+        if dm_uuid is not None:
+            for prefix, dm_type in self.DM_TYPES:
+                if dm_uuid.startswith(prefix):
+                    return dm_type
+            return "dm"
+        md_level = self._read("sys/class/block", kname, "md/level")
+        if md_level:
+            return md_level
+        if kname.startswith("loop"):
+            return "loop"
+        if self._read("sys/class/block", kname, "device/type") == "5":
+            return "rom"
+        return "disk"
+
+    def scan(self):
+        """return the property tuple list in lsblk order
+
+        Each device is followed by its partitions and holders, so a device
+        with several parents (like a md member) may appear more than once.
+        """
+        devices = {}
+        for kname in self._listdir("sys/class/block"):
+            dev = self._read("sys/class/block", kname, "dev")
+            size = self._read("sys/class/block", kname, "size")
+            if dev is None or size is None:
+                continue
+            maj_num, sep, min_num = dev.partition(":")
+            major, minor = int(maj_num), int(min_num)
+            size = int(size) * 512
+            if major == 1 or size == 0:
+                continue  # lsblk skips ram disks and empty devices
+            devices[kname] = {
+                "major": major,
+                "minor": minor,
+                "size": size,
+                "ro": self._read("sys/class/block", kname, "ro") not in (None, "0"),
+                "children": [],
+            }
+
+        # build the device tree from partitions and holders
+        child_set = set()
+        for disk in self._listdir("sys/block"):
+            if disk not in devices:
+                continue
+            for entry in sorted(self._listdir("sys/block", disk), key=_natural_key):
+                if entry in devices and \
+                        os.path.exists(self._path("sys/block", disk, entry, "partition")):
+                    devices[disk]["children"].append(entry)
+                    devices[entry]["is_part"] = True
+                    child_set.add(entry)
+        for kname, device in devices.items():
+            for holder in sorted(self._listdir("sys/class/block", kname, "holders"),
+                                 key=_natural_key):
+                if holder in devices:
+                    device["children"].append(holder)
+                    child_set.add(holder)
+
+        mount_points = self._read_mount_points()
+        entries = []
+
+        def walk(kname, path):
+            device = devices[kname]
+            if "entry" not in device:
+                major, minor = device["major"], device["minor"]
+                name = self._read("sys/class/block", kname, "dm/name") or kname
+                props = self._read_udev_props(kname, major, minor)
+                device["entry"] = (name, major, minor, device["size"],
+                                   self._block_type(kname, device.get("is_part", False)),
+                                   device["ro"], props.get("ID_FS_TYPE", ""),
+                                   mount_points.get((major, minor), ""))
+            entries.append(device["entry"])
+            for child in device["children"]:
+                if child not in path:
+                    walk(child, path + (child, ))
+
+        roots = [kname for kname in devices if kname not in child_set]
+        for kname in sorted(roots, key=_natural_key):
+            walk(kname, (kname, ))
+        # devices in a holder loop have no root
+        for kname in sorted(devices, key=_natural_key):
+            if "entry" not in devices[kname]:
+                walk(kname, (kname, ))
+
+        return entries
+
+
+class BlockInventory(object):
+    """a point-in-time snapshot of all the block devices in system
+
+    It's built from one single lsblk call, and indexed by name,
+    dev file and device number, so that all block lookups can be
+    served from memory.
+    """
+
+    def __init__(self, entries=(), dev_names=None, mapper_names=None):
+        self.timestamp = time.time()
+        self.entries = []
+        self.by_name = {}
+        self.by_dev_file = {}
+        self.by_devno = {}
+        if dev_names is None or mapper_names is None:
+            dev_names, mapper_names = _dev_dir_names()
+        for entry in entries:
+            name, major, minor = entry[0], entry[1], entry[2]
+            if name in self.by_name:
+                continue  # this block device already in the list
+            if name in dev_names:
+                dev_file = os.path.join("/dev/", name)
+            elif name in mapper_names:
+                dev_file = os.path.join("/dev/mapper/", name)
+            else:
+                dev_file = os.path.join("/dev/block/", "%d:%d" % (major, minor))
+            entry = tuple(entry) + (dev_file, )
+            self.entries.append(entry)
+            self.by_name[name] = entry
+            self.by_dev_file[dev_file] = entry
+            self.by_devno[(major, minor)] = entry
+
+    @classmethod
+    def from_lsblk(cls):
+        lines = check_output([LSBLK_CMD, "-ribn", "-o",
+                              LSBLK_COLUMNS]).splitlines()
+        return cls([_parse_lsblk_line(line) for line in lines if line])
+
+    @classmethod
+    def from_sysfs(cls, root="/"):
+        return cls(SysfsBlockScanner(root).scan())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, name):
+        """return the entry of the given block name or dev file, or None"""
+        entry = self.by_name.get(name)
+        if entry is None:
+            entry = self.by_dev_file.get(name)
+        if entry is None:
+            # maybe an alias of the device, like /dev/dm-0 for a lvm volume
+            if name.startswith("/"):
+                dev_file = name
+            else:
+                try:
+                    dev_file = _block_name_to_dev_file(name)
+                except StorLeverError:
+                    return None
+            try:
+                rdev = os.stat(dev_file).st_rdev
+            except OSError:
+                return None
+            entry = self.by_devno.get((os.major(rdev), os.minor(rdev)))
+        return entry
+
+
 class BlockDev(object):
+
     def __init__(self, name, major, minor, size, type, readonly,
-                 fs_type, mount_point):
+                 fs_type, mount_point, dev_file=None):
         self.name = name
         self.major = int(major)
         self.minor = int(minor)
@@ -51,35 +338,22 @@ class BlockDev(object):
         self.readonly = readonly
         self.fs_type = fs_type
         self.mount_point = mount_point
-        try:
-            self.dev_file = _block_name_to_dev_file(self.name)
-        except StorLeverError as e:
-            self.dev_file = \
-                os.path.join("/dev/block/", "%d:%d" % (self.major, self.minor))
-
+        if dev_file is not None:
+            self.dev_file = dev_file
+        else:
+            try:
+                self.dev_file = _block_name_to_dev_file(self.name)
+            except StorLeverError as e:
+                self.dev_file = \
+                    os.path.join("/dev/block/", "%d:%d" % (self.major, self.minor))
 
     def refresh_property(self):
-        lines = check_output([LSBLK_CMD, "-ribn", "-o",
-                              "NAME,MAJ:MIN,TYPE,SIZE,RO,FSTYPE,MOUNTPOINT",
-                              self.dev_file]).splitlines()
-        if not lines:
+        entry = block_mgr().get_inventory().by_devno.get((self.major, self.minor))
+        if entry is None:
             raise StorLeverError("Device (%s) has been removed from system" % self.dev_file, 404)
 
-        line = lines[0]
-        line_list = line.split(" ")
-        maj_num, sep, min_num = line_list[1].partition(":")
-        if int(line_list[4]) == 0:
-            ro = False
-        else:
-            ro = True
-        self.name = line_list[0]
-        self.major = int(maj_num)
-        self.minor = int(min_num)
-        self.size = int(line_list[3])
-        self.type = line_list[2]
-        self.readonly = ro
-        self.fs_type = line_list[5]
-        self.mount_point = line_list[6]
+        (self.name, self.major, self.minor, self.size, self.type,
+         self.readonly, self.fs_type, self.mount_point, self.dev_file) = entry
 
     def flush_block_buf(self):
         check_output([BLOCKDEV_CMD, "--flushbufs", self.dev_file])
@@ -90,7 +364,7 @@ class BlockDev(object):
         In detail, this method would clean the start 4M and end 4M space of the dev
         '''
         bs = 4096
-        count = 1024 # 4M / 4K
+        count = CLEAN_META_SIZE / bs
         seek = int((self.size + 4095) / 4096) - count
         check_output([DD_CMD, "if=/dev/zero",
                       "of=%s" % self.dev_file,
@@ -106,58 +380,91 @@ class BlockDev(object):
                       "bs=%d" % bs,
                       "count=%d" % count])
 
+        # the fs/lvm/md signature on the device has gone
+        block_mgr().invalidate()
+
 
 class BlockManager(object):
-    """contains all methods to manage block device in linux system"""
+    """contains all methods to manage block device in linux system
+
+    All the block lookups are served from a shared inventory snapshot,
+    which is rebuilt when it's older than inventory_ttl seconds, when the
+    kernel emits a block uevent, or when storlever itself changes the block
+    devices (see invalidate())
+    """
+
+    def __init__(self):
+        self.lock = lock()
+        self.inventory_ttl = BLOCK_INVENTORY_TTL
+        self.scanner = BLOCK_SCANNER
+        self._inventory = None
+        self._uevent_registered = False
+
+    def set_inventory_ttl(self, ttl):
+        """set the max age in seconds of the block inventory snapshot
+
+        0 means the snapshot is rebuilt on every lookup
+        """
+        with self.lock:
+            self.inventory_ttl = float(ttl)
+            self._inventory = None
+
+    def set_scanner(self, scanner):
+        """set the scanner to build the block inventory
+
+        "lsblk" calls the lsblk command, "sysfs" reads sysfs, udev database
+        and mountinfo directly without subprocess
+        """
+        if scanner not in ("lsblk", "sysfs"):
+            raise StorLeverError("block scanner (%s) is not supported" % scanner, 400)
+        with self.lock:
+            self.scanner = scanner
+            self._inventory = None
+
+    def invalidate(self, *args, **kwargs):
+        """drop the block inventory snapshot
+
+        It should be called after any operation which changes the block
+        devices, and is also used as the callback of block uevent
+        """
+        with self.lock:
+            self._inventory = None
+
+    def _scan(self):
+        if self.scanner == "sysfs":
+            return BlockInventory.from_sysfs()
+        else:
+            return BlockInventory.from_lsblk()
+
+    def get_inventory(self):
+        """return the current block inventory snapshot, rebuild it if needed"""
+        if not self._uevent_registered:
+            self._uevent_registered = True
+            uevent_monitor().register_cb("block", self.invalidate)
+
+        with self.lock:
+            inventory = self._inventory
+            now = time.time()
+            if inventory is None or \
+                    not (0 <= now - inventory.timestamp < self.inventory_ttl):
+                inventory = self._inventory = self._scan()
+        return inventory
 
     def get_block_dev_list(self):
-        block_list = []
-        block_name_list = []
-        lines = check_output([LSBLK_CMD, "-ribn", "-o",
-                              "NAME,MAJ:MIN,TYPE,SIZE,RO,FSTYPE,MOUNTPOINT"]).splitlines()
-        for line in lines:
-            line_list = line.split(" ")
-
-            # remove duplication
-            if line_list[0] in block_name_list:
-                continue # this block device already in the list
-            else:
-                block_name_list.append(line_list[0])
-
-            maj_num, sep, min_num = line_list[1].partition(":")
-            if int(line_list[4]) == 0:
-                ro = False
-            else:
-                ro = True
-            block_list.append(BlockDev(line_list[0],int(maj_num), int(min_num),
-                                       int(line_list[3]), line_list[2], ro,
-                                       line_list[5], line_list[6]))
-
-        return block_list
+        return [BlockDev(*entry) for entry in self.get_inventory().entries]
 
     def get_block_dev_by_name(self, name):
-        dev_file = _block_name_to_dev_file(name)
-
-        lines = check_output([LSBLK_CMD, "-ribn", "-o",
-                              "NAME,MAJ:MIN,TYPE,SIZE,RO,FSTYPE,MOUNTPOINT",
-                              dev_file]).splitlines()
-        if not lines:
-            raise StorLeverError("Device (%s) Not Block Device" % name, 404)
-
-        line = lines[0]
-
-        line_list = line.split(" ")
-        maj_num, sep, min_num = line_list[1].partition(":")
-        if int(line_list[4]) == 0:
-            ro = False
-        else:
-            ro = True
-
-        return BlockDev(line_list[0],int(maj_num), int(min_num),
-                        int(line_list[3]), line_list[2], ro,
-                        line_list[5], line_list[6])
-
-
+        entry = self.get_inventory().lookup(name)
+        if entry is None:
+            # raise 404 if the dev file does not exist at all, otherwise the
+            # device may appear after the snapshot was built, rescan once
+            _block_name_to_dev_file(name)
+            self.invalidate()
+            entry = self.get_inventory().lookup(name)
+            if entry is None:
+                raise StorLeverError("Device (%s) Not Block Device" % name, 404)
+
+        return BlockDev(*entry)
 
 
 BlockManager = BlockManager()
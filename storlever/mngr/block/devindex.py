@@ -0,0 +1,157 @@
+"""
+storlever.mngr.block.devindex
+~~~~~~~~~~~~~~~~
+
+This module implements the index of the block devices by UUID and label.
+
+The index is built from the symlinks of /dev/disk/by-uuid and
+/dev/disk/by-label created by udev, and it's rebuilt only when the kernel
+emits a block uevent or the mtime of the link directory changes, so a
+device is resolved with a dict lookup instead of forking blkid. If udev
+does not create the links in the system, like in a container, or the
+device is not linked yet, the device is resolved by blkid, and the result
+(even not found) is cached until the index is rebuilt.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import re
+
+from storlever.lib.command import check_output
+from storlever.lib.lock import lock
+from storlever.lib.uevent import uevent_monitor
+
+
+DEV_DISK_DIR = "/dev/disk"
+SYS_BLOCK_DIR = "/sys/block"
+BLKID_CMD = "/sbin/blkid"
+
+# kind of the index -> option of blkid to resolve it
+DEV_INDEX_KINDS = {
+    "uuid": "-U",
+    "label": "-L",
+}
+
+# udev escapes the special chars of the link name, like "\x20" for space
+_UDEV_ESCAPE = re.compile(r"\\x([0-9a-fA-F]{2})")
+
+
+def _udev_unescape(name):
+    return _UDEV_ESCAPE.sub(lambda match: chr(int(match.group(1), 16)), name)
+
+
+class DevIndex(object):
+    """map the UUID/label of a block device to its dev file"""
+
+    def __init__(self, dev_disk_dir=DEV_DISK_DIR, sys_block_dir=SYS_BLOCK_DIR):
+        self.lock = lock()
+        self.dev_disk_dir = dev_disk_dir
+        self.sys_block_dir = sys_block_dir
+        # kind -> ((mtime, inode) of the link dir, {name: dev file})
+        self._indexes = {}
+        # kind -> {name: dev file or ""} resolved by blkid
+        self._resolved = {}
+        self._uevent_registered = False
+
+    def invalidate(self, *args, **kwargs):
+        """drop the index, it's also used as the callback of block uevent"""
+        with self.lock:
+            self._indexes.clear()
+            self._resolved.clear()
+
+    def _dir_key(self, link_dir):
+        try:
+            st = os.stat(link_dir)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_ino
+
+    def _dev_file(self, target):
+        """
+        return the dev file of the link target, the device mapper device is
+        named by its /dev/mapper path, like blkid does
+        """
+        name = os.path.basename(target)
+        if name.startswith("dm-"):
+            try:
+                with open(os.path.join(self.sys_block_dir, name, "dm", "name")) as f:
+                    dm_name = f.read().strip()
+            except IOError:
+                dm_name = ""
+            if dm_name:
+                return os.path.join(os.path.dirname(target), "mapper", dm_name)
+        return target
+
+    def _build(self, link_dir):
+        index = {}
+        try:
+            names = os.listdir(link_dir)
+        except OSError:
+            return index
+        for name in names:
+            try:
+                target = os.readlink(os.path.join(link_dir, name))
+            except OSError:
+                continue    # removed after listed
+            target = os.path.normpath(os.path.join(link_dir, target))
+            index[_udev_unescape(name)] = self._dev_file(target)
+        return index
+
+    def _get_index(self, kind):
+        """return the index of the kind, or None if there is no link dir"""
+        if not self._uevent_registered:
+            self._uevent_registered = True
+            uevent_monitor().register_cb("block", self.invalidate)
+
+        link_dir = os.path.join(self.dev_disk_dir, "by-" + kind)
+        key = self._dir_key(link_dir)
+        if key is None:
+            return None
+        with self.lock:
+            entry = self._indexes.get(kind)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        # the key is got before the build, so the links changed during the
+        # build make the next lookup rebuild the index again
+        index = self._build(link_dir)
+        with self.lock:
+            self._indexes[kind] = (key, index)
+            self._resolved.pop(kind, None)
+        return index
+
+    def lookup(self, kind, name):
+        """return the dev file of the device with the UUID/label, or "" """
+        index = self._get_index(kind)
+        if index is not None and name in index:
+            return index[name]
+        # no udev links in the system, or the device is not linked by udev yet
+        with self.lock:
+            resolved = self._resolved.setdefault(kind, {})
+            if name in resolved:
+                return resolved[name]
+        try:
+            dev_file = check_output([BLKID_CMD, DEV_INDEX_KINDS[kind], name]).strip()
+        except Exception:
+            dev_file = ""
+        with self.lock:
+            # not cached if the index is dropped during blkid
+            if self._resolved.get(kind) is resolved:
+                resolved[name] = dev_file
+        return dev_file
+
+    def uuid_to_dev_file(self, uuid):
+        return self.lookup("uuid", uuid)
+
+    def label_to_dev_file(self, label):
+        return self.lookup("label", label)
+
+
+DevIndex = DevIndex()
+
+
+def dev_index():
+    """return the global block device index instance"""
+    return DevIndex
@@ -10,12 +10,19 @@ lvm manager of storlever
 """
 
 import os.path
+import time
+import threading
+import functools
+from contextlib import contextmanager
 from functools import wraps
 from lvm2app import *
 from storlever.lib.exception import StorLeverError
 from storlever.mngr.system.modulemgr import ModuleManager
 from storlever.lib.lock import lock
 from storlever.lib.command import check_output
+from storlever.lib.uevent import uevent_monitor
+from storlever.mngr.block.blockmgr import block_mgr
+from storlever.mngr.system.jobmgr import job_mgr, report_progress
 
 from storlever.lib import logger
 import logging
@@ -27,6 +34,18 @@ MODULE_INFO = {
     "comment": "Provides the management functions for lvm subsystem(lvm2)"
 }
 
+# seconds a VG metadata snapshot is served without checking its seqno
+LVM_METADATA_TTL = 2
+
+# seconds between two full device rescans of the pooled lvm handles
+LVM_RESCAN_INTERVAL = 60
+
+# liblvm2app is not thread-safe, so only one handle is kept by default
+LVM_HANDLE_POOL_SIZE = 1
+
+# seconds between two polls of the progress of a pvmove in background
+PVMOVE_POLL_INTERVAL = 5
+
 
 class DeferAndCache(object):
     """
@@ -140,6 +159,102 @@ class _LVM(object):
             mode = _VG.MODE_READ
         return _VG(self, name, mode=mode)
 
+    @check_hdlr
+    def scan(self):
+        if lvm_scan(self._hdlr) != 0:
+            self.raise_from_error(info='Failed to scan devices')
+
+
+class _LVMHandlePool(object):
+    """
+    Keep the lvm handles(lvm_t) alive across requests, because lvm_init
+    would rescan all the block devices in system.
+
+    A thread which already holds a handle gets the same handle again,
+    so nested usage would not dead lock on a pool with one handle.
+    """
+
+    def __init__(self, size=LVM_HANDLE_POOL_SIZE):
+        self.size = size
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []
+        self._created = 0
+        self._local = threading.local()
+        self._last_scan = 0
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return _LVM()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, _lvm, discard=False):
+        if discard:
+            try:
+                _lvm.close()
+            except Exception:
+                pass
+        with self._cond:
+            if discard:
+                self._created -= 1
+            else:
+                self._idle.append(_lvm)
+            self._cond.notify()
+
+    @contextmanager
+    def handle(self):
+        _lvm = getattr(self._local, "lvm", None)
+        if _lvm is not None:
+            # nested usage in the same thread
+            yield _lvm
+            return
+
+        _lvm = self._acquire()
+        self._local.lvm = _lvm
+        discard = False
+        try:
+            yield _lvm
+        except StorLeverError:
+            raise     # lvm reports its error, the handle is still usable
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self._local.lvm = None
+            self._release(_lvm, discard)
+
+    def rescan(self, force=False):
+        """rescan devices on the current handle, at most every LVM_RESCAN_INTERVAL"""
+        now = time.time()
+        if force or not (0 <= now - self._last_scan < LVM_RESCAN_INTERVAL):
+            with self.handle() as _lvm:
+                _lvm.scan()
+            self._last_scan = now
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for _lvm in idle:
+            _lvm.close()
+
+
+_handle_pool = _LVMHandlePool()
+
+
+def _lvm_handle():
+    """return a context of a pooled lvm handle"""
+    return _handle_pool.handle()
+
 
 class _VG(object):
     """
@@ -326,6 +441,10 @@ class _VG(object):
     def get_max_pv(self):
         return lvm_vg_get_max_pv(self._hdlr)
 
+    @check_hdlr
+    def get_seqno(self):
+        return lvm_vg_get_seqno(self._hdlr)
+
     @property
     def hdlr(self):
         return self._hdlr
@@ -449,70 +568,234 @@ class _PV(object):
             self._vg.raise_from_error('Failed to resize PV {0} to size {}'.format(self.name, size))
 
 
+def _lv_record(_lv):
+    """read all the properties of a LV handler into a dict"""
+    origin = _lv.get_origin()
+    if origin:
+        snap_percent = _lv.get_property('snap_percent')/1000000.0
+    else:
+        snap_percent = None
+    return {
+        'name': _lv.name,
+        'uuid': _lv.uuid,
+        'size': _lv.size,
+        'is_activate': _lv.is_activate(),
+        'origin': origin,
+        'attr': _lv.get_attr(),
+        'snap_percent': snap_percent,
+    }
+
+
+def _vg_record(_vg):
+    """read all the properties of a VG handler with its PVs and LVs into a dict"""
+    return {
+        'name': _vg.name,
+        'uuid': _vg.get_uuid(),
+        'size': _vg.get_size(),
+        'free_size': _vg.get_free_size(),
+        'extent_size': _vg.get_extent_size(),
+        'extent_count': _vg.get_extent_count(),
+        'free_extent_count': _vg.get_free_extent_count(),
+        'pv_count': _vg.get_pv_count(),
+        'max_pv': _vg.get_max_pv(),
+        'max_lv': _vg.get_max_lv(),
+        'seqno': _vg.get_seqno(),
+        'pvs': [{'name': _pv.name,
+                 'uuid': _pv.uuid,
+                 'size': _pv.size,
+                 'free': _pv.free} for _pv in _vg.iter_pv()],
+        'lvs': [_lv_record(_lv) for _lv in _vg.iter_lv()],
+    }
+
+
 class LVMManager(object):
+    """
+    All the VG/LV/PV properties are served from an in-memory metadata
+    snapshot, which is built on a pooled lvm handle. When the snapshot is
+    older than LVM_METADATA_TTL, each VG is opened once to compare its
+    metadata seqno, and only the changed VGs are read again.
+    """
+
     def __init__(self):
         self.lock = lock()
+        self._metadata_lock = lock()
+        self._metadata = None
+        self._metadata_time = 0
+        self._rescan_needed = False
+        self._uevent_registered = False
+
+    def invalidate(self, rescan=False):
+        """
+        Make the metadata snapshot to be checked on next access,
+        it should be called after storlever changes lvm
+        :param rescan: rescan the block devices before next check
+        """
+        with self._metadata_lock:
+            self._metadata_time = 0
+            if rescan:
+                self._rescan_needed = True
+        block_mgr().invalidate()
+
+    def _on_block_uevent(self, event):
+        # new devices may be PV, rescan lazily on next check
+        with self._metadata_lock:
+            self._metadata_time = 0
+            self._rescan_needed = True
+
+    def _refresh_metadata(self, rescan):
+        old_metadata = self._metadata or {}
+        metadata = {}
+        with _lvm_handle() as _lvm:
+            _handle_pool.rescan(force=rescan)
+            for vg_name in _lvm.list_vg_names():
+                record = old_metadata.get(vg_name)
+                try:
+                    with _VG(_lvm, vg_name) as _vg:
+                        if record is None or record['seqno'] != _vg.get_seqno() or \
+                                record['uuid'] != _vg.get_uuid():
+                            record = _vg_record(_vg)
+                except StorLeverError:
+                    # VG is removed after listed
+                    continue
+                metadata[vg_name] = record
+        return metadata
+
+    def get_metadata(self):
+        """return the metadata snapshot, a dict of VG name to VG record"""
+        if not self._uevent_registered:
+            self._uevent_registered = True
+            uevent_monitor().register_cb("block", self._on_block_uevent)
+
+        with self._metadata_lock:
+            now = time.time()
+            if self._metadata is None or \
+                    not (0 <= now - self._metadata_time < LVM_METADATA_TTL):
+                rescan, self._rescan_needed = self._rescan_needed, False
+                self._metadata = self._refresh_metadata(rescan)
+                # the snapshot is as new as the end of the refresh, which
+                # may take long with many VGs
+                self._metadata_time = time.time()
+            return self._metadata
+
+    def get_vg_record(self, vg_name):
+        record = self.get_metadata().get(vg_name)
+        if record is None:
+            raise StorLeverError('No VG {0} exists'.format(vg_name))
+        return record
+
+    def report(self, refresh=False):
+        """
+        return all VGs with their PVs and LVs as a list of dicts
+
+        Every VG is read in a single traversal of its PVs and LVs,
+        the result would not be changed by the following lvm operations
+        :param refresh: drop the metadata snapshot and read all VGs again
+        """
+        if refresh:
+            with self._metadata_lock:
+                self._metadata = None
+        vg_list = []
+        metadata = self.get_metadata()
+        for vg_name in sorted(metadata.keys()):
+            record = metadata[vg_name]
+            vg_info = {}
+            for key in ('name', 'uuid', 'size', 'free_size', 'extent_size',
+                        'extent_count', 'free_extent_count', 'pv_count',
+                        'max_pv', 'max_lv'):
+                vg_info[key] = record[key]
+            vg_info['pvs'] = [{
+                'name': os.path.basename(pv_record['name']),
+                'dev_file': pv_record['name'],
+                'uuid': pv_record['uuid'],
+                'size': pv_record['size'],
+                'free': pv_record['free'],
+            } for pv_record in record['pvs']]
+            vg_info['lvs'] = [{
+                'name': lv_record['name'],
+                'uuid': lv_record['uuid'],
+                'size': lv_record['size'],
+                'state': lv_record['is_activate'],
+                'origin': lv_record['origin'],
+                'attr': lv_record['attr'],
+                'snap_percent': lv_record['snap_percent'],
+            } for lv_record in record['lvs']]
+            vg_list.append(vg_info)
+        return vg_list
 
     def new_vg(self, vg_name, devices, pe_size=64):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 _lvm.create_vg(vg_name, devices, pe_size=pe_size)
+            self.invalidate(rescan=True)
         return self.get_vg(vg_name)
 
     def get_vg(self, vg_name):
-        with _LVM() as _lvm:
-            if vg_name in _lvm.list_vg_names():
-                return VG(self, vg_name)
-            else:
-                raise StorLeverError('No VG {0} exists'.format(vg_name))
+        return VG(self, vg_name, self.get_vg_record(vg_name))
 
     def get_all_vg(self):
         vgs = {}
-        with _LVM() as _lvm:
-            for vg_name in _lvm.list_vg_names():
-                vgs[vg_name] = VG(self, vg_name)
+        for vg_name, record in self.get_metadata().items():
+            vgs[vg_name] = VG(self, vg_name, record)
         return vgs
 
+    def get_pv(self, dev_file):
+        """return the PV of the device file in any VG"""
+        for vg in self.get_all_vg().values():
+            for pv in vg.pvs.values():
+                if pv.dev_file == dev_file:
+                    return pv
+        raise StorLeverError('No PV {0} exists in any VG'.format(dev_file), 404)
+
+    def move_pv(self, dev_file, dst_device=None, lv_name=None, started=False):
+        """
+        move the extents of the PV, and return when the move is finished.
+        It's run as the pvmove job, which reports the progress of the move.
+
+        :param started: the move is already started in background, like
+                        before a restart, only wait for it
+        """
+        pv = self.get_pv(dev_file)
+        if not started:
+            pv.move(dst_device, lv_name)
+        pv.wait_move(lv_name, on_progress=lambda progress: report_progress(
+            progress, "%s: Moved: %.1f%%" % (dev_file, progress)))
+
+    def abort_move_pv(self, dev_file):
+        self.get_pv(dev_file).abort_move()
+
 
 class VG(object):
-    def __init__(self, lvm, name):
+    def __init__(self, lvm, name, record=None):
         self.lock = lvm.lock
         self.lvm = lvm
-        with _LVM() as _lvm:
-            with _VG(_lvm, name) as _vg:
-                self.name = _vg.name
-                self.uuid = _vg.get_uuid()
-                self.size = _vg.get_size()
-                self.free_size = _vg.get_free_size()
+        if record is None:
+            record = lvm.get_vg_record(name)
+        self._record = record
+        self.name = record['name']
+        self.uuid = record['uuid']
+        self.size = record['size']
+        self.free_size = record['free_size']
 
     @DeferAndCache
     def pvs(self):
         pvs = {}
-        with _LVM() as _lvm:
-            with _VG(_lvm, self.name) as _vg:
-                for _pv in _vg.iter_pv():
-                    pv = PV(self, _pv.name, _pv.uuid, _pv.size, _pv.free)
-                    pvs[pv.name] = pv
+        for pv_record in self._record['pvs']:
+            pv = PV(self, pv_record['name'], pv_record['uuid'],
+                    pv_record['size'], pv_record['free'])
+            pvs[pv.name] = pv
         return pvs
 
     @DeferAndCache
     def lvs(self):
         lvs = {}
-        with _LVM() as _lvm:
-            with _VG(_lvm, self.name) as _vg:
-                for _lv in _vg.iter_lv():
-                    lvs[_lv.name] = LV(self, _lv=_lv)
+        for lv_record in self._record['lvs']:
+            lvs[lv_record['name']] = LV(self, record=lv_record)
         return lvs
 
     def _get_detail(self):
-        with _LVM() as _lvm:
-            with _VG(_lvm, self.name) as _vg:
-                self.__dict__['extent_size'] = _vg.get_extent_size()
-                self.__dict__['extent_count'] = _vg.get_extent_count()
-                self.__dict__['free_extent_count'] = _vg.get_free_extent_count()
-                self.__dict__['pv_count'] = _vg.get_pv_count()
-                self.__dict__['max_pv'] = _vg.get_max_pv()
-                self.__dict__['max_lv'] = _vg.get_max_lv()
+        for key in ('extent_size', 'extent_count', 'free_extent_count',
+                    'pv_count', 'max_pv', 'max_lv'):
+            self.__dict__[key] = self._record[key]
 
     @DeferAndCache
     def extent_size(self):
@@ -546,37 +829,41 @@ class VG(object):
 
     def delete(self):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 _lvm.delete_vg(self.name)
             for pv in self.pvs.itervalues():
                 pv.delete()
+            self.lvm.invalidate()
 
     def create_lv(self, lv_name, size):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.name, mode=_VG.MODE_WRITE) as _vg:
                     _lv = _vg.create_lv(lv_name, size)
                     lv = LV(self, _lv=_lv)
             self.lvs[lv_name] = lv
+            self.lvm.invalidate()
             return lv
 
     def grow(self, device):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.name, mode=_VG.MODE_WRITE) as _vg:
                     _vg.add_pv(device)
                     _pv = _vg.get_pv_by_name(device)
             pv = PV(self, _pv.name, _pv.uuid, _pv.size, _pv.free)
-            self.pvs[pv.name] = PV(self, _pv.name, _pv.uuid, _pv.size, _pv.free)
+            self.pvs[pv.name] = pv
+            self.lvm.invalidate(rescan=True)
 
     def shrink(self, device):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.name, mode=_VG.MODE_WRITE) as _vg:
                     _vg.remove_pv(device)
             pv = self.pvs.pop(os.path.basename(device), None)
             if pv:
                 pv.delete()
+            self.lvm.invalidate()
 
     def replace_pv(self):
         pass
@@ -585,10 +872,11 @@ class VG(object):
         return LV(self, name=lv_name)
 
     def get_pv(self, pv_name):
-        with _LVM() as _lvm:
-            with _VG(_lvm, self.name) as _vg:
-                _pv = _vg.get_pv_by_name(pv_name)
-                return PV(self, _pv.name, _pv.uuid, _pv.size, _pv.free)
+        for pv_record in self.lvm.get_vg_record(self.name)['pvs']:
+            if pv_name in (pv_record['name'], os.path.basename(pv_record['name'])):
+                return PV(self, pv_record['name'], pv_record['uuid'],
+                          pv_record['size'], pv_record['free'])
+        raise StorLeverError('No PV {0} under VG {1}'.format(pv_name, self.name))
 
 
 class PV(object):
@@ -603,18 +891,25 @@ class PV(object):
     def delete(self):
         # wipe the metadata recorded on the PV block device
         # in case to remove PV from VG, use VG.shrink instead
-        with _LVM() as _lvm:
+        with _lvm_handle() as _lvm:
             _lvm.remove_pv(self.dev_file)
+        self.vg.lvm.invalidate()
 
     def resize(self, size):
-        with _LVM() as _lvm:
-            with _VG(_lvm, self.vg.name) as _vg:
-                with _PV(_vg, name=self.dev_file) as _pv:
-                    _pv.resize(size)
-                    self.size = _pv.get_size()
-                    self.free = _pv.get_free_size()
+        with _lvm_handle() as _lvm:
+            with _VG(_lvm, self.vg.name, mode=_VG.MODE_WRITE) as _vg:
+                _pv = _PV(_vg, name=self.dev_file)
+                _pv.resize(size)
+                self.size = _pv.get_size()
+                self.free = _pv.get_free_size()
+        self.vg.lvm.invalidate()
 
     def move(self, dst_device=None, lv_name=None):
+        """
+        move the extents of this PV to the other PVs of its VG. It returns
+        at once and the extents are moved in background, which goes on
+        across the restart of storlever, see wait_move()
+        """
         cmd = ['pvmove', '-b']
         if lv_name:
             cmd.append('-n')
@@ -623,6 +918,53 @@ class PV(object):
         if dst_device:
             cmd.append(dst_device)
         check_output(cmd)
+        self.vg.lvm.invalidate()
+
+    def get_move_progress(self):
+        """
+        return the percent of the extents moved by the pvmove of this PV,
+        or None if this PV is not being moved
+        """
+        output = check_output(['lvs', '-a', '--noheadings', '--separator', '|',
+                               '-o', 'move_pv,copy_percent', self.vg.name])
+        for line in output.splitlines():
+            fields = line.strip().split('|')
+            if len(fields) == 2 and fields[0] == self.dev_file:
+                try:
+                    return float(fields[1])
+                except ValueError:
+                    return 0.0
+        return None
+
+    def wait_move(self, lv_name=None, on_progress=None,
+                  interval=PVMOVE_POLL_INTERVAL):
+        """
+        wait for the pvmove of this PV to finish, on_progress is called with
+        the percent of the moved extents every interval seconds.
+        StorLeverError is raised if the extents are still on this PV, like
+        the move is aborted
+        """
+        while True:
+            progress = self.get_move_progress()
+            if progress is None:
+                break
+            if on_progress is not None:
+                on_progress(progress)
+            time.sleep(interval)
+        self.vg.lvm.invalidate()
+
+        output = check_output(['pvs', '--noheadings', '--segments',
+                               '-o', 'lv_name', self.dev_file])
+        lv_names = set(line.strip() for line in output.splitlines())
+        lv_names.discard('')
+        if (lv_name in lv_names) if lv_name else lv_names:
+            raise StorLeverError('The extents of PV {0} are not moved, '
+                                 'the move may be aborted'.format(self.dev_file), 500)
+
+    def abort_move(self):
+        """abort the move of this PV, the moved extents are kept"""
+        check_output(['pvmove', '--abort', self.dev_file])
+        self.vg.lvm.invalidate()
 
 
 class LV(object):
@@ -654,76 +996,72 @@ class LV(object):
         'R': 'read-only activation of non-read-only volume'
     }
 
-    def __init__(self, vg, name=None, _lv=None):
+    def __init__(self, vg, name=None, _lv=None, record=None):
         self.lock = vg.lock
         self.vg = vg
-        if name:
-            with _LVM() as _lvm:
-                with _VG(_lvm, self.vg.name) as _vg:
-                    _lv = _vg.get_lv_by_name(name)
-                    self.name = _lv.name
-                    self.uuid = _lv.uuid
-                    self.size = _lv.size
-                    self.is_activate = _lv.is_activate()
-                    self.origin = _lv.get_origin()
-                    self.attr = _lv.get_attr()
-                    if self.origin:
-                        self.snap_percent = _lv.get_property('snap_percent')/1000000.0
-                    else:
-                        self.snap_percent = None
-        elif _lv:
-            self.name = _lv.name
-            self.uuid = _lv.uuid
-            self.size = _lv.size
-            self.is_activate = _lv.is_activate()
-            self.origin = _lv.get_origin()
-            self.attr = _lv.get_attr()
-            if self.origin:
-                self.snap_percent = _lv.get_property('snap_percent')/1000000.0
+        if record is None:
+            if name:
+                for record in vg.lvm.get_vg_record(vg.name)['lvs']:
+                    if record['name'] == name:
+                        break
+                else:
+                    raise StorLeverError('No LV {0} under VG {1}'.format(name, vg.name))
+            elif _lv:
+                record = _lv_record(_lv)
             else:
-                self.snap_percent = None
-        else:
-            raise StorLeverError('No LV name given')
+                raise StorLeverError('No LV name given')
+        self.name = record['name']
+        self.uuid = record['uuid']
+        self.size = record['size']
+        self.is_activate = record['is_activate']
+        self.origin = record['origin']
+        self.attr = record['attr']
+        self.snap_percent = record['snap_percent']
         self.type = self.TYPE_ABBR.get(self.attr[0], 'unknown')
         self.permission = self.PERMISSION_ABBR.get(self.attr[1], 'unknown')
         self.partial = True if self.attr[8] == 'p' else False
 
     def resize(self, size):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.vg.name) as _vg:
                     _vg.get_lv_by_name(self.name).resize(size)
                     size = _vg.get_lv_by_name(self.name).get_size()
             self.size = size
+            self.vg.lvm.invalidate()
 
     def delete(self):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.vg.name, mode=_VG.MODE_WRITE) as _vg:
                     _vg.get_lv_by_name(self.name).delete()
             self.vg.lvs.pop(self.name, None)
+            self.vg.lvm.invalidate()
 
     def activate(self):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.vg.name, mode=_VG.MODE_WRITE) as _vg:
                     _vg.get_lv_by_name(self.name).activate()
         self.is_activate = True
+        self.vg.lvm.invalidate()
 
     def deactivate(self):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.vg.name, mode=_VG.MODE_WRITE) as _vg:
                     _vg.get_lv_by_name(self.name).deactivate()
         self.is_activate = False
+        self.vg.lvm.invalidate()
 
     def snapshot(self, name, size):
         with self.lock:
-            with _LVM() as _lvm:
+            with _lvm_handle() as _lvm:
                 with _VG(_lvm, self.vg.name, mode=_VG.MODE_WRITE) as _vg:
                     _lv = _vg.get_lv_by_name(self.name).snapshot(name, size)
                     lv = LV(self.vg, _lv=_lv)
         self.vg.lvs[name] = lv
+        self.vg.lvm.invalidate()
 
 
 LVMManager = LVMManager()
@@ -733,4 +1071,15 @@ def lvm_mgr():
     return LVMManager
 
 
-ModuleManager.register_module(**MODULE_INFO)
\ No newline at end of file
+def _resume_pvmove(params, running):
+    """
+    resume the pvmove job interrupted by a restart, the move started by
+    the job goes on in background, so only wait for it
+    """
+    mgr = lvm_mgr()
+    return (functools.partial(mgr.move_pv, started=running, **params),
+            functools.partial(mgr.abort_move_pv, params['dev_file']))
+
+
+ModuleManager.register_module(**MODULE_INFO)
+job_mgr().register_resume('pvmove', _resume_pvmove)
\ No newline at end of file
@@ -10,6 +10,11 @@ lvm manager of storlever
 """
 
 import os
+import re
+import copy
+import time
+import threading
+import collections
 import logging
 
 from storlever.lib.command import check_output
@@ -17,6 +22,7 @@ from storlever.lib.lock import lock as lock_factory
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 from storlever.mngr.system.modulemgr import ModuleManager
+from storlever.mngr.block.blockmgr import block_mgr
 
 
 MODULE_INFO = {
@@ -48,13 +54,507 @@ def _md_name_to_dev_file(name):
     return dev_file
 
 
+# the state shown in "mdadm --detail" for each sync action in sysfs
+MD_SYNC_ACTIONS = {
+    "resync": "resyncing",
+    "recover": "recovering",
+    "reshape": "reshaping",
+    "check": "checking",
+    "repair": "repairing",
+}
+
+# the fields of MD which sysfs can not supply, got from "mdadm --detail"
+MDADM_ONLY_FIELDS = ("uuid", "full_name", "creation_time", "update_time")
+
+# seconds between two samples of the md sync progress
+MD_SYNC_SAMPLE_INTERVAL = 1
+
+# number of sync progress events kept for the slow subscribers
+MD_SYNC_EVENT_BACKLOG = 1024
+
+# max number of the requests waiting for the md sync progress at the same
+# time, each of them holds a thread of the web server, the other requests
+# are answered at once without waiting
+MD_SYNC_MAX_SUBSCRIBERS = 4
+
+# seconds the sampler thread keeps running after the last subscriber left,
+# so the polls of a client in turn do not restart it each time
+MD_SYNC_IDLE_TIMEOUT = 30
+
+MDSTAT_MEMBER_RE = re.compile(r"^(\S+?)\[(\d+)\]((?:\(\w\))*)$")
+MDSTAT_SYNC_RE = re.compile(r"(resync|recovery|reshape|check|repair)\s*=\s*([\d.]+)%\s*"
+                            r"\((\d+)/(\d+)\)(?:\s+finish=([\d.]+)min)?"
+                            r"(?:\s+speed=(\d+)K/sec)?")
+
+
+def _parse_mdadm_detail(output, dev_file):
+    """parse the output of "mdadm --detail" into a dict of MD fields"""
+    detail = {"members": {}}
+    for line in output.splitlines():
+        if line.startswith(dev_file):
+            continue
+        if ' ' not in line:
+            continue
+        if not ':' in line:
+            if '/dev/' in line:
+                comps = line.split()
+                state = comps[4:-1]
+                detail["members"][comps[0]] = {
+                    'device': comps[-1],
+                    'major': comps[1],
+                    'minor': comps[2],
+                    'number': comps[0],
+                    'raiddevice': comps[3],
+                    'state': ' '.join(state),
+                    }
+            continue
+        else:
+            comps = line.split(' : ')
+            comps[0] = comps[0].lower()
+            comps[0] = comps[0].strip()
+            comps[0] = comps[0].replace(' ', '_')
+            if comps[0] in ('array_size', 'used_dev_size'):
+                try:
+                    comps[1] = int(comps[1].split()[0])
+                except Exception:
+                    logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                               "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
+                    continue
+            elif comps[0] in ('raid_devices', 'total_devices', 'active_devices',
+                              'working_devices', 'failed_devices', 'spare_devices'):
+                try:
+                    comps[1] = int(comps[1])
+                except Exception:
+                    logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                               "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
+                    continue
+            elif comps[0] == 'resync_status':
+                try:
+                    comps[1] = int(comps[1].split()[0][0:-1])
+                except Exception:
+                    logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                               "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
+                    continue
+
+            if comps[0] == 'name':
+                detail['full_name'] = comps[1]
+            elif len(comps) > 1:
+                detail[comps[0]] = comps[1]
+    return detail
+
+
+class MDStateReader(object):
+    """
+    read the state of md arrays from /proc/mdstat and sysfs in one pass,
+    no command is run
+    """
+
+    def __init__(self, root="/"):
+        self.root = root
+
+    def _read(self, *paths):
+        try:
+            with open(os.path.join(self.root, *paths), "r") as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return None
+
+    def _read_int(self, *paths):
+        try:
+            return int(self._read(*paths))
+        except (TypeError, ValueError):
+            return 0
+
+    def read_mdstat(self):
+        """
+        parse /proc/mdstat, return a dict of md kernel name to its state,
+        level, members and sync progress
+        """
+        arrays = {}
+        md = None
+        for line in (self._read("proc/mdstat") or "").splitlines():
+            if not line.strip():
+                md = None
+                continue
+            if line.startswith("Personalities") or line.startswith("unused devices"):
+                continue
+            if not line[0].isspace():
+                name, sep, rest = line.partition(" : ")
+                if not sep:
+                    md = None
+                    continue
+                comps = rest.split()
+                md = {
+                    "state": comps[0] if comps else "",
+                    "read_only": False,
+                    "level": "",
+                    "members": {},
+                    "sync_action": "idle",
+                    "sync_percent": None,
+                    "sync_completed": None,
+                    "sync_finish": None,
+                    "sync_speed": None,
+                }
+                for comp in comps[1:]:
+                    match = MDSTAT_MEMBER_RE.match(comp)
+                    if match:
+                        md["members"][match.group(1)] = {
+                            "number": int(match.group(2)),
+                            "flags": re.findall(r"\((\w)\)", match.group(3)),
+                        }
+                    elif comp.startswith("("):
+                        md["read_only"] = True
+                    else:
+                        md["level"] = comp
+                arrays[name.strip()] = md
+            elif md is not None:
+                match = MDSTAT_SYNC_RE.search(line)
+                if match:
+                    action = match.group(1)
+                    md["sync_action"] = "recover" if action == "recovery" else action
+                    md["sync_percent"] = float(match.group(2))
+                    md["sync_completed"] = (int(match.group(3)), int(match.group(4)))
+                    if match.group(5):
+                        md["sync_finish"] = float(match.group(5))
+                    if match.group(6):
+                        md["sync_speed"] = int(match.group(6))
+        return arrays
+
+    def list_dev_files(self):
+        """
+        return a dict of md kernel name to its device file, the named
+        arrays use their link under /dev/md/ like "mdadm --detail --scan"
+        """
+        dev_files = {}
+        md_dir = os.path.join(self.root, "dev/md")
+        try:
+            names = sorted(os.listdir(md_dir))
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(md_dir, name)
+            if name.isdigit() or not os.path.islink(path):
+                continue
+            dev_files.setdefault(os.path.basename(os.readlink(path)),
+                                 os.path.join("/dev/md", name))
+        return dev_files
+
+    def _read_sync_completed(self, md_dir):
+        value = self._read(md_dir, "sync_completed") or ""
+        done, sep, total = value.partition("/")
+        try:
+            return int(done), int(total)
+        except ValueError:
+            return None
+
+    def read_array(self, name, mdstat=None):
+        """
+        read the state of a md array by its kernel name (like md0),
+        return a dict with the same fields as MD, or None if the
+        array does not exist
+        """
+        md_dir = os.path.join("sys/block", name, "md")
+        if not os.path.isdir(os.path.join(self.root, md_dir)):
+            return None
+        if mdstat is None:
+            mdstat = self.read_mdstat().get(name, {})
+
+        raid_devices = self._read_int(md_dir, "raid_disks")
+        metadata = self._read(md_dir, "metadata_version") or ""
+        sync_action = self._read(md_dir, "sync_action") or mdstat.get("sync_action", "idle")
+        state = [self._read(md_dir, "array_state") or mdstat.get("state", "")]
+        if self._read_int(md_dir, "degraded"):
+            state.append("degraded")
+
+        resync_status = 100
+        sync_completed = None
+        sync_speed = 0
+        if sync_action in MD_SYNC_ACTIONS:
+            state.append(MD_SYNC_ACTIONS[sync_action])
+            sync_completed = self._read_sync_completed(md_dir) or \
+                mdstat.get("sync_completed")
+            if sync_completed and sync_completed[1]:
+                resync_status = sync_completed[0] * 100 / sync_completed[1]
+            sync_speed = self._read_int(md_dir, "sync_speed") or \
+                mdstat.get("sync_speed") or 0
+
+        try:
+            dev_dirs = sorted(dev_dir for dev_dir in os.listdir(os.path.join(self.root, md_dir))
+                              if dev_dir.startswith("dev-"))
+        except OSError:
+            dev_dirs = []
+        mdstat_members = mdstat.get("members", {})
+        members = []
+        failed_devices = active_devices = 0
+        for dev_dir in dev_dirs:
+            dev_name = dev_dir[4:]
+            dev_state = (self._read(md_dir, dev_dir, "state") or "").split(",")
+            slot = self._read(md_dir, dev_dir, "slot") or "none"
+            devno = (self._read(md_dir, dev_dir, "block", "dev") or "").split(":")
+            if len(devno) != 2:
+                devno = ["", ""]
+            if "faulty" in dev_state:
+                member_state = "faulty"
+                failed_devices += 1
+            elif "in_sync" in dev_state and slot.isdigit():
+                member_state = "active sync"
+                active_devices += 1
+            elif slot.isdigit():
+                member_state = "spare rebuilding"
+            else:
+                member_state = "spare"
+            if "write_mostly" in dev_state:
+                member_state += " writemostly"
+
+            number = mdstat_members.get(dev_name, {}).get("number")
+            if number is None and slot.isdigit():
+                number = int(slot)
+            members.append({
+                'device': os.path.join("/dev", dev_name),
+                'major': devno[0],
+                'minor': devno[1],
+                'number': number,
+                'raiddevice': slot if slot.isdigit() else '-',
+                'state': member_state,
+            })
+
+        # devices without descriptor number in mdstat or slot are
+        # numbered after the raid devices
+        next_number = max([raid_devices] +
+                          [member['number'] + 1 for member in members
+                           if member['number'] is not None])
+        members_dict = {}
+        for member in members:
+            if member['number'] is None:
+                member['number'] = next_number
+                next_number += 1
+            member['number'] = str(member['number'])
+            members_dict[member['number']] = member
+
+        array = {
+            "raid_level": self._read(md_dir, "level") or mdstat.get("level", ""),
+            "state": ", ".join(state),
+            "array_size": self._read_int("sys/block", name, "size") / 2,
+            "used_dev_size": self._read_int(md_dir, "component_size"),
+            "raid_devices": raid_devices,
+            "total_devices": len(members),
+            "active_devices": active_devices,
+            "working_devices": len(members) - failed_devices,
+            "failed_devices": failed_devices,
+            "spare_devices": len(members) - failed_devices - active_devices,
+            "resync_status": resync_status,
+            "sync_action": sync_action,
+            "sync_completed": sync_completed,
+            "sync_speed": sync_speed,
+            "metadata": metadata,
+            "persistence": "Superblock is persistent"
+            if metadata not in ("", "none") else "Superblock is not persistent",
+            "members": members_dict,
+        }
+        uuid = (self._read(md_dir, "uuid") or "").replace("-", "").replace(":", "")
+        if len(uuid) == 32:
+            array["uuid"] = ":".join(uuid[i:i + 8] for i in range(0, 32, 8))
+        return array
+
+    def read_all(self):
+        """return a dict of md kernel name to the state of all md arrays"""
+        arrays = {}
+        for name, mdstat in self.read_mdstat().iteritems():
+            array = self.read_array(name, mdstat)
+            if array is not None:
+                arrays[name] = array
+        return arrays
+
+
+class MDSyncSampler(object):
+    """
+    sample the sync progress of all md arrays from /proc/mdstat at a fixed
+    cadence in a single background thread, and publish the changes as
+    events for the subscribers. The thread runs only while there are
+    subscribers, or a subscriber left in the last idle_timeout seconds.
+    """
+
+    def __init__(self, reader, interval=MD_SYNC_SAMPLE_INTERVAL,
+                 backlog=MD_SYNC_EVENT_BACKLOG,
+                 max_subscribers=MD_SYNC_MAX_SUBSCRIBERS,
+                 idle_timeout=MD_SYNC_IDLE_TIMEOUT):
+        self.reader = reader
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._sample_lock = lock_factory()
+        self._events = collections.deque(maxlen=backlog)
+        self._seq = 0
+        self._progress = {}
+        self._subscribers = 0
+        self._last_active = 0
+        self._thread = None
+
+    def _read_progress(self):
+        progress = {}
+        for name, mdstat in self.reader.read_mdstat().iteritems():
+            if mdstat["sync_action"] == "idle" or mdstat["sync_completed"] is None:
+                continue
+            done, total = mdstat["sync_completed"]
+            speed = mdstat["sync_speed"] or 0
+            progress[name] = {
+                "sync_action": mdstat["sync_action"],
+                "progress": mdstat["sync_percent"],
+                "done": done,
+                "total": total,
+                "speed": speed,
+                "eta": (total - done) / speed if speed else None,
+            }
+        return progress
+
+    def sample(self):
+        """
+        read the sync progress once and publish the changes since the
+        last sample, return the number of new events
+        """
+        with self._sample_lock:
+            progress = self._read_progress()
+            deltas = []
+            for name, state in sorted(progress.items()):
+                old_state = self._progress.get(name)
+                if old_state is None:
+                    delta = dict(state)
+                else:
+                    delta = dict((key, value) for key, value in state.iteritems()
+                                 if old_state.get(key) != value)
+                if delta:
+                    deltas.append((name, delta))
+            for name in sorted(set(self._progress) - set(progress)):
+                # sync finished, or the array is stopped
+                deltas.append((name, {"sync_action": "idle"}))
+
+            now = time.time()
+            with self._cond:
+                for name, delta in deltas:
+                    self._seq += 1
+                    delta["seq"] = self._seq
+                    delta["time"] = now
+                    delta["name"] = name
+                    self._events.append(delta)
+                self._progress = progress
+                if deltas:
+                    self._cond.notify_all()
+            return len(deltas)
+
+    def snapshot(self):
+        """
+        return the sequence of the last event and the full progress of all
+        the arrays in sync, the events after the sequence are the changes
+        based on this progress
+        """
+        with self._cond:
+            return self._seq, copy.deepcopy(self._progress)
+
+    def wait_events(self, last_seq, timeout):
+        """
+        wait for the events after last_seq, return the list of the events or
+        an empty list on timeout. If some of these events are already
+        dropped from the backlog, or last_seq is not a sequence of this
+        sampler, like the one got before a restart, return None, then the
+        subscriber should start again from a new snapshot
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            if last_seq > self._seq:
+                return None
+            while self._seq <= last_seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            if not self._events or self._events[0]["seq"] > last_seq + 1:
+                return None
+            return [event for event in self._events if event["seq"] > last_seq]
+
+    def subscribe(self):
+        """
+        add a subscriber, the sampler thread is started on demand. Return
+        False without adding if there are too many subscribers, then the
+        caller should not wait for the events. The sampler thread is
+        running in this case, since the other subscribers keep it
+        """
+        with self._cond:
+            if self._subscribers >= self.max_subscribers:
+                return False
+            self._subscribers += 1
+            if self._thread is not None:
+                return True
+        # the progress may be stale when the thread is not running
+        self.sample()
+        with self._cond:
+            if self._thread is None and self._subscribers > 0:
+                self._thread = threading.Thread(target=self._run,
+                                                name="storlever-md-sync")
+                self._thread.daemon = True
+                self._thread.start()
+        return True
+
+    def unsubscribe(self):
+        with self._cond:
+            if self._subscribers > 0:
+                self._subscribers -= 1
+            self._last_active = time.time()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._cond:
+                if self._subscribers == 0 and \
+                        time.time() - self._last_active >= self.idle_timeout:
+                    self._thread = None
+                    return
+            try:
+                self.sample()
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to sample md sync progress", exc_info=True)
+
+
 class MDManager(object):
     def __init__(self):
         self.lock = lock_factory()
+        self.reader = MDStateReader()
+        self.sync_sampler = MDSyncSampler(self.reader)
+        self._mdadm_cache_lock = lock_factory()
+        self._mdadm_cache = {}
 
     def get_all_md(self):
         return MDs(self.lock)
 
+    def invalidate(self, kernel_name=None):
+        """drop the cached mdadm detail of a md array, or of all arrays"""
+        with self._mdadm_cache_lock:
+            if kernel_name is None:
+                self._mdadm_cache.clear()
+            else:
+                self._mdadm_cache.pop(kernel_name, None)
+
+    def get_mdadm_detail(self, kernel_name, dev_file):
+        """
+        return the detail from "mdadm --detail" for the fields sysfs can
+        not supply, it's cached for each array until invalidated
+        """
+        with self._mdadm_cache_lock:
+            detail = self._mdadm_cache.get(kernel_name)
+        if detail is None:
+            output = check_output(['/sbin/mdadm', '--detail', dev_file])
+            detail = _parse_mdadm_detail(output, dev_file)
+            with self._mdadm_cache_lock:
+                self._mdadm_cache[kernel_name] = detail
+        return detail
+
+    def _prune(self, kernel_names):
+        with self._mdadm_cache_lock:
+            for kernel_name in self._mdadm_cache.keys():
+                if kernel_name not in kernel_names:
+                    del self._mdadm_cache[kernel_name]
+
 
 class MDs():
     def __init__(self, lock):
@@ -67,22 +567,31 @@ class MDs():
         self._detail = {}
 
     def _list_raid(self):
+        mgr = md_mgr()
+        arrays = mgr.reader.read_all()
+        dev_files = mgr.reader.list_dev_files()
+        mgr._prune(arrays)
         ret = {}
-        for line in check_output('/sbin/mdadm --detail --scan'.split()).splitlines():
-            if ' ' not in line:
-                continue
-            comps = line.split()
-            device = comps[1]
+        for kernel_name, array in arrays.iteritems():
+            device = dev_files.get(kernel_name, os.path.join("/dev", kernel_name))
             md_name = os.path.basename(device)
-            ret[md_name] = {"dev_file": device}
-            for comp in comps[2:]:
-                key = comp.split('=')[0].lower()
-                value = comp.split('=')[1]
-                ret[md_name][key] = value
-            full_name = ret[md_name].get('name')
-            if full_name:
-                ret[md_name]['full_name'] = full_name
-            ret[md_name]['name'] = md_name
+            ret[md_name] = {
+                "dev_file": device,
+                "name": md_name,
+                "metadata": array["metadata"],
+            }
+            try:
+                detail = mgr.get_mdadm_detail(kernel_name, device)
+            except StorLeverError:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to get mdadm detail of MD {0}".format(device),
+                           exc_info=True)
+                detail = {}
+            uuid = array.get("uuid") or detail.get("uuid")
+            if uuid:
+                ret[md_name]["uuid"] = uuid
+            if detail.get("full_name"):
+                ret[md_name]["full_name"] = detail["full_name"]
         return ret
 
     def _update_mdadm_conf(self):
@@ -125,7 +634,9 @@ class MDs():
                                "Failed zero superblock of device {0}".format(md_device),
                                exc_info=True)
             self._update_mdadm_conf()
+            md_mgr().invalidate()
             self.refresh()
+            block_mgr().invalidate()
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "MD {0} removed successfully".format(md_device))
 
@@ -207,7 +718,9 @@ class MDs():
 
             check_output(cmd, shell=True)
             self._update_mdadm_conf()
+            md_mgr().invalidate()
             self.refresh()
+            block_mgr().invalidate()
             self._detail[name] = MD(name, self._lock)
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "MD {0} created successfully".format(name))
@@ -218,8 +731,8 @@ class MD(object):
     def __init__(self, name, lock):
         self.name = name
         self.dev_file = _md_name_to_dev_file(name)
-        self.refresh()
         self._lock = lock
+        self._load()
 
     def refresh(self):
         """
@@ -231,78 +744,52 @@ class MD(object):
 
         salt '*' raid.detail '/dev/md0'
         """
+        md_mgr().invalidate(os.path.basename(os.path.realpath(self.dev_file)))
+        self._load()
+
+    def _load(self):
         self.raid_level = ''
         self.state = ''
         self.array_size = 0
         self.used_dev_size = 0
         self.raid_devices = 0
         self.total_devices = 0
-        self.active_device = 0
-        self.working_device = 0
+        self.active_devices = 0
+        self.working_devices = 0
         self.failed_devices = 0
         self.spare_devices = 0
         self.resync_status = 100
+        self.sync_action = 'idle'
         self.uuid = ''
         self.creation_time = ''
         self.update_time = ''
         self.persistence = ''
         self.members = {}
 
-        # Lets make sure the device exists before running mdadm
+        # Lets make sure the device exists before reading its state
         if not os.path.exists(self.dev_file):
             raise StorLeverError('Device {0} does not exist'.format(self.dev_file))
 
-        cmd = '/sbin/mdadm --detail {0}'.format(self.dev_file)
-        for line in check_output(cmd.split()).splitlines():
-            if line.startswith(self.dev_file):
-                continue
-            if ' ' not in line:
-                continue
-            if not ':' in line:
-                if '/dev/' in line:
-                    comps = line.split()
-                    state = comps[4:-1]
-                    self.members[comps[0]] = {
-                        'device': comps[-1],
-                        'major': comps[1],
-                        'minor': comps[2],
-                        'number': comps[0],
-                        'raiddevice': comps[3],
-                        'state': ' '.join(state),
-                        }
-                continue
-            else:
-                comps = line.split(' : ')
-                comps[0] = comps[0].lower()
-                comps[0] = comps[0].strip()
-                comps[0] = comps[0].replace(' ', '_')
-                if comps[0] in ('array_size', 'used_dev_size'):
-                    try:
-                        comps[1] = int(comps[1].split()[0])
-                    except Exception:
-                        logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
-                                   "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
-                        continue
-                elif comps[0] in ('raid_devices', 'total_devices', 'active_devices',
-                                  'working_devices', 'failed_devices', 'spare_devices'):
-                    try:
-                        comps[1] = int(comps[1])
-                    except Exception:
-                        logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
-                                   "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
-                        continue
-                elif comps[0] == 'resync_status':
-                    try:
-                        comps[1] = int(comps[1].split()[0][0:-1])
-                    except Exception:
-                        logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
-                                   "Failed to parse MD detail [{0}] [{1}]".format(comps[0], comps[1]))
-                        continue
-
-                if comps[0] == 'name':
-                    setattr(self, 'full_name', comps[1])
-                elif hasattr(self, comps[0]):
-                    setattr(self, comps[0], comps[1])
+        mgr = md_mgr()
+        kernel_name = os.path.basename(os.path.realpath(self.dev_file))
+        array = mgr.reader.read_array(kernel_name)
+        if array is None:
+            raise StorLeverError('Device {0} is not a MD device'.format(self.dev_file))
+        for key, value in array.iteritems():
+            if hasattr(self, key):
+                setattr(self, key, value)
+
+        # the remaining fields can only be got from mdadm
+        try:
+            detail = mgr.get_mdadm_detail(kernel_name, self.dev_file)
+        except StorLeverError:
+            logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                       "Failed to get mdadm detail of MD {0}".format(self.dev_file),
+                       exc_info=True)
+            detail = {}
+        for key in MDADM_ONLY_FIELDS:
+            if key in detail and not getattr(self, key, None):
+                setattr(self, key, detail[key])
 
     def remove_component(self, device):
         fail_cmd = '/sbin/mdadm {0} --fail {1}'.format(self.dev_file, device)
@@ -17,6 +17,7 @@ from stat import *
 from storlever.lib.command import check_output, write_file_entry, read_file_entry
 from storlever.lib.exception import StorLeverError
 from storlever.mngr.block.blockmgr import BLOCKDEV_CMD
+from storlever.mngr.block.smartmgr import smart_mgr, SMARTCTL_CMD
 from storlever.mngr.system.modulemgr import ModuleManager
 
 MODULE_INFO = {
@@ -31,7 +32,6 @@ MODULE_INFO = {
 
 LSSCSI_CMD = "/usr/bin/lsscsi"
 SCSI_RESCAN_CMD = "/usr/bin/rescan-scsi-bus.sh"
-SMARTCTL_CMD = "/usr/sbin/smartctl"
 
 class ScsiDev(object):
     def __init__(self, scsi_id, scsi_type, dev_file, sg_file):
@@ -89,34 +89,28 @@ class ScsiDev(object):
         state_path = os.path.join("/sys/class/scsi_device/", self.scsi_id, "device/state")
         write_file_entry(state_path, "offline\n")
 
-    def get_smart_info(self):
+    def get_smart_info(self, refresh=False):
+        """
+        return the SMART info of the device, see
+        storlever.mngr.block.smartmgr.parse_smart_output for the fields.
+        It's cached for a while unless refresh is True
+        """
         if self.dev_file == "":
             raise StorLeverError("scsi_id (%s) has not be recognized" % self.scsi_id, 400)
-        output = check_output([SMARTCTL_CMD, "-i", "-T", "verypermissive", self.dev_file])
-        smart_enabled = False
-        auto_offline_enabled = False
-        if "SMART support is: Enabled" in output:
-            smart_enabled = True
-            output = check_output([SMARTCTL_CMD, "-a", "-T", "verypermissive", self.dev_file])
-
-            if "Auto Offline Data Collection: Enabled" in output:
-                auto_offline_enabled = True
-
-        # filter the copyright
-        lines = output.splitlines()
-        for index, line in enumerate(lines):
-            if line == "":
-                break
-        else:
-            index = 0
-        detail = "\n".join(lines[index + 1:])
-
-        info = {
-            "smart_enabled": smart_enabled,
-            "auto_offline_enabled": auto_offline_enabled,
-            "detail": detail
-        }
-        return info
+        return smart_mgr().get_smart_info(self.dev_file, refresh)
+
+    def get_smart_history(self, since=None, until=None, max_points=None,
+                          key=None):
+        """
+        return the SMART records of the drive in the time range, see
+        storlever.mngr.block.smarthistory.SmartHistory.query. The drive is
+        the one last collected from this device unless its history key
+        is given
+        """
+        if self.dev_file == "":
+            raise StorLeverError("scsi_id (%s) has not be recognized" % self.scsi_id, 400)
+        return smart_mgr().get_smart_history(self.dev_file, since, until,
+                                             max_points, key)
 
     def set_smart_config(self, smart_enabled=None, auto_offline_enabled=None):
 
@@ -137,6 +131,8 @@ class ScsiDev(object):
                 param = "off"
             out = check_output([SMARTCTL_CMD, "-o", param, "-T", "verypermissive", self.dev_file])
 
+        smart_mgr().invalidate(self.dev_file)
+
     def smart_test(self, scsi_id, test_type):
         if test_type not in ("offline", "short", "long", "conveyance"):
             raise StorLeverError("test_type (%s) Not Support" % test_type, 400)
@@ -145,6 +141,7 @@ class ScsiDev(object):
             raise StorLeverError("scsi_id (%s) has not be recognized" % self.scsi_id, 400)
 
         out = check_output([SMARTCTL_CMD, "-t", test_type, "-T", "verypermissive", self.dev_file])
+        smart_mgr().invalidate(self.dev_file)
 
 
 
@@ -201,6 +198,29 @@ class ScsiManager(object):
             })
         return host_list
 
+    def get_smart_dev_files(self):
+        """return the dev files of the scsi disks"""
+        return [scsi_dev.dev_file for scsi_dev in self.get_scsi_dev_list()
+                if scsi_dev.scsi_type == "disk" and scsi_dev.dev_file != ""]
+
+    def get_smart_summary(self, refresh=False):
+        """
+        return the SMART info of all the scsi disks without the detail text,
+        the disks are queried in parallel
+        """
+        dev_list = [scsi_dev for scsi_dev in self.get_scsi_dev_list()
+                    if scsi_dev.scsi_type == "disk" and scsi_dev.dev_file != ""]
+        infos = smart_mgr().get_smart_info_list(
+            [scsi_dev.dev_file for scsi_dev in dev_list], refresh)
+        summary = []
+        for scsi_dev in dev_list:
+            info = infos[scsi_dev.dev_file]
+            info.pop("detail", None)
+            info["scsi_id"] = scsi_dev.scsi_id
+            info["dev_file"] = scsi_dev.dev_file
+            summary.append(info)
+        return summary
+
     def rescan_bus(self, host=[], channels=[], targets=[], luns=[],
                  remove=False, force_rescan=False, force_remove=False):
         cmd_list = [SCSI_RESCAN_CMD]
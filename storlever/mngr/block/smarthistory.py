@@ -0,0 +1,202 @@
+"""
+storlever.mngr.block.smarthistory
+~~~~~~~~~~~~~~~~
+
+This module implements the on-disk history of the SMART records.
+
+Each drive has its own history file of fixed-width binary records appended
+in time order, named by the model and serial number of the drive, so the
+history follows the drive instead of its device name. A record is
+SMART_RECORD_SIZE (55) bytes, which is less than 500KB per drive for a year of
+hourly records. A time range is found by binary search on the file, and
+a long range is down-sampled by reading evenly spaced records, so a trend
+query over months of data reads only the records it returns.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import re
+import struct
+import logging
+import collections
+
+from storlever.lib import logger
+from storlever.lib.lock import lock
+
+
+SMART_HISTORY_DIR = "/var/lib/storlever/smart"
+
+# seconds between two records of a drive, the more frequent ones are
+# not recorded
+SMART_HISTORY_MIN_INTERVAL = 300
+
+SMART_HISTORY_SUFFIX = ".smart"
+
+# health of the record
+SMART_RECORD_HEALTH = ("unknown", "passed", "failed")
+
+SMART_RECORD_FIELDS = ("time", "health", "temperature", "power_on_hours",
+                       "reallocated_sectors", "pending_sectors",
+                       "offline_uncorrectable", "grown_defects",
+                       "uncorrected_errors")
+
+# little-endian without padding, the counters are -1 if not reported
+SMART_RECORD_FORMAT = "<dbhiqqqqq"
+SMART_RECORD_SIZE = struct.calcsize(SMART_RECORD_FORMAT)
+
+_KEY_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class SmartRecord(collections.namedtuple("SmartRecord", SMART_RECORD_FIELDS)):
+    """
+    a typed SMART record of a drive at a time, the fields other than time
+    and health are None if not reported by the drive
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_info(cls, info, timestamp):
+        """make the record from the SMART info parsed by smartmgr"""
+        return cls(timestamp, info["health"],
+                   *[info.get(field) for field in SMART_RECORD_FIELDS[2:]])
+
+    def pack(self):
+        if self.health in SMART_RECORD_HEALTH:
+            health = SMART_RECORD_HEALTH.index(self.health)
+        else:
+            health = 0
+        values = [-1 if value is None else value for value in self[2:]]
+        return struct.pack(SMART_RECORD_FORMAT, self.time, health, *values)
+
+    @classmethod
+    def unpack(cls, data):
+        values = struct.unpack(SMART_RECORD_FORMAT, data)
+        health = SMART_RECORD_HEALTH[values[1]] \
+            if 0 <= values[1] < len(SMART_RECORD_HEALTH) else "unknown"
+        return cls(values[0], health,
+                   *[None if value < 0 else value for value in values[2:]])
+
+    def to_dict(self):
+        return dict(zip(SMART_RECORD_FIELDS, self))
+
+
+def history_key(info, dev_file):
+    """return the history key of the drive, by its model and serial number"""
+    if info.get("serial"):
+        key = "%s_%s" % (info.get("model", ""), info["serial"])
+    else:
+        key = os.path.basename(dev_file)
+    return _KEY_CHARS.sub("_", key.strip()).strip("_.") or "unknown"
+
+
+class SmartHistory(object):
+    """the append-only history files of the SMART records"""
+
+    def __init__(self, history_dir=SMART_HISTORY_DIR,
+                 min_interval=SMART_HISTORY_MIN_INTERVAL):
+        self.lock = lock()
+        self.history_dir = history_dir
+        self.min_interval = min_interval
+        # key -> time of the last record
+        self._last_time = {}
+
+    def _path(self, key):
+        return os.path.join(self.history_dir, key + SMART_HISTORY_SUFFIX)
+
+    def _read_record(self, f, index):
+        f.seek(index * SMART_RECORD_SIZE)
+        return SmartRecord.unpack(f.read(SMART_RECORD_SIZE))
+
+    def _last_record_time(self, key):
+        """with lock"""
+        if key not in self._last_time:
+            last_time = None
+            try:
+                with open(self._path(key), "rb") as f:
+                    count = os.fstat(f.fileno()).st_size // SMART_RECORD_SIZE
+                    if count > 0:
+                        last_time = self._read_record(f, count - 1).time
+            except IOError:
+                pass
+            self._last_time[key] = last_time
+        return self._last_time[key]
+
+    def append(self, key, record):
+        """
+        append the record to the history of the drive, return whether it's
+        appended. It's dropped if it's within min_interval seconds after
+        the last record
+        """
+        with self.lock:
+            last_time = self._last_record_time(key)
+            if last_time is not None and \
+                    0 <= record.time - last_time < self.min_interval:
+                return False
+            try:
+                if not os.path.isdir(self.history_dir):
+                    os.makedirs(self.history_dir, 0755)
+                path = self._path(key)
+                with open(path, "ab") as f:
+                    # drop the partial record left by a crash
+                    size = os.fstat(f.fileno()).st_size
+                    if size % SMART_RECORD_SIZE:
+                        f.truncate(size - size % SMART_RECORD_SIZE)
+                    f.write(record.pack())
+            except (IOError, OSError) as e:
+                logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                           "Failed to append SMART history of %s (%s)" %
+                           (key, str(e)))
+                return False
+            self._last_time[key] = record.time
+            return True
+
+    def keys(self):
+        """return the keys of the drives with history"""
+        if not os.path.isdir(self.history_dir):
+            return []
+        return sorted(name[:-len(SMART_HISTORY_SUFFIX)]
+                      for name in os.listdir(self.history_dir)
+                      if name.endswith(SMART_HISTORY_SUFFIX))
+
+    def _bisect(self, f, count, timestamp):
+        """return the index of the first record after the time"""
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if self._read_record(f, mid).time > timestamp:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def query(self, key, since=None, until=None, max_points=None):
+        """
+        return the records of the drive in the time range (since, until],
+        in time order. If there are more than max_points records, they are
+        down-sampled to max_points evenly spaced ones, always with the
+        latest one
+        """
+        try:
+            f = open(self._path(key), "rb")
+        except IOError:
+            return []
+        with f:
+            count = os.fstat(f.fileno()).st_size // SMART_RECORD_SIZE
+            start = 0 if since is None else self._bisect(f, count, since)
+            end = count if until is None else self._bisect(f, count, until)
+            if end <= start:
+                return []
+            if max_points is None or end - start <= max_points:
+                f.seek(start * SMART_RECORD_SIZE)
+                data = f.read((end - start) * SMART_RECORD_SIZE)
+                return [SmartRecord.unpack(data[i:i + SMART_RECORD_SIZE])
+                        for i in xrange(0, len(data) - SMART_RECORD_SIZE + 1,
+                                        SMART_RECORD_SIZE)]
+            if max_points <= 1:
+                return [self._read_record(f, end - 1)]
+            step = float(end - 1 - start) / (max_points - 1)
+            return [self._read_record(f, start + int(round(i * step)))
+                    for i in xrange(max_points)]
@@ -0,0 +1,401 @@
+"""
+storlever.mngr.block.smartmgr
+~~~~~~~~~~~~~~~~
+
+This module implements the SMART health collection of the disks.
+
+The SMART info of a disk is read by one "smartctl -a" and parsed into
+structured fields. The disks are queried in parallel, at most
+SMART_MAX_WORKERS at the same time, and the result of each disk is cached
+for SMART_CACHE_TTL seconds, so the health of all the drives in a JBOD can
+be shown at once.
+
+Each collected result is also appended to the SMART history of the drive
+(see storlever.mngr.block.smarthistory) as a typed record, and the drives
+can be collected periodically in background, so the trend of a drive can
+be queried without running smartctl.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import re
+import time
+import logging
+import threading
+import collections
+
+from storlever.lib.command import command_executor
+from storlever.lib.exception import StorLeverError, StorLeverCmdError
+from storlever.lib.lock import lock
+from storlever.lib import logger
+from storlever.mngr.block.smarthistory import SmartHistory, SmartRecord, \
+    history_key
+
+
+SMARTCTL_CMD = "/usr/sbin/smartctl"
+
+# max number of the disks queried at the same time
+SMART_MAX_WORKERS = 8
+
+# seconds the SMART info of a disk is cached
+SMART_CACHE_TTL = 60
+
+# seconds between two background collections of all the disks, 0 means
+# the disks are recorded to the history only when queried
+SMART_COLLECT_INTERVAL = 3600
+
+# bits of smartctl exit status, the command line is not parsed or
+# the device can not be opened. The other bits are the disk status,
+# with which the output is still valid
+SMARTCTL_ERROR_MASK = 0x03
+
+SMART_HEALTH_PASSED = "passed"
+SMART_HEALTH_FAILED = "failed"
+SMART_HEALTH_UNKNOWN = "unknown"
+
+# seconds to wait for one of the running smartctl to finish
+_POLL_INTERVAL = 0.05
+
+# fields of the information section, the key in smartctl output -> field
+_INFO_FIELDS = {
+    "Device Model": "model",
+    "Model Family": "family",
+    "Product": "model",
+    "Vendor": "vendor",
+    "Serial Number": "serial",
+    "Serial number": "serial",
+    "Firmware Version": "firmware",
+    "Revision": "firmware",
+    "User Capacity": "capacity",
+}
+
+_INFO_LINE = re.compile(r"^([A-Za-z][A-Za-z ]*?)\s*:\s+(.*?)\s*$")
+_ATTRIBUTE_LINE = re.compile(r"^\s*(\d+)\s+(\S+)\s+(0x[0-9a-fA-F]+)\s+(\d+)\s+"
+                             r"(\d+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(.*?)\s*$")
+_INTEGER = re.compile(r"\d+")
+_SCSI_TEMPERATURE = re.compile(r"^Current Drive Temperature:\s+(\d+)\s+C")
+_SCSI_POWER_ON_HOURS = re.compile(r"number of hours powered up\s*=\s*([\d.]+)")
+_SCSI_POWER_ON_TIME = re.compile(r"power on time, hours:minutes\s+(\d+):")
+_SCSI_GROWN_DEFECTS = re.compile(r"^Elements in grown defect list:\s+(\d+)")
+# read/write/verify lines of the error counter log, the last column is
+# the total uncorrected errors
+_SCSI_ERROR_COUNTER = re.compile(r"^(read|write|verify):\s+.*\s(\d+)\s*$")
+
+# ATA attribute ids of the temperature and power on hours
+ATA_TEMPERATURE_IDS = (194, 190)
+ATA_POWER_ON_HOURS_ID = 9
+
+# ATA attribute ids of the counters, field -> id
+ATA_COUNTER_IDS = {
+    "reallocated_sectors": 5,
+    "pending_sectors": 197,
+    "offline_uncorrectable": 198,
+    "uncorrected_errors": 187,
+}
+
+
+def _first_int(raw):
+    match = _INTEGER.search(raw)
+    if match is None:
+        return None
+    return int(match.group())
+
+
+def _parse_attribute(match):
+    (attr_id, name, flag, value, worst, thresh, attr_type, updated,
+     when_failed, raw) = match.groups()
+    return {
+        "id": int(attr_id),
+        "name": name,
+        "flag": flag,
+        "value": int(value),
+        "worst": int(worst),
+        "thresh": int(thresh) if thresh.isdigit() else None,
+        "type": attr_type,
+        "updated": updated,
+        "when_failed": "" if when_failed == "-" else when_failed,
+        "raw": raw,
+        "raw_value": _first_int(raw),
+    }
+
+
+def parse_smart_output(output):
+    """
+    parse the output of "smartctl -a" of an ATA or SCSI disk, return a dict
+    of the structured fields, and the output without the copyright header
+    as detail.
+
+    The counters are None if not reported by the disk. reallocated_sectors,
+    pending_sectors and offline_uncorrectable are from the ATA attributes,
+    grown_defects is from the SCSI grown defect list, and
+    uncorrected_errors is the ATA Reported_Uncorrect or the total
+    uncorrected errors of the SCSI error counter log
+    """
+    lines = output.splitlines()
+    # filter the copyright
+    for index, line in enumerate(lines):
+        if line == "":
+            break
+    else:
+        index = -1
+    lines = lines[index + 1:]
+
+    info = {
+        "model": "",
+        "family": "",
+        "vendor": "",
+        "serial": "",
+        "firmware": "",
+        "capacity": "",
+        "smart_available": False,
+        "smart_enabled": False,
+        "auto_offline_enabled": False,
+        "health": SMART_HEALTH_UNKNOWN,
+        "temperature": None,
+        "power_on_hours": None,
+        "reallocated_sectors": None,
+        "pending_sectors": None,
+        "offline_uncorrectable": None,
+        "grown_defects": None,
+        "uncorrected_errors": None,
+        "attributes": [],
+        "detail": "\n".join(lines),
+    }
+    in_attributes = False
+    for line in lines:
+        if in_attributes:
+            match = _ATTRIBUTE_LINE.match(line)
+            if match is not None:
+                info["attributes"].append(_parse_attribute(match))
+                continue
+            in_attributes = False
+        if line.startswith("ID# ATTRIBUTE_NAME"):
+            in_attributes = True
+        elif line.startswith("SMART support is:"):
+            if "Available" in line:
+                info["smart_available"] = True
+            elif "Enabled" in line:
+                info["smart_available"] = info["smart_enabled"] = True
+        elif line.startswith("Device supports SMART and is"):
+            # SCSI disks
+            info["smart_available"] = True
+            info["smart_enabled"] = line.endswith("Enabled")
+        elif line.startswith("SMART overall-health self-assessment test result:") or \
+                line.startswith("SMART Health Status:"):
+            status = line.split(":", 1)[1].strip()
+            if status in ("PASSED", "OK"):
+                info["health"] = SMART_HEALTH_PASSED
+            elif status:
+                info["health"] = SMART_HEALTH_FAILED
+        elif line.strip().startswith("Auto Offline Data Collection: Enabled"):
+            info["auto_offline_enabled"] = True
+        else:
+            match = _SCSI_TEMPERATURE.match(line)
+            if match is not None:
+                info["temperature"] = int(match.group(1))
+                continue
+            match = _SCSI_POWER_ON_HOURS.search(line)
+            if match is not None:
+                info["power_on_hours"] = int(float(match.group(1)))
+                continue
+            match = _SCSI_POWER_ON_TIME.search(line)
+            if match is not None:
+                info["power_on_hours"] = int(match.group(1))
+                continue
+            match = _SCSI_GROWN_DEFECTS.match(line)
+            if match is not None:
+                info["grown_defects"] = int(match.group(1))
+                continue
+            match = _SCSI_ERROR_COUNTER.match(line)
+            if match is not None:
+                info["uncorrected_errors"] = \
+                    (info["uncorrected_errors"] or 0) + int(match.group(2))
+                continue
+            match = _INFO_LINE.match(line)
+            if match is not None and match.group(1) in _INFO_FIELDS:
+                field = _INFO_FIELDS[match.group(1)]
+                if not info[field]:
+                    info[field] = match.group(2)
+
+    attributes = dict((attr["id"], attr) for attr in info["attributes"])
+    for attr_id in ATA_TEMPERATURE_IDS:
+        if attr_id in attributes and info["temperature"] is None:
+            info["temperature"] = attributes[attr_id]["raw_value"]
+    if ATA_POWER_ON_HOURS_ID in attributes and info["power_on_hours"] is None:
+        info["power_on_hours"] = attributes[ATA_POWER_ON_HOURS_ID]["raw_value"]
+    for field, attr_id in ATA_COUNTER_IDS.items():
+        if attr_id in attributes and info[field] is None:
+            info[field] = attributes[attr_id]["raw_value"]
+    return info
+
+
+class SmartManager(object):
+    """collect the SMART info of the disks in parallel with a result cache"""
+
+    def __init__(self, max_workers=SMART_MAX_WORKERS, cache_ttl=SMART_CACHE_TTL):
+        self.lock = lock()
+        self.max_workers = max_workers
+        self.cache_ttl = cache_ttl
+        self.history = SmartHistory()
+        # dev file -> (time of collection, info)
+        self._cache = {}
+        # dev file -> history key of the drive last collected from it
+        self._history_keys = {}
+        self.interval = SMART_COLLECT_INTERVAL
+        self._thread = None
+
+    def invalidate(self, dev_file=None):
+        """drop the cached SMART info of the device, or all devices"""
+        with self.lock:
+            if dev_file is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(dev_file, None)
+
+    def _smartctl_cmd(self, dev_file):
+        return [SMARTCTL_CMD, "-a", "-T", "verypermissive", dev_file]
+
+    def _parse_result(self, dev_file, future):
+        try:
+            output = future.result()
+        except StorLeverCmdError as e:
+            # the disk status bits are set, like the disk is failing
+            if e.return_code is None or e.return_code < 0 or \
+                    e.return_code & SMARTCTL_ERROR_MASK:
+                raise
+            output = str(e)
+        return parse_smart_output(output)
+
+    def _collect(self, dev_files):
+        """
+        run smartctl on the devices, at most max_workers at the same time,
+        return a dict of dev file -> info or the error
+        """
+        results = {}
+        pending = collections.deque(dev_files)
+        running = []
+        while pending or running:
+            while pending and len(running) < self.max_workers:
+                dev_file = pending.popleft()
+                running.append((dev_file, command_executor().submit(
+                    self._smartctl_cmd(dev_file))))
+            done = [item for item in running if item[1].done()]
+            if not done:
+                running[0][1].wait(_POLL_INTERVAL)
+                continue
+            for dev_file, future in done:
+                running.remove((dev_file, future))
+                try:
+                    results[dev_file] = self._parse_result(dev_file, future)
+                except (StorLeverError, EnvironmentError) as e:
+                    # like smartctl is not installed
+                    results[dev_file] = e
+        return results
+
+    def get_smart_info_list(self, dev_files, refresh=False):
+        """
+        return a dict of dev file -> SMART info of the devices, the devices
+        failed to be read have a single field "error" with the reason
+        """
+        now = time.time()
+        infos = {}
+        with self.lock:
+            for dev_file in dev_files:
+                entry = self._cache.get(dev_file)
+                if not refresh and entry is not None and \
+                        0 <= now - entry[0] < self.cache_ttl:
+                    infos[dev_file] = dict(entry[1])
+
+        results = self._collect([dev_file for dev_file in dev_files
+                                 if dev_file not in infos])
+        with self.lock:
+            for dev_file, info in results.items():
+                if isinstance(info, Exception):
+                    infos[dev_file] = {"error": str(info)}
+                else:
+                    self._cache[dev_file] = (now, info)
+                    infos[dev_file] = dict(info)
+        for dev_file, info in results.items():
+            if not isinstance(info, Exception):
+                key = history_key(info, dev_file)
+                with self.lock:
+                    self._history_keys[dev_file] = key
+                self.history.append(key, SmartRecord.from_info(info, now))
+        return infos
+
+    def get_smart_info(self, dev_file, refresh=False):
+        """return the SMART info of the device, StorLeverError if failed"""
+        info = self.get_smart_info_list([dev_file], refresh)[dev_file]
+        if "error" in info:
+            raise StorLeverError(info["error"], 500)
+        return info
+
+
+    def get_history_key(self, dev_file):
+        """
+        return the history key of the drive of the device without running
+        smartctl, or None if the drive is not collected yet
+        """
+        with self.lock:
+            key = self._history_keys.get(dev_file)
+        if key is not None:
+            return key
+        # the drive without serial number is keyed by its dev file
+        key = history_key({}, dev_file)
+        if key in self.history.keys():
+            return key
+        return None
+
+    def get_smart_history(self, dev_file, since=None, until=None,
+                          max_points=None, key=None):
+        """
+        return the SMART records of the drive in the time range as a list
+        of dicts, see SmartHistory.query(). The drive is found by the key,
+        default to the one last collected from the dev file, and it's empty
+        if the drive is not collected yet
+        """
+        if key is None:
+            key = self.get_history_key(dev_file)
+            if key is None:
+                return []
+        elif key not in self.history.keys():
+            raise StorLeverError("No SMART history of drive (%s)" % key, 404)
+        return [record.to_dict() for record in
+                self.history.query(key, since, until, max_points)]
+
+    def start(self, list_dev_files, interval=None):
+        """
+        start the thread to collect the SMART info of the disks returned by
+        list_dev_files() every interval seconds
+        """
+        if interval is not None:
+            if interval <= 0:
+                raise StorLeverError("SMART collect interval must be positive", 400)
+            self.interval = interval
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            args=(list_dev_files,),
+                                            name="storlever-smart")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self, list_dev_files):
+        while True:
+            try:
+                self.get_smart_info_list(list_dev_files(), refresh=True)
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to collect the SMART info", exc_info=True)
+            time.sleep(self.interval)
+
+
+SmartManager = SmartManager()
+
+
+def smart_mgr():
+    """return the global SMART manager instance"""
+    return SmartManager
@@ -0,0 +1,477 @@
+"""
+storlever.mngr.fs.dirindex
+~~~~~~~~~~~~~~~~
+
+This module implements the incremental directory size index of the
+filesystems.
+
+The index of a filesystem keeps the mtime, the bytes of the files directly
+in it and the total bytes of the whole subtree of each directory. It's
+built by DIR_INDEX_MAX_WORKERS threads walking the tree in parallel, and
+a later refresh lists only the directories whose mtime is changed, the
+others are just lstat'ed and their last result is reused. The walk stays
+in the filesystem, like "du -x".
+
+A file modified in place does not change the mtime of its directory, so
+its new size is only counted by a full refresh, or when its directory is
+changed.
+
+The index is saved as zlib compressed fixed-width records of the
+directories in DIR_INDEX_DIR, so the usage of any directory to any depth
+is queried from memory without walking the filesystem. The filesystem is
+never walked in the request, the index is refreshed by the background
+thread or the background job submitted by DirIndexManager.submit_refresh().
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import stat
+import time
+import zlib
+import Queue
+import heapq
+import struct
+import logging
+import threading
+import collections
+
+from storlever.lib.config import write_file_atomic
+from storlever.lib.exception import StorLeverError
+from storlever.lib.lock import lock
+from storlever.lib import logger
+from storlever.mngr.system.jobmgr import job_mgr, JOB_FINISHED_STATES
+
+
+DIR_INDEX_DIR = "/var/lib/storlever/dirindex"
+
+# max number of the directories scanned at the same time
+DIR_INDEX_MAX_WORKERS = 4
+
+# seconds between two background refreshes of all the filesystems,
+# 0 means the index is refreshed only on demand
+DIR_INDEX_INTERVAL = 0
+
+# seconds between two checks of the cancel flag of a refresh waiting for
+# the directory scans or another refresh
+DIR_INDEX_CANCEL_POLL = 0.5
+
+DIR_INDEX_SUFFIX = ".idx"
+DIR_INDEX_MAGIC = "SLDI"
+DIR_INDEX_VERSION = 1
+
+# magic, version, update time, number of the records
+_HEADER_FORMAT = "<4sHdI"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+# mtime, own bytes, total bytes, length of the relative path, followed by
+# the path
+_RECORD_FORMAT = "<dqqI"
+_RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+
+# the mtime of the directory changed within the second of its scan is not
+# trusted, since another change in the same second keeps the same mtime
+_RACY_MTIME = -1.0
+
+
+class DirNode(collections.namedtuple("DirNode", ("mtime", "own_bytes",
+                                                 "total_bytes", "subdirs"))):
+    """a directory in the index, subdirs is the tuple of the names"""
+    __slots__ = ()
+
+
+def _join(relative_path, name):
+    return os.path.join(relative_path, name) if relative_path else name
+
+
+def _depth(relative_path):
+    return relative_path.count("/") + 1 if relative_path else 0
+
+
+def _is_under(relative_path, top):
+    return top == "" or relative_path == top or \
+        relative_path.startswith(top + "/")
+
+
+def _sum_totals(nodes, relative_paths):
+    """set the total bytes of the directories in nodes, children first"""
+    for relative_path in sorted(relative_paths, key=_depth, reverse=True):
+        node = nodes.get(relative_path)
+        if node is None:
+            continue
+        total = node.own_bytes
+        for name in node.subdirs:
+            child = nodes.get(_join(relative_path, name))
+            if child is not None:
+                total += child.total_bytes
+        nodes[relative_path] = node._replace(total_bytes=total)
+
+
+class DirIndex(object):
+    """the directory size index of a filesystem"""
+
+    def __init__(self, root, index_file, max_workers=DIR_INDEX_MAX_WORKERS):
+        self.lock = lock()
+        self.root = root
+        self.index_file = index_file
+        self.max_workers = max_workers
+        self.update_time = None
+        # relative path -> DirNode, "" is the root
+        self._nodes = {}
+        self._refresh_lock = lock()
+
+    def _path(self, relative_path):
+        return os.path.join(self.root, relative_path) if relative_path else self.root
+
+    def load(self):
+        """load the index from the index file, return whether it's loaded"""
+        try:
+            with open(self.index_file, "rb") as f:
+                data = zlib.decompress(f.read())
+            magic, version, update_time, count = \
+                struct.unpack_from(_HEADER_FORMAT, data)
+            if magic != DIR_INDEX_MAGIC or version != DIR_INDEX_VERSION:
+                raise ValueError("unknown format")
+            records = []
+            offset = _HEADER_SIZE
+            for _ in xrange(count):
+                mtime, own_bytes, total_bytes, path_len = \
+                    struct.unpack_from(_RECORD_FORMAT, data, offset)
+                offset += _RECORD_SIZE
+                records.append((data[offset:offset + path_len],
+                                mtime, own_bytes, total_bytes))
+                offset += path_len
+        except IOError:
+            return False
+        except (zlib.error, struct.error, ValueError) as e:
+            logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                       "Directory index %s is corrupted (%s), "
+                       "it would be rebuilt" % (self.index_file, str(e)))
+            return False
+
+        subdirs = collections.defaultdict(list)
+        for relative_path, _, _, _ in records:
+            if relative_path:
+                parent, name = os.path.split(relative_path)
+                subdirs[parent].append(name)
+        nodes = {}
+        for relative_path, mtime, own_bytes, total_bytes in records:
+            nodes[relative_path] = DirNode(mtime, own_bytes, total_bytes,
+                                           tuple(subdirs[relative_path]))
+        with self.lock:
+            self._nodes = nodes
+            self.update_time = update_time
+        return True
+
+    def save(self):
+        with self.lock:
+            nodes = self._nodes
+            update_time = self.update_time
+        chunks = [struct.pack(_HEADER_FORMAT, DIR_INDEX_MAGIC, DIR_INDEX_VERSION,
+                              update_time, len(nodes))]
+        for relative_path, node in nodes.iteritems():
+            chunks.append(struct.pack(_RECORD_FORMAT, node.mtime, node.own_bytes,
+                                      node.total_bytes, len(relative_path)))
+            chunks.append(relative_path)
+        index_dir = os.path.dirname(self.index_file)
+        if not os.path.isdir(index_dir):
+            os.makedirs(index_dir, 0755)
+        write_file_atomic(self.index_file, zlib.compress("".join(chunks)), 0600)
+
+    def _scan(self, relative_path, old_node, dev, walk_start):
+        """return the DirNode of the directory, None if it's gone"""
+        path = self._path(relative_path)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(st.st_mode) or st.st_dev != dev:
+            return None
+        mtime = st.st_mtime if st.st_mtime < walk_start - 1 else _RACY_MTIME
+        if old_node is not None and old_node.mtime == st.st_mtime and \
+                mtime != _RACY_MTIME:
+            return DirNode(mtime, old_node.own_bytes, 0, old_node.subdirs)
+
+        own_bytes = st.st_size
+        subdirs = []
+        try:
+            names = os.listdir(path)
+        except OSError:
+            names = []  # like permission denied
+        for name in names:
+            try:
+                child_st = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue    # removed after listed
+            if stat.S_ISDIR(child_st.st_mode):
+                if child_st.st_dev == dev:
+                    subdirs.append(name)
+            else:
+                own_bytes += child_st.st_size
+        return DirNode(mtime, own_bytes, 0, tuple(subdirs))
+
+    def _cancelled(self):
+        return StorLeverError("The refresh of directory index of %s is "
+                              "cancelled" % self.root, 500)
+
+    def _walk(self, top, old_nodes, dev, cancel):
+        """scan the subtree of top by the workers, return the new nodes"""
+        nodes = {}
+        tasks = Queue.Queue()
+        walk_start = time.time()
+
+        def _work():
+            while True:
+                relative_path = tasks.get()
+                try:
+                    if relative_path is None:
+                        return
+                    if cancel.is_set():
+                        continue    # drop the remaining directories
+                    node = self._scan(relative_path, old_nodes.get(relative_path),
+                                      dev, walk_start)
+                    if node is not None:
+                        nodes[relative_path] = node
+                        for name in node.subdirs:
+                            tasks.put(_join(relative_path, name))
+                except Exception:
+                    logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                               "Failed to scan directory %s" %
+                               self._path(relative_path), exc_info=True)
+                finally:
+                    tasks.task_done()
+
+        tasks.put(top)
+        workers = []
+        for _ in range(max(1, self.max_workers)):
+            worker = threading.Thread(target=_work, name="storlever-dir-index")
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        # a worker may hang on a directory, so the cancel flag is checked
+        # while waiting instead of joining the queue
+        with tasks.all_tasks_done:
+            while tasks.unfinished_tasks and not cancel.is_set():
+                tasks.all_tasks_done.wait(DIR_INDEX_CANCEL_POLL)
+        for worker in workers:
+            tasks.put(None)
+        if cancel.is_set():
+            raise self._cancelled()
+        for worker in workers:
+            worker.join()
+        return nodes
+
+    def refresh(self, relative_path="", full=False, cancel=None):
+        """
+        refresh the subtree of the directory, only the directories with
+        changed mtime are scanned unless full is True.
+
+        :param cancel: threading.Event to cancel the refresh, it stops
+                       between the directories and raises StorLeverError
+                       once it's set, even if a directory scan hangs
+        """
+        if cancel is None:
+            cancel = threading.Event()
+        top = relative_path.strip("/")
+        # wait for the refresh in progress, which may hang as well
+        while not self._refresh_lock.acquire(False):
+            if cancel.wait(DIR_INDEX_CANCEL_POLL):
+                raise self._cancelled()
+        try:
+            self._refresh(top, full, cancel)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self, top, full, cancel):
+        """with the refresh lock"""
+        try:
+            dev = os.lstat(self.root).st_dev
+        except OSError as e:
+            raise StorLeverError("Failed to scan %s (%s)" %
+                                 (self.root, str(e)), 500)
+        with self.lock:
+            old_nodes = self._nodes
+        new_nodes = self._walk(top, {} if full else old_nodes, dev, cancel)
+        _sum_totals(new_nodes, new_nodes.keys())
+
+        if top == "":
+            nodes = new_nodes
+        else:
+            nodes = dict((path, node) for path, node in old_nodes.iteritems()
+                         if not _is_under(path, top))
+            nodes.update(new_nodes)
+            ancestors = []
+            parent = top
+            while parent:
+                parent = os.path.dirname(parent)
+                ancestors.append(parent)
+            _sum_totals(nodes, ancestors)
+        with self.lock:
+            self._nodes = nodes
+            self.update_time = time.time()
+        try:
+            self.save()
+        except (IOError, OSError) as e:
+            logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                       "Failed to save directory index %s (%s)" %
+                       (self.index_file, str(e)))
+
+    def is_indexed(self, relative_path=""):
+        """whether the directory is in the index"""
+        with self.lock:
+            return relative_path.strip("/") in self._nodes
+
+    def refresh_top(self, relative_path=""):
+        """
+        return the directory to refresh for the directory, it's the nearest
+        indexed ancestor if the directory is not in the index yet
+        """
+        relative_path = relative_path.strip("/")
+        with self.lock:
+            nodes = self._nodes
+        while relative_path and relative_path not in nodes:
+            relative_path = os.path.dirname(relative_path)
+        return relative_path
+
+    def query(self, relative_path="", depth=None, top=None):
+        """
+        return the usage list of the directory and its sub directories
+
+        :param depth: the max depth of the sub directories below the
+                      directory, 0 for the directory itself, None for all
+        :param top: return only the N largest directories, largest first
+        """
+        relative_path = relative_path.strip("/")
+        with self.lock:
+            nodes = self._nodes
+        if relative_path not in nodes:
+            raise StorLeverError("Directory (%s) is not in the index" %
+                                 self._path(relative_path), 404)
+        base_depth = _depth(relative_path)
+        usage_list = []
+        pending = collections.deque([relative_path])
+        while pending:
+            path = pending.popleft()
+            node = nodes.get(path)
+            if node is None:
+                continue
+            level = _depth(path) - base_depth
+            usage_list.append({
+                "bytes": node.total_bytes,
+                "abspath": self._path(path),
+                "relpath": path,
+                "depth": level
+            })
+            if depth is None or level < depth:
+                pending.extend(_join(path, name) for name in node.subdirs)
+        if top is not None:
+            usage_list = heapq.nlargest(top, usage_list,
+                                        key=lambda usage: usage["bytes"])
+        return usage_list
+
+
+class DirIndexManager(object):
+    """manage the directory index of each filesystem"""
+
+    def __init__(self, index_dir=DIR_INDEX_DIR, max_workers=DIR_INDEX_MAX_WORKERS):
+        self.lock = lock()
+        self.index_dir = index_dir
+        self.max_workers = max_workers
+        self.interval = DIR_INDEX_INTERVAL
+        # fs name -> DirIndex
+        self._indexes = {}
+        # (fs name, directory, full) -> id of the last refresh job
+        self._refresh_jobs = {}
+        self._thread = None
+
+    def _index_file(self, fs_name):
+        return os.path.join(self.index_dir, fs_name + DIR_INDEX_SUFFIX)
+
+    def get_index(self, fs_name, mount_point):
+        """return the loaded DirIndex of the filesystem"""
+        with self.lock:
+            index = self._indexes.get(fs_name)
+            if index is not None and index.root == mount_point:
+                return index
+            index = DirIndex(mount_point, self._index_file(fs_name),
+                             self.max_workers)
+            self._indexes[fs_name] = index
+        index.load()
+        return index
+
+    def submit_refresh(self, fs_name, mount_point, relative_path="",
+                       full=False, operator="unknown"):
+        """
+        submit the refresh of the directory in the index of the filesystem
+        as a background job, see DirIndex.refresh(), return the job id. The
+        directory not indexed yet is refreshed from its nearest indexed
+        ancestor, and the same refresh still pending or running is not
+        submitted again. Cancelling the job stops the refresh
+        """
+        index = self.get_index(fs_name, mount_point)
+        top = index.refresh_top(relative_path)
+        key = (fs_name, top, full)
+        with self.lock:
+            job_id = self._refresh_jobs.get(key)
+            if job_id is not None:
+                try:
+                    if job_mgr().get_job(job_id)["state"] not in JOB_FINISHED_STATES:
+                        return job_id
+                except StorLeverError:
+                    pass    # dropped from the job history
+            cancel = threading.Event()
+            job_id = job_mgr().submit(
+                "dir_index", index.refresh, args=(top, full, cancel),
+                description="refresh directory index of %s" % fs_name,
+                on_cancel=cancel.set, operator=operator)
+            self._refresh_jobs[key] = job_id
+        return job_id
+
+    def drop_index(self, fs_name):
+        """drop the index of the filesystem, like it's deleted"""
+        with self.lock:
+            self._indexes.pop(fs_name, None)
+            for key in [key for key in self._refresh_jobs if key[0] == fs_name]:
+                del self._refresh_jobs[key]
+        try:
+            os.remove(self._index_file(fs_name))
+        except OSError:
+            pass
+
+    def start(self, list_mount_points, interval=None):
+        """
+        start the thread to refresh the index of the filesystems every
+        interval seconds, list_mount_points() returns a dict of fs name ->
+        mount point of the filesystems to index
+        """
+        if interval is not None:
+            if interval <= 0:
+                raise StorLeverError("directory index interval must be positive", 400)
+            self.interval = interval
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            args=(list_mount_points,),
+                                            name="storlever-dir-index")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self, list_mount_points):
+        while True:
+            try:
+                for fs_name, mount_point in list_mount_points().items():
+                    self.get_index(fs_name, mount_point).refresh()
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to refresh the directory index", exc_info=True)
+            time.sleep(self.interval)
+
+
+DirIndexManager = DirIndexManager()
+
+
+def dir_index_mgr():
+    """return the global directory index manager instance"""
+    return DirIndexManager
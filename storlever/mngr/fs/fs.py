@@ -11,21 +11,69 @@ filesystem base class. All filesystem type must inherit this class.
 import os
 import stat
 import re
+import heapq
+
+# use the scandir of python 3.5+ or the scandir package, which is required
+# by setup.py, the listing falls back to listdir and stat without both
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 from storlever.lib.command import check_output
 from storlever.mngr.system.usermgr import user_mgr
+from storlever.mngr.fs.mounttable import mount_table
+from storlever.mngr.fs.fsusage import fs_usage_mgr, empty_usage
+from storlever.mngr.fs.dirindex import dir_index_mgr
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 import logging
 
 
-PROC_MOUNT_FILE = "/proc/mounts"
 QUOTACHECK_BIN = "/sbin/quotacheck"
 QUOTAON_BIN = "/sbin/quotaon"
 REPQUOTA_BIN = "/usr/sbin/repquota"
 SETQUOTA_BIN = "/usr/sbin/setquota"
-DU_BIN = "/usr/bin/du"
+
+# sort the directory listing by name
+LS_SORT_NAME = "name"
+
+# list the directory in the directory order
+LS_SORT_NONE = "none"
+
+
+def _scan_sub_dirs(path):
+    """
+    yield (index, name, dir entry) of the sub directories in the directory
+    order, the index is the position of the entry in the directory. The dir
+    entry is None if there is no scandir, and then each entry is stat'ed to
+    know whether it's a directory
+    """
+    if scandir is not None:
+        for index, entry in enumerate(scandir(path)):
+            try:
+                # got from d_type without stat if it's not a symlink
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                yield index, entry.name, entry
+    else:
+        for index, name in enumerate(os.listdir(path)):
+            if os.path.isdir(os.path.join(path, name)):
+                yield index, name, None
+
 
 class FileSystem(object):
+
+    # whether the fs is on a local block device, only the local fs has the
+    # directory index, like "du -x" the remote fs is not walked, which may
+    # hang when its server is dead
+    local = True
+
     def __init__(self, name, fs_conf):
         self.name = name
         self.fs_conf = fs_conf
@@ -71,33 +119,21 @@ class FileSystem(object):
                       self.fs_conf["mount_point"]],
                      input_ret=[1])
 
+    def is_mounted(self):
+        """whether the fs is mounted, by the mount table without any IO"""
+        return mount_table().snapshot().is_mounted(self.fs_conf["dev_file"],
+                                                   self.fs_conf["mount_point"])
+
     def is_available(self):
-        with open(PROC_MOUNT_FILE, "r") as f:
-            for line in f:
-                mount_entry = line.split()
-                if mount_entry[0].rstrip(" /") == self.fs_conf["dev_file"].rstrip(" /") and \
-                   mount_entry[1].strip() == self.fs_conf["mount_point"].strip():
-                    return True
-        return False
+        return self.is_mounted()
 
     def usage_info(self):
-        if self.is_available():
-            st = os.statvfs(self.fs_conf["mount_point"])
-            available = (st.f_bavail * st.f_frsize)
-            total = (st.f_blocks * st.f_frsize)
-            used = (st.f_blocks - st.f_bfree) * st.f_frsize
-            try:
-                percent = (used * 100 + (total - 1)) / total
-            except ZeroDivisionError:
-                percent = 0
+        # the usage of a mounted fs whose backend does not respond is the
+        # last known one with the stale flag
+        if self.is_mounted():
+            return fs_usage_mgr().get_usage(self.fs_conf["mount_point"])
         else:
-            total = 0
-            available = 0
-            used = 0
-            percent = 0
-
-        return {"total": total, "available": available,
-                "used": used, "percent":  percent}
+            return empty_usage()
 
     def fs_meta_dump(self):
         return ""
@@ -160,30 +196,52 @@ class FileSystem(object):
                    " by user(%s)" %
                    (path, user))
 
-    def _get_uid_map(self):
-        umgr = user_mgr();
-        ulist = umgr.user_list()
-        uid_map = {}
-        for user in ulist:
-            uid_map[user["uid"]] = user
-
-        return uid_map
-
-    def _get_gid_map(self):
+    def _dir_info(self, relative_path, parent_path, name, entry):
+        """return the info dict of the sub directory, None if it's gone"""
+        path = os.path.join(parent_path, name)
+        try:
+            entry_stat = entry.stat() if entry is not None else os.stat(path)
+        except OSError:
+            return None     # removed after listed
         umgr = user_mgr()
-        glist = umgr.group_list()
-        gid_map = {}
-        for group in glist:
-            gid_map[group["gid"]] = group
-
-        return gid_map
-
-
-    def ls_dir(self, relative_path=""):
+        return {
+            "name": name,
+            "abspath": path,
+            "relpath": os.path.join(relative_path, name),
+            "mode": stat.S_IMODE(entry_stat.st_mode),
+            "user": umgr.uid_to_name(entry_stat.st_uid),
+            "group": umgr.gid_to_name(entry_stat.st_gid)
+        }
+
+    def ls_dir_page(self, relative_path="", limit=None, cursor=None,
+                    sort=LS_SORT_NAME):
+        """list the sub directories of the directory in pages
+
+        :param limit: return at most N directories
+        :param cursor: the next cursor returned by the previous call with
+                       the same sort, to list the next page
+        :param sort: LS_SORT_NAME, or LS_SORT_NONE (None) for the directory
+                     order
+
+        return (directory info list, next cursor), the next cursor is None
+        if there are no more directories. Only the returned directories are
+        stat'ed, the others are filtered by the type in the directory entry.
+
+        Each page scans the directory from the start. The name cursor is
+        stable when the directory changes between pages. The cursor of
+        the directory order is the position of the entry, which is cheaper
+        for a single page but O(n^2/limit) to list all the n entries, and
+        the entries may be skipped or listed twice if the directory
+        changes between pages.
+        """
         if "." in relative_path or ".." in relative_path:
             raise StorLeverError("parent cannot include . or ..", 400)
         if relative_path.startswith("/"):
             raise StorLeverError("parent must be a relative path name", 400)
+        if sort == LS_SORT_NONE:
+            sort = None
+        if sort not in (None, LS_SORT_NAME):
+            raise StorLeverError("sort (%s) is not supported" % sort, 400)
         if not self.is_available():
             raise StorLeverError("File system is unavailable", 500)
 
@@ -192,37 +250,42 @@ class FileSystem(object):
         if not os.path.exists(parent_path):
             raise StorLeverError("Parent directory not found", 404)
 
-
-        share_list = os.listdir(parent_path)
-        uid_map = self._get_uid_map()
-        gid_map = self._get_gid_map()
-        output_list = []
-        for entry in share_list:
-            path = os.path.join(parent_path, entry)
-            entry_stat = os.stat(path)
-            if not stat.S_ISDIR(entry_stat.st_mode):
-                continue    # filter out all file
-            name = entry
-            mode = stat.S_IMODE(entry_stat.st_mode)
-            if entry_stat.st_uid in uid_map:
-                user = uid_map[entry_stat.st_uid]["name"]
-            else:
-                user = str(entry_stat.st_uid)
-            if entry_stat.st_gid in gid_map:
-                group = gid_map[entry_stat.st_gid]["name"]
+        if sort == LS_SORT_NAME:
+            # the cursor is the last name of the previous page
+            sub_dirs = [(name, entry) for index, name, entry in _scan_sub_dirs(parent_path)
+                        if cursor is None or name > cursor]
+            if limit is not None and len(sub_dirs) > limit:
+                page = heapq.nsmallest(limit, sub_dirs, key=lambda item: item[0])
+                next_cursor = page[-1][0]
             else:
-                group = str(entry_stat.st_gid)
+                page = sorted(sub_dirs, key=lambda item: item[0])
+                next_cursor = None
+        else:
+            # the cursor is the number of the entries scanned
+            try:
+                start = int(cursor) if cursor is not None else 0
+            except ValueError:
+                raise StorLeverError("cursor (%s) is invalid" % cursor, 400)
+            page = []
+            next_cursor = None
+            for index, name, entry in _scan_sub_dirs(parent_path):
+                if index < start:
+                    continue
+                if limit is not None and len(page) >= limit:
+                    next_cursor = str(index)
+                    break
+                page.append((name, entry))
 
-            output_list.append({
-                "name": name,
-                "abspath": path,
-                "relpath": os.path.join(relative_path, name),
-                "mode": mode,
-                "user": user,
-                "group": group
-            })
+        output_list = []
+        for name, entry in page:
+            info = self._dir_info(relative_path, parent_path, name, entry)
+            if info is not None:
+                output_list.append(info)
+        return output_list, next_cursor
 
-        return output_list
+    def ls_dir(self, relative_path="", sort=None):
+        """list all the sub directories of the directory, see ls_dir_page()"""
+        return self.ls_dir_page(relative_path, sort=sort)[0]
 
     def mod_dir_owner(self, relative_path, user = None, group = None, operator="unknown"):
         if not self.is_available():
@@ -270,28 +333,45 @@ class FileSystem(object):
                    " by user(%s)" %
                    (path, mode, operator))
 
-    def dir_usage_stat(self, relative_path=""):
+    def dir_usage_stat(self, relative_path="", depth=None, top=None):
+        """return the usage list of the directory from the directory index
+
+        See DirIndex.query() for depth and top. The filesystem is not
+        walked here, None is returned if the directory is not indexed yet,
+        then the index should be refreshed by submit_dir_index_refresh()
+        """
         if "." in relative_path or ".." in relative_path:
             raise StorLeverError("name cannot include . or ..", 400)
         if relative_path.startswith("/"):
             raise StorLeverError("name must be a relative path name", 400)
+        if not self.local:
+            raise StorLeverError("Directory index of the remote file system "
+                                 "is not supported", 400)
         if not self.is_available():
             raise StorLeverError("File system is unavailable", 500)
 
         path = os.path.join(self.fs_conf["mount_point"], relative_path)
         if not os.path.exists(path):
             raise StorLeverError("Share directory not found", 404)
-        output_lines = check_output([DU_BIN, "-b", path]).splitlines()
-        usage_list = []
-        for line in output_lines:
-            elements = line.split()
-            if len(elements) != 2:
-                continue
-            usage_list.append({
-                "bytes": int(elements[0]),
-                "abspath": elements[1]
-            })
-        return usage_list
+        index = dir_index_mgr().get_index(self.name, self.fs_conf["mount_point"])
+        if not index.is_indexed(relative_path):
+            return None
+        return index.query(relative_path, depth, top)
+
+    def submit_dir_index_refresh(self, relative_path="", full=False,
+                                 operator="unknown"):
+        """
+        submit the refresh of the directory index of the filesystem as a
+        background job, return the job id, see DirIndexManager.submit_refresh()
+        """
+        if not self.local:
+            raise StorLeverError("Directory index of the remote file system "
+                                 "is not supported", 400)
+        if not self.is_available():
+            raise StorLeverError("File system is unavailable", 500)
+        return dir_index_mgr().submit_refresh(self.name,
+                                              self.fs_conf["mount_point"],
+                                              relative_path, full, operator)
 
 
     #
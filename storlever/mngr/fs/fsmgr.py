@@ -13,8 +13,8 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
-from storlever.lib.command import check_output, set_selinux_permissive
+from storlever.lib.config import config_store
+from storlever.lib.command import set_selinux_permissive
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 import logging
@@ -22,6 +22,10 @@ from storlever.lib.schema import Schema, Use, Optional, \
     Default, DoNotCare, BoolVal, AutoDel
 
 from storlever.mngr.fs import fs
+from storlever.mngr.fs.fsusage import fs_usage_mgr, empty_usage
+from storlever.mngr.fs.dirindex import dir_index_mgr
+from storlever.mngr.block.blockmgr import block_mgr
+from storlever.mngr.block.devindex import dev_index
 
 from storlever.lib.lock import lock
 from storlever.mngr.system.cfgmgr import STORLEVER_CONF_DIR, cfg_mgr
@@ -72,10 +76,7 @@ class FileSystemManager(object):
         self.sync_to_fstab()
 
     def _uuid_to_dev_file(self, uuid):
-        try:
-            return check_output(["/sbin/blkid", "-U", uuid]).strip()
-        except Exception:
-            return ""
+        return dev_index().uuid_to_dev_file(uuid)
 
     def _dev_file_to_uuid(self, dev_file):
 
@@ -99,9 +100,9 @@ class FileSystemManager(object):
     def _load_conf(self):
         fs_dict = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             fs_dict = \
-                Config.from_file(self.conf_file, self.fs_dict_schema).conf
+                config_store().load(self.conf_file, self.fs_dict_schema)
             # check dev_file by uuid
             for fs_name, fs_conf in fs_dict.items():
                 if fs_conf["dev_uuid"] != "":
@@ -110,7 +111,7 @@ class FileSystemManager(object):
 
     def _save_conf(self, fs_dict):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, fs_dict)
+        config_store().save(self.conf_file, fs_dict)
 
     def _fs_conf_to_fstab_line(self, fs_name, fs_conf):
         if fs_conf["dev_uuid"] == "":
@@ -224,6 +225,29 @@ class FileSystemManager(object):
 
         return fs_list
 
+    def get_fs_usage_list(self, fs_list):
+        """get a dict of fs name -> usage info of the fs objects
+
+        The usage of the mounted filesystems are collected in parallel, and
+        the one whose backend does not respond is the last known usage with
+        the stale flag, see FsUsageManager.get_usage_list()
+        """
+        mount_points = {}
+        for fs_object in fs_list:
+            if fs_object.is_mounted():
+                mount_points[fs_object.name] = fs_object.fs_conf["mount_point"]
+        usages = fs_usage_mgr().get_usage_list(mount_points.values())
+        return dict((fs_object.name,
+                     usages[mount_points[fs_object.name]]
+                     if fs_object.name in mount_points else empty_usage())
+                    for fs_object in fs_list)
+
+    def get_local_mount_points(self):
+        """get a dict of fs name -> mount point of the mounted local filesystems"""
+        return dict((fs_object.name, fs_object.fs_conf["mount_point"])
+                    for fs_object in self.get_fs_list()
+                    if fs_object.local and fs_object.is_mounted())
+
     def fs_type_list(self):
         """list all fs type supported in the storlever"""
         with self.lock:
@@ -280,6 +304,7 @@ class FileSystemManager(object):
 
             # mount fs first
             self._mount_fs(fs_name, fs_conf)
+            block_mgr().invalidate()
 
             fs_dict[fs_name] = fs_conf
             self._save_conf(fs_dict)
@@ -306,6 +331,7 @@ class FileSystemManager(object):
 
              #umount fs first. if it failed, don't delete it in the config
             self._umount_fs(fs_name, fs_conf)
+            block_mgr().invalidate()
 
             self._save_conf(fs_dict)
             self._sync_to_fstab(fs_dict)
@@ -314,6 +340,7 @@ class FileSystemManager(object):
             os.rmdir(fs_conf["mount_point"])
         except OSError as e:
             pass
+        dir_index_mgr().drop_index(fs_name)
 
 
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
@@ -327,6 +354,7 @@ class FileSystemManager(object):
         with self.lock:
             cls = self._get_fs_type_cls(type)
         cls.mkfs(type, dev_file, fs_options)
+        block_mgr().invalidate()
 
 
 FileSystemManager = FileSystemManager()
@@ -0,0 +1,197 @@
+"""
+storlever.mngr.fs.fsusage
+~~~~~~~~~~~~~~~~
+
+This module implements the hang-proof usage collection of the filesystems.
+
+statvfs on a mount point blocks as long as its backend does not respond,
+like a hard NFS mount of an unreachable server, so it's never called in
+the request thread. The mount points are probed in parallel by at most
+FS_USAGE_MAX_WORKERS worker threads, each one is waited for at most
+FS_USAGE_TIMEOUT seconds, and a mount point has at most one probe in
+flight, so a dead mount holds no more than one thread.
+
+The last successful usage of each mount point is cached, it's returned
+with the stale flag when the probe of the mount point times out or fails,
+and a mount point whose probe has already timed out is not waited for
+again until the probe returns.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import time
+import logging
+import threading
+import collections
+
+from storlever.lib.lock import lock
+from storlever.lib import logger
+
+
+# max number of the mount points probed at the same time
+FS_USAGE_MAX_WORKERS = 4
+
+# seconds to wait for the statvfs of a mount point
+FS_USAGE_TIMEOUT = 5
+
+
+def empty_usage():
+    """return the usage info of the unavailable filesystem"""
+    return {"total": 0, "available": 0, "used": 0, "percent": 0,
+            "stale": False, "update_time": None}
+
+
+def statvfs_usage(mount_point):
+    """return the usage info of the mount point by statvfs"""
+    st = os.statvfs(mount_point)
+    available = (st.f_bavail * st.f_frsize)
+    total = (st.f_blocks * st.f_frsize)
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    try:
+        percent = (used * 100 + (total - 1)) / total
+    except ZeroDivisionError:
+        percent = 0
+    return {"total": total, "available": available,
+            "used": used, "percent": percent}
+
+
+class UsageProbe(object):
+    """the statvfs of a mount point running in the worker"""
+
+    def __init__(self, mount_point):
+        self.mount_point = mount_point
+        self.start_time = None
+        self.released = False
+        self.result = None
+        self.error = None
+        self._event = threading.Event()
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+
+class FsUsageManager(object):
+    """collect the usage of the mount points with timeouts"""
+
+    def __init__(self, max_workers=FS_USAGE_MAX_WORKERS, timeout=FS_USAGE_TIMEOUT):
+        self.lock = lock()
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._running = 0
+        self._queue = collections.deque()
+        # mount point -> the probe in flight
+        self._probes = {}
+        # mount point -> (time, usage) of the last successful probe
+        self._cache = {}
+
+    def _submit(self, mount_point):
+        """with lock, return the probe in flight of the mount point"""
+        probe = self._probes.get(mount_point)
+        if probe is None:
+            probe = UsageProbe(mount_point)
+            self._probes[mount_point] = probe
+            self._queue.append(probe)
+        return probe
+
+    def _dispatch(self):
+        """start the queued probes while there are free slots"""
+        started = []
+        with self.lock:
+            while self._queue and self._running < self.max_workers:
+                self._running += 1
+                probe = self._queue.popleft()
+                probe.start_time = time.time()
+                started.append(probe)
+        for probe in started:
+            thread = threading.Thread(target=self._run_probe, args=(probe,),
+                                      name="storlever-fs-usage")
+            thread.daemon = True
+            thread.start()
+
+    def _release(self, probe):
+        """release the slot of the probe, only once"""
+        with self.lock:
+            if probe.released:
+                return
+            probe.released = True
+            self._running -= 1
+        self._dispatch()
+
+    def _run_probe(self, probe):
+        try:
+            probe.result = statvfs_usage(probe.mount_point)
+        except EnvironmentError as e:
+            probe.error = e
+        with self.lock:
+            if self._probes.get(probe.mount_point) is probe:
+                del self._probes[probe.mount_point]
+            if probe.result is not None:
+                self._cache[probe.mount_point] = (time.time(), probe.result)
+        probe._event.set()
+        if probe.error is not None:
+            logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                       "Failed to get the usage of %s (%s)" %
+                       (probe.mount_point, str(probe.error)))
+        self._release(probe)
+
+    def _expire(self, probe):
+        """give the slot of the timed out probe to the others"""
+        if probe.done() or probe.released or probe.start_time is None or \
+                time.time() - probe.start_time < self.timeout:
+            return
+        logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                   "The usage of %s is not got in %s seconds, "
+                   "the filesystem may hang" % (probe.mount_point, self.timeout))
+        self._release(probe)
+
+    def get_usage_list(self, mount_points, timeout=None):
+        """
+        return a dict of mount point -> usage info of the mount points,
+        collected in parallel in at most timeout seconds. The usage of a
+        mount point which is timed out or failed is the last known one
+        with the field "stale" set, or zero if never got
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            probes = dict((mount_point, self._submit(mount_point))
+                          for mount_point in set(mount_points))
+        self._dispatch()
+
+        deadline = time.time() + timeout
+        for probe in probes.values():
+            # the probe already timed out is still hanging
+            if not probe.released:
+                probe.wait(max(0, deadline - time.time()))
+            self._expire(probe)
+
+        usages = {}
+        with self.lock:
+            for mount_point, probe in probes.items():
+                entry = self._cache.get(mount_point)
+                usage = empty_usage()
+                if entry is not None:
+                    usage.update(entry[1])
+                    usage["update_time"] = entry[0]
+                usage["stale"] = not probe.done() or probe.result is None
+                usages[mount_point] = usage
+        return usages
+
+    def get_usage(self, mount_point, timeout=None):
+        """return the usage info of the mount point, see get_usage_list()"""
+        return self.get_usage_list([mount_point], timeout)[mount_point]
+
+
+FsUsageManager = FsUsageManager()
+
+
+def fs_usage_mgr():
+    """return the global filesystem usage manager instance"""
+    return FsUsageManager
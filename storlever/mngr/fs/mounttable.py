@@ -0,0 +1,157 @@
+"""
+storlever.mngr.fs.mounttable
+~~~~~~~~~~~~~~~~
+
+This module implements the shared snapshot of the system mount table.
+
+The snapshot is parsed from /proc/self/mountinfo and indexed by
+(source, mount point) and by mount point, and it's shared by all the
+filesystem classes. The mountinfo file is kept open, the kernel marks it
+with POLLPRI when the mount table is changed, so it's re-read only after a
+mount or umount instead of on each query.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import select
+import collections
+
+from storlever.lib.lock import lock
+from storlever.mngr.block.blockmgr import _unescape_mount_path
+
+
+PROC_MOUNTINFO_FILE = "/proc/self/mountinfo"
+
+
+MountEntry = collections.namedtuple("MountEntry", (
+    "mount_id", "parent_id", "devno", "root", "mount_point",
+    "options", "fs_type", "source", "super_options"))
+
+
+def parse_mountinfo(content):
+    """return the MountEntry list of the mountinfo content in mount order"""
+    entries = []
+    for line in content.splitlines():
+        fields = line.split()
+        # the optional fields end with the separator "-"
+        try:
+            sep = fields.index("-", 6)
+        except ValueError:
+            continue
+        if len(fields) < sep + 3:
+            continue
+        maj_num, _, min_num = fields[2].partition(":")
+        try:
+            devno = (int(maj_num), int(min_num))
+            mount_id, parent_id = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        entries.append(MountEntry(
+            mount_id, parent_id, devno,
+            _unescape_mount_path(fields[3]),
+            _unescape_mount_path(fields[4]),
+            fields[5], fields[sep + 1],
+            _unescape_mount_path(fields[sep + 2]),
+            fields[sep + 3] if len(fields) > sep + 3 else ""))
+    return entries
+
+
+def _source_key(source):
+    return source.rstrip(" /")
+
+
+def _mount_point_key(mount_point):
+    return mount_point.strip()
+
+
+class MountSnapshot(object):
+    """the immutable indexed mount entries at a time"""
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self._by_mount_point = {}
+        self._by_source = {}
+        for entry in self.entries:
+            # the later mount on the same mount point covers the former one
+            self._by_mount_point[entry.mount_point] = entry
+            self._by_source[(_source_key(entry.source), entry.mount_point)] = entry
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, mount_point):
+        """return the entry on the top of the mount point, or None"""
+        return self._by_mount_point.get(_mount_point_key(mount_point))
+
+    def find(self, source, mount_point):
+        """return the entry of the source mounted on the mount point, or None"""
+        return self._by_source.get((_source_key(source),
+                                    _mount_point_key(mount_point)))
+
+    def is_mounted(self, source, mount_point):
+        return self.find(source, mount_point) is not None
+
+
+class MountTable(object):
+    """the mount table service which keeps the latest snapshot"""
+
+    def __init__(self, mountinfo_file=PROC_MOUNTINFO_FILE):
+        self.lock = lock()
+        self.mountinfo_file = mountinfo_file
+        self._fd = None
+        self._poller = None
+        self._snapshot = None
+
+    def invalidate(self):
+        """make the next query re-read the mount table"""
+        with self.lock:
+            self._snapshot = None
+
+    def _open(self):
+        """with lock"""
+        self._fd = os.open(self.mountinfo_file, os.O_RDONLY)
+        if hasattr(select, "poll"):
+            self._poller = select.poll()
+            self._poller.register(self._fd, select.POLLPRI)
+
+    def _changed(self):
+        """with lock, return whether the mount table is changed since read
+
+        The kernel clears the change mark of the file on poll, a change
+        after that is marked again, so no change is missed by the re-read.
+        """
+        if self._poller is None:
+            return True
+        return bool(self._poller.poll(0))
+
+    def _read(self):
+        """with lock"""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def snapshot(self):
+        """return the MountSnapshot of the current mount table"""
+        with self.lock:
+            if self._fd is None:
+                self._open()
+            elif self._snapshot is not None and not self._changed():
+                return self._snapshot
+            self._snapshot = MountSnapshot(parse_mountinfo(self._read()))
+            return self._snapshot
+
+
+MountTable = MountTable()
+
+
+def mount_table():
+    """return the global mount table instance"""
+    return MountTable
@@ -9,7 +9,7 @@ nfs filesystem class..
 
 """
 
-from storlever.lib.command import check_output
+from storlever.lib.command import check_output, COMMAND_TIMEOUT_STATUS
 from storlever.mngr.fs.fs import FileSystem
 from storlever.mngr.fs.fsmgr import FileSystemManager
 from storlever.lib.exception import StorLeverError, StorLeverCmdError
@@ -30,6 +30,8 @@ NFSSTAT_CMD = "/usr/sbin/nfsstat"
 
 class Nfs(FileSystem):
 
+    local = False
+
     @staticmethod
     def _get_nfs_transport_proto(mount_options):
         option_list =mount_options.split(",")
@@ -51,7 +53,9 @@ class Nfs(FileSystem):
                 if "nfs" in result:
                     return True
             except StorLeverCmdError as e:
-                if e.return_code == 1:
+                # the unreachable host is not available as well
+                if e.return_code == 1 or \
+                        e.http_status_code == COMMAND_TIMEOUT_STATUS:
                     pass
                 else:
                     raise
@@ -64,7 +68,8 @@ class Nfs(FileSystem):
                 result = check_output(cmd)
                 return True
             except StorLeverCmdError as e:
-                if e.return_code == 1:
+                if e.return_code == 1 or \
+                        e.http_status_code == COMMAND_TIMEOUT_STATUS:
                     pass
                 else:
                     raise
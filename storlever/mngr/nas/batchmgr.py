@@ -0,0 +1,137 @@
+"""
+storlever.mngr.nas.batchmgr
+~~~~~~~~~~~~~~~~
+
+This module implements the batch provisioning of NAS shares.
+
+A batch of create/update/delete operations on the SMB shares, NFS exports
+and FTP users is applied to the in-memory confs under the locks of all the
+involved managers. If any operation fails, nothing is changed. Otherwise
+each conf is saved and synced to the system conf file only once, and each
+service is reloaded at most once.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import logging
+
+from storlever.lib.command import check_output
+from storlever.lib.config import config_writer
+from storlever.lib.exception import StorLeverError
+from storlever.lib.schema import SchemaError
+from storlever.lib import logger
+from storlever.mngr.system.servicemgr import service_mgr
+from storlever.mngr.nas.ftpmgr import ftp_mgr
+from storlever.mngr.nas.nfsmgr import nfs_mgr
+from storlever.mngr.nas.smbmgr import smb_mgr
+
+
+EXPORTFS_CMD = "/usr/sbin/exportfs"
+
+NAS_BATCH_OPS = ("create", "update", "delete")
+
+# type -> (manager, name of create/update/delete method on the conf,
+#          the word used in the log)
+NAS_BATCH_TYPES = {
+    "ftp": (ftp_mgr, ("_add_user", "_set_user", "_del_user"), "ftp user"),
+    "nfs": (nfs_mgr, ("_append_export", "_set_export", "_del_export"), "NFS export"),
+    "smb": (smb_mgr, ("_add_share", "_set_share", "_del_share"), "Samba share"),
+}
+
+
+class NasBatchManager(object):
+    """apply a batch of operations on the NAS shares as a whole"""
+
+    def _check_operations(self, operations):
+        for index, operation in enumerate(operations):
+            if operation.get("op") not in NAS_BATCH_OPS:
+                raise StorLeverError("operation %d: op must be one of %s" %
+                                     (index, ", ".join(NAS_BATCH_OPS)), 400)
+            if operation.get("type") not in NAS_BATCH_TYPES:
+                raise StorLeverError("operation %d: type must be one of %s" %
+                                     (index, ", ".join(sorted(NAS_BATCH_TYPES))), 400)
+            if not operation.get("name"):
+                raise StorLeverError("operation %d: name is absent" % index, 400)
+
+    def _apply_operation(self, mgr, methods, conf, operation):
+        method = getattr(mgr, methods[NAS_BATCH_OPS.index(operation["op"])])
+        if operation["op"] == "delete":
+            method(conf, operation["name"])
+        else:
+            method(conf, operation["name"], **operation.get("conf", {}))
+
+    def _reload(self, types):
+        # the reload needs the system conf files on the disk
+        config_writer().flush()
+        if "nfs" in types:
+            check_output([EXPORTFS_CMD, "-r"])
+        if "smb" in types:
+            smb_service = service_mgr().get_service_by_name("smb")
+            if smb_service.get_state():
+                smb_service.reload()
+
+    def apply(self, operations, reload=False, operator="unkown"):
+        """
+        apply the operations in order, each is a dict of:
+
+        op: "create", "update" or "delete"
+        type: "smb" (share), "nfs" (export) or "ftp" (user)
+        name: name of the share, export or user
+        conf: the fields of the share, export or user for create/update,
+              the None value of update is ignored
+
+        All the operations are validated against the current confs first,
+        StorLeverError is raised with the index of the failed operation, and
+        nothing is changed in this case.
+
+        :param reload: reload the conf of the changed NFS/SMB services
+        """
+        self._check_operations(operations)
+        types = sorted(set(operation["type"] for operation in operations))
+        mgrs = dict((t, NAS_BATCH_TYPES[t][0]()) for t in types)
+
+        # always acquire the locks in the same order to avoid dead lock
+        locked = []
+        try:
+            for t in types:
+                mgrs[t].lock.acquire()
+                locked.append(mgrs[t])
+
+            confs = dict((t, mgrs[t]._load_conf()) for t in types)
+            for index, operation in enumerate(operations):
+                t = operation["type"]
+                try:
+                    self._apply_operation(mgrs[t], NAS_BATCH_TYPES[t][1],
+                                          confs[t], operation)
+                except StorLeverError as e:
+                    raise StorLeverError("operation %d: %s" % (index, str(e)),
+                                         e.http_status_code)
+                except (SchemaError, TypeError) as e:
+                    # like the unknown fields in conf
+                    raise StorLeverError("operation %d: %s" % (index, str(e)), 400)
+
+            for t in types:
+                mgrs[t]._save_conf(confs[t])
+                mgrs[t]._sync_to_system_conf(confs[t])
+        finally:
+            for mgr in reversed(locked):
+                mgr.lock.release()
+
+        for operation in operations:
+            logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
+                       "%s (%s) config is %sd in batch by operator(%s)" %
+                       (NAS_BATCH_TYPES[operation["type"]][2], operation["name"],
+                        operation["op"].rstrip("e"), operator))
+
+        if reload:
+            self._reload(types)
+
+
+NasBatchManager = NasBatchManager()
+
+
+def nas_batch_mgr():
+    """return the global NAS batch manager instance"""
+    return NasBatchManager
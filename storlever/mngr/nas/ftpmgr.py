@@ -13,7 +13,7 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.command import check_output, set_selinux_permissive
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
@@ -145,16 +145,16 @@ class FtpManager(object):
     def _load_conf(self):
         ftp_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             ftp_conf = \
-                Config.from_file(self.conf_file, self.ftp_conf_schema).conf
+                config_store().load(self.conf_file, self.ftp_conf_schema)
         else:
             ftp_conf = self.ftp_conf_schema.validate(ftp_conf)
         return ftp_conf
 
     def _save_conf(self, ftp_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, ftp_conf)
+        config_store().save(self.conf_file, ftp_conf)
 
     def _bool_to_yn(self, value):
         if value:
@@ -344,22 +344,45 @@ class FtpManager(object):
         }
         return result
 
+    def _add_user(self, ftp_conf, user_name, login_enable=False,
+                  chroot_enable=False):
+        """add the user conf into ftp_conf, nothing is saved"""
+        if user_name in ftp_conf["user_list"]:
+             raise StorLeverError("user_name(%s) already exists" % (user_name), 400)
+        try:
+            user_mgr().get_user_info_by_name(user_name)
+        except Exception as e:
+            raise StorLeverError("user (%s) not found in system" % (user_name), 400)
+
+        user_conf ={
+            "user_name": user_name,
+            "login_enable": login_enable,
+            "chroot_enable": chroot_enable
+        }
+        ftp_conf["user_list"][user_name] = user_conf
+
+    def _del_user(self, ftp_conf, user_name):
+        """delete the user conf from ftp_conf, nothing is saved"""
+        user_conf = ftp_conf["user_list"].get(user_name)
+        if user_conf is None:
+            raise StorLeverError("user_name(%s) not found" % (user_name), 404)
+        del ftp_conf["user_list"][user_name]
+
+    def _set_user(self, ftp_conf, user_name, login_enable=None,
+                  chroot_enable=None):
+        """update the user conf in ftp_conf, nothing is saved"""
+        user_conf = ftp_conf["user_list"].get(user_name)
+        if user_conf is None:
+            raise StorLeverError("user_name(%s) not found" % (user_name), 404)
+        if login_enable is not None:
+            user_conf["login_enable"] = login_enable
+        if chroot_enable is not None:
+            user_conf["chroot_enable"] = chroot_enable
+
     def add_user_conf(self, user_name, login_enable=False, chroot_enable=False, operator="unkown"):
         with self.lock:
             ftp_conf = self._load_conf()
-            if user_name in ftp_conf["user_list"]:
-                 raise StorLeverError("user_name(%s) already exists" % (user_name), 400)
-            try:
-                user_mgr().get_user_info_by_name(user_name)
-            except Exception as e:
-                raise StorLeverError("user (%s) not found in system" % (user_name), 400)
-
-            user_conf ={
-                "user_name": user_name,
-                "login_enable": login_enable,
-                "chroot_enable": chroot_enable
-            }
-            ftp_conf["user_list"][user_name] = user_conf
+            self._add_user(ftp_conf, user_name, login_enable, chroot_enable)
 
             # save new conf
             self._save_conf(ftp_conf)
@@ -372,10 +395,7 @@ class FtpManager(object):
     def del_user_conf(self, user_name, operator="unkown"):
         with self.lock:
             ftp_conf = self._load_conf()
-            user_conf = ftp_conf["user_list"].get(user_name)
-            if user_conf is None:
-                raise StorLeverError("user_name(%s) not found" % (user_name), 404)
-            del ftp_conf["user_list"][user_name]
+            self._del_user(ftp_conf, user_name)
 
             # save new conf
             self._save_conf(ftp_conf)
@@ -389,13 +409,7 @@ class FtpManager(object):
     def set_user_conf(self, user_name, login_enable=None, chroot_enable=None, operator="unkown"):
         with self.lock:
             ftp_conf = self._load_conf()
-            user_conf = ftp_conf["user_list"].get(user_name)
-            if user_conf is None:
-                raise StorLeverError("user_name(%s) not found" % (user_name), 404)
-            if login_enable is not None:
-                user_conf["login_enable"] = login_enable
-            if chroot_enable is not None:
-                user_conf["chroot_enable"] = chroot_enable
+            self._set_user(ftp_conf, user_name, login_enable, chroot_enable)
 
             # save new conf
             self._save_conf(ftp_conf)
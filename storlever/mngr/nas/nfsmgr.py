@@ -13,7 +13,7 @@ import os
 import os.path
 
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store, config_writer
 from storlever.lib.command import check_output, set_selinux_permissive
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
@@ -117,16 +117,16 @@ class NfsManager(object):
     def _load_conf(self):
         nfs_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             nfs_conf = \
-                Config.from_file(self.conf_file, self.nfs_conf_schema).conf
+                config_store().load(self.conf_file, self.nfs_conf_schema)
         else:
             nfs_conf = self.nfs_conf_schema.validate(nfs_conf)
         return nfs_conf
 
     def _save_conf(self, nfs_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, nfs_conf)
+        config_store().save(self.conf_file, nfs_conf)
 
     def _export_point_to_file_line(self, export_point):
 
@@ -150,31 +150,36 @@ class NfsManager(object):
             os.makedirs(NFS_ETC_CONF_DIR)
 
         nfs_sys_file = os.path.join(NFS_ETC_CONF_DIR, NFS_ETC_CONF_FILE)
-        if os.path.exists(nfs_sys_file):
-            with open(nfs_sys_file, "r") as f:
-                lines = f.readlines()
-        else:
-            lines = []
 
-        if "# begin storlever\n" in lines:
-            before_storlever = lines[0:lines.index("# begin storlever\n")]
-        else:
-            before_storlever = lines[0:]
-            if before_storlever and (not before_storlever[-1].endswith("\n")):
-                before_storlever[-1] += "\n"
+        def _render():
+            if os.path.exists(nfs_sys_file):
+                with open(nfs_sys_file, "r") as f:
+                    lines = f.readlines()
+            else:
+                lines = []
 
-        if "# end storlever\n" in lines:
-            after_storlever = lines[lines.index("# end storlever\n") + 1:]
-        else:
-            after_storlever = []
+            if "# begin storlever\n" in lines:
+                before_storlever = lines[0:lines.index("# begin storlever\n")]
+            else:
+                before_storlever = lines[0:]
+                if before_storlever and (not before_storlever[-1].endswith("\n")):
+                    before_storlever[-1] += "\n"
 
-        with open(nfs_sys_file, "w") as f:
-            f.writelines(before_storlever)
-            f.write("# begin storlever\n")
+            if "# end storlever\n" in lines:
+                after_storlever = lines[lines.index("# end storlever\n") + 1:]
+            else:
+                after_storlever = []
+
+            content = before_storlever[:]
+            content.append("# begin storlever\n")
             for export_point in nfs_conf["export_point_list"]:
-                f.write(self._export_point_to_file_line(export_point))
-            f.write("# end storlever\n")
-            f.writelines(after_storlever)
+                content.append(self._export_point_to_file_line(export_point))
+            content.append("# end storlever\n")
+            content.extend(after_storlever)
+            return "".join(content)
+
+        # rendered when it's written, so a burst of changes is written once
+        config_writer().write(nfs_sys_file, _render)
 
 
     def sync_to_system_conf(self):
@@ -214,8 +219,8 @@ class NfsManager(object):
             raise StorLeverError("export(%s) not found" % (name), 404)
 
 
-    def append_export_conf(self, name, path="/", clients=[], operator="unkown"):
-
+    def _append_export(self, nfs_conf, name, path="/", clients=[]):
+        """append the export point into nfs_conf, nothing is saved"""
         if path != "" and not os.path.exists(path):
              raise StorLeverError("path(%s) does not exists" % (path), 400)
 
@@ -226,17 +231,48 @@ class NfsManager(object):
         }
         new_export_point = self.export_point_conf_schema.validate(new_export_point)
 
-        with self.lock:
-            nfs_conf = self._load_conf()
+        # check duplication
+        for point in nfs_conf["export_point_list"]:
+            if path == point["path"]:
+                raise StorLeverError("export with path(%s) already in nfs export table" % (path), 400)
+            if name == point["name"]:
+                raise StorLeverError("export with name(%s) already in nfs export table" % (name), 400)
+
+        nfs_conf["export_point_list"].append(new_export_point)
+
+    def _del_export(self, nfs_conf, name):
+        """delete the export point from nfs_conf and return it, nothing is saved"""
+        for point in nfs_conf["export_point_list"]:
+            if name == point["name"]:
+                break
+        else:
+            raise StorLeverError("export(%s) not found" % (name), 404)
+
+        nfs_conf["export_point_list"].remove(point)
+        return point
+
+    def _set_export(self, nfs_conf, name, path=None, clients=None):
+        """update the export point in nfs_conf, nothing is saved"""
+        if path is not None and path != "" and not os.path.exists(path):
+             raise StorLeverError("path(%s) does not exists" % (path), 400)
+
+        for index, point in enumerate(nfs_conf["export_point_list"]):
+            if name == point["name"]:
+                break
+        else:
+            raise StorLeverError("export(%s) not found" % (name), 404)
 
-            # check duplication
-            for point in nfs_conf["export_point_list"]:
-                if path == point["path"]:
-                    raise StorLeverError("export with path(%s) already in nfs export table" % (path), 400)
-                if name == point["name"]:
-                    raise StorLeverError("export with name(%s) already in nfs export table" % (name), 400)
+        if path is not None:
+            point["path"] = path
+        if clients is not None:
+            point["clients"] = clients
 
-            nfs_conf["export_point_list"].append(new_export_point)
+        nfs_conf["export_point_list"][index] = self.export_point_conf_schema.validate(point)
+
+    def append_export_conf(self, name, path="/", clients=[], operator="unkown"):
+        with self.lock:
+            nfs_conf = self._load_conf()
+            self._append_export(nfs_conf, name, path, clients)
 
             # save new conf
             self._save_conf(nfs_conf)
@@ -249,13 +285,7 @@ class NfsManager(object):
     def del_export_conf(self, name, operator="unkown"):
         with self.lock:
             nfs_conf = self._load_conf()
-            for point in nfs_conf["export_point_list"]:
-                if name == point["name"]:
-                    break
-            else:
-                raise StorLeverError("export(%s) not found" % (name), 404)
-
-            nfs_conf["export_point_list"].remove(point)
+            point = self._del_export(nfs_conf, name)
 
             # save new conf
             self._save_conf(nfs_conf)
@@ -266,24 +296,9 @@ class NfsManager(object):
                    (point["path"], operator))
 
     def set_export_conf(self, name, path=None, clients=None, operator="unkown"):
-
-        if path is not None and path != "" and not os.path.exists(path):
-             raise StorLeverError("path(%s) does not exists" % (path), 400)
-
         with self.lock:
             nfs_conf = self._load_conf()
-            for index, point in enumerate(nfs_conf["export_point_list"]):
-                if name == point["name"]:
-                    break
-            else:
-                raise StorLeverError("export(%s) not found" % (name), 404)
-
-            if path is not None:
-                point["path"] = path
-            if clients is not None:
-                point["clients"] = clients
-
-            nfs_conf["export_point_list"][index] = self.export_point_conf_schema.validate(point)
+            self._set_export(nfs_conf, name, path, clients)
 
             # save new conf
             self._save_conf(nfs_conf)
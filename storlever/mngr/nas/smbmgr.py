@@ -11,9 +11,10 @@ This module implements samba server management.
 
 import os
 import os.path
+import re
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store, config_writer
 from storlever.lib.command import check_output, set_selinux_permissive
 from storlever.lib.exception import StorLeverError, StorLeverCmdError
 from storlever.lib import logger
@@ -25,7 +26,7 @@ from storlever.mngr.system.usermgr import user_mgr
 from storlever.lib.lock import lock
 from storlever.mngr.system.cfgmgr import STORLEVER_CONF_DIR, cfg_mgr
 from storlever.mngr.system.servicemgr import service_mgr
-from storlever.lib.confparse import properties, ini
+from storlever.lib.confparse import ini
 from storlever.mngr.system.modulemgr import ModuleManager
 
 MODULE_INFO = {
@@ -39,6 +40,19 @@ MODULE_INFO = {
 SMB_CONF_FILE_NAME = "smb_conf.yaml"
 SMB_ETC_CONF_DIR = "/etc/samba/"
 SMB_ETC_CONF_FILE = "smb.conf"
+# the global conf and the share list generated by storlever, which is
+# included by smb.conf
+SMB_ETC_STORLEVER_FILE = "storlever.conf"
+# directory of the generated conf file of each share
+SMB_ETC_SHARE_DIR = "storlever.d"
+
+# the keys of the global section written into smb.conf by the former
+# versions, which are generated into SMB_ETC_STORLEVER_FILE now
+SMB_GLOBAL_KEYS = (
+    "workgroup", "server string", "netbios name", "hosts allow", "security",
+    "passdb backend", "password server", "realm", "guest account",
+    "browseable",
+)
 SMBSTATUS_CMD = "/usr/bin/smbstatus"
 PDBEDIT_CMD = "/usr/bin/pdbedit"
 
@@ -194,20 +208,24 @@ class SmbManager(object):
         self.conf_file = os.path.join(STORLEVER_CONF_DIR, SMB_CONF_FILE_NAME)
         self.share_conf_schema = SHARE_CONF_SCHEMA
         self.smb_conf_schema = SMB_CONF_SCHEMA
+        # generated file -> content, None means to be read from the disk
+        self._etc_files = None
+        # whether smb.conf includes the storlever conf file
+        self._etc_conf_included = False
 
     def _load_conf(self):
         smb_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             smb_conf = \
-                Config.from_file(self.conf_file, self.smb_conf_schema).conf
+                config_store().load(self.conf_file, self.smb_conf_schema)
         else:
             smb_conf = self.smb_conf_schema.validate(smb_conf)
         return smb_conf
 
     def _save_conf(self, smb_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, smb_conf)
+        config_store().save(self.conf_file, smb_conf)
 
     def _bool_to_yn(self, value):
         if value:
@@ -215,117 +233,133 @@ class SmbManager(object):
         else:
             return "no"
 
-    def _sync_to_system_conf(self, smb_conf):
-
-        if not os.path.exists(SMB_ETC_CONF_DIR):
-            os.makedirs(SMB_ETC_CONF_DIR)
-
+    def _global_section(self, smb_conf):
+        lines = ["[global]\n"]
+        for key, value in (("workgroup", smb_conf["workgroup"]),
+                           ("server string", smb_conf["server_string"]),
+                           ("netbios name", smb_conf["netbios_name"]),
+                           ("hosts allow", smb_conf["hosts_allow"]),
+                           ("security", smb_conf["security"]),
+                           ("passdb backend", smb_conf["passdb_backend"]),
+                           ("password server", smb_conf["password_server"]),
+                           ("realm", smb_conf["realm"]),
+                           ("guest account", smb_conf["guest_account"]),
+                           ("browseable", self._bool_to_yn(smb_conf["browseable"]))):
+            if value != "":
+                lines.append("%s = %s\n" % (key, value))
+        return "".join(lines)
+
+    def _share_section(self, share_name, share_conf):
+        lines = ["[%s]\n" % share_name]
+        for key, value in (("path", share_conf["path"]),
+                           ("comment", share_conf["comment"]),
+                           ("create mask", "0%03o" % share_conf["create_mask"]),
+                           ("directory mask", "0%03o" % share_conf["directory_mask"]),
+                           ("guest ok", self._bool_to_yn(share_conf["guest_ok"])),
+                           ("read only", self._bool_to_yn(share_conf["read_only"])),
+                           ("browseable", self._bool_to_yn(share_conf["browseable"])),
+                           ("force create mode", "0%03o" % share_conf["force_create_mode"]),
+                           ("force directory mode", "0%03o" % share_conf["force_directory_mode"]),
+                           ("valid users", share_conf["valid_users"]),
+                           ("write list", share_conf["write_list"]),
+                           ("veto files", share_conf["veto_files"])):
+            if value != "":
+                lines.append("%s = %s\n" % (key, value))
+        return "".join(lines)
+
+    def _share_file(self, share_name):
+        # samba substitutes the %X in the include path, so escape by _XX,
+        # and "_" itself is escaped to keep the file names of shares unique
+        file_name = re.sub(r"[^A-Za-z0-9.-]", lambda mo: "_%02x" % ord(mo.group()),
+                           share_name)
+        return os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_SHARE_DIR,
+                            file_name + ".conf")
+
+    def _load_etc_files(self):
+        """read the generated files from the disk"""
+        self._etc_files = {}
+        file_names = [os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_STORLEVER_FILE)]
+        share_dir = os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_SHARE_DIR)
+        if os.path.isdir(share_dir):
+            file_names.extend(os.path.join(share_dir, name)
+                              for name in os.listdir(share_dir)
+                              if name.endswith(".conf"))
+        for file_name in file_names:
+            if os.path.isfile(file_name):
+                with open(file_name, "r") as f:
+                    self._etc_files[file_name] = f.read()
+
+    def _include_etc_conf(self):
+        """
+        make smb.conf include the storlever conf file at its end, the share
+        sections and global keys written by the former versions are removed
+        """
         smb_etc_conf_file = os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_CONF_FILE)
+        storlever_file = os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_STORLEVER_FILE)
+        include_line = "include = %s\n" % storlever_file
         if os.path.exists(smb_etc_conf_file):
-            smb_etc_conf = ini(smb_etc_conf_file)
-        else:
-            smb_etc_conf = ini()
-
-        smb_etc_conf.set_sep(True)
-
-        # global configs
-        if "global" not in smb_etc_conf:
-            smb_etc_conf["global"] = properties()
-            smb_etc_conf["global"].set_sep(True)
-
-        if smb_conf["workgroup"] == "":
-            smb_etc_conf["global"].delete("workgroup")
-        else:
-            smb_etc_conf["global"]["workgroup"] = smb_conf["workgroup"]
-
-        smb_etc_conf["global"]["server string"] = smb_conf["server_string"]
-
-        if smb_conf["netbios_name"] == "":
-            smb_etc_conf["global"].delete("netbios name")
-        else:
-            smb_etc_conf["global"]["netbios name"] = smb_conf["netbios_name"]
-
-        if smb_conf["hosts_allow"] == "":
-            smb_etc_conf["global"].delete("hosts allow")
-        else:
-            smb_etc_conf["global"]["hosts allow"] = smb_conf["hosts_allow"]
-
-        smb_etc_conf["global"]["security"] = smb_conf["security"]
-
-        if smb_conf["passdb_backend"] == "":
-            smb_etc_conf["global"].delete("passdb backend")
-        else:
-            smb_etc_conf["global"]["passdb backend"] = smb_conf["passdb_backend"]
-
-        if smb_conf["password_server"] == "":
-            smb_etc_conf["global"].delete("password server")
-        else:
-            smb_etc_conf["global"]["password server"] = smb_conf["password_server"]
-
-        if smb_conf["realm"] == "":
-            smb_etc_conf["global"].delete("realm")
-        else:
-            smb_etc_conf["global"]["realm"] = smb_conf["realm"]
-
-        if smb_conf["guest_account"] == "":
-            smb_etc_conf["global"].delete("guest account")
+            with open(smb_etc_conf_file, "r") as f:
+                lines = f.readlines()
         else:
-            smb_etc_conf["global"]["guest account"] = smb_conf["guest_account"]
+            lines = []
+
+        if include_line not in lines:
+            smb_etc_conf = ini(smb_etc_conf_file) if lines else ini()
+            smb_etc_conf.set_sep(True)
+            for section in smb_etc_conf.keys():
+                if section != "global":
+                    del smb_etc_conf[section]
+            if "global" in smb_etc_conf:
+                for key in SMB_GLOBAL_KEYS:
+                    smb_etc_conf["global"].delete(key)
+            content = repr(smb_etc_conf)
+            if content and not content.endswith("\n"):
+                content += "\n"
+            content += "# begin storlever\n" + include_line + "# end storlever\n"
+            config_writer().write(smb_etc_conf_file, lambda: content)
+
+        self._etc_conf_included = True
+
+    def _write_etc_file(self, file_name, content):
+        if self._etc_files.get(file_name) != content:
+            self._etc_files[file_name] = content
+            config_writer().write(file_name, lambda: content)
 
-        smb_etc_conf["global"]["browseable"] = self._bool_to_yn(smb_conf["browseable"])
+    def _sync_to_system_conf(self, smb_conf):
+        """
+        generate the global conf and each share into its own file, only the
+        files whose content changes are written
+        """
+
+        share_dir = os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_SHARE_DIR)
+        if not os.path.exists(share_dir):
+            os.makedirs(share_dir)
+        if self._etc_files is None:
+            self._load_etc_files()
+        if not self._etc_conf_included:
+            self._include_etc_conf()
 
         # for share configs
+        share_files = {}
         for share_name, share_conf in smb_conf["share_list"].items():
-            if share_name not in smb_etc_conf:
-                smb_etc_conf[share_name] = properties()
-                smb_etc_conf[share_name].set_sep(True)
-
-            if share_conf["path"] == "":
-                smb_etc_conf[share_name].delete("path")
-            else:
-                smb_etc_conf[share_name]["path"] = share_conf["path"]
-
-            if share_conf["comment"] == "":
-                smb_etc_conf[share_name].delete("comment")
-            else:
-                smb_etc_conf[share_name]["comment"] = share_conf["comment"]
-
-            smb_etc_conf[share_name]["create mask"] = "0%03o" % share_conf["create_mask"]
-
-            smb_etc_conf[share_name]["directory mask"] = "0%03o" % share_conf["directory_mask"]
-
-            smb_etc_conf[share_name]["guest ok"] = self._bool_to_yn(share_conf["guest_ok"])
-
-            smb_etc_conf[share_name]["read only"] = self._bool_to_yn(share_conf["read_only"])
-
-            smb_etc_conf[share_name]["browseable"] = self._bool_to_yn(share_conf["browseable"])
-
-            smb_etc_conf[share_name]["force create mode"] = "0%03o" % share_conf["force_create_mode"]
-
-            smb_etc_conf[share_name]["force directory mode"] = "0%03o" % share_conf["force_directory_mode"]
-
-            if share_conf["valid_users"] == "":
-                smb_etc_conf[share_name].delete("valid users")
-            else:
-                smb_etc_conf[share_name]["valid users"] = share_conf["valid_users"]
-
-            if share_conf["write_list"] == "":
-                smb_etc_conf[share_name].delete("write list")
-            else:
-                smb_etc_conf[share_name]["write list"] = share_conf["write_list"]
-
-            if share_conf["veto_files"] == "":
-                smb_etc_conf[share_name].delete("veto files")
-            else:
-                smb_etc_conf[share_name]["veto files"] = share_conf["veto_files"]
+            share_file = self._share_file(share_name)
+            share_files[share_file] = share_name
+            self._write_etc_file(share_file,
+                                 self._share_section(share_name, share_conf))
 
         # delete other shares
-        old_share_list = smb_etc_conf.keys()
-        for share_name in old_share_list:
-            if share_name != "global" and share_name not in smb_conf["share_list"]:
-                del smb_etc_conf[share_name]
-
-        smb_etc_conf.write()
+        for file_name in self._etc_files.keys():
+            if os.path.dirname(file_name) == share_dir and \
+                    file_name not in share_files:
+                del self._etc_files[file_name]
+                config_writer().remove(file_name)
+
+        # global configs and the share list
+        lines = [self._global_section(smb_conf)]
+        for share_file in sorted(share_files):
+            lines.append("include = %s\n" % share_file)
+        self._write_etc_file(os.path.join(SMB_ETC_CONF_DIR, SMB_ETC_STORLEVER_FILE),
+                             "".join(lines))
 
     def sync_to_system_conf(self):
         """sync the smb conf to /etc/samba/"""
@@ -334,6 +368,9 @@ class SmbManager(object):
             return  # if not conf file, don't change the system config
 
         with self.lock:
+            # the files may be restored, read them again
+            self._etc_files = None
+            self._etc_conf_included = False
             smb_conf = self._load_conf()
             self._sync_to_system_conf(smb_conf)
 
@@ -414,42 +451,66 @@ class SmbManager(object):
 
         return share_conf
 
-    def add_share_conf(self, share_name, path="", comment="",
-                       create_mask=0744, directory_mask=0755, guest_ok=False,
-                       read_only=True, browseable=True, force_create_mode=0,
-                       force_directory_mode=0, valid_users="", write_list="",
-                       veto_files="", operator="unkown"):
-
+    def _add_share(self, smb_conf, share_name, **share_conf):
+        """add the share conf into smb_conf, nothing is saved"""
+        path = share_conf.get("path", "")
         if path != "" and not os.path.exists(path):
             raise StorLeverError("path(%s) does not exists" % (path), 400)
         if share_name == "global":
             raise StorLeverError("share cannot named global",  400)
 
-        share_conf ={
-            "share_name": share_name,
-            "path": path,
-            "comment": comment,
-            "create_mask": create_mask,
-            "directory_mask": directory_mask,
-            "guest_ok": guest_ok,
-            "read_only": read_only,
-            "browseable": browseable,
-            "force_create_mode": force_create_mode,
-            "force_directory_mode": force_directory_mode,
-            "valid_users": valid_users,
-            "write_list": write_list,
-            "veto_files": veto_files
-        }
+        share_conf["share_name"] = share_name
         share_conf = self.share_conf_schema.validate(share_conf)
+        if share_name in smb_conf["share_list"]:
+             raise StorLeverError("share_name(%s) already exists" % (share_name), 400)
 
-        with self.lock:
-            smb_conf = self._load_conf()
-            if share_name in smb_conf["share_list"]:
-                 raise StorLeverError("share_name(%s) already exists" % (share_name), 400)
+        smb_conf["share_list"][share_name] = share_conf
+
+    def _del_share(self, smb_conf, share_name):
+        """delete the share conf from smb_conf, nothing is saved"""
+        share_conf = smb_conf["share_list"].get(share_name)
+        if share_conf is None:
+            raise StorLeverError("share_name(%s) not found" % (share_name), 404)
+        del smb_conf["share_list"][share_name]
+
+    def _set_share(self, smb_conf, share_name, **changes):
+        """update the share conf in smb_conf, the None value is ignored,
+        nothing is saved"""
+        path = changes.get("path")
+        if path is not None and path != "" and not os.path.exists(path):
+             raise StorLeverError("path(%s) does not exists" % (path), 400)
+
+        share_conf = smb_conf["share_list"].get(share_name)
+        if share_conf is None:
+            raise StorLeverError("share_conf(%s) not found" % (share_name), 404)
 
+        for name, value in changes.items():
+            if name != "share_name" and name in share_conf and value is not None:
+                share_conf[name] = value
+        smb_conf["share_list"][share_name] = \
+            self.share_conf_schema.validate(share_conf)
 
+    def add_share_conf(self, share_name, path="", comment="",
+                       create_mask=0744, directory_mask=0755, guest_ok=False,
+                       read_only=True, browseable=True, force_create_mode=0,
+                       force_directory_mode=0, valid_users="", write_list="",
+                       veto_files="", operator="unkown"):
 
-            smb_conf["share_list"][share_name] = share_conf
+        with self.lock:
+            smb_conf = self._load_conf()
+            self._add_share(smb_conf, share_name,
+                            path=path,
+                            comment=comment,
+                            create_mask=create_mask,
+                            directory_mask=directory_mask,
+                            guest_ok=guest_ok,
+                            read_only=read_only,
+                            browseable=browseable,
+                            force_create_mode=force_create_mode,
+                            force_directory_mode=force_directory_mode,
+                            valid_users=valid_users,
+                            write_list=write_list,
+                            veto_files=veto_files)
 
             # save new conf
             self._save_conf(smb_conf)
@@ -462,10 +523,7 @@ class SmbManager(object):
     def del_share_conf(self, share_name, operator="unkown"):
         with self.lock:
             smb_conf = self._load_conf()
-            share_conf = smb_conf["share_list"].get(share_name)
-            if share_conf is None:
-                raise StorLeverError("share_name(%s) not found" % (share_name), 404)
-            del smb_conf["share_list"][share_name]
+            self._del_share(smb_conf, share_name)
 
             # save new conf
             self._save_conf(smb_conf)
@@ -481,40 +539,21 @@ class SmbManager(object):
                        force_directory_mode=None, valid_users=None, write_list=None,
                        veto_files=None, operator="unkown"):
 
-        if path is not None and path != "" and not os.path.exists(path):
-             raise StorLeverError("path(%s) does not exists" % (path), 400)
-
         with self.lock:
             smb_conf = self._load_conf()
-            share_conf = smb_conf["share_list"].get(share_name)
-            if share_conf is None:
-                raise StorLeverError("share_conf(%s) not found" % (share_conf), 404)
-
-            if path is not None:
-                share_conf["path"] = path
-            if comment is not None:
-                share_conf["comment"] = comment
-            if create_mask is not None:
-                share_conf["create_mask"] = create_mask
-            if directory_mask is not None:
-                share_conf["directory_mask"] = directory_mask
-            if guest_ok is not None:
-                share_conf["guest_ok"] = guest_ok
-            if read_only is not None:
-                share_conf["read_only"] = read_only
-            if browseable is not None:
-                share_conf["browseable"] = browseable
-            if force_create_mode is not None:
-                share_conf["force_create_mode"] = force_create_mode
-            if force_directory_mode is not None:
-                share_conf["force_directory_mode"] = force_directory_mode
-            if valid_users is not None:
-                share_conf["valid_users"] = valid_users
-            if write_list is not None:
-                share_conf["write_list"] = write_list
-            if veto_files is not None:
-                share_conf["veto_files"] = veto_files
-
+            self._set_share(smb_conf, share_name,
+                            path=path,
+                            comment=comment,
+                            create_mask=create_mask,
+                            directory_mask=directory_mask,
+                            guest_ok=guest_ok,
+                            read_only=read_only,
+                            browseable=browseable,
+                            force_create_mode=force_create_mode,
+                            force_directory_mode=force_directory_mode,
+                            valid_users=valid_users,
+                            write_list=write_list,
+                            veto_files=veto_files)
 
             # save new conf
             self._save_conf(smb_conf)
@@ -15,6 +15,7 @@ import os.path
 from stat import *
 
 from storlever.lib.command import check_output
+from storlever.lib.config import config_writer
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 from storlever.lib.utils import filter_dict
@@ -32,6 +33,8 @@ class Target(object):
         self.mgr = mgr
 
     def _update_target(self):
+        # tgt-admin reads the conf files
+        config_writer().flush()
         try:
             check_output([TGTADMIN_CMD, "-f", "--update", self.iqn])
         except StorLeverError:
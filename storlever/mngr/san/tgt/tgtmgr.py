@@ -14,7 +14,7 @@ to output iscsi targets
 import os
 import os.path
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store, config_writer
 from storlever.lib.command import check_output, set_selinux_permissive
 from storlever.lib.exception import StorLeverError
 from storlever.lib.utils import filter_dict
@@ -149,16 +149,16 @@ class TgtManager(object):
     def _load_conf(self):
         tgt_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             tgt_conf = \
-                Config.from_file(self.conf_file, self.tgt_conf_schema).conf
+                config_store().load(self.conf_file, self.tgt_conf_schema)
         else:
             tgt_conf = self.tgt_conf_schema.validate(tgt_conf)
         return tgt_conf
 
     def _save_conf(self, tgt_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, tgt_conf)
+        config_store().save(self.conf_file, tgt_conf)
 
     def _get_target_conf(self, iqn):
         tgt_conf = self._load_conf()
@@ -241,50 +241,59 @@ class TgtManager(object):
 
         # write the etc storlever config
         storlever_file_name = os.path.join(TGT_ETC_CONF_DIR, TGT_ETC_STORLEVER_FILE)
-        with open(storlever_file_name, "w") as f:
+
+        def _render_storlever_conf():
+            content = []
             if tgt_conf["incomingdiscoveryuser"] != "":
-                f.write("incomingdiscoveryuser %s\n" %
-                        tgt_conf["incomingdiscoveryuser"].replace(":", " "))
+                content.append("incomingdiscoveryuser %s\n" %
+                               tgt_conf["incomingdiscoveryuser"].replace(":", " "))
 
             if tgt_conf["outgoingdiscoveryuser"] != "":
-                f.write("outgoingdiscoveryuser %s\n" %
-                        tgt_conf["outgoingdiscoveryuser"].replace(":", " "))
-            f.write("# target list\n")
+                content.append("outgoingdiscoveryuser %s\n" %
+                               tgt_conf["outgoingdiscoveryuser"].replace(":", " "))
+            content.append("# target list\n")
             for target_conf in tgt_conf["target_list"]:
-                f.write(self._target_conf_to_line(target_conf))
-            f.write("\n\n")
+                content.append(self._target_conf_to_line(target_conf))
+            content.append("\n\n")
+            return "".join(content)
 
         # add storlever config to ntp.conf
         file_name = os.path.join(TGT_ETC_CONF_DIR, TGT_ETC_CONF_FILE)
-        if os.path.exists(file_name):
-            with open(file_name, "r") as f:
-                lines = f.readlines()
-        else:
-            lines = []
 
-        # filter some line
-        lines = [line for line in lines
-                 if (not line.strip().startswith("incomingdiscoveryuser")) and
-                    (not line.strip().startswith("incomingdiscoveryuser"))]
+        def _render_conf():
+            if os.path.exists(file_name):
+                with open(file_name, "r") as f:
+                    lines = f.readlines()
+            else:
+                lines = []
 
-        if "# begin storlever\n" in lines:
-            before_storlever = lines[0:lines.index("# begin storlever\n")]
-        else:
-            before_storlever = lines[0:]
-            if before_storlever and (not before_storlever[-1].endswith("\n")):
-                before_storlever[-1] += "\n"
+            # filter some line
+            lines = [line for line in lines
+                     if (not line.strip().startswith("incomingdiscoveryuser")) and
+                        (not line.strip().startswith("incomingdiscoveryuser"))]
 
-        if "# end storlever\n" in lines:
-            after_storlever = lines[lines.index("# end storlever\n") + 1:]
-        else:
-            after_storlever = []
+            if "# begin storlever\n" in lines:
+                before_storlever = lines[0:lines.index("# begin storlever\n")]
+            else:
+                before_storlever = lines[0:]
+                if before_storlever and (not before_storlever[-1].endswith("\n")):
+                    before_storlever[-1] += "\n"
+
+            if "# end storlever\n" in lines:
+                after_storlever = lines[lines.index("# end storlever\n") + 1:]
+            else:
+                after_storlever = []
+
+            content = before_storlever[:]
+            content.append("# begin storlever\n")
+            content.append("include %s\n" % storlever_file_name)
+            content.append("# end storlever\n")
+            content.extend(after_storlever)
+            return "".join(content)
 
-        with open(file_name, "w") as f:
-            f.writelines(before_storlever)
-            f.write("# begin storlever\n")
-            f.write("include %s\n" % storlever_file_name)
-            f.write("# end storlever\n")
-            f.writelines(after_storlever)
+        # rendered when they're written, so a burst of changes is written once
+        config_writer().write(storlever_file_name, _render_storlever_conf)
+        config_writer().write(file_name, _render_conf)
 
     def sync_to_system_conf(self):
         """sync the smb conf to /etc/samba/"""
@@ -396,6 +405,8 @@ class TgtManager(object):
             self._save_conf(tgt_conf)
             self._sync_to_system_conf(tgt_conf)
 
+        # tgt-admin reads the conf files
+        config_writer().flush()
         try:
             check_output([TGTADMIN_CMD, "--execute"])
         except StorLeverError:
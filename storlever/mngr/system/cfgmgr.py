@@ -18,6 +18,7 @@ import tarfile
 import os
 
 from storlever.lib.exception import StorLeverError
+from storlever.lib.config import config_store, config_writer
 from storlever.lib import logger
 import logging
 from modulemgr import ModuleManager
@@ -114,6 +115,7 @@ class CfgManager(object):
             raise StorLeverError("File path (%s) does not exist" % os.path.dirname(filename), 400)
 
         self.check_conf_dir()     # make sure config dir exist
+        config_writer().flush()   # write the pending conf files
 
         tar_file = tarfile.open(filename, 'w:gz')
         for config_file in self.managed_config_files:
@@ -133,10 +135,13 @@ class CfgManager(object):
         if not tarfile.is_tarfile(filename):
             raise StorLeverError("File (%s) is not a config archive" % filename, 400)
 
+        # the pending writes must not overwrite the restored files
+        config_writer().flush()
         self._del_all_config_files()
         tar_file = tarfile.open(filename, 'r')
         tar_file.extractall("/")
         tar_file.close()
+        config_store().invalidate()
 
         # call the register callback function for restore config
         for callback in self.restore_from_file_cb:
@@ -162,11 +167,15 @@ class CfgManager(object):
 
     def system_restore(self, user="unkown"):
 
+        # the pending writes must not overwrite the restored files
+        config_writer().flush()
+
         # call the register callback function for system_restore
         for callback in self.system_restore_cb:
             callback()
 
         self._clear_conf_dir()
+        config_store().invalidate()
 
         # invoke the other module's interface to restore
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
@@ -0,0 +1,153 @@
+"""
+storlever.mngr.system.cpustat
+~~~~~~~~~~~~~~~~
+
+This module implements the CPU utilization service of storlever.
+
+A background thread keeps the recent snapshots of /proc/stat, so the CPU
+percentage over any interval up to CPU_STAT_RETENTION seconds is computed
+from the deltas instantly, instead of sleeping in the request thread.
+All the callers in the same sample period get the identical numbers.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import time
+import threading
+import collections
+import logging
+
+from storlever.lib import logger
+from storlever.lib.lock import lock
+from storlever.lib.exception import StorLeverError
+
+
+# seconds between two snapshots of /proc/stat
+CPU_STAT_SAMPLE_INTERVAL = 1
+
+# seconds the snapshots are kept, it's the max interval to compute
+CPU_STAT_RETENTION = 300
+
+
+def _parse_proc_stat(content):
+    """
+    parse the cpu lines of /proc/stat, return a tuple of the (busy, total)
+    jiffies of all CPUs and a list of (busy, total) for each CPU
+    """
+    all_cpu = (0, 0)
+    per_cpu = []
+    for line in content.splitlines():
+        if not line.startswith("cpu"):
+            continue
+        comps = line.split()
+        times = [int(value) for value in comps[1:]]
+        # user nice system idle iowait irq softirq steal guest guest_nice,
+        # guest time is already counted in user and nice
+        total = sum(times[:8])
+        busy = total - sum(times[3:5])
+        if comps[0] == "cpu":
+            all_cpu = (busy, total)
+        else:
+            per_cpu.append((busy, total))
+    return all_cpu, per_cpu
+
+
+def _percent(new, old):
+    busy = new[0] - old[0]
+    total = new[1] - old[1]
+    if total <= 0:
+        return 0.0
+    return round(min(100.0, max(0.0, 100.0 * busy / total)), 1)
+
+
+class CPUStat(object):
+    """CPU utilization service based on the cached /proc/stat snapshots"""
+
+    def __init__(self, root="/"):
+        self.root = root
+        self.lock = lock()
+        self.interval = CPU_STAT_SAMPLE_INTERVAL
+        self.retention = CPU_STAT_RETENTION
+        # list of (timestamp, all cpu, per cpu list)
+        self._snapshots = collections.deque()
+        self._thread = None
+
+    def sample(self, now=None):
+        """take a snapshot of /proc/stat"""
+        if now is None:
+            now = time.time()
+        with open(os.path.join(self.root, "proc/stat"), "r") as f:
+            all_cpu, per_cpu = _parse_proc_stat(f.read())
+        with self.lock:
+            self._snapshots.append((now, all_cpu, per_cpu))
+            while len(self._snapshots) > 1 and \
+                    now - self._snapshots[0][0] > self.retention + self.interval:
+                self._snapshots.popleft()
+
+    def start(self):
+        """start the sampler thread if it's not running"""
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name="storlever-cpustat")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to sample /proc/stat", exc_info=True)
+            time.sleep(self.interval)
+
+    def percent(self, interval=1.0, percpu=False):
+        """
+        return the CPU utilization percentage over the last interval seconds,
+        or a list of percentage for each CPU if percpu is True.
+
+        It's computed between the latest snapshot and the snapshot taken
+        interval seconds before, the interval is limited by the retention.
+        Before two snapshots are available, the average since boot is
+        returned.
+        """
+        if interval < 0:
+            raise StorLeverError("interval must not be negative", 400)
+        if self._thread is None:
+            self.start()
+        with self.lock:
+            snapshots = list(self._snapshots)
+        if not snapshots:
+            # no snapshot is taken by the thread yet
+            self.sample()
+            with self.lock:
+                snapshots = list(self._snapshots)
+
+        latest = snapshots[-1]
+        if len(snapshots) == 1:
+            base = (0, (0, 0), [(0, 0)] * len(latest[2]))
+        else:
+            base = snapshots[0]
+            target = latest[0] - interval
+            for snapshot in reversed(snapshots[:-1]):
+                if snapshot[0] <= target:
+                    base = snapshot
+                    break
+
+        if percpu:
+            return [_percent(new, old) for new, old in zip(latest[2], base[2])]
+        else:
+            return _percent(latest[1], base[1])
+
+
+CPUStat = CPUStat()
+
+
+def cpu_stat_mgr():
+    """return the global CPU utilization service"""
+    return CPUStat
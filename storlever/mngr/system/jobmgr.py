@@ -0,0 +1,447 @@
+"""
+storlever.mngr.system.jobmgr
+~~~~~~~~~~~~~~~~
+
+This module implements the background jobs of storlever.
+
+The long-running storage operations, like mkfs on a large LUN or pvmove,
+are submitted as jobs instead of running in the REST request. At most
+JOB_MAX_WORKERS jobs run at the same time, the others wait in the queue.
+The progress of a job is parsed from the output of the commands it runs,
+and a job can be cancelled, which kills its running command.
+
+The jobs are saved to the state file when their state changes, so the
+outcome of a job survives the restart of storlever. A job still pending
+or running at the restart is resumed if its type has a resume function,
+like pvmove which goes on in kernel, otherwise it's marked as failed. At
+most JOB_HISTORY_SIZE finished jobs are kept.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+import collections
+
+from storlever.lib import logger
+from storlever.lib.lock import lock
+from storlever.lib.command import CommandScope
+from storlever.lib.config import config_store, config_writer, dump_yaml, \
+    ConfigError
+from storlever.lib.exception import StorLeverError
+
+
+# max number of the jobs running at the same time
+JOB_MAX_WORKERS = 4
+
+# max number of the finished jobs kept in the history
+JOB_HISTORY_SIZE = 100
+
+JOB_STATE_FILE = "/var/lib/storlever/jobs.yaml"
+
+JOB_STATE_PENDING = "pending"
+JOB_STATE_RUNNING = "running"
+JOB_STATE_SUCCEEDED = "succeeded"
+JOB_STATE_FAILED = "failed"
+JOB_STATE_CANCELLED = "cancelled"
+
+JOB_FINISHED_STATES = (JOB_STATE_SUCCEEDED, JOB_STATE_FAILED,
+                       JOB_STATE_CANCELLED)
+
+JOB_FIELDS = ("id", "type", "description", "state", "progress",
+              "progress_info", "create_time", "start_time", "end_time",
+              "error", "operator", "params")
+
+# max length of the progress info kept from the output
+JOB_PROGRESS_INFO_SIZE = 256
+
+_PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+_FRACTION = re.compile(r"(\d+)\s*/\s*(\d+)")
+_DD_BYTES = re.compile(r"^(\d+) bytes")
+_BACKSPACES = re.compile(r"\x08+")
+
+# the job run by the current thread
+_current = threading.local()
+
+
+def report_progress(progress, info=None):
+    """
+    report the percent of progress of the job run by the current thread,
+    for the operation whose progress is not printed by its commands
+    """
+    job = getattr(_current, "job", None)
+    if job is None:
+        return
+    job.progress = min(float(progress), 100.0)
+    if info:
+        job.progress_info = info[-JOB_PROGRESS_INFO_SIZE:]
+
+
+def parse_progress(line):
+    """
+    return the percent of progress in the output line, or None.
+
+    It's the last percent in the line, like "/dev/sdb: Moved: 42.5%" of
+    pvmove, or the last fraction, like "Writing inode tables: 12/800" of
+    mkfs.ext4
+    """
+    percents = _PERCENT.findall(line)
+    if percents:
+        return min(float(percents[-1]), 100.0)
+    fractions = _FRACTION.findall(line)
+    if fractions:
+        done, total = fractions[-1]
+        if int(total) > 0:
+            return min(100.0 * int(done) / int(total), 100.0)
+    return None
+
+
+class DDProgress(object):
+    """
+    progress parser of the dd commands writing total bytes in all. The
+    bytes copied are reported by dd at the end, after "records out"
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.copied = 0
+        self._summary = False
+
+    def __call__(self, line):
+        if "records out" in line:
+            self._summary = True
+            return None
+        match = _DD_BYTES.match(line)
+        if match is None or self.total <= 0:
+            return None
+        copied = int(match.group(1))
+        if self._summary:
+            # finished, the following dd starts from 0
+            self._summary = False
+            self.copied += copied
+            copied = 0
+        return min(100.0 * (self.copied + copied) / self.total, 100.0)
+
+
+class Job(object):
+    """a background job"""
+
+    def __init__(self, job_type, fun=None, args=(), kwargs=None,
+                 description="", progress=None, on_cancel=None,
+                 operator="unknown", params=None):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.description = description
+        self.state = JOB_STATE_PENDING
+        self.progress = None
+        self.progress_info = ""
+        self.create_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self.operator = operator
+        self.params = params
+
+        self.fun = fun
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.progress_parser = progress or parse_progress
+        self.on_cancel = on_cancel
+        self.cancelling = False
+        self.scope = CommandScope(on_output=self._on_output, timeout=0)
+        self._event = threading.Event()
+
+    def _on_output(self, line):
+        info = _BACKSPACES.sub(" ", line).strip()
+        if info:
+            self.progress_info = info[-JOB_PROGRESS_INFO_SIZE:]
+        progress = self.progress_parser(line)
+        if progress is not None:
+            self.progress = progress
+
+    def is_finished(self):
+        return self.state in JOB_FINISHED_STATES
+
+    def wait(self, timeout=None):
+        """wait for the job to finish, return whether it's finished"""
+        self._event.wait(timeout)
+        return self.is_finished()
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in JOB_FIELDS)
+
+    @classmethod
+    def from_dict(cls, info):
+        job = cls(info.get("type", ""))
+        for field in JOB_FIELDS:
+            if field in info:
+                setattr(job, field, info[field])
+        if job.is_finished():
+            job._event.set()
+        return job
+
+
+class JobManager(object):
+    """run the background jobs with bounded concurrency"""
+
+    def __init__(self, max_workers=JOB_MAX_WORKERS, state_file=JOB_STATE_FILE,
+                 history_size=JOB_HISTORY_SIZE):
+        self.lock = lock()
+        self.max_workers = max_workers
+        self.state_file = state_file
+        self.history_size = history_size
+        # job id -> job, and the job ids in the order of creation
+        self._jobs = {}
+        self._order = []
+        self._queue = collections.deque()
+        self._running = 0
+        self._loaded = False
+        # job type -> function to resume the job after a restart
+        self._resumes = {}
+
+    def register_resume(self, job_type, resume):
+        """
+        register the function to resume the jobs of the type still pending
+        or running at the restart of storlever. It's called with the params
+        of the job and whether the job was running, and returns
+        (fun, on_cancel) to run as the job again, like waiting for the
+        operation going on in kernel
+        """
+        with self.lock:
+            self._resumes[job_type] = resume
+
+    def load(self):
+        """load the jobs of the former run, and start the resumed ones"""
+        with self.lock:
+            self._load()
+        self._dispatch()
+
+    def _load(self):
+        """load the jobs of the former run from the state file, with lock"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if not config_store().exists(self.state_file):
+                return
+            jobs = config_store().load(self.state_file) or []
+        except ConfigError as e:
+            logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                       "Failed to load job state file %s (%s)" %
+                       (self.state_file, str(e)))
+            return
+
+        interrupted = False
+        for info in jobs:
+            job = Job.from_dict(info)
+            if not job.is_finished():
+                self._resume(job)
+                interrupted = True
+            self._jobs[job.id] = job
+            self._order.append(job.id)
+        if interrupted:
+            self._save()
+
+    def _resume(self, job):
+        """queue the interrupted job again or mark it as failed, with lock"""
+        resume = self._resumes.get(job.type)
+        if resume is not None:
+            try:
+                job.fun, job.on_cancel = resume(job.params or {},
+                                                job.state == JOB_STATE_RUNNING)
+                job.state = JOB_STATE_PENDING
+                self._queue.append(job)
+                logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
+                           "Job %s (%s) is resumed after the restart" %
+                           (job.id, job.description or job.type))
+                return
+            except Exception as e:
+                logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                           "Failed to resume job %s (%s)" % (job.id, str(e)))
+        job.state = JOB_STATE_FAILED
+        job.error = "interrupted by the restart of storlever"
+        job.end_time = time.time()
+        job._event.set()
+
+    def _save(self):
+        """schedule to write the state file, with lock"""
+        jobs = [self._jobs[job_id].to_dict() for job_id in self._order]
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir, 0700)
+        config_writer().write(self.state_file, lambda: dump_yaml(jobs), 0600)
+
+    def _trim_history(self):
+        """drop the oldest finished jobs beyond the history size, with lock"""
+        finished = [job_id for job_id in self._order
+                    if self._jobs[job_id].is_finished()]
+        for job_id in finished[:max(len(finished) - self.history_size, 0)]:
+            del self._jobs[job_id]
+            self._order.remove(job_id)
+
+    def _get_job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise StorLeverError("job (%s) Not Found" % job_id, 404)
+        return job
+
+    def submit(self, job_type, fun, args=(), kwargs=None, description="",
+               progress=None, on_cancel=None, operator="unknown", params=None):
+        """
+        submit fun(*args, **kwargs) to run as a background job, return the
+        job id.
+
+        :param job_type: the kind of the job, like "mkfs"
+        :param progress: function of an output line of the job's commands,
+                         return the percent of progress or None, default to
+                         parse_progress
+        :param on_cancel: called after the running commands of the job are
+                          killed when it's cancelled, like to abort the
+                          operation going on in kernel
+        :param params: the dict saved with the job to resume it after a
+                       restart, see register_resume()
+        """
+        job = Job(job_type, fun, args, kwargs, description, progress,
+                  on_cancel, operator, params)
+        with self.lock:
+            self._load()
+            self._jobs[job.id] = job
+            self._order.append(job.id)
+            self._queue.append(job)
+            self._save()
+        logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
+                   "Job %s (%s) is submitted by operator(%s)" %
+                   (job.id, description or job_type, operator))
+        self._dispatch()
+        return job.id
+
+    def get_job(self, job_id):
+        """return the info dict of the job"""
+        with self.lock:
+            self._load()
+            return self._get_job(job_id).to_dict()
+
+    def get_job_list(self, state=None, job_type=None):
+        """return the info dicts of the jobs in the order of creation"""
+        with self.lock:
+            self._load()
+            jobs = [self._jobs[job_id] for job_id in self._order]
+        return [job.to_dict() for job in jobs
+                if (state is None or job.state == state) and
+                (job_type is None or job.type == job_type)]
+
+    def wait(self, job_id, timeout=None):
+        """wait for the job to finish, return whether it's finished"""
+        with self.lock:
+            self._load()
+            job = self._get_job(job_id)
+        return job.wait(timeout)
+
+    def cancel(self, job_id, operator="unknown"):
+        """
+        cancel the pending or running job. The running commands of the job
+        are killed, and the job is cancelled when its function returns
+        """
+        with self.lock:
+            self._load()
+            job = self._get_job(job_id)
+            if job.is_finished():
+                raise StorLeverError("job (%s) is already %s" %
+                                     (job_id, job.state), 400)
+            job.cancelling = True
+            if job in self._queue:
+                self._queue.remove(job)
+                self._finish(job, JOB_STATE_CANCELLED)
+                running = False
+            else:
+                running = True
+        if running:
+            job.scope.cancel()
+            if job.on_cancel is not None:
+                try:
+                    job.on_cancel()
+                except Exception as e:
+                    logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                               "Failed to abort job %s (%s)" % (job_id, str(e)))
+        logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
+                   "Job %s (%s) is cancelled by operator(%s)" %
+                   (job_id, job.description or job.type, operator))
+
+    def delete(self, job_id):
+        """remove the finished job from the history"""
+        with self.lock:
+            self._load()
+            job = self._get_job(job_id)
+            if not job.is_finished():
+                raise StorLeverError("job (%s) is still %s" %
+                                     (job_id, job.state), 400)
+            del self._jobs[job_id]
+            self._order.remove(job_id)
+            self._save()
+
+    def _finish(self, job, state, error=None):
+        """with lock"""
+        job.state = state
+        job.error = error
+        job.end_time = time.time()
+        if state == JOB_STATE_SUCCEEDED:
+            job.progress = 100.0
+        # release the references to the operation
+        job.fun = job.args = job.kwargs = job.on_cancel = None
+        job._event.set()
+        self._trim_history()
+        self._save()
+
+    def _dispatch(self):
+        """start the queued jobs while there are free workers"""
+        started = []
+        with self.lock:
+            while self._queue and self._running < self.max_workers:
+                self._running += 1
+                job = self._queue.popleft()
+                job.state = JOB_STATE_RUNNING
+                # the resumed job keeps its start time
+                job.start_time = job.start_time or time.time()
+                started.append(job)
+            if started:
+                self._save()
+        for job in started:
+            thread = threading.Thread(target=self._run_job, args=(job,),
+                                      name="storlever-job")
+            thread.daemon = True
+            thread.start()
+
+    def _run_job(self, job):
+        state, error = JOB_STATE_SUCCEEDED, None
+        _current.job = job
+        try:
+            with job.scope:
+                job.fun(*job.args, **job.kwargs)
+        except Exception as e:
+            if job.cancelling:
+                state = JOB_STATE_CANCELLED
+            else:
+                state, error = JOB_STATE_FAILED, str(e)
+            logger.log(logging.ERROR, logger.LOG_TYPE_ERROR,
+                       "Job %s (%s) is %s (%s)" %
+                       (job.id, job.description or job.type, state, str(e)))
+        finally:
+            _current.job = None
+        with self.lock:
+            self._running -= 1
+            self._finish(job, state, error)
+        self._dispatch()
+
+
+JobManager = JobManager()
+
+
+def job_mgr():
+    """return the global job manager instance"""
+    return JobManager
@@ -0,0 +1,229 @@
+"""
+storlever.mngr.system.metrics
+~~~~~~~~~~~~~~~~
+
+This module implements the time-series metrics collector of storlever.
+
+A background thread samples CPU, memory, per-disk and per-NIC counters at
+a fixed interval and records them into fixed-size ring buffers with
+several retention tiers, so the statistics graphs can load their history
+in one request.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import time
+import array
+import fnmatch
+import threading
+import logging
+
+import psutil
+
+from storlever.lib import logger
+from storlever.lib.lock import lock
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.system.cpustat import cpu_stat_mgr
+
+
+# seconds between two samples
+METRICS_SAMPLE_INTERVAL = 1
+
+# retention tiers of (resolution in seconds, number of points)
+METRICS_TIERS = (
+    (1, 600),       # 10 minutes
+    (10, 720),      # 2 hours
+    (60, 1440),     # 24 hours
+)
+
+DISK_COUNTERS = ("read_count", "write_count", "read_bytes", "write_bytes")
+NET_COUNTERS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv")
+
+
+class RingBuffer(object):
+    """fixed-size ring buffer of (time, value) points backed by arrays"""
+
+    def __init__(self, size):
+        self.size = size
+        self.times = array.array('d', [0.0]) * size
+        self.values = array.array('d', [0.0]) * size
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, timestamp, value):
+        index = self.count % self.size
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+
+    def since(self, timestamp):
+        """return the points after the given time as a list of [time, value]"""
+        # points are appended in time order, so binary search it
+        low, high = self.count - len(self), self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.times[mid % self.size] > timestamp:
+                high = mid
+            else:
+                low = mid + 1
+        return [[self.times[i % self.size], self.values[i % self.size]]
+                for i in xrange(low, self.count)]
+
+
+class _Series(object):
+    """one metric with a ring buffer for each retention tier"""
+
+    def __init__(self):
+        self.tiers = [RingBuffer(size) for _, size in METRICS_TIERS]
+        # the bucket, sum and number of values not recorded in each tier yet
+        self.pending = [[None, 0.0, 0] for _ in METRICS_TIERS]
+
+    def add(self, timestamp, value):
+        for (resolution, _), tier, pending in \
+                zip(METRICS_TIERS, self.tiers, self.pending):
+            bucket = int(timestamp // resolution)
+            if pending[0] is not None and pending[0] != bucket and pending[2]:
+                # the average of a finished bucket is recorded at its start time
+                tier.append(pending[0] * resolution, pending[1] / pending[2])
+                pending[1], pending[2] = 0.0, 0
+            pending[0] = bucket
+            pending[1] += value
+            pending[2] += 1
+
+
+class MetricsCollector(object):
+    """sample the system counters in background and keep their history"""
+
+    def __init__(self):
+        self.lock = lock()
+        self.interval = METRICS_SAMPLE_INTERVAL
+        self.series = {}
+        self._thread = None
+        self._last_time = None
+        self._last_counters = {}
+
+    def _add(self, timestamp, name, value):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = _Series()
+        series.add(timestamp, value)
+
+    def _add_rate(self, timestamp, name, counter, elapsed):
+        last = self._last_counters.get(name)
+        self._last_counters[name] = counter
+        # skip the first sample and the counter wraps/resets
+        if last is not None and elapsed > 0 and counter >= last:
+            self._add(timestamp, name, (counter - last) / elapsed)
+
+    def sample(self, now=None):
+        """sample all the counters once and record them"""
+        if now is None:
+            now = time.time()
+        cpu_percent = cpu_stat_mgr().percent(self.interval)
+        memory = psutil.virtual_memory()
+        disk_counters = psutil.disk_io_counters(perdisk=True)
+        net_counters = psutil.net_io_counters(pernic=True)
+
+        with self.lock:
+            elapsed = now - self._last_time if self._last_time is not None else 0
+            self._last_time = now
+
+            self._add(now, "cpu.percent", cpu_percent)
+            self._add(now, "memory.percent", memory.percent)
+            self._add(now, "memory.used", memory.used)
+
+            for disk_name, counters in disk_counters.iteritems():
+                for field in DISK_COUNTERS:
+                    self._add_rate(now, "disk.%s.%s" % (disk_name, field),
+                                   getattr(counters, field), elapsed)
+            for nic_name, counters in net_counters.iteritems():
+                for field in NET_COUNTERS:
+                    self._add_rate(now, "net.%s.%s" % (nic_name, field),
+                                   getattr(counters, field), elapsed)
+
+    def start(self, interval=None):
+        """start the sampler thread"""
+        if interval is not None:
+            if interval <= 0:
+                raise StorLeverError("metrics interval must be positive", 400)
+            self.interval = interval
+        with self.lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name="storlever-metrics")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def is_running(self):
+        return self._thread is not None
+
+    def _run(self):
+        next_time = time.time()
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.log(logging.WARNING, logger.LOG_TYPE_ERROR,
+                           "Failed to sample the metrics", exc_info=True)
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay < 0:
+                # too slow, skip the missed samples
+                next_time = time.time()
+                delay = 0
+            time.sleep(delay)
+
+    def series_names(self):
+        with self.lock:
+            return sorted(self.series.keys())
+
+    def query(self, patterns=None, since=None, resolution=None):
+        """
+        return the history of the series matching the given patterns
+
+        :param patterns: list of series names, shell-style wildcards are
+                         supported, like "disk.sda.*". None means all
+        :param since: return the points after this timestamp, default to
+                      the retention of the selected tier
+        :param resolution: resolution of the tier in seconds, default to the
+                           finest tier which retains the points since "since"
+        return a dict with "resolution" and "series" (name to [time, value] list)
+        """
+        now = time.time()
+        tier_index = None
+        for index, (tier_resolution, size) in enumerate(METRICS_TIERS):
+            if resolution is not None:
+                if tier_resolution == resolution:
+                    tier_index = index
+                    break
+            elif since is None or now - since <= tier_resolution * size \
+                    or index == len(METRICS_TIERS) - 1:
+                tier_index = index
+                break
+        if tier_index is None:
+            raise StorLeverError("resolution must be one of %s" %
+                                 ", ".join(str(r) for r, _ in METRICS_TIERS), 400)
+        if since is None:
+            since = 0
+
+        result = {}
+        with self.lock:
+            for name, series in self.series.iteritems():
+                if patterns is not None and \
+                        not any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                    continue
+                result[name] = series.tiers[tier_index].since(since)
+        return {"resolution": METRICS_TIERS[tier_index][0], "series": result}
+
+
+MetricsCollector = MetricsCollector()
+
+
+def metrics_mgr():
+    """return the global metrics collector instance"""
+    return MetricsCollector
@@ -0,0 +1,349 @@
+"""
+storlever.mngr.system.procmgr
+~~~~~~~~~~~~~~~~
+
+This module implements the process listing of storlever.
+
+The process information is read from /proc directly. Only the /proc files
+which supply the requested fields (and the fields used for filtering and
+sorting) are read for each process, and the rows are generated lazily
+unless they need to be sorted.
+
+The CPU and IO rates of each process are computed against its previous
+sample, which is kept per pid and create time.
+
+:copyright: (c) 2014 by OpenSight (www.opensight.cn).
+:license: AGPLv3, see LICENSE for more details.
+
+"""
+
+import os
+import pwd
+import time
+import errno
+import heapq
+import fnmatch
+import itertools
+
+from storlever.lib.lock import lock
+from storlever.lib.exception import StorLeverError
+
+
+# the /proc file supplying each field, None means no file is read
+PROC_FIELDS = {
+    'pid': None,
+    'current_time': None,
+    'ppid': 'stat',
+    'name': 'stat',
+    'nice': 'stat',
+    'status': 'stat',
+    'create_time': 'stat',
+    'user_time': 'stat',
+    'system_time': 'stat',
+    'vms': 'stat',
+    'rss': 'stat',
+    'memory_percent': 'stat',
+    'cmdline': 'cmdline',
+    'user': 'owner',
+    'read_count': 'io',
+    'write_count': 'io',
+    'read_bytes': 'io',
+    'write_bytes': 'io',
+    'cpu_rate': 'rate',
+    'read_bps': 'rate',
+    'write_bps': 'rate',
+}
+
+# the fields of each process returned by default
+DEFAULT_PROC_FIELDS = (
+    'pid', 'ppid', 'name', 'cmdline', 'nice', 'status', 'current_time',
+    'create_time', 'user_time', 'system_time', 'vms', 'rss',
+    'memory_percent', 'read_count', 'write_count', 'read_bytes',
+    'write_bytes', 'cpu_rate', 'read_bps', 'write_bps'
+)
+
+# the fields summed up as the key of each sort order, in descending order
+PROC_SORT_KEYS = {
+    'cpu': ('user_time', 'system_time'),
+    'rss': ('rss', ),
+    'io': ('read_bytes', 'write_bytes'),
+    'cpu_rate': ('cpu_rate', ),
+    'io_rate': ('read_bps', 'write_bps'),
+}
+
+# the previous sample of a process is replaced only after this seconds,
+# so the rates of the concurrent callers are not computed in a tiny interval
+PROC_RATE_MIN_INTERVAL = 1
+
+# seconds the previous sample of a process is kept without being updated
+PROC_RATE_SAMPLE_TTL = 600
+
+PROC_STATUS = {
+    'R': 'running',
+    'S': 'sleeping',
+    'D': 'disk-sleep',
+    'T': 'stopped',
+    't': 'tracing-stop',
+    'Z': 'zombie',
+    'X': 'dead',
+    'x': 'dead',
+    'K': 'wake-kill',
+    'W': 'waking',
+    'P': 'parked',
+    'I': 'idle',
+}
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class _ProcessGone(Exception):
+    pass
+
+
+class ProcManager(object):
+    """list the processes from /proc"""
+
+    def __init__(self, root="/"):
+        self.root = root
+        self._boot_time = None
+        self._user_names = {}
+        self._samples_lock = lock()
+        # pid -> (create_time, sample time, cpu time, read bytes, write bytes)
+        self._samples = {}
+
+    def _path(self, *paths):
+        return os.path.join(self.root, "proc", *paths)
+
+    def _read_file(self, pid, name):
+        try:
+            with open(self._path(str(pid), name), "r") as f:
+                return f.read()
+        except (IOError, OSError) as e:
+            if e.errno in (errno.ENOENT, errno.ESRCH):
+                raise _ProcessGone()
+            # like /proc/<pid>/io of other users' processes
+            return None
+
+    def boot_time(self):
+        if self._boot_time is None:
+            with open(self._path("stat"), "r") as f:
+                for line in f:
+                    if line.startswith("btime"):
+                        self._boot_time = float(line.split()[1])
+                        break
+                else:
+                    self._boot_time = 0.0
+        return self._boot_time
+
+    def _mem_total(self):
+        with open(self._path("meminfo"), "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _user_name(self, uid):
+        name = self._user_names.get(uid)
+        if name is None:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = str(uid)
+            self._user_names[uid] = name
+        return name
+
+    def _read_stat(self, pid, proc, mem_total):
+        content = self._read_file(pid, "stat")
+        if content is None:
+            return
+        # name may contain spaces and parenthesis
+        name = content[content.find("(") + 1:content.rfind(")")]
+        comps = content[content.rfind(")") + 2:].split()
+        rss = int(comps[21]) * PAGE_SIZE
+        proc.update({
+            'name': name,
+            'status': PROC_STATUS.get(comps[0], comps[0]),
+            'ppid': int(comps[1]),
+            'user_time': float(comps[11]) / CLOCK_TICKS,
+            'system_time': float(comps[12]) / CLOCK_TICKS,
+            'nice': int(comps[16]),
+            'create_time': self.boot_time() + float(comps[19]) / CLOCK_TICKS,
+            'vms': int(comps[20]),
+            'rss': rss,
+            'memory_percent': 100.0 * rss / mem_total if mem_total else 0.0,
+        })
+
+    def _read_io(self, pid, proc):
+        content = self._read_file(pid, "io")
+        if content is None:
+            return
+        counters = {}
+        for line in content.splitlines():
+            key, sep, value = line.partition(":")
+            if sep:
+                counters[key] = int(value)
+        proc.update({
+            'read_count': counters.get('syscr'),
+            'write_count': counters.get('syscw'),
+            'read_bytes': counters.get('read_bytes'),
+            'write_bytes': counters.get('write_bytes'),
+        })
+
+    def _read_cmdline(self, pid, proc):
+        content = self._read_file(pid, "cmdline")
+        if content is None:
+            return
+        if content.endswith("\0"):
+            content = content[:-1]
+        proc['cmdline'] = content.split("\0") if content else []
+
+    def _read_owner(self, pid, proc):
+        try:
+            uid = os.stat(self._path(str(pid))).st_uid
+        except OSError:
+            raise _ProcessGone()
+        proc['user'] = self._user_name(uid)
+
+    def _compute_rate(self, pid, proc, now):
+        if proc['create_time'] is None:
+            return
+        cpu_time = proc['user_time'] + proc['system_time']
+        read_bytes = proc['read_bytes'] or 0
+        write_bytes = proc['write_bytes'] or 0
+        with self._samples_lock:
+            sample = self._samples.get(pid)
+            if sample is None or sample[0] != proc['create_time']:
+                # new process or pid reused, the rates are the averages since
+                # the process was created
+                sample = (proc['create_time'], proc['create_time'], 0.0, 0, 0)
+                self._samples[pid] = (proc['create_time'], now, cpu_time,
+                                      read_bytes, write_bytes)
+            elif now - sample[1] >= PROC_RATE_MIN_INTERVAL:
+                self._samples[pid] = (proc['create_time'], now, cpu_time,
+                                      read_bytes, write_bytes)
+        elapsed = now - sample[1]
+        if elapsed <= 0:
+            proc.update({'cpu_rate': 0.0, 'read_bps': 0.0, 'write_bps': 0.0})
+            return
+        proc['cpu_rate'] = max(0.0, 100.0 * (cpu_time - sample[2]) / elapsed)
+        if proc['read_bytes'] is not None:
+            proc['read_bps'] = max(0.0, (read_bytes - sample[3]) / elapsed)
+            proc['write_bps'] = max(0.0, (write_bytes - sample[4]) / elapsed)
+
+    def _evict_samples(self, pids, now):
+        """drop the previous samples of the dead processes"""
+        with self._samples_lock:
+            for pid, sample in self._samples.items():
+                if (pids is not None and pid not in pids) or \
+                        now - sample[1] > PROC_RATE_SAMPLE_TTL:
+                    del self._samples[pid]
+
+    def _read_proc(self, pid, sources, now, mem_total):
+        proc = {'pid': pid, 'current_time': now}
+        for field, source in PROC_FIELDS.iteritems():
+            if source is not None:
+                proc.setdefault(field, None)
+        if 'stat' in sources:
+            self._read_stat(pid, proc, mem_total)
+        if 'io' in sources:
+            self._read_io(pid, proc)
+        if 'cmdline' in sources:
+            self._read_cmdline(pid, proc)
+        if 'owner' in sources:
+            self._read_owner(pid, proc)
+        if 'rate' in sources:
+            self._compute_rate(pid, proc, now)
+        return proc
+
+    def list_pids(self):
+        pids = []
+        for name in os.listdir(self._path()):
+            if name.isdigit():
+                pids.append(int(name))
+        pids.sort()
+        return pids
+
+    def list_procs(self, fields=None, names=None, users=None, pids=None,
+                   sort=None, top=None, offset=0, limit=None):
+        """
+        return an iterator of processes, each is a dict of the requested fields.
+        The processes are read lazily during the iteration unless sorted
+
+        :param fields: the list of fields for each process, None means
+                       DEFAULT_PROC_FIELDS
+        :param names: only the processes whose name matches one of these
+                      shell-style patterns
+        :param users: only the processes owned by one of these users
+        :param pids: only the processes in this pid list
+        :param sort: sort the processes by "cpu", "rss", "io", "cpu_rate"
+                     or "io_rate" in descending order
+        :param top: only the first N processes after sorting
+        :param offset: skip the first N processes
+        :param limit: return at most N processes
+        """
+        if fields is None:
+            fields = DEFAULT_PROC_FIELDS
+        for field in fields:
+            if field not in PROC_FIELDS:
+                raise StorLeverError("Unknown process field (%s)" % field, 400)
+        if sort is not None and sort not in PROC_SORT_KEYS:
+            raise StorLeverError("Unknown sort key (%s) of process" % sort, 400)
+
+        needed_fields = set(fields)
+        if names:
+            needed_fields.add('name')
+        if users:
+            needed_fields.add('user')
+        if sort is not None:
+            needed_fields.update(PROC_SORT_KEYS[sort])
+        sources = set(PROC_FIELDS[field] for field in needed_fields)
+        if 'rate' in sources:
+            sources.update(('stat', 'io'))
+
+        now = time.time()
+        if pids is None:
+            pids = self.list_pids()
+            if 'rate' in sources:
+                self._evict_samples(set(pids), now)
+        elif 'rate' in sources:
+            self._evict_samples(None, now)
+        mem_total = self._mem_total() if 'memory_percent' in needed_fields else 0
+
+        def _iter_procs():
+            for pid in pids:
+                try:
+                    proc = self._read_proc(pid, sources, now, mem_total)
+                except _ProcessGone:
+                    continue
+                if names and not any(fnmatch.fnmatchcase(proc['name'] or "", pattern)
+                                     for pattern in names):
+                    continue
+                if users and proc['user'] not in users:
+                    continue
+                yield proc
+
+        procs = _iter_procs()
+        if sort is not None:
+            sort_fields = PROC_SORT_KEYS[sort]
+
+            def _sort_key(proc):
+                return sum(proc[field] or 0 for field in sort_fields)
+            if top is not None:
+                procs = heapq.nlargest(top, procs, key=_sort_key)
+            else:
+                procs = sorted(procs, key=_sort_key, reverse=True)
+        elif top is not None:
+            procs = itertools.islice(procs, top)
+
+        stop = offset + limit if limit is not None else None
+        return (dict((field, proc[field]) for field in fields)
+                for proc in itertools.islice(procs, offset, stop))
+
+
+ProcManager = ProcManager()
+
+
+def proc_mgr():
+    """return the global process manager instance"""
+    return ProcManager
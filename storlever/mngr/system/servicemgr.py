@@ -13,6 +13,7 @@ import subprocess
 import re
 
 from storlever.lib.command import check_output
+from storlever.lib.config import config_writer
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 import logging
@@ -71,17 +72,20 @@ class SystemService(object):
         return False
 
     def restart(self, user="unkown"):
+        config_writer().flush()  # the service reads its conf files
         check_output([INIT_SCRIPT_DIR + self.init_script, "restart"])
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "Service %s is restarted by user(%s)" % (self.name, user))
 
     def reload(self, user="unkown"):
+        config_writer().flush()  # the service reads its conf files
         check_output([INIT_SCRIPT_DIR + self.init_script, "reload"])
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "Service %s is reloaded configure by user(%s)" % (self.name, user))
 
 
     def start(self, user="unkown"):
+        config_writer().flush()  # the service reads its conf files
         check_output([INIT_SCRIPT_DIR + self.init_script, "start"])
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "Service %s is start by user(%s)" % (self.name, user))
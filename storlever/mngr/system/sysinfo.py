@@ -19,6 +19,7 @@ import socket
 
 from storlever.lib import logger
 from storlever.lib.command import check_output, write_file_entry
+from storlever.lib.config import config_writer
 import logging
 from storlever.lib.confparse import properties
 from modulemgr import ModuleManager
@@ -114,6 +115,7 @@ class SysManager(object):
                    (hostname, user))
 
     def get_host_list(self):
+        config_writer().flush(ETC_HOSTS_FILE)
         # add ip for this hostname
         if os.path.exists("/etc/hosts"):
             with open("/etc/hosts", "r") as f:
@@ -148,35 +150,39 @@ class SysManager(object):
     def set_host_list(self, host_list, user="unknown"):
         host_list = HOST_LIST_SCHEMA.validate(host_list)
 
-        if os.path.exists(ETC_HOSTS_FILE):
-            with open(ETC_HOSTS_FILE, "r") as f:
-                lines = f.readlines()
-        else:
-            lines = []
+        def _render():
+            if os.path.exists(ETC_HOSTS_FILE):
+                with open(ETC_HOSTS_FILE, "r") as f:
+                    lines = f.readlines()
+            else:
+                lines = []
 
-        if "# begin storlever\n" in lines:
-            before_storlever = lines[0:lines.index("# begin storlever\n")]
-        else:
-            before_storlever = lines[0:]
-            if before_storlever and (not before_storlever[-1].endswith("\n")):
-                before_storlever[-1] += "\n"
+            if "# begin storlever\n" in lines:
+                before_storlever = lines[0:lines.index("# begin storlever\n")]
+            else:
+                before_storlever = lines[0:]
+                if before_storlever and (not before_storlever[-1].endswith("\n")):
+                    before_storlever[-1] += "\n"
 
-        if "# end storlever\n" in lines:
-            after_storlever = lines[lines.index("# end storlever\n") + 1:]
-        else:
-            after_storlever = []
+            if "# end storlever\n" in lines:
+                after_storlever = lines[lines.index("# end storlever\n") + 1:]
+            else:
+                after_storlever = []
 
-        with open(ETC_HOSTS_FILE, "w") as f:
-            f.writelines(before_storlever)
-            f.write("# begin storlever\n")
+            content = before_storlever[:]
+            content.append("# begin storlever\n")
             for host in host_list:
-                f.write("%s %s %s\n" % (
+                content.append("%s %s %s\n" % (
                     host["addr"],
                     host["hostname"],
                     host["alias"]
                 ))
-            f.write("# end storlever\n")
-            f.writelines(after_storlever)
+            content.append("# end storlever\n")
+            content.extend(after_storlever)
+            return "".join(content)
+
+        # rendered when it's written, so a burst of changes is written once
+        config_writer().write(ETC_HOSTS_FILE, _render)
 
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "Host list is updated by user(%s)" % user)
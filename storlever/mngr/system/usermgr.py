@@ -11,11 +11,13 @@ This module implements some functions of linux user management.
 
 import pwd
 import grp
+import time
 from crypt import crypt
 import os
 
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError
+from storlever.lib.lock import lock
 from storlever.lib import logger
 import logging
 from modulemgr import ModuleManager
@@ -35,11 +37,44 @@ MODULE_INFO = {
 NO_LOGIN_SHELL = "/sbin/nologin"
 LOGIN_SHELL = "/bin/bash"
 
+# seconds the name of an uid/gid got from NSS is cached, the cache is also
+# dropped when the user/group is changed by storlever
+NSS_NAME_CACHE_TTL = 60
+
 class UserManager(object):
     """contains all methods to manage the user and group in linux system"""
 
     def __init__(self):
-        pass
+        self.lock = lock()
+        self.name_cache_ttl = NSS_NAME_CACHE_TTL
+        # ("uid" or "gid", id) -> (time of lookup, name)
+        self._name_cache = {}
+
+    def invalidate_name_cache(self):
+        with self.lock:
+            self._name_cache.clear()
+
+    def _id_to_name(self, kind, id_num, lookup):
+        now = time.time()
+        with self.lock:
+            entry = self._name_cache.get((kind, id_num))
+        if entry is not None and 0 <= now - entry[0] < self.name_cache_ttl:
+            return entry[1]
+        try:
+            name = lookup(id_num)
+        except KeyError:
+            name = str(id_num)
+        with self.lock:
+            self._name_cache[(kind, id_num)] = (now, name)
+        return name
+
+    def uid_to_name(self, uid):
+        """return the user name of the uid by NSS, or the uid string if unknown"""
+        return self._id_to_name("uid", uid, lambda uid: pwd.getpwuid(uid).pw_name)
+
+    def gid_to_name(self, gid):
+        """return the group name of the gid by NSS, or the gid string if unknown"""
+        return self._id_to_name("gid", gid, lambda gid: grp.getgrgid(gid).gr_name)
 
     def _get_groups_for_user(self, user):
         groups = grp.getgrall()
@@ -166,6 +201,7 @@ class UserManager(object):
 
         cmds.append(name)
         check_output(cmds, input_ret=[2, 3, 4, 6, 9])
+        self.invalidate_name_cache()
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "New system user %s is created by user(%s)" %
                    (name, user))
@@ -177,6 +213,7 @@ class UserManager(object):
             cmds.append("%d" % int(gid))
         cmds.append(name)
         check_output(cmds, input_ret=[2, 3, 4, 9])
+        self.invalidate_name_cache()
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "New system group %s is created by user(%s)" %
                    (name, user))
@@ -187,6 +224,7 @@ class UserManager(object):
         cmds = ["/usr/sbin/userdel"]
         cmds.append(name)
         check_output(cmds, input_ret=[2, 6, 8])
+        self.invalidate_name_cache()
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "System user %s is deleted by user(%s)" %
                    (name, user))
@@ -233,6 +271,7 @@ class UserManager(object):
         cmds.append(name)
         if len(cmds) > 2:
             check_output(cmds, input_ret=[4, 6, 12])
+            self.invalidate_name_cache()
 
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "System user %s is modified by user(%s)" %
@@ -244,6 +283,7 @@ class UserManager(object):
         cmds = ["/usr/sbin/groupdel"]
         cmds.append(name)
         check_output(cmds, input_ret=[2, 6, 8])
+        self.invalidate_name_cache()
         logger.log(logging.INFO, logger.LOG_TYPE_CONFIG,
                    "System group %s is deleted by user(%s)" %
                    (name, user))
@@ -13,7 +13,7 @@ import os
 import errno
 import hashlib
 from storlever.mngr.system.cfgmgr import STORLEVER_CONF_DIR
-from storlever.lib.config import Config, yaml, ConfigError
+from storlever.lib.config import Config, load_yaml, ConfigError
 from storlever.lib.schema import Schema, Use
 
 
@@ -39,7 +39,7 @@ class WebConfig(Config):
         if self.conf_file is not None and self.conf_file != "":
             try:
                 with open(self.conf_file, "r") as f:
-                    self.conf = yaml.load(f)
+                    self.conf = load_yaml(f)
                 if self.schema:
                     self.conf = self.schema.validate(self.conf)
                 return self.conf
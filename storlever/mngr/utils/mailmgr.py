@@ -13,7 +13,7 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError, StorLeverCmdError
 from storlever.lib import logger
@@ -71,16 +71,16 @@ class MailManager(object):
     def _load_conf(self):
         mail_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             mail_conf = \
-                Config.from_file(self.conf_file, self.mail_conf_schema).conf
+                config_store().load(self.conf_file, self.mail_conf_schema)
         else:
             mail_conf = self.mail_conf_schema.validate(mail_conf)
         return mail_conf
 
     def _save_conf(self, mail_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, mail_conf)
+        config_store().save(self.conf_file, mail_conf)
 
 
     def _sync_to_system_conf(self, mail_conf):
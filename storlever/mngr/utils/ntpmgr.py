@@ -13,7 +13,7 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
@@ -149,16 +149,16 @@ class NtpManager(object):
     def _load_conf(self):
         ntp_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             ntp_conf = \
-                Config.from_file(self.conf_file, self.ntp_conf_schema).conf
+                config_store().load(self.conf_file, self.ntp_conf_schema)
         else:
             ntp_conf = self.ntp_conf_schema.validate(ntp_conf)
         return ntp_conf
 
     def _save_conf(self, ntp_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, ntp_conf)
+        config_store().save(self.conf_file, ntp_conf)
 
     def _server_conf_to_line(self, server_conf):
 
@@ -13,7 +13,7 @@ import os
 import os.path
 from stat import *
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
 from storlever.lib.utils import filter_dict
@@ -89,16 +89,16 @@ class SmartdManager(object):
     def _load_conf(self):
         smartd_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             smartd_conf = \
-                Config.from_file(self.conf_file, self.smartd_conf_schema).conf
+                config_store().load(self.conf_file, self.smartd_conf_schema)
         else:
             smartd_conf = self.smartd_conf_schema.validate(smartd_conf)
         return smartd_conf
 
     def _save_conf(self, smartd_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, smartd_conf)
+        config_store().save(self.conf_file, smartd_conf)
 
     def _monitor_to_file_line(self, monitor_conf):
 
@@ -13,7 +13,7 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
@@ -160,16 +160,16 @@ class SnmpAgentManager(object):
     def _load_conf(self):
         snmp_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             snmp_conf = \
-                Config.from_file(self.conf_file, self.snmp_conf_schema).conf
+                config_store().load(self.conf_file, self.snmp_conf_schema)
         else:
             snmp_conf = self.snmp_conf_schema.validate(snmp_conf)
         return snmp_conf
 
     def _save_conf(self, snmp_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, snmp_conf)
+        config_store().save(self.conf_file, snmp_conf)
 
     def _global_conf_to_etc_lines(self, snmp_conf):
         result = ""
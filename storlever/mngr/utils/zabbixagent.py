@@ -13,7 +13,7 @@ import os
 import os.path
 import subprocess
 
-from storlever.lib.config import Config
+from storlever.lib.config import config_store
 from storlever.lib.command import check_output
 from storlever.lib.exception import StorLeverError
 from storlever.lib import logger
@@ -78,16 +78,16 @@ class ZabbixAgentManager(object):
     def _load_conf(self):
         zabbix_agent_conf = {}
         cfg_mgr().check_conf_dir()
-        if os.path.exists(self.conf_file):
+        if config_store().exists(self.conf_file):
             zabbix_agent_conf = \
-                Config.from_file(self.conf_file, self.zabbix_agentd_conf_schema).conf
+                config_store().load(self.conf_file, self.zabbix_agentd_conf_schema)
         else:
             zabbix_agent_conf = self.zabbix_agentd_conf_schema.validate(zabbix_agent_conf)
         return zabbix_agent_conf
 
     def _save_conf(self, zabbix_agent_conf):
         cfg_mgr().check_conf_dir()
-        Config.to_file(self.conf_file, zabbix_agent_conf)
+        config_store().save(self.conf_file, zabbix_agent_conf)
 
 
     def _sync_to_system_conf(self, zabbix_agent_conf):
@@ -4,10 +4,11 @@ from storlever.lib.exception import StorLeverError
 from storlever.mngr.block import blockmgr
 from storlever.mngr.block import scsimgr
 from storlever.mngr.block.md import md
+from storlever.mngr.system import jobmgr
 from pyramid.response import Response
 from storlever.lib.schema import Schema, Optional, DoNotCare, \
     Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal
-from storlever.rest.common import get_params_from_request
+from storlever.rest.common import get_params_from_request, job_accepted
 
 def includeme(config):
     # block device list resource
@@ -18,8 +19,11 @@ def includeme(config):
     config.add_route('dev_list', '/block/scsi/dev_list')
     config.add_route('dev_host_list', '/block/scsi/host_list')
     config.add_route('scan_bus', '/block/scsi/scan_bus')
+    config.add_route('smart_summary', '/block/scsi/smart_summary')
     config.add_route('scsi_dev', '/block/scsi/dev_list/{scsi_id}')
     config.add_route('scsi_dev_smart', '/block/scsi/dev_list/{scsi_id}/smart')
+    config.add_route('scsi_dev_smart_test', '/block/scsi/dev_list/{scsi_id}/smart_test')
+    config.add_route('scsi_dev_smart_history', '/block/scsi/dev_list/{scsi_id}/smart_history')
     
 
 
@@ -78,7 +82,13 @@ def block_clean_meta(request):
     if params['opt'] == "clean_meta":  
         block_mgr =  blockmgr.block_mgr()
         block_dev = block_mgr.get_block_dev_by_name(block_name)
-        block_dev.clean_meta()
+        # clean_meta runs dd at the start and the end of the block dev
+        job_id = jobmgr.job_mgr().submit(
+            "clean_meta", block_dev.clean_meta,
+            description="clean meta data on %s" % block_dev.dev_file,
+            progress=jobmgr.DDProgress(2 * blockmgr.CLEAN_META_SIZE),
+            operator=request.client_addr)
+        return job_accepted(request, job_id)
     elif params['opt'] == "flush_buf":  
         block_mgr =  blockmgr.block_mgr()
         block_dev = block_mgr.get_block_dev_by_name(block_name)
@@ -148,12 +158,16 @@ scan_bus_schema = Schema({
 def scan_bus(request):
     scsi_mgr =  scsimgr.scsi_mgr()
     params = get_params_from_request(request, scan_bus_schema)
-    remove = params.get("remove", False),
-    force_rescan = params.get("force_rescan", False),
-    force_remove = params.get("force_remove", False),
+    remove = params.get("remove", False)
+    force_rescan = params.get("force_rescan", False)
+    force_remove = params.get("force_remove", False)
     if params['opt'] == "re_scan":  
-        scsi_mgr.rescan_bus(params['host'], params['channels'], params['targets'],\
-                             params['luns'],remove,force_rescan, force_remove)
+        job_id = jobmgr.job_mgr().submit(
+            "rescan_bus", scsi_mgr.rescan_bus,
+            args=(params['host'], params['channels'], params['targets'],
+                  params['luns'], remove, force_rescan, force_remove),
+            description="rescan scsi bus", operator=request.client_addr)
+        return job_accepted(request, job_id)
     return Response(status=200)
 
 
@@ -178,15 +192,29 @@ def get_scsi_dev(request):
     return scsi_dev
 
 
+smart_get_schema = Schema({
+    Optional("refresh"): BoolVal(),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
 # http://192.168.1.10:6543/storlever/api/v1/block/scsi_list/{scsi_id}/smart
 @get_view(route_name='scsi_dev_smart')
 def get_scsi_dev_smartinfo(request):
     scsi_id = request.matchdict['scsi_id']
+    params = get_params_from_request(request, smart_get_schema)
     scsi_mgr =  scsimgr.scsi_mgr()
     scsi_dev_info = scsi_mgr.get_scsi_dev_by_id(scsi_id)
-    samrt_info = scsi_dev_info.get_smart_info()
+    samrt_info = scsi_dev_info.get_smart_info(params.get("refresh", False))
     return samrt_info
 
+
+# http://192.168.1.10:6543/storlever/api/v1/block/scsi/smart_summary?refresh=true
+@get_view(route_name='smart_summary')
+def get_smart_summary(request):
+    params = get_params_from_request(request, smart_get_schema)
+    scsi_mgr =  scsimgr.scsi_mgr()
+    return scsi_mgr.get_smart_summary(params.get("refresh", False))
+
 scsi_dev_smart_schema = Schema({
     Optional("smart"): BoolVal(),
     Optional("offline_auto"): BoolVal(),
@@ -205,6 +233,44 @@ def set_scsi_dev_smart(request):
     return Response(status=200)
 
 
+smart_history_get_schema = Schema({
+    Optional("since"): Use(float),
+    Optional("until"): Use(float),
+    Optional("max_points"): IntVal(1),
+    Optional("key"): Use(str),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+# curl -v -X GET "http://192.168.1.10:6543/storlever/api/v1/block/scsi/dev_list/2:0:0:0/smart_history?since=1400000000&max_points=100"
+@get_view(route_name='scsi_dev_smart_history')
+def get_scsi_dev_smart_history(request):
+    scsi_id = request.matchdict['scsi_id']
+    params = get_params_from_request(request, smart_history_get_schema)
+    scsi_mgr =  scsimgr.scsi_mgr()
+    scsi_dev_info = scsi_mgr.get_scsi_dev_by_id(scsi_id)
+    return scsi_dev_info.get_smart_history(params.get("since"), params.get("until"),
+                                           params.get("max_points"), params.get("key"))
+
+scsi_dev_smart_test_schema = Schema({
+    "test_type": StrRe(r"^(offline|short|long|conveyance)$"),
+    DoNotCare(Use(str)): object   # for all those key we don't care
+})
+
+# curl -v -X POST -d test_type=short http://192.168.1.10:6543/storlever/api/v1/block/scsi/dev_list/2:0:0:0/smart_test
+@post_view(route_name='scsi_dev_smart_test')
+def post_scsi_dev_smart_test(request):
+    scsi_id = request.matchdict['scsi_id']
+    scsi_mgr =  scsimgr.scsi_mgr()
+    scsi_dev_info = scsi_mgr.get_scsi_dev_by_id(scsi_id)
+    params = get_params_from_request(request, scsi_dev_smart_test_schema)
+    job_id = jobmgr.job_mgr().submit(
+        "smart_test", scsi_dev_info.smart_test,
+        args=(scsi_id, params["test_type"]),
+        description="start %s SMART test on %s" % (params["test_type"], scsi_id),
+        operator=request.client_addr)
+    return job_accepted(request, job_id)
+
+
 
 #@get_view(route_name='adapter_list')
 #def adapters_get(request):
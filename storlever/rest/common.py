@@ -120,3 +120,14 @@ def get_params_from_request(request, schema=None):
 
     return params
 
+
+
+def job_accepted(request, job_id):
+    """
+    return the 202 response of the operation submitted as a background job,
+    the job resource is in the Location header and the body
+    """
+    response = request.response
+    response.status_int = 202
+    response.location = request.route_url('job', job_id=job_id)
+    return {'job_id': job_id, 'location': response.location}
@@ -1,12 +1,16 @@
+import urllib
+
 from storlever.rest.common import (get_view, post_view, 
                                    put_view, delete_view)
-from storlever.rest.common import get_params_from_request
+from storlever.rest.common import get_params_from_request, job_accepted
 from pyramid.response import Response
 
 from storlever.lib.exception import StorLeverError
+from storlever.lib.utils import iter_encode_json_list
 from storlever.mngr.fs import fsmgr
 from storlever.mngr.fs import ext4
 from storlever.mngr.fs import xfs
+from storlever.mngr.system import jobmgr
 from storlever.lib.schema import Schema, Optional, DoNotCare, \
     Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal
 
@@ -17,7 +21,7 @@ def includeme(config):
     config.add_route('mkfs', '/fs/mkfs')
     config.add_route('fs_list', '/fs/list')
     config.add_route('fs', '/fs/list/{fsname}')
-    #config.add_route('fs_usage', '/fs/list/{fsname}/usage')
+    config.add_route('dir_usage', '/fs/list/{fsname}/dir_usage')
     config.add_route('fs_meta', '/fs/list/{fsname}/meta')
     config.add_route('ls', '/fs/list/{fsname}/ls')
     config.add_route('opt', '/fs/list/{fsname}/opt')
@@ -46,20 +50,28 @@ mk_fs_schema = Schema({
 def mk_fs(request):
     fs_mrg = fsmgr.fs_mgr()
     params = get_params_from_request(request, mk_fs_schema)
-    fs_mrg.mkfs_on_dev(params["type"],params["dev"],params["options"])
-    return Response(status=200)
+    job_id = jobmgr.job_mgr().submit(
+        "mkfs", fs_mrg.mkfs_on_dev,
+        args=(params["type"], params["dev"], params["options"]),
+        description="make %s file system on %s" % (params["type"], params["dev"]),
+        operator=request.client_addr)
+    return job_accepted(request, job_id)
 
 #http://192.168.1.2:6543/storlever/api/v1/fs_list
 @get_view(route_name='fs_list')
 def get_fs_list(request):
     fs_mrg = fsmgr.fs_mgr()
     files = fs_mrg.get_fs_list()
+    usages = fs_mrg.get_fs_usage_list(files)
     fs_dict = []
     for fs in files:
+        # the fs whose backend does not respond to the parallel usage probe
+        # is unavailable, without checking the remote server one by one
         fs_info = {
                    'name':fs.name,
                    'conf':fs.fs_conf,
-                   'available':fs.is_available(),
+                   'available':fs.is_mounted() and not usages[fs.name]["stale"],
+                   'usage': usages[fs.name]
                    }
         fs_dict.append(fs_info)
     return fs_dict
@@ -90,11 +102,12 @@ def get_fs(request):
     fs_name = request.matchdict['fsname']
     fs_mrg = fsmgr.fs_mgr()
     fs = fs_mrg.get_fs_by_name(fs_name)
+    usage = fs.usage_info()
     fs_info = {
                    'name':fs.name,
                    'conf':fs.fs_conf,
-                   'available':fs.is_available(),
-                   'usage': fs.usage_info()
+                   'available':fs.is_mounted() and not usage["stale"],
+                   'usage': usage
                    }
     return fs_info
 
@@ -140,10 +153,17 @@ def del_fs(request):
 
 get_fs_ls_schema = Schema({
     Optional("path"): Default(StrRe(),default=""),
+    Optional("limit"): IntVal(1),
+    Optional("cursor"): StrRe(r"^(.+)$"),
+    Optional("sort"): Default(StrRe(r"^(name|none)$"), default="name"),
     DoNotCare(Use(str)): object  # for all those key we don't care
 })
 
 #curl -v -X get  -H "Content-Type: application/json; charset=UTF-8" -d '{"path":"aa"}' http://192.168.1.2:6543/storlever/api/v1/fs/list/test/ls
+#curl -v -X GET "http://192.168.1.2:6543/storlever/api/v1/fs/list/test/ls?path=aa&sort=name&limit=100"
+# the cursor of the next page is returned percent-encoded in the header X-Next-Cursor,
+# pass the header value as is in the query string or in the json body,
+# sort=none lists in the directory order, which is unstable across pages
 @get_view(route_name='ls')
 def get_fs_ls(request):
     fs_name = request.matchdict['fsname']
@@ -151,8 +171,21 @@ def get_fs_ls(request):
     fs = fs_mrg.get_fs_by_name(fs_name)
     params = get_params_from_request(request, get_fs_ls_schema)
     path = params["path"]
-    ls_info = fs.ls_dir(path)
-    return ls_info
+    cursor = params.get("cursor")
+    # the query string is decoded already, only the cursor from the json
+    # body is still percent-encoded
+    if cursor is not None and "json" in request.content_type and \
+            "cursor" in request.json_body:
+        cursor = urllib.unquote(cursor)
+    ls_info, next_cursor = fs.ls_dir_page(path,
+                                          limit=params.get("limit"),
+                                          cursor=cursor,
+                                          sort=params["sort"])
+    response = Response(app_iter=iter_encode_json_list(ls_info),
+                        content_type='application/json')
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = urllib.quote(next_cursor, safe="")
+    return response
 
 file_opt_schema = Schema({
     "opt": StrRe(r"^(mod_owner|mod_mode|quota_check)|$"),
@@ -187,22 +220,46 @@ def file_opt_owner(request):
         return Response(status=403)
 
 
-'''
-file_opt_schema = Schema({
-    Optional("path"): StrRe(r"^(.+)$"),
+dir_usage_get_schema = Schema({
+    Optional("path"): Default(StrRe(), default=""),
+    Optional("depth"): IntVal(0),
+    Optional("top"): IntVal(1),
     DoNotCare(Use(str)): object  # for all those key we don't care
-}) 
-#curl -v -X get http://192.168.1.2:6543/storlever/api/v1/fs/list/{fsname}/usage
-@get_view(route_name='fs_usage')
-def get_fs_usage(request):
+})
+
+#curl -v -X GET "http://192.168.1.2:6543/storlever/api/v1/fs/list/{fsname}/dir_usage?path=aa&depth=1&top=10"
+@get_view(route_name='dir_usage')
+def get_dir_usage(request):
     fs_name = request.matchdict['fsname']
     fs_mrg = fsmgr.fs_mgr()
     fs = fs_mrg.get_fs_by_name(fs_name)
-    params = get_params_from_request(request, file_opt_schema)
-    path = params["path"]
-    usage_info = fs.dir_usage_stat(path)
-    return usage_info
-'''
+    params = get_params_from_request(request, dir_usage_get_schema)
+    usage_list = fs.dir_usage_stat(params["path"],
+                                   depth=params.get("depth"),
+                                   top=params.get("top"))
+    if usage_list is None:
+        # not indexed yet, query again after the refresh job is finished
+        job_id = fs.submit_dir_index_refresh(params["path"],
+                                             operator=request.client_addr)
+        return job_accepted(request, job_id)
+    return usage_list
+
+dir_usage_refresh_schema = Schema({
+    Optional("path"): Default(StrRe(), default=""),
+    Optional("full"): Default(BoolVal(), default=False),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X POST -d full=true http://192.168.1.2:6543/storlever/api/v1/fs/list/{fsname}/dir_usage
+@post_view(route_name='dir_usage')
+def refresh_dir_usage(request):
+    fs_name = request.matchdict['fsname']
+    fs_mrg = fsmgr.fs_mgr()
+    fs = fs_mrg.get_fs_by_name(fs_name)
+    params = get_params_from_request(request, dir_usage_refresh_schema)
+    job_id = fs.submit_dir_index_refresh(params["path"], params["full"],
+                                         operator=request.client_addr)
+    return job_accepted(request, job_id)
    
 #http://192.168.1.2:6543/storlever/api/v1/fs/list/{fsname}/quota_group_list
 @get_view(route_name='quota_group_list')
@@ -1,10 +1,13 @@
+import functools
+
 from storlever.rest.common import (get_view, post_view, 
                                    put_view, delete_view)
-from storlever.rest.common import get_params_from_request
+from storlever.rest.common import get_params_from_request, job_accepted
 from pyramid.response import Response
 
 from storlever.lib.exception import StorLeverError
 from storlever.mngr.block.lvm import lvm
+from storlever.mngr.system import jobmgr
 from storlever.lib.schema import Schema, Optional, DoNotCare, \
     Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal
     
@@ -34,6 +37,10 @@ def includeme(config):
     config.add_route('lv_snapshot', '/block/lvm/vg_list/{vg}/lv_list/{lv}/snapshot')
     config.add_route('pvmove', '/block/lvm/pvmove')
 
+    # lvm report resource
+    # GET:    all vg with their pv and lv
+    config.add_route('lvm_report', '/block/lvm/report')
+
 #curl -v -X GET http://192.168.1.123:6543/storlever/api/v1/block/lvm/vg_list
 @get_view(route_name='vg_list')
 def get_vg_list(request):
@@ -50,6 +57,18 @@ def get_vg_list(request):
         vg_dict.append(vg_info)
     return vg_dict
 
+lvm_report_get_schema = Schema({
+    Optional("refresh"): BoolVal(),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X GET http://192.168.1.123:6543/storlever/api/v1/block/lvm/report?refresh=true
+@get_view(route_name='lvm_report')
+def get_lvm_report(request):
+    params = get_params_from_request(request, lvm_report_get_schema)
+    lvm_mng = lvm.lvm_mgr()
+    return lvm_mng.report(refresh=params.get("refresh", False))
+
 new_vg_schema = Schema({
     "vgname": StrRe(r"^([a-zA-Z].+)$"),
     "dev": Default(ListVal(StrRe(r"^(/dev/sd[a-z]|/dev/md.+)$")), default=[]),
@@ -252,7 +271,16 @@ pv_move_schema = Schema({
 @post_view(route_name='pvmove')
 def post_pv_move(request):
     params = get_params_from_request(request, pv_move_schema)
-    pv_name = params["src"]
-    pv_mgr = lvm.PV(name=pv_name)
-    pv_mgr.move(params["dst"], params["lvname"])
-    return Response(status=200)
+    lvm_mgr = lvm.lvm_mgr()
+    pv = lvm_mgr.get_pv(params["src"])
+    # the move goes on in kernel and the job polls its progress, it's
+    # resumed by the params after a restart and aborted if cancelled
+    move_params = {"dev_file": pv.dev_file,
+                   "dst_device": params.get("dst"),
+                   "lv_name": params.get("lvname")}
+    job_id = jobmgr.job_mgr().submit(
+        "pvmove", lvm_mgr.move_pv, kwargs=move_params, params=move_params,
+        description="move the extents of PV %s" % pv.dev_file,
+        on_cancel=functools.partial(lvm_mgr.abort_move_pv, pv.dev_file),
+        operator=request.client_addr)
+    return job_accepted(request, job_id)
@@ -2,16 +2,18 @@ from storlever.rest.common import (get_view, post_view,
                                    put_view, delete_view)
 from storlever.lib.exception import StorLeverError
 from storlever.mngr.block.md import md
+from storlever.mngr.system import jobmgr
 from pyramid.response import Response
 from storlever.lib.schema import Schema, Optional, DoNotCare, \
     Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal, Or
-from storlever.rest.common import get_params_from_request
+from storlever.rest.common import get_params_from_request, job_accepted
 
 def includeme(config):
 ####md rest
     config.add_route('md_list', '/block/md_list') #post get 
     config.add_route('md', '/block/md_list/{md_name}')#get put delete
     config.add_route('md_op', '/block/md_list/{md_name}/op')
+    config.add_route('md_sync_progress', '/block/md_sync_progress') #get
 
 
 
@@ -48,8 +50,12 @@ def add_md_rest(request):
     md_mgr =  md.md_mgr()
     mds = md_mgr.get_all_md()
     params = get_params_from_request(request, add_md_schema)
-    mds.create(params['name'],params['level'],params['dev'])
-    return Response(status=200)
+    job_id = jobmgr.job_mgr().submit(
+        "md_create", mds.create,
+        args=(params['name'], params['level'], params['dev']),
+        description="create MD %s" % params['name'],
+        operator=request.client_addr)
+    return job_accepted(request, job_id)
 
 #curl -v -X delete http://192.168.1.123:6543/storlever/api/v1/block/md_list/name
 @delete_view(route_name='md')
@@ -84,4 +90,48 @@ def post_md_op(request):
     elif(params['opt']) == 'grow' :
         md_mgr.grow_raid(params['sum'])
         
-    return Response(status=200)
\ No newline at end of file
+    return Response(status=200)
+
+
+# max seconds a sync progress request waits for the new events
+MD_SYNC_MAX_WAIT = 30
+
+md_sync_progress_schema = Schema({
+    Optional("last_seq"): IntVal(0),
+    Optional("timeout"): Default(IntVal(0, MD_SYNC_MAX_WAIT), default=10),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X GET http://192.168.1.123:6543/storlever/api/v1/block/md_sync_progress
+#curl -v -X GET http://192.168.1.123:6543/storlever/api/v1/block/md_sync_progress?last_seq=20&timeout=10
+@get_view(route_name='md_sync_progress')
+def get_md_sync_progress(request):
+    """
+    long poll the sync progress of the md arrays. Without last_seq, or if
+    the events after last_seq are no longer kept, return the snapshot of
+    all the arrays in sync as {"seq": seq, "arrays": {...}}. Otherwise wait
+    at most timeout seconds and return the changes after last_seq as
+    {"seq": seq, "events": [...]}, the events list is empty on timeout.
+    If too many requests are waiting, return at once without waiting.
+    The client polls again with the returned seq as last_seq.
+    """
+    params = get_params_from_request(request, md_sync_progress_schema)
+    last_seq = params.get('last_seq')
+    sampler = md.md_mgr().sync_sampler
+    if not sampler.subscribe():
+        return _get_md_sync_progress(sampler, last_seq, 0)
+    try:
+        return _get_md_sync_progress(sampler, last_seq, params['timeout'])
+    finally:
+        sampler.unsubscribe()
+
+
+def _get_md_sync_progress(sampler, last_seq, timeout):
+    if last_seq is not None:
+        events = sampler.wait_events(last_seq, timeout)
+        if events is not None:
+            if events:
+                last_seq = events[-1]["seq"]
+            return {"seq": last_seq, "events": events}
+    seq, progress = sampler.snapshot()
+    return {"seq": seq, "arrays": progress}
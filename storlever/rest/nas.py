@@ -20,6 +20,7 @@ from storlever.lib.exception import StorLeverError
 from storlever.mngr.nas import ftpmgr
 from storlever.mngr.nas import nfsmgr
 from storlever.mngr.nas import smbmgr
+from storlever.mngr.nas import batchmgr
 
 from storlever.rest.common import get_params_from_request
 
@@ -40,6 +41,8 @@ def includeme(config):
     config.add_route('smb_account_list', '/nas/smb/account_list')
     config.add_route('smb_account_conf', '/nas/smb/account_list/{account_name}')
 
+    config.add_route('nas_batch', '/nas/batch')
+
 
 @get_view(route_name='ftp_conf')
 def get_ftp_conf(request):
@@ -620,4 +623,64 @@ def delete_smb_account_conf(request):
     account_name = request.matchdict['account_name']
     smb_mgr = smbmgr.SmbManager
     smb_mgr.del_smb_account(account_name, operator=request.client_addr)
-    return Response(status=200)
\ No newline at end of file
+    return Response(status=200)
+
+
+
+nas_batch_operation_schema = Schema({
+    # "create", "update" or "delete"
+    "op": StrRe(r"^(create|update|delete)$"),
+
+    # "smb" (share), "nfs" (export) or "ftp" (user)
+    "type": StrRe(r"^(smb|nfs|ftp)$"),
+
+    # name of the share/export/user, it can also be given in conf for create
+    Optional("name"): StrRe(r"^\S+$"),
+
+    # fields of the share/export/user, the same as the single share API
+    Optional("conf"): Default(dict, default={}),
+
+    DoNotCare(Use(str)): object  # for all other key we don't care
+})
+
+nas_batch_schema = Schema({
+    # operations applied in order, as a whole
+    "operations": [nas_batch_operation_schema],
+
+    # reload the NFS exports and samba service after applied
+    Optional("reload"): Default(BoolVal(), default=False),
+
+    DoNotCare(Use(str)): object  # for all other key we don't care
+})
+
+# type -> (schema of conf, name key in conf)
+nas_batch_conf_schemas = {
+    "smb": (smb_share_schema, "share_name"),
+    "nfs": (nfs_export_schema, "name"),
+    "ftp": (ftp_user_schema, "user_name"),
+}
+
+
+@post_view(route_name='nas_batch')
+def post_nas_batch(request):
+    batch_mgr = batchmgr.nas_batch_mgr()
+    params = get_params_from_request(request, nas_batch_schema)
+    operations = []
+    for index, operation in enumerate(params["operations"]):
+        schema, name_key = nas_batch_conf_schemas[operation["type"]]
+        conf = dict(operation["conf"])
+        if "name" in operation:
+            conf[name_key] = operation["name"]
+        try:
+            conf = schema.validate(conf)
+        except SchemaError as e:
+            raise StorLeverError("operation %d: %s" % (index, str(e)), 400)
+        operations.append({
+            "op": operation["op"],
+            "type": operation["type"],
+            "name": conf.pop(name_key),
+            "conf": conf,
+        })
+
+    batch_mgr.apply(operations, params["reload"], operator=request.client_addr)
+    return Response(status=200)
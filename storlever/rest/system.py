@@ -27,9 +27,14 @@ from storlever.mngr.system import servicemgr
 from storlever.mngr.system import cfgmgr
 from storlever.mngr.system import webconfig
 from storlever.lib.schema import Schema, Optional, DoNotCare, \
-    Use, IntVal, Default, SchemaError, BoolVal, StrRe
+    Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal
 from storlever.lib.exception import StorLeverError
 from storlever.mngr.system import modulemgr
+from storlever.mngr.system import metrics
+from storlever.mngr.system import cpustat
+from storlever.mngr.system import procmgr
+from storlever.mngr.system import jobmgr
+from storlever.lib.utils import iter_encode_json_list
 from storlever import storlever_version, build_date
 
 
@@ -49,6 +54,7 @@ def includeme(config):
     config.add_route('per_disk_io_counters', '/system/per_disk_io_counters')
     config.add_route('net_io_counters', '/system/net_io_counters')
     config.add_route('per_net_io_counters', '/system/per_net_io_counters')
+    config.add_route('metrics', '/system/metrics')
     config.add_route('download_log', '/system/log_download')
     config.add_route('sys_poweroff', '/system/poweroff')
     config.add_route('sys_reboot', '/system/reboot')
@@ -67,6 +73,8 @@ def includeme(config):
     config.add_route('selinux_state', '/system/selinux')
     config.add_route('module_list', '/system/module_list')
     config.add_route('module_info', '/system/module_list/{module_name}')
+    config.add_route('job_list', '/jobs')
+    config.add_route('job', '/jobs/{job_id}')
 
 
 
@@ -141,14 +149,14 @@ cpu_persent_schema = Schema({
 @get_view(route_name='cpu_percent')
 def system_cpu_percent_get(request):
     params = get_params_from_request(request, cpu_persent_schema)
-    cpu_percent = psutil.cpu_percent(interval=params["interval"])
+    cpu_percent = cpustat.cpu_stat_mgr().percent(interval=params["interval"])
     return cpu_percent
 
 
 @get_view(route_name='per_cpu_percent')
 def system_per_cpu_percent_get(request):
     params = get_params_from_request(request, cpu_persent_schema)
-    per_cpu_percent_list = psutil.cpu_percent(interval=params["interval"], percpu=True)
+    per_cpu_percent_list = cpustat.cpu_stat_mgr().percent(interval=params["interval"], percpu=True)
     return per_cpu_percent_list
 
 
@@ -284,34 +292,48 @@ def system_per_net_io_counters_get(request):
     return io_counters_list_output
 
 
+metrics_get_schema = Schema({
+    Optional("series"): ListVal(StrRe(r"^\S+$")),
+    Optional("since"): Use(float),
+    Optional("resolution"): IntVal(1),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X GET "http://192.168.1.123:6543/storlever/api/v1/system/metrics?series=cpu.percent,net.eth0.*&since=1400000000"
+@get_view(route_name='metrics')
+def system_metrics_get(request):
+    params = get_params_from_request(request, metrics_get_schema)
+    return metrics.metrics_mgr().query(patterns=params.get("series") or None,
+                                       since=params.get("since"),
+                                       resolution=params.get("resolution"))
+
+
+ps_get_schema = Schema({
+    Optional("fields"): ListVal(StrRe(r"^\w+$")),
+    Optional("name"): ListVal(StrRe(r"^\S+$")),
+    Optional("user"): ListVal(StrRe(r"^\S+$")),
+    Optional("pid"): ListVal(IntVal(0)),
+    Optional("sort"): StrRe(r"^(cpu|rss|io|cpu_rate|io_rate)$"),
+    Optional("top"): IntVal(1),
+    Optional("offset"): Default(IntVal(0), default=0),
+    Optional("limit"): IntVal(1),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X GET "http://192.168.1.123:6543/storlever/api/v1/system/ps?fields=pid,name,rss&name=smbd&sort=rss&top=10"
 @get_view(route_name='ps')
 def system_ps_get(request):
-    ps_list_output = []
-    for proc in psutil.process_iter():
-        now = time.time()
-        io_counters = proc.get_io_counters()
-        cpu_times = proc.get_cpu_times()
-        memory_info = proc.get_memory_info()
-        ps_output = {'pid': proc.pid,
-                     'ppid': proc.ppid,
-                     'name': proc.name,
-                     'cmdline': proc.cmdline,
-                     'nice': proc.get_nice(),
-                     'status': str(proc.status),
-                     'current_time': now,
-                     'create_time': proc.create_time,
-                     'user_time': cpu_times.user,
-                     'system_time': cpu_times.system,
-                     'vms': memory_info.vms,
-                     'rss': memory_info.rss,
-                     'memory_percent': proc.get_memory_percent(),
-                     'read_count': io_counters.read_count,
-                     'write_count': io_counters.write_count,
-                     'read_bytes': io_counters.read_bytes,
-                     'write_bytes': io_counters.write_bytes}
-        ps_list_output.append(ps_output)
-
-    return ps_list_output
+    params = get_params_from_request(request, ps_get_schema)
+    procs = procmgr.proc_mgr().list_procs(fields=params.get("fields") or None,
+                                          names=params.get("name") or None,
+                                          users=params.get("user") or None,
+                                          pids=params.get("pid") or None,
+                                          sort=params.get("sort"),
+                                          top=params.get("top"),
+                                          offset=params["offset"],
+                                          limit=params.get("limit"))
+    return Response(app_iter=iter_encode_json_list(procs),
+                    content_type='application/json')
 
 
 @get_view(route_name='download_log')
@@ -675,6 +697,40 @@ def put_selinux_state(request):
     return "System should be reboot when selinux state is changed"
 
 
+job_list_get_schema = Schema({
+    Optional("state"): StrRe(r"^(pending|running|succeeded|failed|cancelled)$"),
+    Optional("type"): StrRe(r"^\w+$"),
+    DoNotCare(Use(str)): object  # for all those key we don't care
+})
+
+#curl -v -X GET "http://192.168.1.123:6543/storlever/api/v1/jobs?state=running"
+@get_view(route_name='job_list')
+def get_job_list(request):
+    params = get_params_from_request(request, job_list_get_schema)
+    return jobmgr.job_mgr().get_job_list(state=params.get("state"),
+                                         job_type=params.get("type"))
+
+
+#curl -v -X GET http://192.168.1.123:6543/storlever/api/v1/jobs/{job_id}
+@get_view(route_name='job')
+def get_job(request):
+    job_id = request.matchdict['job_id']
+    return jobmgr.job_mgr().get_job(job_id)
+
+
+# cancel the pending/running job, or remove the finished job from history
+#curl -v -X DELETE http://192.168.1.123:6543/storlever/api/v1/jobs/{job_id}
+@delete_view(route_name='job')
+def delete_job(request):
+    job_id = request.matchdict['job_id']
+    job_mgr = jobmgr.job_mgr()
+    if job_mgr.get_job(job_id)["state"] in jobmgr.JOB_FINISHED_STATES:
+        job_mgr.delete(job_id)
+    else:
+        job_mgr.cancel(job_id, operator=request.client_addr)
+    return Response(status=200)
+
+
 @get_view(route_name='module_list')
 def get_module_list(request):
     module_mgr = modulemgr.module_mgr()      # get module manager
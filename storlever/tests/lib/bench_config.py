@@ -0,0 +1,98 @@
+"""
+micro-benchmark of loading and dumping the conf files
+
+run "python -m storlever.tests.lib.bench_config" to compare the pure python
+yaml implementation, the LibYAML based one used by storlever.lib.config
+and the sidecar cache, with configs of 10, 1k and 10k entries
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import yaml
+
+from storlever.lib import config
+from storlever.lib.config import Config
+from storlever.lib.schema import Schema, Optional, DoNotCare, \
+    Use, Default, BoolVal
+
+
+SHARE_SCHEMA = Schema({
+    Optional("share_list"): Default(Schema({DoNotCare(str): {
+        "path": Use(str),
+        Optional("comment"): Default(Use(str), default=""),
+        Optional("read_only"): Default(BoolVal(), default=False),
+        Optional("valid_users"): Default(Use(str), default=""),
+    }}), default={}),
+})
+
+
+def make_conf(entries):
+    share_list = {}
+    for i in range(entries):
+        share_list["share%d" % i] = {
+            "path": "/mnt/share%d" % i,
+            "comment": "share number %d" % i,
+            "read_only": bool(i % 2),
+            "valid_users": "user%d,@group%d" % (i, i % 10),
+        }
+    return {"share_list": share_list}
+
+
+def timeit(fun, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fun()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench(entries, conf_dir):
+    conf = make_conf(entries)
+    conf_file = os.path.join(conf_dir, "bench_%d.yaml" % entries)
+    Config.to_file(conf_file, conf)
+    with open(conf_file, "r") as f:
+        content = f.read()
+
+    results = [
+        ("pure dump", timeit(lambda: yaml.dump(conf, Dumper=yaml.SafeDumper,
+                                               default_flow_style=False))),
+        ("conf dump", timeit(lambda: config.dump_yaml(conf))),
+        ("pure load", timeit(lambda: yaml.load(content, Loader=yaml.SafeLoader))),
+        ("conf load", timeit(lambda: config.load_yaml(content))),
+        ("validate", timeit(lambda: SHARE_SCHEMA.validate(config.load_yaml(content)))),
+    ]
+
+    Config.sidecar_dir = os.path.join(conf_dir, "cache")
+    min_size = config.CONF_SIDECAR_MIN_SIZE
+    config.CONF_SIDECAR_MIN_SIZE = 0
+    try:
+        Config.from_file(conf_file, SHARE_SCHEMA)
+        results.append(("sidecar", timeit(lambda: Config.from_file(conf_file, SHARE_SCHEMA))))
+    finally:
+        Config.sidecar_dir = None
+        config.CONF_SIDECAR_MIN_SIZE = min_size
+
+    print "%6d entries (%d bytes): %s" % (
+        entries, len(content),
+        ", ".join("%s %.4fs" % result for result in results))
+
+
+def main(entries_list=(10, 1000, 10000)):
+    print "LibYAML: %s" % yaml.__with_libyaml__
+    conf_dir = tempfile.mkdtemp(prefix="storlever_bench_")
+    try:
+        for entries in entries_list:
+            bench(entries, conf_dir)
+    finally:
+        shutil.rmtree(conf_dir)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or (10, 1000, 10000))
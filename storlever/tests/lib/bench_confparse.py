@@ -0,0 +1,120 @@
+"""
+micro-benchmark of parsing and writing the conf files with confparse
+
+run "python -m storlever.tests.lib.bench_confparse [OLD_CONFPARSE_PY]" to
+time reading, representing and applying properties and ini files of
+10, 1k and 10k entries. If the path of another confparse.py is given, like
+the former implementation extracted by
+"git show <commit>:storlever/lib/confparse.py > /tmp/old_confparse.py",
+it's timed with the same files for comparison
+"""
+
+import os
+import sys
+import imp
+import time
+import shutil
+import tempfile
+
+from storlever.lib import confparse
+
+
+def make_properties(entries):
+    lines = ["# generated properties file\n"]
+    for i in range(entries):
+        if i % 10 == 0:
+            lines.append("# option number %d\n" % i)
+            lines.append("#KEY%d_DEFAULT=default\n" % i)
+        lines.append("KEY%d=value%d\n" % (i, i))
+    return "".join(lines)
+
+
+def make_ini(entries):
+    lines = ["[global]\n", "\tworkgroup = MYGROUP\n", "\n"]
+    for i in range(entries):
+        lines.append("[share%d]\n" % i)
+        lines.append("\t# share number %d\n" % i)
+        lines.append("\tpath = /mnt/share%d\n" % i)
+        lines.append("\tread only = no\n")
+        lines.append(";\tvalid users = user%d\n" % i)
+        lines.append("\n")
+    return "".join(lines)
+
+
+def timeit(fun, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fun()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_properties(cp, path, entries):
+    conf = cp.properties(path)
+
+    def _edit():
+        conf["KEY0"] = "changed"
+        conf["KEY%d_DEFAULT" % (entries - 10 if entries >= 10 else 0)] = "set"
+        conf.delete("KEY1")
+        return repr(conf)
+
+    def _apply():
+        cp.properties(KEY0="applied", NEW="new").apply_to(path)
+
+    return [
+        ("read", timeit(lambda: cp.properties(path))),
+        ("repr", timeit(lambda: repr(conf))),
+        ("edit", timeit(_edit)),
+        ("apply", timeit(_apply)),
+    ]
+
+
+def bench_ini(cp, path, entries):
+    conf = cp.ini(path)
+    conf.set_sep(True)
+
+    def _edit():
+        conf["share0"]["read only"] = "yes"
+        conf["share0"]["valid users"] = "admin"
+        del conf["share%d" % (entries - 1)]
+        return repr(conf)
+
+    return [
+        ("read", timeit(lambda: cp.ini(path))),
+        ("repr", timeit(lambda: repr(conf))),
+        ("edit", timeit(_edit)),
+    ]
+
+
+def bench(implementations, entries, conf_dir):
+    for kind, make, run in (("properties", make_properties, bench_properties),
+                            ("ini", make_ini, bench_ini)):
+        content = make(entries)
+        for name, cp in implementations:
+            path = os.path.join(conf_dir, "bench_%s_%d" % (kind, entries))
+            with open(path, "w") as f:
+                f.write(content)
+            results = run(cp, path, entries)
+            print "%6d entries %-10s %-4s (%d bytes): %s" % (
+                entries, kind, name, len(content),
+                ", ".join("%s %.4fs" % result for result in results))
+
+
+def main(old_confparse=None, entries_list=(10, 1000, 10000)):
+    implementations = [("new", confparse)]
+    if old_confparse is not None:
+        implementations.append(("old", imp.load_source("old_confparse",
+                                                       old_confparse)))
+    conf_dir = tempfile.mkdtemp(prefix="storlever_bench_")
+    try:
+        for entries in entries_list:
+            bench(implementations, entries, conf_dir)
+    finally:
+        shutil.rmtree(conf_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
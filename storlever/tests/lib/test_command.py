@@ -0,0 +1,148 @@
+import sys
+import time
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib import command
+from storlever.lib.command import CommandExecutor, CommandScope, \
+    check_output, current_command_scope
+from storlever.lib.exception import StorLeverError, StorLeverCmdError
+
+
+class TestCommandExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = CommandExecutor.__class__(max_workers=2)
+
+    def test_check_output(self):
+        self.assertEquals("hello\n", check_output(["echo", "hello"]))
+        self.assertEquals("out\nerr\n",
+                          check_output("echo out; echo err >&2", shell=True))
+
+    def test_error(self):
+        try:
+            self.executor.run("echo failed; exit 3", shell=True, input_ret=[3])
+        except StorLeverCmdError as e:
+            self.assertEquals(3, e.return_code)
+            self.assertEquals(400, e.http_status_code)
+            self.assertEquals("failed\n", str(e))
+        else:
+            self.fail("StorLeverCmdError is not raised")
+
+        try:
+            self.executor.run(["false"])
+        except StorLeverCmdError as e:
+            self.assertEquals(500, e.http_status_code)
+        else:
+            self.fail("StorLeverCmdError is not raised")
+
+        self.assertRaises(OSError, self.executor.run, ["/not/exist/program"])
+
+    def test_timeout(self):
+        start = time.time()
+        try:
+            # the child of the shell is killed as well
+            self.executor.run("echo started; sleep 10; echo done", shell=True,
+                              timeout=0.2)
+        except StorLeverCmdError as e:
+            self.assertEquals(command.COMMAND_TIMEOUT_STATUS, e.http_status_code)
+            self.assertIn("timed out", str(e))
+            self.assertIn("started", str(e))
+        else:
+            self.fail("StorLeverCmdError is not raised")
+        self.assertLess(time.time() - start, 5)
+        # the slot is released
+        self.assertEquals("ok\n", self.executor.run(["echo", "ok"]))
+        # the killed command is counted until it exits
+        time.sleep(0.1)
+        self.assertEquals(0, self.executor._stuck)
+        self.assertEquals(0, self.executor._running)
+
+    def test_default_timeout(self):
+        saved = command.COMMAND_TIMEOUTS
+        command.COMMAND_TIMEOUTS = {"sleep": 0.2}
+        try:
+            self.assertRaises(StorLeverCmdError, self.executor.run, ["sleep", "10"])
+        finally:
+            command.COMMAND_TIMEOUTS = saved
+
+    def test_on_output(self):
+        lines = []
+        output = self.executor.run("printf 'a\\nb\\rc\\n\\nd'", shell=True,
+                                   on_output=lines.append)
+        self.assertEquals("a\nb\rc\n\nd", output)
+        self.assertEquals(["a", "b", "c", "d"], lines)
+
+    def test_bounded(self):
+        start = time.time()
+        futures = [self.executor.submit(["sleep", "0.3"]) for _ in range(4)]
+        for future in futures:
+            future.result()
+        # 2 rounds of 2 commands
+        self.assertGreaterEqual(time.time() - start, 0.55)
+
+    def test_busy(self):
+        self.executor.queue_timeout = 0.2
+        running = [self.executor.submit(["sleep", "10"]) for _ in range(2)]
+        try:
+            start = time.time()
+            try:
+                self.executor.run(["echo", "never"])
+            except StorLeverError as e:
+                self.assertEquals(command.COMMAND_BUSY_STATUS, e.http_status_code)
+            else:
+                self.fail("StorLeverError is not raised")
+            self.assertLess(time.time() - start, 5)
+            self.assertEquals(0, len(self.executor._queue))
+        finally:
+            for future in running:
+                self.executor.cancel(future)
+
+    def test_program_limit(self):
+        saved = command.COMMAND_PROGRAM_LIMITS
+        command.COMMAND_PROGRAM_LIMITS = {"sleep": 1}
+        try:
+            start = time.time()
+            futures = [self.executor.submit(["sleep", "0.3"]) for _ in range(2)]
+            # the other programs are not blocked by the queued sleep
+            self.assertEquals("ok\n", self.executor.run(["echo", "ok"]))
+            self.assertLess(time.time() - start, 0.25)
+            for future in futures:
+                future.result()
+            self.assertGreaterEqual(time.time() - start, 0.55)
+        finally:
+            command.COMMAND_PROGRAM_LIMITS = saved
+
+    def test_cancel(self):
+        running = self.executor.submit(["sleep", "10"])
+        blocker = self.executor.submit(["sleep", "10"])
+        queued = self.executor.submit(["echo", "never"])
+        self.executor.cancel(queued)
+        self.assertRaises(StorLeverCmdError, queued.result, 1)
+        time.sleep(0.1)
+        self.executor.cancel(running)
+        self.assertRaises(StorLeverCmdError, running.result, 5)
+        self.assertTrue(running.cancelled)
+        self.executor.cancel(blocker)
+
+    def test_scope(self):
+        lines = []
+        scope = CommandScope(on_output=lines.append)
+        with scope:
+            self.assertTrue(current_command_scope() is scope)
+            self.executor.run(["echo", "in scope"])
+        self.assertTrue(current_command_scope() is None)
+        self.executor.run(["echo", "out of scope"])
+        self.assertEquals(["in scope"], lines)
+
+        scope.cancel()
+        with scope:
+            self.assertRaises(StorLeverCmdError, self.executor.run, ["echo", "never"])
+        self.assertEquals(["in scope"], lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
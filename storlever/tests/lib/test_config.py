@@ -0,0 +1,225 @@
+import sys
+import os
+import stat
+import time
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib import config
+from storlever.lib.config import Config, ConfigError, config_store, \
+    config_writer, write_file_atomic
+from storlever.lib.schema import Schema, Optional, DoNotCare, \
+    Use, IntVal, Default
+
+
+CONF_SCHEMA = Schema({
+    Optional("share_list"): Default(Schema({DoNotCare(str): {
+        "path": Use(str),
+        Optional("size"): Default(IntVal(), default=0),
+    }}), default={}),
+})
+
+
+class TestConfigStore(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp(prefix="storlever_conf_")
+        self.conf_file = os.path.join(self.conf_dir, "test.yaml")
+        self.writer = type(config_writer())(delay=60)
+        self.store = type(config_store())(self.writer)
+
+    def tearDown(self):
+        self.writer.flush()
+        shutil.rmtree(self.conf_dir)
+
+    def test_cache(self):
+        Config.to_file(self.conf_file, {"share_list": {"a": {"path": "/mnt/a"}}})
+        conf = self.store.load(self.conf_file, CONF_SCHEMA)
+        self.assertEquals({"share_list": {"a": {"path": "/mnt/a", "size": 0}}}, conf)
+
+        # each load is a private copy
+        conf["share_list"]["b"] = {"path": "/mnt/b"}
+        conf["share_list"]["a"]["size"] = 10
+        self.assertEquals({"share_list": {"a": {"path": "/mnt/a", "size": 0}}},
+                          self.store.load(self.conf_file, CONF_SCHEMA))
+
+        # not parsed again if the file is not changed
+        entry = self.store._cache.values()[0]
+        self.store.load(self.conf_file, CONF_SCHEMA)
+        self.assertTrue(entry is self.store._cache.values()[0])
+
+        # parsed again after the file is changed by others
+        with open(self.conf_file, "a") as f:
+            f.write("    size: 5\n")
+        self.assertEquals(5, self.store.load(self.conf_file, CONF_SCHEMA)["share_list"]["a"]["size"])
+
+        self.store.save(self.conf_file, conf)
+        self.assertEquals(set(["a", "b"]),
+                          set(self.store.load(self.conf_file, CONF_SCHEMA)["share_list"].keys()))
+
+    def test_write_behind(self):
+        Config.to_file(self.conf_file, {"share_list": {"a": {"path": "/mnt/a"}}})
+        conf = self.store.load(self.conf_file, CONF_SCHEMA)
+        conf["share_list"]["b"] = {"path": "/mnt/b", "size": 1}
+        self.store.save(self.conf_file, conf)
+        conf["share_list"]["c"] = {"path": "/mnt/c", "size": 2}
+        self.store.save(self.conf_file, conf)
+
+        # the saved conf is loaded before it's written
+        self.assertNotIn("/mnt/b", open(self.conf_file).read())
+        self.assertEquals(conf, self.store.load(self.conf_file, CONF_SCHEMA))
+        # another schema has no cached conf, so it's flushed before parsed
+        self.assertEquals(conf, self.store.load(self.conf_file))
+        self.assertFalse(self.writer.is_pending(self.conf_file))
+        self.assertEquals(0600, stat.S_IMODE(os.stat(self.conf_file).st_mode))
+
+        # the cache entry is updated after written, no parse again
+        entry = self.store._cache[(self.conf_file, CONF_SCHEMA)]
+        self.assertTrue(entry[0] is not None)
+        self.store.load(self.conf_file, CONF_SCHEMA)
+        self.assertTrue(entry is self.store._cache[(self.conf_file, CONF_SCHEMA)])
+
+        # a new conf file exists once it's saved
+        new_file = os.path.join(self.conf_dir, "new.yaml")
+        self.assertFalse(self.store.exists(new_file))
+        self.store.save(new_file, {"share_list": {}})
+        self.assertFalse(os.path.exists(new_file))
+        self.assertTrue(self.store.exists(new_file))
+        self.assertEquals({"share_list": {}}, self.store.load(new_file, CONF_SCHEMA))
+
+    def test_missing_file(self):
+        self.assertRaises(ConfigError, self.store.load,
+                          os.path.join(self.conf_dir, "not_exist.yaml"))
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp(prefix="storlever_conf_")
+        self.conf_file = os.path.join(self.conf_dir, "test.yaml")
+        self.sidecar_min_size = config.CONF_SIDECAR_MIN_SIZE
+
+    def tearDown(self):
+        Config.sidecar_dir = None
+        config.CONF_SIDECAR_MIN_SIZE = self.sidecar_min_size
+        shutil.rmtree(self.conf_dir)
+
+    def test_safe_load(self):
+        # written by the former yaml.dump
+        with open(self.conf_file, "w") as f:
+            f.write("share_list:\n  a: {path: !!python/unicode \"/mnt/\\u4e2d\"}\n"
+                    "  b: {path: !!python/str '/mnt/b'}\n")
+        conf = Config.from_file(self.conf_file).conf
+        self.assertEquals(u"/mnt/\u4e2d", conf["share_list"]["a"]["path"])
+        self.assertEquals("/mnt/b", conf["share_list"]["b"]["path"])
+
+        with open(self.conf_file, "w") as f:
+            f.write("a: !!python/object/apply:os.system ['true']\n")
+        self.assertRaises(ConfigError, Config.from_file, self.conf_file)
+
+        Config.to_file(self.conf_file, {"a": [u"\u4e2d", "b", (1, 2)]})
+        with open(self.conf_file, "r") as f:
+            self.assertNotIn("!!", f.read())
+        self.assertEquals({"a": [u"\u4e2d", "b", [1, 2]]},
+                          Config.from_file(self.conf_file).conf)
+
+    def test_sidecar(self):
+        Config.sidecar_dir = os.path.join(self.conf_dir, "cache")
+        share_list = {}
+        for i in range(100):
+            share_list["share%d" % i] = {"path": "/mnt/share%d" % i}
+        Config.to_file(self.conf_file, {"share_list": share_list})
+        config.CONF_SIDECAR_MIN_SIZE = os.path.getsize(self.conf_file) + 1
+        Config.from_file(self.conf_file, CONF_SCHEMA)
+        self.assertFalse(os.path.exists(Config.sidecar_dir))
+        config.CONF_SIDECAR_MIN_SIZE = os.path.getsize(self.conf_file)
+
+        conf = Config.from_file(self.conf_file, CONF_SCHEMA).conf
+        self.assertEquals(1, len(os.listdir(Config.sidecar_dir)))
+        self.assertEquals(conf, Config.from_file(self.conf_file, CONF_SCHEMA).conf)
+
+        # the sidecar is not used for a different schema or content
+        self.assertNotIn("size", Config.from_file(self.conf_file).conf["share_list"]["share0"])
+        share_list["share0"]["size"] = 10
+        Config.to_file(self.conf_file, {"share_list": share_list})
+        self.assertEquals(10, Config.from_file(self.conf_file, CONF_SCHEMA).conf
+                          ["share_list"]["share0"]["size"])
+
+
+class TestConfigWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp(prefix="storlever_conf_")
+        self.file_name = os.path.join(self.conf_dir, "exports")
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir)
+
+    def test_atomic_write(self):
+        with open(self.file_name, "w") as f:
+            f.write("old\n")
+        os.chmod(self.file_name, 0640)
+        link_name = os.path.join(self.conf_dir, "link")
+        os.symlink(self.file_name, link_name)
+
+        write_file_atomic(link_name, "new\n")
+        self.assertTrue(os.path.islink(link_name))
+        self.assertEquals("new\n", open(self.file_name).read())
+        self.assertEquals(0640, stat.S_IMODE(os.stat(self.file_name).st_mode))
+        self.assertEquals(["exports", "link"], sorted(os.listdir(self.conf_dir)))
+
+        # the file is not touched if the write fails
+        self.assertRaises(TypeError, write_file_atomic, self.file_name, None)
+        self.assertEquals("new\n", open(self.file_name).read())
+        self.assertEquals(["exports", "link"], sorted(os.listdir(self.conf_dir)))
+
+    def test_coalesce(self):
+        writer = type(config_writer())(delay=60)
+        renders = []
+
+        def _render(content):
+            def _fun():
+                renders.append(content)
+                return content
+            return _fun
+        for i in range(10):
+            writer.write(self.file_name, _render("line %d\n" % i))
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertTrue(writer.is_pending(self.file_name))
+
+        writer.flush(self.file_name)
+        self.assertEquals(["line 9\n"], renders)
+        self.assertEquals("line 9\n", open(self.file_name).read())
+        self.assertFalse(writer.is_pending(self.file_name))
+        writer.flush()
+        self.assertEquals(1, len(renders))
+
+    def test_delay(self):
+        writer = type(config_writer())(delay=0.05)
+        written = []
+        writer.write(self.file_name, lambda: "a\n", on_written=lambda: written.append(1))
+        for _ in range(100):
+            if written:
+                break
+            time.sleep(0.05)
+        self.assertEquals([1], written)
+        self.assertEquals("a\n", open(self.file_name).read())
+
+        # written at once without delay
+        writer.delay = 0
+        writer.write(self.file_name, lambda: "b\n")
+        self.assertEquals("b\n", open(self.file_name).read())
+
+    def test_error(self):
+        writer = type(config_writer())(delay=60)
+        writer.write(os.path.join(self.conf_dir, "not_exist", "a"), lambda: "a\n")
+        writer.write(self.file_name, lambda: "b\n")
+        self.assertRaises(ConfigError, writer.flush)
+        # the other files are still written
+        self.assertEquals("b\n", open(self.file_name).read())
+        self.assertFalse(writer.is_pending(self.file_name))
@@ -0,0 +1,312 @@
+import sys
+import os
+import stat
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib import confparse
+from storlever.lib.confparse import properties, ini
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "confparse_corpus")
+
+
+# the round-trip cases of the corpus, each is
+# (case name, input file, function of (confparse module, input path) -> output).
+# The expected output of each case is in CORPUS_DIR/expected/<case name>,
+# which was generated with the former regex based implementation
+
+def _read_properties(cp, path):
+    return repr(cp.properties(path))
+
+
+def _read_ini(cp, path):
+    return repr(cp.ini(path))
+
+
+def _apply_to(cp, path, conf, sep=False):
+    conf.set_sep(sep)
+    conf.write(path)
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _ifcfg_edit(cp, path):
+    conf = cp.properties(path)
+    conf["IPADDR"] = "10.0.0.2"
+    conf["GATEWAY"] = "10.0.0.1"
+    conf.delete(["HWADDR", "UUID"])
+    conf["MTU"] = 9000
+    conf["ONBOOT"] = "yes"
+    return repr(conf)
+
+
+def _ifcfg_bond_slave(cp, path):
+    conf = cp.properties(path)
+    conf.delete("IPADDR")
+    conf.delete("NETMASK")
+    conf.delete("GATEWAY")
+    conf["MASTER"] = "bond0"
+    conf["SLAVE"] = "yes"
+    return _apply_to(cp, path, conf)
+
+
+def _network_apply(cp, path):
+    return _apply_to(cp, path, cp.properties(HOSTNAME="nas.example.com",
+                                             NOZEROCONF="yes"))
+
+
+def _network_nonl_edit(cp, path):
+    conf = cp.properties(path)
+    conf["HOSTNAME"] = "nas"
+    return repr(conf)
+
+
+def _vsftpd_apply(cp, path):
+    conf = cp.properties()
+    conf["listen"] = "YES"
+    conf["listen_ipv6"] = "NO"
+    conf["listen_port"] = 21
+    conf["idle_session_timeout"] = 300
+    conf["write_enable"] = "NO"
+    conf["local_enable"] = "YES"
+    conf["userlist_enable"] = "YES"
+    conf["userlist_deny"] = "NO"
+    conf["local_umask"] = "022"
+    conf.delete("local_root")
+    conf["anonymous_enable"] = "NO"
+    conf["anon_mkdir_write_enable"] = "NO"
+    conf["anon_upload_enable"] = "YES"
+    conf["ftp_username"] = "ftp"
+    conf["anon_root"] = "/var/ftp"
+    # twice, like the ftp manager
+    _apply_to(cp, path, conf)
+    return _apply_to(cp, path, conf)
+
+
+def _zabbix_apply(cp, path):
+    return _apply_to(cp, path, cp.properties(Server="10.0.0.1",
+                                             ServerActive="10.0.0.1",
+                                             Hostname="storlever",
+                                             LogFileSize=0))
+
+
+def _selinux_apply(cp, path):
+    return _apply_to(cp, path, cp.properties(SELINUX="disabled"))
+
+
+def _continuation_edit(cp, path):
+    conf = cp.properties(path)
+    conf["name"] = "second"
+    conf["path"] = "/opt/lib\n/usr/lib"
+    conf.delete("dup")
+    conf["spaced key"] = "changed"
+    conf["empty"] = "not empty"
+    conf["added"] = "1"
+    return repr(conf)
+
+
+def _continuation_order(cp, path):
+    conf = cp.properties(path, _order=["zzz", "aaa"])
+    conf.delete(["name", "empty"])
+    conf["aaa"] = "a"
+    conf["mmm"] = "m"
+    conf["zzz"] = "z"
+    conf["dup"] = "3"
+    return _apply_to(cp, path, conf, sep=True)
+
+
+def _smb_include(cp, path):
+    # like smbmgr, only the global section without the managed keys is kept
+    conf = cp.ini(path)
+    conf.set_sep(True)
+    for section in conf.keys():
+        if section != "global":
+            del conf[section]
+    for key in ("workgroup", "server string", "security", "log file"):
+        conf["global"].delete(key)
+    return repr(conf)
+
+
+def _smb_edit(cp, path):
+    conf = cp.ini(path)
+    conf["homes"]["comment"] = "Homes"
+    conf["homes"]["valid users"] = "%S"
+    conf["homes"].delete("browseable")
+    conf["global"]["netbios name"] = "NAS"
+    conf["global"]["max log size"] = 100
+    del conf["printers"]
+    data = cp.properties(path="/data", comment="Data")
+    data["read only"] = "no"
+    conf["data"] = data
+    conf.set_sep(True)
+    return _apply_to(cp, path, conf, sep=True)
+
+
+CORPUS_CASES = (
+    ("ifcfg-read", "ifcfg-eth0", _read_properties),
+    ("ifcfg-edit", "ifcfg-eth0", _ifcfg_edit),
+    ("ifcfg-bond-slave", "ifcfg-eth0", _ifcfg_bond_slave),
+    ("network-apply", "network", _network_apply),
+    ("network-nonl-read", "network-nonl", _read_properties),
+    ("network-nonl-edit", "network-nonl", _network_nonl_edit),
+    ("vsftpd-apply", "vsftpd.conf", _vsftpd_apply),
+    ("zabbix-apply", "zabbix_agentd.conf", _zabbix_apply),
+    ("selinux-apply", "selinux", _selinux_apply),
+    ("continuation-read", "continuation.properties", _read_properties),
+    ("continuation-edit", "continuation.properties", _continuation_edit),
+    ("continuation-order", "continuation.properties", _continuation_order),
+    ("smb-read", "smb.conf", _read_ini),
+    ("smb-include", "smb.conf", _smb_include),
+    ("smb-edit", "smb.conf", _smb_edit),
+)
+
+
+def run_corpus_case(cp, input_name, fun, work_dir):
+    """run a corpus case on a copy of its input file, return the output"""
+    path = os.path.join(work_dir, input_name)
+    shutil.copyfile(os.path.join(CORPUS_DIR, input_name), path)
+    return fun(cp, path)
+
+
+class TestConfparseCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="storlever_confparse_")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_corpus(self):
+        for case_name, input_name, fun in CORPUS_CASES:
+            with open(os.path.join(CORPUS_DIR, "expected", case_name), "r") as f:
+                expected = f.read()
+            output = run_corpus_case(confparse, input_name, fun, self.work_dir)
+            self.assertEquals(expected, output, "corpus case %s" % case_name)
+
+    def test_unchanged(self):
+        # the plain files are written back byte for byte
+        for input_name in ("ifcfg-eth0", "network", "network-nonl",
+                           "vsftpd.conf", "zabbix_agentd.conf", "selinux"):
+            with open(os.path.join(CORPUS_DIR, input_name), "r") as f:
+                content = f.read()
+            output = run_corpus_case(confparse, input_name,
+                                     _read_properties, self.work_dir)
+            self.assertEquals(content, output, input_name)
+
+
+class TestProperties(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="storlever_confparse_")
+        self.path = os.path.join(self.work_dir, "conf")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def _read(self):
+        with open(self.path, "r") as f:
+            return f.read()
+
+    def test_read(self):
+        self._write("A=1\n# B=2\nC = \"x y\" # comment\nD:\n  more\n")
+        conf = properties(self.path)
+        self.assertEquals({"A": "1", "C": "\"x y\"", "D": "\nmore"}, dict(conf))
+        self.assertEquals(self.path, conf.template)
+        self.assertEquals("1", conf.proxy.A)
+
+    def test_dustbin(self):
+        conf = properties(A=1, B=2)
+        del conf["A"]
+        self.assertIn("A", conf.dustbin)
+        conf["A"] = 3
+        self.assertNotIn("A", conf.dustbin)
+        self.assertEquals("A=3\nB=2\n", repr(conf))
+
+    def test_copy(self):
+        self._write("A=1\n")
+        conf = properties(self.path)
+        conf.delete("B")
+        conf.set_sep(True)
+        conf_copy = conf.copy()
+        conf_copy["A"] = 2
+        conf_copy["B"] = 3
+        self.assertEquals("1", conf["A"])
+        self.assertIn("B", conf.dustbin)
+        self.assertTrue(conf_copy.sep)
+
+    def test_empty_value_at_eof(self):
+        self._write("A=1\nB=")
+        conf = properties(self.path)
+        conf["B"] = "2"
+        self.assertEquals("A=1\nB=2", repr(conf))
+
+    def test_template_changed(self):
+        self._write("A=1\n")
+        conf = properties(self.path)
+        self._write("# comment\nA=2\nB=3\n")
+        self.assertEquals("# comment\nA=1\nB=3\n", repr(conf))
+
+    def test_apply_to(self):
+        self._write("# comment\nA=1\nB=2\n")
+        os.chmod(self.path, 0644)
+        properties(B=3, C=4).apply_to(self.path)
+        self.assertEquals("# comment\nA=1\nB=3\nC=4\n", self._read())
+        self.assertEquals(0644, stat.S_IMODE(os.stat(self.path).st_mode))
+        properties(C=5).apply_to(self.path)
+        self.assertEquals("# comment\nA=1\nB=3\nC=5\n", self._read())
+
+    def test_write_new_file(self):
+        conf = properties(A=1)
+        conf.write(self.path)
+        self.assertEquals("A=1\n", self._read())
+        self.assertEquals(self.path, conf.template)
+
+
+class TestIni(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="storlever_confparse_")
+        self.path = os.path.join(self.work_dir, "conf")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def test_read(self):
+        self._write("[a]\nx = 1\n; y = 2\n[b]\nz = 3\n")
+        conf = ini(self.path)
+        self.assertEquals(["a", "b"], sorted(conf.keys()))
+        self.assertEquals({"x": "1"}, dict(conf["a"]))
+        self.assertEquals("3", conf.get("b", "z"))
+
+    def test_option_before_section(self):
+        self._write("x = 1\n[a]\ny = 2\n")
+        conf = ini(self.path)
+        self.assertEquals(["a"], conf.keys())
+        self.assertEquals("x = 1\n[a]\ny = 2\n", repr(conf))
+
+    def test_delete_section(self):
+        self._write("[a]\nx = 1\n[b]\ny = 2\n")
+        conf = ini(self.path)
+        del conf["a"]
+        conf["c"] = properties(z=3)
+        conf.set_sep(True)
+        self.assertEquals("[b]\ny = 2\n[c]\nz = 3\n\n", repr(conf))
+
+
+if __name__ == '__main__':
+    unittest.main()
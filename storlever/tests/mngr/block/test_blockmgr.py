@@ -6,7 +6,8 @@ if sys.version_info >= (2, 7):
 else:
     import unittest2 as unittest
 
-from storlever.mngr.block.blockmgr import  block_mgr
+from storlever.mngr.block.blockmgr import  block_mgr, \
+    BlockInventory, _parse_lsblk_line
 from storlever.tests.mngr.block.utils import get_block_dev
 
 class TestBlockMgr(unittest.TestCase):
@@ -38,16 +39,52 @@ class TestBlockMgr(unittest.TestCase):
         block.clean_meta()
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
+class TestBlockInventory(unittest.TestCase):
+
+    LSBLK_OUTPUT = [
+        "sda 8:0 disk 107374182400 0  ",
+        "sda1 8:1 part 524288000 0 xfs /boot",
+        "vg0-lv0 253:0 lvm 10737418240 0 ext4 /mnt/lv0",
+        "sr0 11:0 rom 1073741312 1  ",
+        "sda1 8:1 part 524288000 0 xfs /boot",
+    ]
+
+    def _inventory(self):
+        return BlockInventory([_parse_lsblk_line(line) for line in self.LSBLK_OUTPUT],
+                              dev_names=set(["sda", "sda1", "sr0"]),
+                              mapper_names=set(["vg0-lv0"]))
+
+    def test_parse(self):
+        inventory = self._inventory()
+        self.assertEquals(4, len(inventory))
+        entry = inventory.lookup("sda1")
+        self.assertEquals(("sda1", 8, 1, 524288000, "part", False,
+                           "xfs", "/boot", "/dev/sda1"), entry)
+        self.assertEquals("/dev/mapper/vg0-lv0", inventory.lookup("vg0-lv0")[-1])
+        self.assertTrue(inventory.lookup("sr0")[5])
+        self.assertEquals(inventory.lookup("sda"), inventory.by_devno[(8, 0)])
+        self.assertTrue(inventory.lookup("/dev/sda") is not None)
+        self.assertTrue(inventory.lookup("no_such_dev") is None)
+
+    def test_cache(self):
+        scans = []
+        mgr = type(block_mgr())()
+        mgr._uevent_registered = True
+
+        def scan():
+            scans.append(1)
+            return self._inventory()
+        mgr._scan = scan
+
+        mgr.set_inventory_ttl(60)
+        self.assertEquals(4, len(mgr.get_block_dev_list()))
+        self.assertEquals("sda1", mgr.get_block_dev_by_name("sda1").name)
+        self.assertEquals(1, len(scans))
+        mgr.invalidate()
+        mgr.get_block_dev_list()
+        self.assertEquals(2, len(scans))
+
+        mgr.set_inventory_ttl(0)
+        mgr.get_block_dev_list()
+        mgr.get_block_dev_list()
+        self.assertEquals(4, len(scans))
@@ -0,0 +1,133 @@
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.block.blockmgr import SysfsBlockScanner, BlockInventory
+
+
+class FakeSysfs(object):
+    """build a fake system tree with the sysfs/udev/mountinfo layout"""
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_sysfs_")
+        self.mounts = []
+        os.makedirs(os.path.join(self.root, "sys/class/block"))
+        os.makedirs(os.path.join(self.root, "sys/block"))
+        os.makedirs(os.path.join(self.root, "run/udev/data"))
+        os.makedirs(os.path.join(self.root, "proc/self"))
+
+    def cleanup(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, value):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value)
+
+    def add_dev(self, name, major, minor, sectors, parent=None, ro=False,
+                fs_type=None, mount_point=None, holders=(), files={}):
+        if parent is None:
+            dev_dir = os.path.join("sys/block", name)
+        else:
+            dev_dir = os.path.join("sys/block", parent, name)
+            self._write(os.path.join(dev_dir, "partition"), "1\n")
+        self._write(os.path.join(dev_dir, "dev"), "%d:%d\n" % (major, minor))
+        self._write(os.path.join(dev_dir, "size"), "%d\n" % sectors)
+        self._write(os.path.join(dev_dir, "ro"), ro and "1\n" or "0\n")
+        os.makedirs(os.path.join(self.root, dev_dir, "holders"))
+        for holder in holders:
+            os.symlink("../../" + holder,
+                       os.path.join(self.root, dev_dir, "holders", holder))
+        for path, value in files.items():
+            self._write(os.path.join(dev_dir, path), value)
+        os.symlink(os.path.join(self.root, dev_dir),
+                   os.path.join(self.root, "sys/class/block", name))
+        if fs_type is not None:
+            self._write("run/udev/data/b%d:%d" % (major, minor),
+                        "S:disk/by-uuid/1234\nE:ID_FS_TYPE=%s\nE:ID_FS_USAGE=filesystem\n"
+                        % fs_type)
+        if mount_point is not None:
+            self.mounts.append("%d 1 %d:%d / %s rw,relatime shared:1 - %s /dev/%s rw\n" %
+                               (20 + len(self.mounts), major, minor,
+                                mount_point.replace(" ", "\\040"), fs_type, name))
+        self._write("proc/self/mountinfo", "".join(self.mounts))
+
+
+class TestSysfsBlockScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeSysfs()
+
+    def tearDown(self):
+        self.fake.cleanup()
+
+    def scan(self):
+        return SysfsBlockScanner(self.fake.root).scan()
+
+    def test_disk_and_partition(self):
+        self.fake.add_dev("sda", 8, 0, 209715200)
+        self.fake.add_dev("sda1", 8, 1, 1024000, parent="sda",
+                          fs_type="xfs", mount_point="/boot")
+        self.fake.add_dev("sda2", 8, 2, 1024000, parent="sda",
+                          fs_type="ext4", mount_point="/mnt/with space")
+        self.fake.add_dev("sr0", 11, 0, 2097151, ro=True,
+                          files={"device/type": "5\n"})
+        self.assertEquals([
+            ("sda", 8, 0, 107374182400, "disk", False, "", ""),
+            ("sda1", 8, 1, 524288000, "part", False, "xfs", "/boot"),
+            ("sda2", 8, 2, 524288000, "part", False, "ext4", "/mnt/with space"),
+            ("sr0", 11, 0, 1073741312, "rom", True, "", ""),
+        ], self.scan())
+
+    def test_skip_ram_and_empty(self):
+        self.fake.add_dev("ram0", 1, 0, 32768)
+        self.fake.add_dev("loop0", 7, 0, 0)
+        self.fake.add_dev("loop1", 7, 1, 2048, fs_type="squashfs")
+        self.assertEquals([("loop1", 7, 1, 1048576, "loop", False, "squashfs", "")],
+                          self.scan())
+
+    def test_holders(self):
+        self.fake.add_dev("sdb", 8, 16, 2048, holders=("md0", ),
+                          fs_type="linux_raid_member")
+        self.fake.add_dev("sdc", 8, 32, 2048, holders=("md0", ),
+                          fs_type="linux_raid_member")
+        self.fake.add_dev("md0", 9, 0, 2048, holders=("dm-0", ),
+                          files={"md/level": "raid1\n"}, fs_type="LVM2_member")
+        self.fake.add_dev("dm-0", 253, 0, 1024, fs_type="xfs", mount_point="/mnt/lv0",
+                          files={"dm/name": "vg0-lv0\n",
+                                 "dm/uuid": "LVM-abcdef\n"})
+        entries = self.scan()
+        self.assertEquals(["sdb", "md0", "vg0-lv0", "sdc", "md0", "vg0-lv0"],
+                          [entry[0] for entry in entries])
+        self.assertEquals(("md0", 9, 0, 1048576, "raid1", False, "LVM2_member", ""),
+                          entries[1])
+        self.assertEquals(("vg0-lv0", 253, 0, 524288, "lvm", False, "xfs", "/mnt/lv0"),
+                          entries[2])
+
+        inventory = BlockInventory(entries,
+                                   dev_names=set(["sdb", "sdc", "md0", "dm-0"]),
+                                   mapper_names=set(["vg0-lv0"]))
+        self.assertEquals(4, len(inventory))
+        self.assertEquals("/dev/mapper/vg0-lv0", inventory.lookup("vg0-lv0")[-1])
+
+    def test_dm_types(self):
+        self.fake.add_dev("dm-1", 253, 1, 2048,
+                          files={"dm/name": "mpatha\n", "dm/uuid": "mpath-3600\n"})
+        self.fake.add_dev("dm-2", 253, 2, 2048,
+                          files={"dm/name": "mpatha1\n", "dm/uuid": "part1-mpath-3600\n"})
+        self.fake.add_dev("dm-3", 253, 3, 2048,
+                          files={"dm/name": "plain\n", "dm/uuid": "\n"})
+        self.assertEquals([("mpatha", "mpath"), ("mpatha1", "part"), ("plain", "dm")],
+                          [(entry[0], entry[4]) for entry in self.scan()])
+
+    def test_empty_tree(self):
+        self.assertEquals([], SysfsBlockScanner(
+            os.path.join(self.fake.root, "not_exist")).scan())
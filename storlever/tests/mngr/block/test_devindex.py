@@ -0,0 +1,118 @@
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.block import devindex
+from storlever.mngr.block.devindex import DevIndex
+
+
+class TestDevIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_devindex_")
+        self.dev_disk_dir = os.path.join(self.root, "dev", "disk")
+        self.sys_block_dir = os.path.join(self.root, "sys", "block")
+        os.makedirs(os.path.join(self.dev_disk_dir, "by-uuid"))
+        os.makedirs(os.path.join(self.dev_disk_dir, "by-label"))
+        os.makedirs(os.path.join(self.sys_block_dir, "dm-0", "dm"))
+        with open(os.path.join(self.sys_block_dir, "dm-0", "dm", "name"), "w") as f:
+            f.write("vg0-lv0\n")
+        self.index = DevIndex.__class__(dev_disk_dir=self.dev_disk_dir,
+                                        sys_block_dir=self.sys_block_dir)
+        # don't start the uevent monitor in test
+        self.index._uevent_registered = True
+        self.saved = devindex.BLKID_CMD
+        devindex.BLKID_CMD = "/bin/false"
+
+    def tearDown(self):
+        devindex.BLKID_CMD = self.saved
+        shutil.rmtree(self.root)
+
+    def _dev(self, name):
+        return os.path.join(self.root, "dev", name)
+
+    def _link(self, kind, name, dev_name):
+        os.symlink(os.path.join("..", "..", dev_name),
+                   os.path.join(self.dev_disk_dir, "by-" + kind, name))
+
+    def test_lookup(self):
+        self._link("uuid", "1234-abcd", "sdb1")
+        self._link("uuid", "5678-ef00", "dm-0")
+        self._link("label", "my\\x20data", "sdc")
+        self.assertEquals(self._dev("sdb1"), self.index.uuid_to_dev_file("1234-abcd"))
+        self.assertEquals(self._dev("mapper/vg0-lv0"),
+                          self.index.uuid_to_dev_file("5678-ef00"))
+        self.assertEquals(self._dev("sdc"), self.index.label_to_dev_file("my data"))
+        self.assertEquals("", self.index.uuid_to_dev_file("not-exist"))
+
+    def test_refresh(self):
+        link_dir = os.path.join(self.dev_disk_dir, "by-uuid")
+        self._link("uuid", "1234-abcd", "sdb1")
+        os.utime(link_dir, (1000000000, 1000000000))
+        self.assertEquals(self._dev("sdb1"), self.index.uuid_to_dev_file("1234-abcd"))
+        os.remove(os.path.join(link_dir, "1234-abcd"))
+        self._link("uuid", "1234-abcd", "sdc1")
+        # the link dir is not changed in the view of mtime, still cached
+        os.utime(link_dir, (1000000000, 1000000000))
+        self.assertEquals(self._dev("sdb1"), self.index.uuid_to_dev_file("1234-abcd"))
+        # the uevent drops the index
+        self.index.invalidate()
+        self.assertEquals(self._dev("sdc1"), self.index.uuid_to_dev_file("1234-abcd"))
+        # the mtime of the link dir is changed
+        os.remove(os.path.join(link_dir, "1234-abcd"))
+        os.utime(link_dir, (1000000010, 1000000010))
+        self.assertEquals("", self.index.uuid_to_dev_file("1234-abcd"))
+
+    def test_no_udev(self):
+        shutil.rmtree(self.dev_disk_dir)
+        devindex.BLKID_CMD = "/bin/echo"
+        self.assertEquals("-U 1234-abcd", self.index.uuid_to_dev_file("1234-abcd"))
+        devindex.BLKID_CMD = "/bin/false"
+        # cached until the uevent
+        self.assertEquals("-U 1234-abcd", self.index.uuid_to_dev_file("1234-abcd"))
+        self.index.invalidate()
+        self.assertEquals("", self.index.uuid_to_dev_file("1234-abcd"))
+
+    def test_not_linked(self):
+        # the device is not linked by udev yet
+        self._link("uuid", "1234-abcd", "sdb1")
+        devindex.BLKID_CMD = "/bin/echo"
+        self.assertEquals(self._dev("sdb1"), self.index.uuid_to_dev_file("1234-abcd"))
+        self.assertEquals("-U 5678-ef00", self.index.uuid_to_dev_file("5678-ef00"))
+
+    def test_miss_cached(self):
+        link_dir = os.path.join(self.dev_disk_dir, "by-uuid")
+        os.utime(link_dir, (1000000000, 1000000000))
+        counter = os.path.join(self.root, "count")
+        blkid = os.path.join(self.root, "blkid")
+        with open(blkid, "w") as f:
+            f.write("#!/bin/sh\necho >> %s\nexit 2\n" % counter)
+        os.chmod(blkid, 0o755)
+        devindex.BLKID_CMD = blkid
+
+        def blkid_runs():
+            with open(counter) as f:
+                return len(f.readlines())
+
+        self.assertEquals("", self.index.uuid_to_dev_file("1234-abcd"))
+        self.assertEquals("", self.index.uuid_to_dev_file("1234-abcd"))
+        self.assertEquals(1, blkid_runs())
+        # the miss is dropped with the index
+        self._link("uuid", "1234-abcd", "sdb1")
+        os.utime(link_dir, (1000000010, 1000000010))
+        self.assertEquals(self._dev("sdb1"), self.index.uuid_to_dev_file("1234-abcd"))
+        self.assertEquals("", self.index.uuid_to_dev_file("5678-ef00"))
+        self.assertEquals(2, blkid_runs())
+        self.index.invalidate()
+        self.assertEquals("", self.index.uuid_to_dev_file("5678-ef00"))
+        self.assertEquals(3, blkid_runs())
+
+
+if __name__ == '__main__':
+    unittest.main()
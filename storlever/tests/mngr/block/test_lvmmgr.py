@@ -32,6 +32,10 @@ class TestLVM(unittest.TestCase):
         self.assertIn('test_lv1', vg.lvs)
         lv = vg.get_lv('test_lv1')
         self.assertEqual(lv.name, 'test_lv1')
+        # report
+        vg_info = [vg_info for vg_info in lvm.report() if vg_info['name'] == 'test_vg'][0]
+        self.assertIn('test_lv1', [lv_info['name'] for lv_info in vg_info['lvs']])
+        self.assertIn(device, [pv_info['dev_file'] for pv_info in vg_info['pvs']])
         # resize LV
         lv.resize(64*1024*1024*15)
         self.assertEqual(lv.size, 64*1024*1024*15)
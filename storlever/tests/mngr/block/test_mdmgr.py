@@ -1,12 +1,14 @@
 import sys
 import os
+import shutil
+import tempfile
 
 if sys.version_info >= (2, 7):
     import unittest
 else:
     import unittest2 as unittest
 
-from storlever.mngr.block.md.md import md_mgr
+from storlever.mngr.block.md.md import md_mgr, MDStateReader, MDSyncSampler
 from storlever.lib.exception import StorLeverError
 from storlever.tests.mngr.block.utils import get_block_dev_simple
 
@@ -33,3 +35,175 @@ class TestMD(unittest.TestCase):
         self.assertRaises(StorLeverError, mds.get_md, '/dev/md0')
 
 
+MDSTAT = """Personalities : [raid1] [raid6] [raid5] [raid4]
+md127 : active raid1 sdc[2] sdb[0] sdd[3](S)
+      2096064 blocks super 1.2 [2/1] [U_]
+      [===>.................]  recovery = 19.6% (412160/2096064) finish=0.1min speed=206080K/sec
+
+md1 : active raid5 sdg[2](F) sdf[1] sde[0]
+      4192256 blocks super 1.2 level 5, 512k chunk, algorithm 2 [3/2] [UU_]
+
+md2 : inactive sdh[0](S)
+      1048576 blocks super 1.2
+
+unused devices: <none>
+"""
+
+
+class TestMDStateReader(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_md_")
+        self._write("proc/mdstat", MDSTAT)
+        self._add_md("md127", 4192128, {
+            "level": "raid1", "raid_disks": "2", "array_state": "clean",
+            "degraded": "1", "sync_action": "recover", "metadata_version": "1.2",
+            "sync_completed": "824320 / 4192128", "sync_speed": "206080",
+            "component_size": "2096064",
+        }, {
+            "sdb": ("8:16", "0", "in_sync"),
+            "sdc": ("8:32", "1", "spare"),
+            "sdd": ("8:48", "none", "spare"),
+        })
+        self._add_md("md1", 8384512, {
+            "level": "raid5", "raid_disks": "3", "array_state": "active",
+            "degraded": "1", "sync_action": "idle", "metadata_version": "1.2",
+            "sync_completed": "none", "component_size": "2096128",
+            "uuid": "3aaa0122-29827cfa-5331ad66-ca767371",
+        }, {
+            "sde": ("8:64", "0", "in_sync"),
+            "sdf": ("8:80", "1", "in_sync,write_mostly"),
+            "sdg": ("8:96", "2", "faulty"),
+        })
+        os.makedirs(os.path.join(self.root, "dev/md"))
+        os.symlink("../md127", os.path.join(self.root, "dev/md/data"))
+        os.symlink("../md127", os.path.join(self.root, "dev/md/127"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, value):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value)
+
+    def _add_md(self, name, sectors, attrs, devs):
+        self._write("sys/block/%s/size" % name, "%d\n" % sectors)
+        for attr, value in attrs.items():
+            self._write("sys/block/%s/md/%s" % (name, attr), value + "\n")
+        for dev_name, (devno, slot, state) in devs.items():
+            dev_dir = "sys/block/%s/md/dev-%s" % (name, dev_name)
+            self._write(dev_dir + "/block/dev", devno + "\n")
+            self._write(dev_dir + "/slot", slot + "\n")
+            self._write(dev_dir + "/state", state + "\n")
+
+    def test_mdstat(self):
+        mdstat = MDStateReader(self.root).read_mdstat()
+        self.assertEquals(set(["md127", "md1", "md2"]), set(mdstat.keys()))
+        self.assertEquals("raid1", mdstat["md127"]["level"])
+        self.assertEquals("recover", mdstat["md127"]["sync_action"])
+        self.assertEquals((412160, 2096064), mdstat["md127"]["sync_completed"])
+        self.assertEquals(206080, mdstat["md127"]["sync_speed"])
+        self.assertEquals({"number": 3, "flags": ["S"]}, mdstat["md127"]["members"]["sdd"])
+        self.assertEquals(["F"], mdstat["md1"]["members"]["sdg"]["flags"])
+        self.assertEquals("inactive", mdstat["md2"]["state"])
+        self.assertEquals("", mdstat["md2"]["level"])
+
+    def test_read_all(self):
+        reader = MDStateReader(self.root)
+        arrays = reader.read_all()
+        # md2 has no sysfs directory
+        self.assertEquals(set(["md127", "md1"]), set(arrays.keys()))
+
+        md127 = arrays["md127"]
+        self.assertEquals("clean, degraded, recovering", md127["state"])
+        self.assertEquals(2096064, md127["array_size"])
+        self.assertEquals(19, md127["resync_status"])
+        self.assertEquals(206080, md127["sync_speed"])
+        self.assertEquals((3, 1, 3, 0, 2), (md127["total_devices"], md127["active_devices"],
+                                            md127["working_devices"], md127["failed_devices"],
+                                            md127["spare_devices"]))
+        self.assertEquals({"device": "/dev/sdc", "major": "8", "minor": "32", "number": "2",
+                           "raiddevice": "1", "state": "spare rebuilding"},
+                          md127["members"]["2"])
+        self.assertEquals("spare", md127["members"]["3"]["state"])
+        self.assertNotIn("uuid", md127)
+
+        md1 = arrays["md1"]
+        self.assertEquals("active, degraded", md1["state"])
+        self.assertEquals(100, md1["resync_status"])
+        self.assertEquals("active sync writemostly", md1["members"]["1"]["state"])
+        self.assertEquals("faulty", md1["members"]["2"]["state"])
+        self.assertEquals("3aaa0122:29827cfa:5331ad66:ca767371", md1["uuid"])
+        self.assertEquals("Superblock is persistent", md1["persistence"])
+
+        self.assertEquals({"md127": "/dev/md/data"}, reader.list_dev_files())
+
+
+class TestMDSyncSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_md_")
+        os.makedirs(os.path.join(self.root, "proc"))
+        self.sampler = MDSyncSampler(MDStateReader(self.root), backlog=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write_mdstat(self, done, speed):
+        with open(os.path.join(self.root, "proc/mdstat"), "w") as f:
+            f.write(MDSTAT.replace("412160", str(done)).replace("206080", str(speed)))
+
+    def test_sample(self):
+        self._write_mdstat(412160, 206080)
+        self.assertEquals(1, self.sampler.sample())
+        seq, progress = self.sampler.snapshot()
+        self.assertEquals(1, seq)
+        self.assertEquals({"sync_action": "recover", "progress": 19.6, "done": 412160,
+                           "total": 2096064, "speed": 206080, "eta": 8},
+                          progress["md127"])
+
+        # only the changed fields are published
+        self._write_mdstat(618240, 206080)
+        self.assertEquals(1, self.sampler.sample())
+        self.assertEquals(0, self.sampler.sample())
+        events = self.sampler.wait_events(1, 0)
+        self.assertEquals(1, len(events))
+        self.assertEquals(set(["seq", "time", "name", "done", "eta"]), set(events[0].keys()))
+        self.assertEquals((2, "md127", 618240, 7),
+                          (events[0]["seq"], events[0]["name"], events[0]["done"], events[0]["eta"]))
+        self.assertEquals([], self.sampler.wait_events(2, 0))
+
+        # sync finished
+        with open(os.path.join(self.root, "proc/mdstat"), "w") as f:
+            f.write("Personalities : [raid1]\nunused devices: <none>\n")
+        self.sampler.sample()
+        self.assertEquals({"sync_action": "idle"},
+                          dict((key, value) for key, value in self.sampler.wait_events(2, 0)[0].items()
+                               if key in ("sync_action", "done")))
+
+        # too old events are dropped from the backlog
+        for done in range(10):
+            self._write_mdstat(done, 1)
+            self.sampler.sample()
+        self.assertEquals(None, self.sampler.wait_events(2, 0))
+
+        # the sequence got before the restart of the sampler
+        seq, progress = self.sampler.snapshot()
+        self.assertEquals(None, self.sampler.wait_events(seq + 100, 0))
+
+    def test_subscribe(self):
+        self._write_mdstat(412160, 206080)
+        sampler = MDSyncSampler(MDStateReader(self.root), interval=0.01,
+                                max_subscribers=2, idle_timeout=0)
+        self.assertTrue(sampler.subscribe())
+        self.assertTrue(sampler.subscribe())
+        self.assertFalse(sampler.subscribe())
+        self.assertEquals(1, sampler.snapshot()[0])
+        thread = sampler._thread
+        sampler.unsubscribe()
+        sampler.unsubscribe()
+        thread.join(1)
+        self.assertEquals(None, sampler._thread)
@@ -0,0 +1,80 @@
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.block.smarthistory import SmartHistory, SmartRecord, \
+    history_key, SMART_RECORD_SIZE
+
+
+def make_record(timestamp, reallocated=0):
+    return SmartRecord(timestamp, "passed", 35, 1000 + int(timestamp) // 3600,
+                       reallocated, 0, None, None, 0)
+
+
+class TestSmartHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_smart_history_")
+        self.history = SmartHistory(self.root, min_interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_record(self):
+        record = SmartRecord(1400000000.5, "failed", 40, 9876, 8, 2, None, 3, 0)
+        self.assertEquals(SMART_RECORD_SIZE, len(record.pack()))
+        self.assertEquals(record, SmartRecord.unpack(record.pack()))
+        self.assertEquals(None, record.to_dict()["offline_uncorrectable"])
+        info = {"health": "passed", "temperature": 36, "reallocated_sectors": 1}
+        record = SmartRecord.from_info(info, 1.0)
+        self.assertEquals(36, record.temperature)
+        self.assertEquals(None, record.grown_defects)
+
+    def test_history_key(self):
+        self.assertEquals("ST2000DM001-1CH164_Z1E5ABCD",
+                          history_key({"model": "ST2000DM001-1CH164",
+                                       "serial": "Z1E5ABCD"}, "/dev/sdb"))
+        self.assertEquals("WDC_WD20EARS_WD-1234",
+                          history_key({"model": "WDC WD20EARS",
+                                       "serial": "WD-1234"}, "/dev/sdb"))
+        self.assertEquals("sdb", history_key({"serial": ""}, "/dev/sdb"))
+
+    def test_append(self):
+        self.assertTrue(self.history.append("disk", make_record(1000)))
+        self.assertFalse(self.history.append("disk", make_record(1030)))
+        self.assertTrue(self.history.append("disk", make_record(1060)))
+        self.assertEquals([1000, 1060], [r.time for r in self.history.query("disk")])
+
+        # the last record time is read from the file
+        history = SmartHistory(self.root, min_interval=60)
+        self.assertFalse(history.append("disk", make_record(1100)))
+
+        # the partial record left by a crash is dropped
+        with open(os.path.join(self.root, "disk.smart"), "ab") as f:
+            f.write("partial")
+        self.assertTrue(history.append("disk", make_record(1200)))
+        self.assertEquals([1000, 1060, 1200], [r.time for r in history.query("disk")])
+        self.assertEquals(["disk"], history.keys())
+
+    def test_query(self):
+        for i in range(1000):
+            self.history.append("disk", make_record(i * 3600, reallocated=i))
+        records = self.history.query("disk", since=3600 * 10, until=3600 * 20)
+        self.assertEquals(range(11, 21), [r.reallocated_sectors for r in records])
+        self.assertEquals([], self.history.query("disk", since=3600 * 1000))
+        self.assertEquals([], self.history.query("not_exist"))
+
+        records = self.history.query("disk", max_points=4)
+        self.assertEquals([0, 333, 666, 999], [r.reallocated_sectors for r in records])
+        records = self.history.query("disk", since=3600 * 500, max_points=1)
+        self.assertEquals([999], [r.reallocated_sectors for r in records])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.block import smartmgr
+from storlever.mngr.block.smartmgr import SmartManager, parse_smart_output
+from storlever.mngr.block.smarthistory import SmartHistory
+
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "smartctl_output")
+
+
+def read_output(name):
+    with open(os.path.join(OUTPUT_DIR, name), "r") as f:
+        return f.read()
+
+
+class TestParseSmartOutput(unittest.TestCase):
+
+    def test_ata(self):
+        info = parse_smart_output(read_output("ata"))
+        self.assertEquals("ST2000DM001-1CH164", info["model"])
+        self.assertEquals("Seagate Barracuda 7200.14 (AF)", info["family"])
+        self.assertEquals("Z1E5ABCD", info["serial"])
+        self.assertEquals("CC27", info["firmware"])
+        self.assertTrue(info["smart_available"])
+        self.assertTrue(info["smart_enabled"])
+        self.assertTrue(info["auto_offline_enabled"])
+        self.assertEquals(smartmgr.SMART_HEALTH_PASSED, info["health"])
+        self.assertEquals(36, info["temperature"])
+        self.assertEquals(9876, info["power_on_hours"])
+        self.assertEquals(8, info["reallocated_sectors"])
+        self.assertEquals(2, info["pending_sectors"])
+        self.assertEquals(0, info["offline_uncorrectable"])
+        self.assertEquals(0, info["uncorrected_errors"])
+        self.assertEquals(None, info["grown_defects"])
+        self.assertEquals(10, len(info["attributes"]))
+        attr = info["attributes"][1]
+        self.assertEquals({"id": 5, "name": "Reallocated_Sector_Ct", "flag": "0x0033",
+                           "value": 100, "worst": 100, "thresh": 10,
+                           "type": "Pre-fail", "updated": "Always", "when_failed": "",
+                           "raw": "8", "raw_value": 8}, attr)
+        self.assertTrue(info["detail"].startswith("=== START OF INFORMATION"))
+
+    def test_sas(self):
+        info = parse_smart_output(read_output("sas"))
+        self.assertEquals("ST4000NM0023", info["model"])
+        self.assertEquals("SEAGATE", info["vendor"])
+        self.assertEquals("Z1Z0ABCD0000C4201XYZ", info["serial"])
+        self.assertEquals("0003", info["firmware"])
+        self.assertTrue(info["smart_enabled"])
+        self.assertEquals(smartmgr.SMART_HEALTH_PASSED, info["health"])
+        self.assertEquals(33, info["temperature"])
+        self.assertEquals(5432, info["power_on_hours"])
+        self.assertEquals(3, info["grown_defects"])
+        self.assertEquals(0, info["uncorrected_errors"])
+        self.assertEquals(None, info["reallocated_sectors"])
+        self.assertEquals([], info["attributes"])
+
+    def test_failed(self):
+        output = read_output("ata").replace("test result: PASSED", "test result: FAILED!")
+        self.assertEquals(smartmgr.SMART_HEALTH_FAILED,
+                          parse_smart_output(output)["health"])
+        info = parse_smart_output("")
+        self.assertEquals(smartmgr.SMART_HEALTH_UNKNOWN, info["health"])
+        self.assertFalse(info["smart_available"])
+
+
+class TestSmartManager(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_smart_")
+        self.count_file = os.path.join(self.root, "count")
+        # fake smartctl prints the output file named by the device without
+        # the digits, and exits with the status in the file "<device>.status"
+        self.smartctl = os.path.join(self.root, "smartctl")
+        with open(self.smartctl, "w") as f:
+            f.write("#!/bin/sh\n"
+                    "dev=$(eval echo \\${$#})\n"
+                    "echo $dev >> %s\n"
+                    "sleep 0.3\n"
+                    "cat %s/$(basename $dev | tr -d 0-9)\n"
+                    "[ -f $dev.status ] && exit $(cat $dev.status)\n"
+                    "exit 0\n" % (self.count_file, OUTPUT_DIR))
+        os.chmod(self.smartctl, 0755)
+        self.saved = smartmgr.SMARTCTL_CMD
+        smartmgr.SMARTCTL_CMD = self.smartctl
+        self.mgr = SmartManager.__class__(max_workers=4, cache_ttl=60)
+        self.mgr.history = SmartHistory(os.path.join(self.root, "history"))
+
+    def tearDown(self):
+        smartmgr.SMARTCTL_CMD = self.saved
+        shutil.rmtree(self.root)
+
+    def _dev(self, name, status=None):
+        dev_file = os.path.join(self.root, name)
+        if status is not None:
+            with open(dev_file + ".status", "w") as f:
+                f.write(str(status))
+        return dev_file
+
+    def _count(self):
+        with open(self.count_file, "r") as f:
+            return len(f.read().splitlines())
+
+    def test_parallel(self):
+        dev_files = [self._dev("ata%d" % i) for i in range(4)] + [self._dev("sas")]
+        start = time.time()
+        infos = self.mgr.get_smart_info_list(dev_files)
+        # 2 rounds of 4 workers instead of 5 serial runs
+        self.assertLess(time.time() - start, 1.2)
+        self.assertEquals(5, len(infos))
+        self.assertEquals("ST2000DM001-1CH164", infos[dev_files[0]]["model"])
+        self.assertEquals("ST4000NM0023", infos[dev_files[-1]]["model"])
+        self.assertEquals(5, self._count())
+
+    def test_cache(self):
+        dev_file = self._dev("ata")
+        info = self.mgr.get_smart_info(dev_file)
+        info["model"] = "changed"
+        self.assertEquals("ST2000DM001-1CH164", self.mgr.get_smart_info(dev_file)["model"])
+        self.assertEquals(1, self._count())
+        self.mgr.get_smart_info(dev_file, refresh=True)
+        self.assertEquals(2, self._count())
+        self.mgr.invalidate(dev_file)
+        self.mgr.get_smart_info(dev_file)
+        self.assertEquals(3, self._count())
+
+    def test_history(self):
+        dev_file = self._dev("ata")
+        self.mgr.get_smart_info(dev_file)
+        records = self.mgr.get_smart_history(dev_file)
+        self.assertEquals(1, len(records))
+        self.assertEquals(8, records[0]["reallocated_sectors"])
+        self.assertEquals("passed", records[0]["health"])
+        # within the min interval of the history
+        self.mgr.get_smart_info(dev_file, refresh=True)
+        self.assertEquals(1, len(self.mgr.get_smart_history(dev_file)))
+        self.assertEquals(["ST2000DM001-1CH164_Z1E5ABCD"], self.mgr.history.keys())
+
+        # the history is queried without running smartctl
+        count = self._count()
+        self.mgr.invalidate()
+        self.assertEquals(1, len(self.mgr.get_smart_history(dev_file)))
+        self.assertEquals(1, len(self.mgr.get_smart_history(
+            "", key="ST2000DM001-1CH164_Z1E5ABCD")))
+        self.assertEquals([], self.mgr.get_smart_history(self._dev("sas", status=2)))
+        self.assertRaises(StorLeverError, self.mgr.get_smart_history,
+                          dev_file, key="../not_exist")
+        self.assertEquals(count, self._count())
+
+    def test_status(self):
+        # the disk status bits, the output is still parsed
+        failing = self._dev("ata", status=8)
+        self.assertEquals(9876, self.mgr.get_smart_info(failing)["power_on_hours"])
+        # the device can not be opened
+        missing = self._dev("sas", status=2)
+        infos = self.mgr.get_smart_info_list([missing])
+        self.assertIn("error", infos[missing])
+        self.assertRaises(StorLeverError, self.mgr.get_smart_info, missing)
+
+
+if __name__ == '__main__':
+    unittest.main()
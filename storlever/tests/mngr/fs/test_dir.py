@@ -8,6 +8,7 @@ else:
 
 from storlever.mngr.fs.fsmgr import fs_mgr
 from storlever.mngr.fs import ext4
+from storlever.mngr.system.jobmgr import job_mgr
 from utils import get_block_dev
 
 
@@ -52,6 +53,8 @@ class TestFsDir(unittest.TestCase):
 
         f.mod_dir_owner("test", "root", "root")
 
+        # the directory is indexed by the refresh job
+        self.assertTrue(job_mgr().wait(f.submit_dir_index_refresh("test"), 60))
         usage_list = f.dir_usage_stat("test")
         found = False
         for each_usage in usage_list:
@@ -0,0 +1,209 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib.config import config_writer
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.fs.dirindex import DirIndex, DirIndexManager
+from storlever.mngr.system.jobmgr import job_mgr
+
+
+class TestDirIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_dirindex_")
+        self.data = os.path.join(self.root, "data")
+        self.index_file = os.path.join(self.root, "index", "data.idx")
+        self._write("a/a1/f", 1000)
+        self._write("a/f", 100)
+        self._write("b/f", 10)
+        self._write("f", 1)
+        os.makedirs(os.path.join(self.data, "a", "a2"))
+        # make the mtime of the directories older than the scans
+        self._age()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, relative_path, size):
+        path = os.path.join(self.data, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("x" * size)
+
+    def _size(self, *relative_paths):
+        """return the total size of the directories themselves"""
+        return sum(os.lstat(os.path.join(self.data, relative_path)).st_size
+                   for relative_path in relative_paths)
+
+    def _age(self):
+        for dir_path, dir_names, file_names in os.walk(self.data):
+            os.utime(dir_path, (1000000000, 1000000000))
+
+    def _bytes(self, index, relative_path="", **kwargs):
+        return dict((usage["relpath"], usage["bytes"])
+                    for usage in index.query(relative_path, **kwargs))
+
+    def _index(self, max_workers=2):
+        return DirIndex(self.data, self.index_file, max_workers)
+
+    def test_query(self):
+        index = self._index()
+        index.refresh()
+        usages = self._bytes(index)
+        self.assertEquals(5, len(usages))
+        self.assertEquals(self._size("", "a", "a/a1", "a/a2", "b") + 1111, usages[""])
+        self.assertEquals(self._size("a", "a/a1", "a/a2") + 1100, usages["a"])
+        self.assertEquals(self._size("a/a1") + 1000, usages["a/a1"])
+        self.assertEquals(self._size("a/a2"), usages["a/a2"])
+
+        self.assertEquals(["", "a", "b"], sorted(self._bytes(index, depth=1)))
+        self.assertEquals(["a", "a/a1", "a/a2"], sorted(self._bytes(index, "a")))
+        usage_list = index.query(top=2)
+        self.assertEquals(["", "a"], [usage["relpath"] for usage in usage_list])
+        self.assertEquals(os.path.join(self.data, "a"), usage_list[1]["abspath"])
+        self.assertEquals(1, usage_list[1]["depth"])
+        self.assertRaises(StorLeverError, index.query, "c")
+
+    def test_incremental(self):
+        index = self._index()
+        index.refresh()
+
+        # the changed directory is rescanned
+        self._write("b/g", 5)
+        os.makedirs(os.path.join(self.data, "b", "c"))
+        self._write("b/c/f", 7)
+        index.refresh()
+        usages = self._bytes(index)
+        self.assertEquals(self._size("b", "b/c") + 22, usages["b"])
+        self.assertEquals(self._size("b/c") + 7, usages["b/c"])
+        self.assertEquals(usages["a"] + usages["b"] + self._size("") + 1, usages[""])
+
+        # the file modified in place is counted by a full refresh
+        self._age()
+        index.refresh()
+        self._write("a/a1/f", 2000)
+        os.utime(os.path.join(self.data, "a", "a1"), (1000000000, 1000000000))
+        index.refresh()
+        self.assertEquals(self._size("a/a1") + 1000, self._bytes(index)["a/a1"])
+        index.refresh(full=True)
+        self.assertEquals(self._size("a/a1") + 2000, self._bytes(index)["a/a1"])
+
+        # refresh a subtree
+        shutil.rmtree(os.path.join(self.data, "a", "a1"))
+        index.refresh("a")
+        usages = self._bytes(index)
+        self.assertNotIn("a/a1", usages)
+        self.assertEquals(self._size("a", "a/a2") + 100, usages["a"])
+        self.assertEquals(usages["a"] + usages["b"] + self._size("") + 1, usages[""])
+
+    def test_refresh_top(self):
+        index = self._index()
+        self.assertFalse(index.is_indexed())
+        self.assertEquals("", index.refresh_top("b/c/d"))
+        index.refresh()
+        self._write("b/c/d/f", 3)
+        self.assertFalse(index.is_indexed("b/c/d"))
+        self.assertEquals("b", index.refresh_top("b/c/d"))
+        self.assertEquals("a/a1", index.refresh_top("a/a1"))
+        index.refresh(index.refresh_top("b/c/d"))
+        self.assertTrue(index.is_indexed("b/c/d"))
+        self.assertEquals(self._size("b/c/d") + 3, self._bytes(index, "b/c/d")["b/c/d"])
+        self.assertEquals(self._size("b", "b/c", "b/c/d") + 13, self._bytes(index)["b"])
+
+    def test_cancel(self):
+        index = self._index()
+        hang = threading.Event()
+        scan = index._scan
+
+        def _scan(relative_path, *args):
+            # like lstat on a dead NFS server
+            if relative_path == "a":
+                hang.wait()
+            return scan(relative_path, *args)
+        index._scan = _scan
+        cancel = threading.Event()
+        errors = []
+
+        def _refresh():
+            try:
+                index.refresh(cancel=cancel)
+            except StorLeverError as e:
+                errors.append(e)
+        thread = threading.Thread(target=_refresh)
+        thread.start()
+        time.sleep(0.2)
+        # the refresh waiting for the hanging one is cancelled as well
+        waiting = threading.Event()
+        waiting.set()
+        self.assertRaises(StorLeverError, index.refresh, cancel=waiting)
+
+        cancel.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEquals(1, len(errors))
+        self.assertFalse(index.is_indexed())
+        # the refresh lock is released though the scan still hangs
+        index._scan = scan
+        index.refresh()
+        self.assertTrue(index.is_indexed("a/a1"))
+        hang.set()
+
+    def test_persist(self):
+        index = self._index()
+        index.refresh()
+        usages = self._bytes(index)
+
+        loaded = self._index()
+        self.assertTrue(loaded.load())
+        self.assertEquals(usages, self._bytes(loaded))
+        self.assertEquals(index.update_time, loaded.update_time)
+        self.assertEquals(sorted(index._nodes["a"].subdirs),
+                          sorted(loaded._nodes["a"].subdirs))
+
+        with open(self.index_file, "wb") as f:
+            f.write("corrupted")
+        self.assertFalse(self._index().load())
+
+    def test_manager(self):
+        mgr = DirIndexManager.__class__(os.path.join(self.root, "index"), 2)
+        index = mgr.get_index("data", self.data)
+        self.assertTrue(mgr.get_index("data", self.data) is index)
+        index.refresh()
+        self.assertTrue(os.path.exists(self.index_file))
+        mgr.drop_index("data")
+        self.assertFalse(os.path.exists(self.index_file))
+        self.assertEquals(None, mgr.get_index("data", self.data).update_time)
+
+    def test_submit_refresh(self):
+        mgr = DirIndexManager.__class__(os.path.join(self.root, "index"), 2)
+        saved = job_mgr().state_file
+        job_mgr().state_file = os.path.join(self.root, "jobs.yaml")
+        try:
+            index = mgr.get_index("data", self.data)
+            with index._refresh_lock:
+                # not indexed yet, refreshed from the root
+                job_id = mgr.submit_refresh("data", self.data, "a/a1")
+                # the same refresh is not submitted again while it's running
+                self.assertEquals(job_id, mgr.submit_refresh("data", self.data, "a"))
+            self.assertTrue(job_mgr().wait(job_id, 5))
+            self.assertTrue(index.is_indexed("a/a1"))
+            job_id2 = mgr.submit_refresh("data", self.data, "a/a1")
+            self.assertNotEquals(job_id, job_id2)
+            self.assertTrue(job_mgr().wait(job_id2, 5))
+        finally:
+            config_writer().flush()
+            job_mgr().state_file = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.fs import fsusage
+from storlever.mngr.fs.fsusage import FsUsageManager, empty_usage
+from storlever.mngr.fs.fs import FileSystem
+from storlever.mngr.fs.fsmgr import fs_mgr
+
+
+class _DeadNfs(FileSystem):
+    """the fs mounted from a dead server, whose availability check hangs"""
+
+    def is_available(self):
+        raise AssertionError("the availability is checked")
+
+    def is_mounted(self):
+        return self.name == "mounted"
+
+
+class TestFsUsageManager(unittest.TestCase):
+
+    def setUp(self):
+        self.hang = threading.Event()
+        self.hanging = set()
+        self.failing = set()
+        self.saved = fsusage.statvfs_usage
+        fsusage.statvfs_usage = self._statvfs_usage
+        self.mgr = FsUsageManager.__class__(max_workers=2, timeout=0.5)
+
+    def tearDown(self):
+        self.hang.set()
+        fsusage.statvfs_usage = self.saved
+
+    def _statvfs_usage(self, mount_point):
+        # like statvfs on a dead NFS mount
+        if mount_point in self.hanging:
+            self.hang.wait()
+        if mount_point in self.failing:
+            raise OSError(116, "Stale file handle")
+        time.sleep(0.1)
+        return self.saved("/")
+
+    def test_parallel(self):
+        start = time.time()
+        usages = self.mgr.get_usage_list(["/", "/a", "/b", "/c"])
+        # 2 rounds of 2 workers
+        self.assertLess(time.time() - start, 0.35)
+        self.assertEquals(4, len(usages))
+        self.assertFalse(usages["/a"]["stale"])
+        self.assertTrue(usages["/a"]["total"] > 0)
+        self.assertTrue(usages["/a"]["update_time"] <= time.time())
+
+    def test_hang(self):
+        usage = self.mgr.get_usage("/nfs")
+        self.hanging.add("/nfs")
+        self.failing.add("/stale")
+
+        start = time.time()
+        usages = self.mgr.get_usage_list(["/nfs", "/stale", "/a", "/b"])
+        self.assertLess(time.time() - start, 0.7)
+        # the last known usage
+        self.assertTrue(usages["/nfs"]["stale"])
+        self.assertEquals(usage["total"], usages["/nfs"]["total"])
+        self.assertEquals(usage["update_time"], usages["/nfs"]["update_time"])
+        self.assertTrue(usages["/stale"]["stale"])
+        self.assertEquals(0, usages["/stale"]["total"])
+        self.assertEquals(None, usages["/stale"]["update_time"])
+        self.assertFalse(usages["/a"]["stale"])
+
+        # the hanging mount is neither waited for nor holding a worker
+        start = time.time()
+        usages = self.mgr.get_usage_list(["/nfs", "/a", "/b"])
+        self.assertLess(time.time() - start, 0.35)
+        self.assertTrue(usages["/nfs"]["stale"])
+        self.assertFalse(usages["/b"]["stale"])
+
+        # the mount is back
+        self.hanging.clear()
+        self.hang.set()
+        time.sleep(0.2)
+        self.assertFalse(self.mgr.get_usage("/nfs")["stale"])
+
+
+class TestFsUsageList(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_usage_")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_mounted(self):
+        fs_list = [_DeadNfs(name, {"mount_point": self.root, "dev_file": ""})
+                   for name in ("mounted", "umounted")]
+        usages = fs_mgr().get_fs_usage_list(fs_list)
+        self.assertGreater(usages["mounted"]["total"], 0)
+        self.assertEquals(empty_usage(), usages["umounted"])
+        self.assertGreater(fs_list[0].usage_info()["total"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
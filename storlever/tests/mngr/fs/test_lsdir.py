@@ -0,0 +1,106 @@
+import sys
+import os
+import pwd
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.fs import fs
+from storlever.mngr.fs.fs import FileSystem
+
+
+class TestLsDir(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_ls_")
+        self.fs = FileSystem("test", {"mount_point": self.root, "dev_file": ""})
+        self.fs.is_available = lambda: True
+        os.makedirs(os.path.join(self.root, "share", "sub"))
+        for i in range(10):
+            os.mkdir(os.path.join(self.root, "dir%d" % i), 0750)
+            with open(os.path.join(self.root, "file%d" % i), "w") as f:
+                f.write("x")
+        os.symlink("dir0", os.path.join(self.root, "link"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _list_all(self, limit, sort):
+        names = []
+        cursor = None
+        while True:
+            page, cursor = self.fs.ls_dir_page(limit=limit, cursor=cursor, sort=sort)
+            self.assertTrue(len(page) <= limit)
+            names.extend(info["name"] for info in page)
+            if cursor is None:
+                return names
+
+    def test_ls_dir(self):
+        dirs = dict((info["name"], info) for info in self.fs.ls_dir())
+        self.assertEquals(12, len(dirs))
+        info = dirs["dir3"]
+        self.assertEquals(0750 & ~self._umask(), info["mode"])
+        self.assertEquals(os.path.join(self.root, "dir3"), info["abspath"])
+        self.assertEquals("dir3", info["relpath"])
+        self.assertEquals(pwd.getpwuid(os.getuid()).pw_name, info["user"])
+        self.assertIn("link", dirs)
+        self.assertEquals(["sub"], [info["name"] for info in self.fs.ls_dir("share")])
+        self.assertEquals("share/sub", self.fs.ls_dir("share")[0]["relpath"])
+        self.assertRaises(StorLeverError, self.fs.ls_dir, "not_exist")
+
+    def _umask(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        return umask
+
+    def test_page(self):
+        names = self._list_all(5, None)
+        self.assertEquals(12, len(names))
+        self.assertEquals(sorted(names), sorted(set(names)))
+
+        names = self._list_all(5, "name")
+        self.assertEquals(["dir%d" % i for i in range(10)] + ["link", "share"], names)
+        page, cursor = self.fs.ls_dir_page(limit=3, sort="name")
+        self.assertEquals("dir2", cursor)
+        # the name cursor is the default
+        self.assertEquals(cursor, self.fs.ls_dir_page(limit=3)[1])
+        self.assertEquals(12, len(self._list_all(5, fs.LS_SORT_NONE)))
+        self.assertRaises(StorLeverError, self.fs.ls_dir_page, cursor="x", sort=None)
+        self.assertRaises(StorLeverError, self.fs.ls_dir_page, sort="mtime")
+
+    @unittest.skipIf(fs.scandir is None, "scandir is not installed")
+    def test_d_type(self):
+        # the sub directories are known from the directory entries, and
+        # only the returned ones are stat'ed
+        saved_isdir, saved_stat = os.path.isdir, os.stat
+        stated = []
+
+        def _stat(path):
+            stated.append(os.path.basename(path))
+            return saved_stat(path)
+        os.path.isdir = None
+        os.stat = _stat
+        try:
+            page, cursor = self.fs.ls_dir_page(limit=2, sort=None)
+        finally:
+            os.path.isdir, os.stat = saved_isdir, saved_stat
+        self.assertEquals(2, len(page))
+        self.assertNotIn("file0", stated)
+
+    def test_no_scandir(self):
+        saved = fs.scandir
+        fs.scandir = None
+        try:
+            self.assertEquals(12, len(self._list_all(4, None)))
+            self.assertEquals(12, len(self.fs.ls_dir(sort="name")))
+        finally:
+            fs.scandir = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.fs.mounttable import MountTable, MountSnapshot, \
+    parse_mountinfo
+
+
+MOUNTINFO = """\
+17 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,data=ordered
+20 17 0:4 / /proc rw,nosuid,nodev,noexec,relatime shared:5 - proc proc rw
+40 17 9:0 / /mnt/data rw,noatime shared:20 - xfs /dev/md0 rw,usrquota
+41 17 0:38 / /mnt/nfs\\040share rw,relatime - nfs 192.168.1.2:/export/ rw,vers=3
+42 40 9:0 /sub /mnt/data rw,noatime - xfs /dev/md0 rw
+bad line
+"""
+
+
+class TestParseMountinfo(unittest.TestCase):
+
+    def test_parse(self):
+        entries = parse_mountinfo(MOUNTINFO)
+        self.assertEquals(5, len(entries))
+        entry = entries[2]
+        self.assertEquals((40, 17, (9, 0)), entry[:3])
+        self.assertEquals("/mnt/data", entry.mount_point)
+        self.assertEquals("xfs", entry.fs_type)
+        self.assertEquals("/dev/md0", entry.source)
+        self.assertEquals("rw,usrquota", entry.super_options)
+        self.assertEquals("/mnt/nfs share", entries[3].mount_point)
+
+    def test_snapshot(self):
+        snapshot = MountSnapshot(parse_mountinfo(MOUNTINFO))
+        self.assertTrue(snapshot.is_mounted("/dev/md0/", "/mnt/data"))
+        self.assertTrue(snapshot.is_mounted("192.168.1.2:/export", "/mnt/nfs share"))
+        self.assertFalse(snapshot.is_mounted("/dev/md0", "/mnt/other"))
+        self.assertFalse(snapshot.is_mounted("/dev/sda1", "/mnt/data"))
+        # the bind mount on the top
+        self.assertEquals("/sub", snapshot.get("/mnt/data").root)
+        self.assertEquals(None, snapshot.get("/mnt/other"))
+
+
+class TestMountTable(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_mount_")
+        self.mountinfo_file = os.path.join(self.root, "mountinfo")
+        with open(self.mountinfo_file, "w") as f:
+            f.write(MOUNTINFO)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_cache(self):
+        table = MountTable.__class__(self.mountinfo_file)
+        snapshot = table.snapshot()
+        self.assertEquals(5, len(snapshot))
+        with open(self.mountinfo_file, "w") as f:
+            f.write(MOUNTINFO.splitlines(True)[0])
+        # a regular file is never marked changed
+        self.assertTrue(table.snapshot() is snapshot)
+        table.invalidate()
+        self.assertEquals(1, len(table.snapshot()))
+
+    @unittest.skipUnless(os.path.exists("/proc/self/mountinfo"),
+                         "no mountinfo in the system")
+    def test_proc(self):
+        table = MountTable.__class__()
+        snapshot = table.snapshot()
+        self.assertNotEqual(None, snapshot.get("/"))
+        # not re-read without mount change
+        self.assertTrue(table.snapshot() is snapshot)
+
+
+if __name__ == '__main__':
+    unittest.main()
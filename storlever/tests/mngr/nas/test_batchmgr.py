@@ -0,0 +1,105 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib.config import config_writer
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.system import cfgmgr
+from storlever.mngr.nas import ftpmgr, nfsmgr, smbmgr
+from storlever.mngr.nas.batchmgr import nas_batch_mgr
+
+
+class TestNasBatchMgr(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_nas_")
+        self.saved = []
+        self._patch(cfgmgr, "STORLEVER_CONF_DIR", os.path.join(self.root, "storlever"))
+        self._patch(nfsmgr, "NFS_ETC_CONF_DIR", os.path.join(self.root, "etc"))
+        self._patch(smbmgr, "SMB_ETC_CONF_DIR", os.path.join(self.root, "samba"))
+        self._patch(ftpmgr, "VSFTPD_ETC_CONF_DIR", os.path.join(self.root, "vsftpd"))
+        for mgr, name in ((nfsmgr.nfs_mgr(), "nfs.yaml"),
+                          (smbmgr.smb_mgr(), "smb.yaml"),
+                          (ftpmgr.ftp_mgr(), "ftp.yaml")):
+            self._patch(mgr, "conf_file", os.path.join(self.root, "storlever", name))
+
+    def tearDown(self):
+        config_writer().flush()
+        for obj, name, value in reversed(self.saved):
+            setattr(obj, name, value)
+        shutil.rmtree(self.root)
+
+    def _patch(self, obj, name, value):
+        self.saved.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def test_batch(self):
+        operations = []
+        for i in range(200):
+            operations.append({"op": "create", "type": "smb", "name": "share%d" % i,
+                               "conf": {"path": self.root, "read_only": False}})
+            operations.append({"op": "create", "type": "nfs", "name": "export%d" % i,
+                               "conf": {"path": os.path.join(self.root, str(i)),
+                                        "clients": [{"host": "*", "options": "rw"}]}})
+        operations.append({"op": "create", "type": "ftp", "name": "root",
+                           "conf": {"login_enable": True}})
+        operations.append({"op": "update", "type": "smb", "name": "share0",
+                           "conf": {"comment": "first", "read_only": None}})
+        operations.append({"op": "delete", "type": "nfs", "name": "export1"})
+        for i in range(200):
+            os.mkdir(os.path.join(self.root, str(i)))
+
+        start = time.time()
+        nas_batch_mgr().apply(operations)
+        self.assertLess(time.time() - start, 10)
+
+        shares = smbmgr.smb_mgr().get_share_conf_list()
+        self.assertEquals(200, len(shares))
+        share0 = smbmgr.smb_mgr().get_share_conf("share0")
+        self.assertEquals("first", share0["comment"])
+        self.assertFalse(share0["read_only"])
+        self.assertEquals(199, len(nfsmgr.nfs_mgr().get_export_list()))
+        self.assertTrue(ftpmgr.ftp_mgr().get_user_conf("root")["login_enable"])
+
+        config_writer().flush()
+        with open(os.path.join(self.root, "etc", "exports")) as f:
+            exports = f.read()
+        self.assertIn(os.path.join(self.root, "0") + "\t*(rw)\n", exports)
+        self.assertNotIn(os.path.join(self.root, "1") + "\t", exports)
+
+    def test_rollback(self):
+        nas_batch_mgr().apply([{"op": "create", "type": "smb", "name": "a",
+                                "conf": {"path": self.root}}])
+        try:
+            nas_batch_mgr().apply([
+                {"op": "create", "type": "smb", "name": "b", "conf": {}},
+                {"op": "delete", "type": "smb", "name": "a"},
+                {"op": "create", "type": "nfs", "name": "c",
+                 "conf": {"path": os.path.join(self.root, "not_exist")}},
+            ])
+        except StorLeverError as e:
+            self.assertEquals(400, e.http_status_code)
+            self.assertTrue(str(e).startswith("operation 2:"))
+        else:
+            self.fail("StorLeverError is not raised")
+
+        # nothing is changed
+        self.assertEquals(["a"], [share["share_name"] for share in
+                                  smbmgr.smb_mgr().get_share_conf_list()])
+        self.assertEquals([], nfsmgr.nfs_mgr().get_export_list())
+
+        self.assertRaises(StorLeverError, nas_batch_mgr().apply,
+                          [{"op": "delete", "type": "ftp", "name": "not_exist"}])
+        self.assertRaises(StorLeverError, nas_batch_mgr().apply,
+                          [{"op": "rename", "type": "smb", "name": "a"}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,15 @@
 import sys
 import os
+import shutil
+import tempfile
 
 if sys.version_info >= (2, 7):
     import unittest
 else:
     import unittest2 as unittest
 
+from storlever.lib.config import config_writer
+from storlever.mngr.nas import smbmgr
 from storlever.mngr.nas.smbmgr import smb_mgr
 
 
@@ -84,11 +88,86 @@ class TestSmbMgr(unittest.TestCase):
         self.assertFalse(found)
 
 
-
-
-
-
-
-
-
-
+class TestSmbEtcConf(unittest.TestCase):
+
+    def setUp(self):
+        self.etc_dir = tempfile.mkdtemp(prefix="storlever_samba_")
+        self.orig_etc_dir = smbmgr.SMB_ETC_CONF_DIR
+        smbmgr.SMB_ETC_CONF_DIR = self.etc_dir
+        self.mgr = type(smb_mgr())()
+        self.smb_conf = self.mgr.smb_conf_schema.validate({})
+        self.smb_etc_conf_file = os.path.join(self.etc_dir, "smb.conf")
+        with open(self.smb_etc_conf_file, "w") as f:
+            f.write("# hand edited\n[global]\n\tworkgroup = OLD\n\tlog level = 1\n"
+                    "[old share]\n\tpath = /old\n")
+
+    def tearDown(self):
+        config_writer().flush()
+        smbmgr.SMB_ETC_CONF_DIR = self.orig_etc_dir
+        shutil.rmtree(self.etc_dir)
+
+    def read(self, *names):
+        with open(os.path.join(self.etc_dir, *names), "r") as f:
+            return f.read()
+
+    def sync(self):
+        self.mgr._sync_to_system_conf(self.smb_conf)
+        config_writer().flush()
+
+    def test_share_files(self):
+        self.mgr._add_share(self.smb_conf, "a", path=self.etc_dir, comment="A")
+        self.mgr._add_share(self.smb_conf, "b c/d")
+        self.sync()
+
+        smb_etc_conf = self.read("smb.conf")
+        self.assertIn("# hand edited\n", smb_etc_conf)
+        self.assertIn("log level = 1", smb_etc_conf)
+        self.assertNotIn("OLD", smb_etc_conf)
+        self.assertNotIn("[old share]", smb_etc_conf)
+        self.assertTrue(smb_etc_conf.endswith(
+            "# begin storlever\ninclude = %s\n# end storlever\n" %
+            os.path.join(self.etc_dir, "storlever.conf")))
+
+        share_dir = os.path.join(self.etc_dir, "storlever.d")
+        self.assertEquals(["a.conf", "b_20c_2fd.conf"], sorted(os.listdir(share_dir)))
+        self.assertEquals(
+            "[global]\nworkgroup = MYGROUP\nserver string = Storlever Samba %%v\n"
+            "security = user\npassdb backend = tdbsam\nguest account = nobody\n"
+            "browseable = no\ninclude = %s\ninclude = %s\n" %
+            (os.path.join(share_dir, "a.conf"), os.path.join(share_dir, "b_20c_2fd.conf")),
+            self.read("storlever.conf"))
+        self.assertEquals(
+            "[a]\npath = %s\ncomment = A\ncreate mask = 0744\ndirectory mask = 0755\n"
+            "guest ok = no\nread only = yes\nbrowseable = yes\n"
+            "force create mode = 0000\nforce directory mode = 0000\n" % self.etc_dir,
+            self.read("storlever.d", "a.conf"))
+
+        # only the changed share is written
+        mtimes = dict((name, os.stat(os.path.join(share_dir, name)).st_mtime)
+                      for name in os.listdir(share_dir))
+        os.utime(os.path.join(share_dir, "b_20c_2fd.conf"), (0, 0))
+        os.utime(os.path.join(self.etc_dir, "smb.conf"), (0, 0))
+        self.mgr._set_share(self.smb_conf, "a", read_only=False)
+        self.sync()
+        self.assertIn("read only = no\n", self.read("storlever.d", "a.conf"))
+        self.assertEquals(0, os.stat(os.path.join(share_dir, "b_20c_2fd.conf")).st_mtime)
+        self.assertEquals(0, os.stat(os.path.join(self.etc_dir, "smb.conf")).st_mtime)
+
+        self.mgr._del_share(self.smb_conf, "b c/d")
+        self.sync()
+        self.assertEquals(["a.conf"], os.listdir(share_dir))
+        self.assertNotIn("b_20c_2fd.conf", self.read("storlever.conf"))
+
+        # a new manager reads the generated files from the disk
+        mgr = type(smb_mgr())()
+        mgr._sync_to_system_conf(self.smb_conf)
+        self.assertFalse(config_writer().is_pending(os.path.join(share_dir, "a.conf")))
+
+    def test_share_file_names(self):
+        self.mgr._add_share(self.smb_conf, "a b")
+        self.mgr._add_share(self.smb_conf, "a_20b")
+        self.sync()
+        share_dir = os.path.join(self.etc_dir, "storlever.d")
+        self.assertEquals(["a_20b.conf", "a_5f20b.conf"], sorted(os.listdir(share_dir)))
+        self.assertTrue(self.read("storlever.d", "a_20b.conf").startswith("[a b]\n"))
+        self.assertTrue(self.read("storlever.d", "a_5f20b.conf").startswith("[a_20b]\n"))
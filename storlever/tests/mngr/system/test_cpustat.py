@@ -0,0 +1,55 @@
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.system.cpustat import cpu_stat_mgr
+
+
+class TestCPUStat(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_cpustat_")
+        os.makedirs(os.path.join(self.root, "proc"))
+        self.cpu_stat = type(cpu_stat_mgr())(self.root)
+        # no sampler thread in test
+        self.cpu_stat._thread = True
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _sample(self, now, cpu0, cpu1):
+        # user nice system idle iowait irq softirq steal guest guest_nice
+        lines = []
+        for name, (busy, idle) in (("cpu ", (cpu0[0] + cpu1[0], cpu0[1] + cpu1[1])),
+                                   ("cpu0", cpu0), ("cpu1", cpu1)):
+            lines.append("%s %d 0 0 %d 0 0 0 0 %d 0" % (name, busy, idle, busy))
+        with open(os.path.join(self.root, "proc/stat"), "w") as f:
+            f.write("\n".join(lines) + "\nintr 1 2 3\n")
+        self.cpu_stat.sample(now)
+
+    def test_percent(self):
+        self._sample(100.0, (100, 300), (200, 200))
+        # the average since boot before two snapshots
+        self.assertEquals(37.5, self.cpu_stat.percent(1))
+        self.assertEquals([25.0, 50.0], self.cpu_stat.percent(1, percpu=True))
+
+        self._sample(101.0, (200, 300), (200, 300))
+        self._sample(102.0, (200, 400), (300, 300))
+        self.assertEquals([0.0, 100.0], self.cpu_stat.percent(1, percpu=True))
+        self.assertEquals(50.0, self.cpu_stat.percent(1))
+        self.assertEquals(50.0, self.cpu_stat.percent(2))
+        self.assertEquals([50.0, 50.0], self.cpu_stat.percent(2, percpu=True))
+        # limited by the oldest snapshot
+        self.assertEquals(50.0, self.cpu_stat.percent(3600))
+
+    def test_retention(self):
+        self.cpu_stat.retention = 10
+        for i in range(30):
+            self._sample(100.0 + i, (i, i), (i, i))
+        self.assertEquals(12, len(self.cpu_stat._snapshots))
@@ -0,0 +1,149 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.lib.command import check_output
+from storlever.lib.config import config_writer
+from storlever.lib.exception import StorLeverError
+from storlever.mngr.system import jobmgr
+from storlever.mngr.system.jobmgr import JobManager, DDProgress, parse_progress
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_parse_progress(self):
+        self.assertEquals(42.5, parse_progress("  /dev/sdb: Moved: 42.5%"))
+        self.assertEquals(50.0, parse_progress(
+            "Writing inode tables:   1/4\x08\x08\x08   2/4\x08\x08\x08"))
+        self.assertEquals(None, parse_progress("meta-data=/dev/sdb isize=256"))
+
+    def test_dd_progress(self):
+        progress = DDProgress(2 * 4096)
+        self.assertEquals(None, progress("1+0 records in"))
+        self.assertEquals(None, progress("1+0 records out"))
+        self.assertEquals(50.0, progress("4096 bytes (4.1 kB) copied, 0.1 s"))
+        progress("1+0 records out")
+        self.assertEquals(100.0, progress("4096 bytes (4.1 kB) copied, 0.1 s"))
+
+
+class TestJobMgr(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_job_")
+        self.state_file = os.path.join(self.root, "lib", "jobs.yaml")
+        self.mgr = JobManager.__class__(max_workers=2, state_file=self.state_file,
+                                        history_size=3)
+
+    def tearDown(self):
+        config_writer().flush()
+        shutil.rmtree(self.root)
+
+    def test_progress(self):
+        job_id = self.mgr.submit("test", check_output,
+                                 args=("echo 10%; echo 'Moved: 60.0%'; echo done",),
+                                 kwargs={"shell": True}, operator="tester")
+        self.assertTrue(self.mgr.wait(job_id, 5))
+        job = self.mgr.get_job(job_id)
+        self.assertEquals(jobmgr.JOB_STATE_SUCCEEDED, job["state"])
+        self.assertEquals(100.0, job["progress"])
+        self.assertEquals("done", job["progress_info"])
+        self.assertEquals("tester", job["operator"])
+
+        progress = []
+
+        def _run():
+            check_output("echo 'Moved: 60.0%'; sleep 0.5", shell=True)
+            progress.append(self.mgr.get_job(job_id)["progress"])
+        job_id = self.mgr.submit("test", _run)
+        self.assertTrue(self.mgr.wait(job_id, 5))
+        self.assertEquals([60.0], progress)
+
+    def test_failed(self):
+        job_id = self.mgr.submit("test", check_output,
+                                 args=("echo oops; exit 1",), kwargs={"shell": True})
+        self.assertTrue(self.mgr.wait(job_id, 5))
+        job = self.mgr.get_job(job_id)
+        self.assertEquals(jobmgr.JOB_STATE_FAILED, job["state"])
+        self.assertEquals("oops\n", job["error"])
+        self.assertRaises(StorLeverError, self.mgr.get_job, "not_exist")
+
+    def test_cancel(self):
+        aborted = []
+        running = [self.mgr.submit("test", check_output, args=(["sleep", "10"],),
+                                   on_cancel=lambda: aborted.append(True))
+                   for _ in range(2)]
+        pending = self.mgr.submit("test", check_output, args=(["sleep", "10"],))
+        time.sleep(0.2)
+        self.assertEquals(jobmgr.JOB_STATE_PENDING,
+                          self.mgr.get_job(pending)["state"])
+
+        self.mgr.cancel(pending)
+        self.assertEquals(jobmgr.JOB_STATE_CANCELLED,
+                          self.mgr.get_job(pending)["state"])
+        start = time.time()
+        for job_id in running:
+            self.mgr.cancel(job_id)
+            self.assertTrue(self.mgr.wait(job_id, 5))
+            self.assertEquals(jobmgr.JOB_STATE_CANCELLED,
+                              self.mgr.get_job(job_id)["state"])
+        self.assertLess(time.time() - start, 5)
+        self.assertEquals([True, True], aborted)
+        self.assertRaises(StorLeverError, self.mgr.cancel, pending)
+
+    def test_history(self):
+        for _ in range(5):
+            self.mgr.wait(self.mgr.submit("test", lambda: None), 5)
+        # the oldest finished jobs are dropped
+        jobs = self.mgr.get_job_list(state=jobmgr.JOB_STATE_SUCCEEDED)
+        self.assertEquals(3, len(jobs))
+        self.mgr.delete(jobs[0]["id"])
+        self.assertEquals(2, len(self.mgr.get_job_list()))
+
+    def test_restart(self):
+        done = self.mgr.submit("test", lambda: None)
+        self.mgr.wait(done, 5)
+        running = self.mgr.submit("test", check_output, args=(["sleep", "10"],))
+        time.sleep(0.2)
+        config_writer().flush()
+
+        # like storlever is restarted while the job is running
+        mgr = JobManager.__class__(state_file=self.state_file)
+        job = mgr.get_job(running)
+        self.assertEquals(jobmgr.JOB_STATE_FAILED, job["state"])
+        self.assertIn("interrupted", job["error"])
+        self.assertEquals(jobmgr.JOB_STATE_SUCCEEDED, mgr.get_job(done)["state"])
+        self.mgr.cancel(running)
+        self.mgr.wait(running, 5)
+
+    def test_resume(self):
+        running = self.mgr.submit("resumable", check_output, args=(["sleep", "10"],),
+                                  params={"target": "a"})
+        time.sleep(0.2)
+        config_writer().flush()
+
+        resumed = []
+
+        def _resume(params, was_running):
+            resumed.append((params, was_running))
+            return (lambda: jobmgr.report_progress(42.0, "resumed"), None)
+        mgr = JobManager.__class__(state_file=self.state_file)
+        mgr.register_resume("resumable", _resume)
+        mgr.load()
+        self.assertTrue(mgr.wait(running, 5))
+        job = mgr.get_job(running)
+        self.assertEquals(jobmgr.JOB_STATE_SUCCEEDED, job["state"])
+        self.assertEquals("resumed", job["progress_info"])
+        self.assertEquals([({"target": "a"}, True)], resumed)
+        self.mgr.cancel(running)
+        self.mgr.wait(running, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
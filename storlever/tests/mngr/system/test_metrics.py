@@ -0,0 +1,48 @@
+import sys
+import time
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.system.metrics import metrics_mgr, RingBuffer
+from storlever.lib.exception import StorLeverError
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        ring = RingBuffer(4)
+        self.assertEquals([], ring.since(0))
+        for i in range(6):
+            ring.append(100.0 + i, i * 10.0)
+        self.assertEquals(4, len(ring))
+        self.assertEquals([[102.0, 20.0], [103.0, 30.0], [104.0, 40.0], [105.0, 50.0]],
+                          ring.since(0))
+        self.assertEquals([[104.0, 40.0], [105.0, 50.0]], ring.since(103.0))
+        self.assertEquals([], ring.since(105.0))
+
+    def test_collector(self):
+        collector = type(metrics_mgr())()
+        # aligned to the buckets of all the tiers
+        start = float(int(time.time()) // 60 * 60 - 120)
+        for i in range(25):
+            collector.sample(start + i)
+        names = collector.series_names()
+        self.assertIn("cpu.percent", names)
+        self.assertIn("memory.percent", names)
+
+        result = collector.query(["memory.*"])
+        self.assertEquals(1, result["resolution"])
+        self.assertEquals(set(["memory.percent", "memory.used"]), set(result["series"].keys()))
+        # the last sample is still pending in every tier
+        self.assertEquals(24, len(result["series"]["memory.used"]))
+        self.assertEquals(14, len(collector.query(["memory.used"], since=start + 9)
+                                  ["series"]["memory.used"]))
+
+        # 10s tier has the average of the finished buckets
+        result = collector.query(["memory.used"], resolution=10)
+        self.assertEquals([start, start + 10], [p[0] for p in result["series"]["memory.used"]])
+        self.assertEquals(10, collector.query(["cpu.percent"], since=start - 3600)["resolution"])
+        self.assertRaises(StorLeverError, collector.query, resolution=5)
@@ -0,0 +1,118 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import time
+
+if sys.version_info >= (2, 7):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from storlever.mngr.system.procmgr import proc_mgr, PAGE_SIZE, CLOCK_TICKS
+from storlever.lib.utils import iter_encode_json_list
+from storlever.lib.exception import StorLeverError
+
+
+class TestProcManager(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="storlever_proc_")
+        self._write("stat", "cpu  1 2 3 4\nbtime 1400000000\n")
+        self._write("meminfo", "MemTotal:        1000 kB\nMemFree:  500 kB\n")
+        self._add_proc(1, "init", 0, 100, 10, 10, 0)
+        self._add_proc(200, "smbd", 1, 20, 300, 100, 4096)
+        self._add_proc(201, "smbd", 200, 50, 5, 2000, 0)
+        self._add_proc(300, "my (odd) name", 1, 1, 1, 0, 0)
+        os.makedirs(os.path.join(self.root, "proc/self"))
+        self.mgr = type(proc_mgr())(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, value):
+        path = os.path.join(self.root, "proc", path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(value)
+
+    def _add_proc(self, pid, name, ppid, rss_pages, utime, read_bytes, write_bytes):
+        stat = [pid, "(%s)" % name, "S", ppid] + [0] * 9 + \
+               [utime, 1, 0, 0, 20, 0, 1, 0, CLOCK_TICKS * 10, 4096000, rss_pages] + [0] * 20
+        self._write("%d/stat" % pid, " ".join(str(comp) for comp in stat) + "\n")
+        self._write("%d/cmdline" % pid, "/usr/sbin/%s\0-D\0" % name)
+        self._write("%d/io" % pid, "rchar: 1\nwchar: 2\nsyscr: 3\nsyscw: 4\n"
+                                   "read_bytes: %d\nwrite_bytes: %d\n" % (read_bytes, write_bytes))
+
+    def test_fields(self):
+        procs = list(self.mgr.list_procs())
+        self.assertEquals([1, 200, 201, 300], [proc['pid'] for proc in procs])
+        smbd = procs[1]
+        self.assertEquals("smbd", smbd['name'])
+        self.assertEquals("sleeping", smbd['status'])
+        self.assertEquals(1, smbd['ppid'])
+        self.assertEquals(["/usr/sbin/smbd", "-D"], smbd['cmdline'])
+        self.assertEquals(20 * PAGE_SIZE, smbd['rss'])
+        self.assertEquals(1400000010.0, smbd['create_time'])
+        self.assertEquals(300.0 / CLOCK_TICKS, smbd['user_time'])
+        self.assertEquals((3, 4, 100, 4096), (smbd['read_count'], smbd['write_count'],
+                                              smbd['read_bytes'], smbd['write_bytes']))
+        self.assertEquals("my (odd) name", procs[3]['name'])
+
+        procs = list(self.mgr.list_procs(fields=["pid", "user"], pids=[200, 999]))
+        self.assertEquals(1, len(procs))
+        self.assertEquals(set(["pid", "user"]), set(procs[0].keys()))
+        self.assertRaises(StorLeverError, self.mgr.list_procs, fields=["pid", "bad"])
+
+    def test_skip_unneeded_files(self):
+        os.remove(os.path.join(self.root, "proc/200/io"))
+        os.remove(os.path.join(self.root, "proc/200/cmdline"))
+        procs = list(self.mgr.list_procs(fields=["pid", "name"], names=["smb*"]))
+        self.assertEquals([{"pid": 200, "name": "smbd"}, {"pid": 201, "name": "smbd"}], procs)
+
+    def test_sort_and_page(self):
+        pids = lambda procs: [proc['pid'] for proc in procs]
+        self.assertEquals([200, 1, 201, 300],
+                          pids(self.mgr.list_procs(fields=["pid"], sort="cpu")))
+        self.assertEquals([200, 201],
+                          pids(self.mgr.list_procs(fields=["pid"], sort="io", top=2)))
+        self.assertEquals([200, 300],
+                          pids(self.mgr.list_procs(fields=["pid"], sort="rss", offset=2)))
+        self.assertEquals([200],
+                          pids(self.mgr.list_procs(fields=["pid"], offset=1, limit=1)))
+
+    def test_stream_encode(self):
+        procs = self.mgr.list_procs(fields=["pid", "name"])
+        chunks = list(iter_encode_json_list(procs, chunk_size=2))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals([1, 200, 201, 300],
+                          [proc['pid'] for proc in json.loads("".join(chunks))])
+        self.assertEquals("[]", "".join(iter_encode_json_list([])))
+
+    def test_rates(self):
+        fields = ["pid", "cpu_rate", "read_bps", "write_bps"]
+        self._write("stat", "cpu  1 2 3 4\nbtime %d\n" % (time.time() - 10 - 100))
+        # the first rates are the averages since the processes were created
+        procs = list(self.mgr.list_procs(fields=fields, pids=[200]))
+        # created 100 seconds ago
+        self.assertAlmostEqual(301.0 / CLOCK_TICKS, procs[0]['cpu_rate'], 1)
+        self.assertAlmostEqual(1, procs[0]['read_bps'], 1)
+
+        # pretend the previous sample was taken 2 seconds ago
+        sample = self.mgr._samples[200]
+        self.mgr._samples[200] = (sample[0], sample[1] - 2) + sample[2:]
+        self._add_proc(200, "smbd", 1, 20, 300 + CLOCK_TICKS, 100 + 2048, 4096)
+        procs = list(self.mgr.list_procs(fields=fields, pids=[200]))
+        self.assertAlmostEqual(50.0, procs[0]['cpu_rate'], 0)
+        self.assertAlmostEqual(1024.0, procs[0]['read_bps'], 0)
+        self.assertEquals(0.0, procs[0]['write_bps'])
+
+        # samples of the dead processes are dropped in a full listing
+        shutil.rmtree(os.path.join(self.root, "proc/200"))
+        self.assertEquals([201, 300], [proc['pid'] for proc in
+                                       self.mgr.list_procs(fields=fields, sort="cpu_rate")
+                                       if proc['pid'] != 1])
+        self.assertNotIn(200, self.mgr._samples)
+